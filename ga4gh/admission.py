@@ -0,0 +1,277 @@
+"""
+Admission control for the requests handled by a server process.
+
+The number of requests to an endpoint that are handled concurrently can
+be limited, with a bounded number of further requests waiting for a free
+slot. Requests arriving when the queue is full are rejected immediately
+with a 429 response, and requests that wait too long for a slot are
+rejected with a 503 response, so that one expensive client cannot make
+every other client time out. Search requests are also given an estimated
+cost before they start iterating over data: requests costing more than a
+maximum are rejected, and expensive requests are admitted through a
+separate, smaller limit rather than through the limit of their endpoint,
+so that they cannot occupy every slot available to cheap requests.
+
+The slots and queues of the limits are kept in shared memory, so that
+the limits configured before the pre-forking server forks its workers
+apply to all the workers together. A worker waiting for a slot cannot
+accept other requests, so the queue depths should be smaller than the
+number of workers. The positions held by a worker that exits without
+returning them are freed by the master. The event loop server makes the
+admission decision on its event loop thread, before a request is given
+an executor thread, so that queued requests do not occupy executor
+threads; requests admitted in this way are not admitted again while
+they are handled.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import contextlib
+import multiprocessing
+import os
+import threading
+import timeit
+
+import ga4gh.exceptions as exceptions
+
+
+ADMITTED_ENVIRON_KEY = "ga4gh.admitted"
+"""
+The WSGI environment key set by servers that admitted a request before
+running the application.
+"""
+
+EXPENSIVE_REQUESTS = "expensive"
+"""
+The name of the limit through which expensive search requests are
+admitted.
+"""
+
+
+class ConcurrencyLimit(object):
+    """
+    Allows at most maxConcurrent requests to be handled at once. Up to
+    maxQueued further requests wait for at most queueTimeout seconds for
+    a slot, or indefinitely if queueTimeout is None. The limit is shared
+    by the threads of this process and by the processes forked from it
+    after it was created.
+    """
+    def __init__(self, name, maxConcurrent, maxQueued=0, queueTimeout=None):
+        if maxConcurrent < 1:
+            raise ValueError(
+                "At least one concurrent {} request must be allowed".format(
+                    name))
+        if maxQueued < 0:
+            raise ValueError(
+                "The queue depth for {} requests must not be negative".format(
+                    name))
+        self._name = name
+        self._maxConcurrent = maxConcurrent
+        self._maxQueued = maxQueued
+        self._queueTimeout = queueTimeout
+        self._condition = multiprocessing.Condition()
+        # Each slot and queue position holds the ID of the process using
+        # it, or 0 if it is free, so that the positions held by a process
+        # that was killed can be freed.
+        self._slots = multiprocessing.RawArray("i", maxConcurrent)
+        self._queue = multiprocessing.RawArray("i", maxQueued)
+
+    def getName(self):
+        """
+        Returns the name of the requests admitted through this limit.
+        """
+        return self._name
+
+    def getMaxQueued(self):
+        """
+        Returns the maximum number of requests waiting for a slot.
+        """
+        return self._maxQueued
+
+    def getQueueTimeout(self):
+        """
+        Returns the maximum number of seconds a request waits for a slot,
+        or None if requests wait indefinitely.
+        """
+        return self._queueTimeout
+
+    def getNumActive(self):
+        """
+        Returns the number of requests currently holding a slot.
+        """
+        return self._maxConcurrent - self._slots[:].count(0)
+
+    def getNumQueued(self):
+        """
+        Returns the number of requests currently waiting for a slot.
+        """
+        return self._maxQueued - self._queue[:].count(0)
+
+    def _take(self, positions, pid):
+        # Returns False if all of the positions are in use.
+        try:
+            positions[positions[:].index(0)] = pid
+        except ValueError:
+            return False
+        return True
+
+    def _give(self, positions, pid):
+        positions[positions[:].index(pid)] = 0
+
+    def tryAcquire(self):
+        """
+        Takes a slot and returns True if one is free, and returns False
+        without waiting otherwise.
+        """
+        with self._condition:
+            return self._take(self._slots, os.getpid())
+
+    def acquire(self):
+        """
+        Takes a slot, waiting for one if necessary. Raises a
+        TooManyRequestsException if the queue is full, and a
+        ServiceUnavailableException if no slot became free in time.
+        """
+        pid = os.getpid()
+        with self._condition:
+            if self._take(self._slots, pid):
+                return
+            if not self._take(self._queue, pid):
+                raise exceptions.TooManyRequestsException(self._name)
+            try:
+                deadline = None
+                if self._queueTimeout is not None:
+                    deadline = timeit.default_timer() + self._queueTimeout
+                while not self._take(self._slots, pid):
+                    timeout = None
+                    if deadline is not None:
+                        timeout = deadline - timeit.default_timer()
+                        if timeout <= 0:
+                            raise exceptions.ServiceUnavailableException(
+                                self._name)
+                    self._condition.wait(timeout)
+            finally:
+                self._give(self._queue, pid)
+
+    def release(self):
+        """
+        Returns a slot taken by acquire.
+        """
+        with self._condition:
+            self._give(self._slots, os.getpid())
+            self._condition.notify()
+
+    def releaseProcess(self, pid):
+        """
+        Frees the slots and queue positions held by the process with the
+        specified ID, which has exited without returning them.
+        """
+        with self._condition:
+            for positions in self._slots, self._queue:
+                for index, holder in enumerate(positions[:]):
+                    if holder == pid:
+                        positions[index] = 0
+            self._condition.notify_all()
+
+
+class AdmissionController(object):
+    """
+    Decides whether requests are admitted, using a ConcurrencyLimit for
+    each endpoint that has one and for expensive search requests.
+    """
+    def __init__(self):
+        self._threadState = threading.local()
+        self.configure({})
+
+    def configure(
+            self, endpointLimits, queueTimeout=None, maxCost=None,
+            expensiveCost=None, expensiveLimit=None):
+        """
+        Sets the limits. The endpointLimits dictionary maps endpoint
+        names, such as "searchReads", to (maxConcurrent, maxQueued)
+        pairs; endpoints without an entry are not limited. Requests
+        estimated to cost more than maxCost are rejected. Requests costing
+        at least expensiveCost are admitted through the expensiveLimit
+        (maxConcurrent, maxQueued) pair instead of their endpoint limit,
+        if it is set. Queued requests wait for at most queueTimeout
+        seconds.
+        """
+        self._limits = {}
+        for endpoint, (maxConcurrent, maxQueued) in endpointLimits.items():
+            self._limits[endpoint] = ConcurrencyLimit(
+                endpoint, maxConcurrent, maxQueued, queueTimeout)
+        self._maxCost = maxCost
+        self._expensiveCost = expensiveCost
+        self._expensiveLimit = None
+        if expensiveLimit is not None:
+            maxConcurrent, maxQueued = expensiveLimit
+            self._expensiveLimit = ConcurrencyLimit(
+                EXPENSIVE_REQUESTS, maxConcurrent, maxQueued, queueTimeout)
+
+    def getLimit(self, endpoint, cost=None):
+        """
+        Returns the ConcurrencyLimit through which a request to the
+        specified endpoint with the specified estimated cost is admitted,
+        or None if the request is not limited or was already admitted by
+        the server. Raises a RequestTooExpensiveException if the cost
+        exceeds the maximum.
+        """
+        if (cost is not None and self._maxCost is not None and
+                cost > self._maxCost):
+            raise exceptions.RequestTooExpensiveException(
+                cost, self._maxCost)
+        if getattr(self._threadState, "admitted", False):
+            return None
+        if (cost is not None and self._expensiveLimit is not None and
+                self._expensiveCost is not None and
+                cost >= self._expensiveCost):
+            return self._expensiveLimit
+        return self._limits.get(endpoint)
+
+    def releaseProcess(self, pid):
+        """
+        Frees the slots and queue positions of all the limits held by the
+        process with the specified ID, which has exited.
+        """
+        limits = self._limits.values()
+        if self._expensiveLimit is not None:
+            limits.append(self._expensiveLimit)
+        for limit in limits:
+            limit.releaseProcess(pid)
+
+    @contextlib.contextmanager
+    def alreadyAdmitted(self, admitted=True):
+        """
+        Returns a context manager within which the requests handled by
+        the current thread are not admitted again, if admitted is True.
+        """
+        previous = getattr(self._threadState, "admitted", False)
+        self._threadState.admitted = admitted
+        try:
+            yield
+        finally:
+            self._threadState.admitted = previous
+
+    @contextlib.contextmanager
+    def admit(self, endpoint, cost=None):
+        """
+        Returns a context manager that holds a slot for a request to the
+        specified endpoint with the specified estimated cost while the
+        request is handled.
+        """
+        limit = self.getLimit(endpoint, cost)
+        if limit is None:
+            yield
+        else:
+            limit.acquire()
+            try:
+                yield
+            finally:
+                limit.release()
+
+
+requestAdmission = AdmissionController()
+"""
+The admission controller for the requests handled by this process.
+"""
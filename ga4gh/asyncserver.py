@@ -0,0 +1,626 @@
+"""
+An event loop HTTP server for the GA4GH frontend.
+
+A single thread multiplexes all client connections with poll(), so idle
+keep-alive connections cost no more than a socket each. Each complete
+request is dispatched to the WSGI application either inline on the event
+loop, for cheap requests such as metadata lookups, or on a bounded pool
+of executor threads, for requests that iterate over data files. Bulk
+searches therefore occupy at most the executor threads, while cheap
+requests and new connections continue to be served by the event loop.
+The bodies of responses produced on executor threads are passed to the
+event loop a chunk at a time as they are generated, so that streamed
+responses are never held in memory in full.
+
+Requests may be subject to concurrency limits, which are applied on the
+event loop before a request is run. Requests waiting for a slot are held
+by the event loop, rather than occupying an executor thread, and are
+rejected with 429 Too Many Requests if the queue of their limit is full,
+or with 503 Service Unavailable if they wait too long.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import errno
+import logging
+import multiprocessing.pool
+import os
+import select
+import socket
+import sys
+import threading
+import timeit
+import urllib
+import StringIO
+
+import werkzeug.http
+
+import ga4gh.admission as admission
+
+
+DEFAULT_EXECUTOR_THREADS = 8
+
+DEFAULT_MAX_QUEUED_REQUESTS = 1000
+"""
+The maximum number of requests waiting for an executor thread, beyond
+which requests are rejected with 503 Service Unavailable.
+"""
+
+KEEP_ALIVE_TIMEOUT = 75
+"""
+The number of seconds after which idle connections are closed.
+"""
+
+MAX_HEADER_LENGTH = 2**16
+MAX_BODY_LENGTH = 2**24
+RECEIVE_SIZE = 2**16
+POLL_INTERVAL = 1.0
+
+MAX_BUFFERED_BYTES = 2**20
+"""
+The number of bytes of a response waiting to be sent to a client beyond
+which the executor thread generating the response waits for the client
+to receive them.
+"""
+
+_READ_EVENTS = select.POLLIN | select.POLLPRI
+_ERROR_EVENTS = select.POLLERR | select.POLLHUP | select.POLLNVAL
+
+log = logging.getLogger(__name__)
+
+
+class BadRequestException(Exception):
+    """
+    A request could not be parsed; the connection is closed after
+    responding with the specified HTTP status.
+    """
+    def __init__(self, httpStatus):
+        super(BadRequestException, self).__init__(httpStatus)
+        self.httpStatus = httpStatus
+
+
+def getStatusLine(httpStatus):
+    """
+    Returns the HTTP status line for the specified integer status.
+    """
+    return "{} {}".format(httpStatus, werkzeug.http.HTTP_STATUS_CODES.get(
+        httpStatus, "Unknown"))
+
+
+def getContentLength(headers):
+    """
+    Returns the value of the Content-Length header in the specified list
+    of (name, value) pairs, or None if there is no valid header.
+    """
+    for name, value in headers:
+        if name.lower() == "content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+def getResponseHead(status, headers, contentLength, keepAlive):
+    """
+    Returns the status line and headers of a response whose body has the
+    specified length, or is delimited by closing the connection if
+    contentLength is None.
+    """
+    lines = ["HTTP/1.1 {}".format(status)]
+    for name, value in headers:
+        if name.lower() not in ("content-length", "connection"):
+            lines.append("{}: {}".format(name, value))
+    if contentLength is not None:
+        lines.append("Content-Length: {}".format(contentLength))
+    lines.append("Connection: {}".format(
+        "keep-alive" if keepAlive else "close"))
+    return "\r\n".join(lines).encode("latin-1") + b"\r\n\r\n"
+
+
+def runApplication(app, environ):
+    """
+    Runs the specified WSGI application for the specified environment,
+    and returns the (status, headers, body) of the response. Exceptions
+    raised by the application result in a 500 response.
+    """
+    response = []
+
+    def startResponse(status, headers, excInfo=None):
+        response[:] = [status, headers]
+
+    try:
+        result = app(environ, startResponse)
+        try:
+            body = b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        status, headers = response
+    except Exception:
+        log.exception("Error running the application")
+        status, headers, body = getStatusLine(500), [], b""
+    return status, headers, body
+
+
+class _Connection(object):
+    """
+    The state of a client connection.
+    """
+    def __init__(self, clientSocket, address):
+        self.socket = clientSocket
+        self.fd = clientSocket.fileno()
+        self.address = address
+        self.inBuffer = b""
+        self.outBuffer = b""
+        self.busy = False
+        self.responseComplete = False
+        self.closeAfterWrite = False
+        self.lastActiveTime = timeit.default_timer()
+        # The concurrency limit that admitted the current request, if any
+        self.limit = None
+        # Guards the fields below, which are shared with the executor
+        # thread streaming a response to the connection.
+        self.condition = threading.Condition()
+        self.closed = False
+        self.numBufferedBytes = 0
+
+
+class AsyncServer(object):
+    """
+    Serves the specified WSGI application on the specified host and port.
+    Requests for which isInline(environ) returns True are run on the
+    event loop thread; all others are run on one of numExecutorThreads
+    executor threads. When all the executor threads are busy and
+    maxQueuedRequests requests are waiting for one, further requests are
+    rejected with a 503 response. The listening socket is bound when the
+    server is created.
+
+    If getAdmissionLimit is specified, it is called with the environ of
+    each request and returns the admission.ConcurrencyLimit through which
+    the request must be admitted before it is run, or None. The environ
+    of admitted requests has admission.ADMITTED_ENVIRON_KEY set, so that
+    the application does not admit them again.
+    """
+    def __init__(
+            self, app, host, port, isInline,
+            numExecutorThreads=DEFAULT_EXECUTOR_THREADS,
+            maxQueuedRequests=DEFAULT_MAX_QUEUED_REQUESTS,
+            getAdmissionLimit=None):
+        if numExecutorThreads < 1:
+            raise ValueError("At least one executor thread is required")
+        self._app = app
+        self._isInline = isInline
+        self._getAdmissionLimit = getAdmissionLimit
+        self._numExecutorThreads = numExecutorThreads
+        self._maxQueuedRequests = maxQueuedRequests
+        self._listenSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listenSocket.setsockopt(
+            socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listenSocket.bind((host, port))
+        self._listenSocket.listen(socket.SOMAXCONN)
+        self._listenSocket.setblocking(False)
+        self._host, self._port = self._listenSocket.getsockname()
+        self._wakeReadFd, self._wakeWriteFd = os.pipe()
+        self._connections = {}
+        self._completed = collections.deque()
+        # Maps concurrency limits to the (connection, environ, keepAlive,
+        # deadline) of the requests waiting for one of their slots.
+        self._waiting = {}
+        self._numPending = 0
+        self._shutdownRequested = False
+        self._poller = None
+        self._executor = None
+
+    def getPort(self):
+        """
+        Returns the port on which the server is listening.
+        """
+        return self._port
+
+    def getNumConnections(self):
+        """
+        Returns the number of open client connections.
+        """
+        return len(self._connections)
+
+    def shutdown(self):
+        """
+        Stops the event loop. This may be called from any thread, before
+        or after the event loop has started.
+        """
+        self._shutdownRequested = True
+        self._wake()
+
+    def _wake(self):
+        if self._wakeWriteFd is not None:
+            os.write(self._wakeWriteFd, b"x")
+
+    def serveForever(self):
+        """
+        Runs the event loop until shutdown is called.
+        """
+        self._executor = multiprocessing.pool.ThreadPool(
+            self._numExecutorThreads)
+        self._poller = select.poll()
+        self._poller.register(self._listenSocket.fileno(), _READ_EVENTS)
+        self._poller.register(self._wakeReadFd, _READ_EVENTS)
+        lastTimeoutCheck = timeit.default_timer()
+        try:
+            while not self._shutdownRequested:
+                try:
+                    events = self._poller.poll(self._getPollTimeout() * 1000)
+                except select.error as error:
+                    if error.args[0] != errno.EINTR:
+                        raise
+                    events = []
+                for fd, event in events:
+                    if fd == self._listenSocket.fileno():
+                        self._accept()
+                    elif fd == self._wakeReadFd:
+                        os.read(self._wakeReadFd, 4096)
+                    elif fd in self._connections:
+                        self._handleEvent(self._connections[fd], event)
+                self._handleCompleted()
+                now = timeit.default_timer()
+                self._dispatchWaiting(now)
+                if now - lastTimeoutCheck >= POLL_INTERVAL:
+                    self._closeIdleConnections(now)
+                    lastTimeoutCheck = now
+        finally:
+            for connection in self._connections.values():
+                self._close(connection)
+            self._executor.terminate()
+            self._listenSocket.close()
+            wakeFds = [self._wakeReadFd, self._wakeWriteFd]
+            self._wakeReadFd = self._wakeWriteFd = None
+            for fd in wakeFds:
+                os.close(fd)
+
+    def _accept(self):
+        while True:
+            try:
+                clientSocket, address = self._listenSocket.accept()
+            except socket.error as error:
+                if error.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                if error.args[0] in (errno.ECONNABORTED, errno.EINTR):
+                    continue
+                raise
+            clientSocket.setblocking(False)
+            clientSocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = _Connection(clientSocket, address)
+            self._connections[connection.fd] = connection
+            self._poller.register(connection.fd, _READ_EVENTS)
+
+    def _isOpen(self, connection):
+        return self._connections.get(connection.fd) is connection
+
+    def _close(self, connection):
+        if self._isOpen(connection):
+            del self._connections[connection.fd]
+            self._poller.unregister(connection.fd)
+            connection.socket.close()
+            with connection.condition:
+                connection.closed = True
+                connection.condition.notify_all()
+
+    def _closeIdleConnections(self, now):
+        for connection in self._connections.values():
+            if (not connection.busy and connection.outBuffer == b"" and
+                    now - connection.lastActiveTime > KEEP_ALIVE_TIMEOUT):
+                self._close(connection)
+
+    def _handleEvent(self, connection, event):
+        if event & select.POLLOUT:
+            self._write(connection)
+            if not self._isOpen(connection):
+                return
+        if event & _READ_EVENTS:
+            self._read(connection)
+        elif event & _ERROR_EVENTS:
+            self._close(connection)
+
+    def _read(self, connection):
+        try:
+            data = connection.socket.recv(RECEIVE_SIZE)
+        except socket.error as error:
+            if error.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            self._close(connection)
+            return
+        if data == b"":
+            self._close(connection)
+            return
+        connection.lastActiveTime = timeit.default_timer()
+        connection.inBuffer += data
+        self._processInput(connection)
+
+    def _write(self, connection):
+        try:
+            numSent = connection.socket.send(connection.outBuffer)
+        except socket.error as error:
+            if error.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            self._close(connection)
+            return
+        connection.outBuffer = connection.outBuffer[numSent:]
+        connection.lastActiveTime = timeit.default_timer()
+        with connection.condition:
+            connection.numBufferedBytes -= numSent
+            connection.condition.notify_all()
+        if connection.outBuffer == b"":
+            if not connection.responseComplete:
+                # Wait for more of the body being generated.
+                self._poller.modify(connection.fd, _READ_EVENTS)
+            elif connection.closeAfterWrite:
+                self._close(connection)
+            else:
+                self._poller.modify(connection.fd, _READ_EVENTS)
+                connection.busy = False
+                # Handle a request that was sent before this response.
+                self._processInput(connection)
+
+    def _processInput(self, connection):
+        """
+        Dispatches the next request in the input buffer of the connection
+        if it is complete and no other request is being handled.
+        """
+        if connection.busy or connection.closeAfterWrite:
+            return
+        try:
+            request = self._parseRequest(connection)
+        except BadRequestException as exception:
+            connection.busy = True
+            self._sendResponse(
+                connection, getStatusLine(exception.httpStatus), [], b"",
+                False)
+            return
+        if request is None:
+            return
+        environ, keepAlive = request
+        connection.busy = True
+        connection.responseComplete = False
+        if environ.get("HTTP_EXPECT", "").lower() == "100-continue":
+            # The body has already been received in full.
+            del environ["HTTP_EXPECT"]
+        limit = None
+        if self._getAdmissionLimit is not None:
+            try:
+                limit = self._getAdmissionLimit(environ)
+            except Exception:
+                log.exception("Error choosing the admission limit")
+        if limit is None or limit.tryAcquire():
+            self._dispatch(connection, environ, keepAlive, limit)
+        elif len(self._waiting.get(limit, ())) >= limit.getMaxQueued():
+            self._sendResponse(
+                connection, getStatusLine(429), [], b"", keepAlive)
+        else:
+            deadline = None
+            if limit.getQueueTimeout() is not None:
+                deadline = timeit.default_timer() + limit.getQueueTimeout()
+            self._waiting.setdefault(limit, collections.deque()).append(
+                (connection, environ, keepAlive, deadline))
+
+    def _dispatch(self, connection, environ, keepAlive, limit):
+        """
+        Runs the specified request, which holds a slot of the specified
+        limit if it is not None, on the event loop or an executor thread.
+        """
+        if limit is not None:
+            environ[admission.ADMITTED_ENVIRON_KEY] = True
+        if self._isInline(environ):
+            status, headers, body = runApplication(self._app, environ)
+            if limit is not None:
+                limit.release()
+            self._sendResponse(connection, status, headers, body, keepAlive)
+        elif (self._numPending >=
+                self._numExecutorThreads + self._maxQueuedRequests):
+            if limit is not None:
+                limit.release()
+            self._sendResponse(
+                connection, getStatusLine(503), [], b"", keepAlive)
+        else:
+            self._numPending += 1
+            connection.limit = limit
+            self._executor.apply_async(
+                self._runStreamed, (connection, environ, keepAlive))
+
+    def _dispatchWaiting(self, now):
+        """
+        Runs the waiting requests for which a slot has become free, and
+        rejects those that have waited too long.
+        """
+        for limit, waiting in self._waiting.items():
+            while len(waiting) > 0:
+                connection, environ, keepAlive, deadline = waiting[0]
+                if not self._isOpen(connection):
+                    waiting.popleft()
+                elif deadline is not None and now >= deadline:
+                    waiting.popleft()
+                    self._sendResponse(
+                        connection, getStatusLine(503), [], b"", keepAlive)
+                elif limit.tryAcquire():
+                    waiting.popleft()
+                    self._dispatch(connection, environ, keepAlive, limit)
+                else:
+                    break
+            if len(waiting) == 0:
+                del self._waiting[limit]
+
+    def _getPollTimeout(self):
+        """
+        Returns the number of seconds to wait for events, which is at
+        most POLL_INTERVAL, and ends when a waiting request times out.
+        """
+        timeout = POLL_INTERVAL
+        now = timeit.default_timer()
+        for waiting in self._waiting.values():
+            deadline = waiting[0][3]
+            if deadline is not None:
+                timeout = min(timeout, max(0, deadline - now))
+        return timeout
+
+    def _runStreamed(self, connection, environ, keepAlive):
+        """
+        Runs the application on an executor thread, passing the response
+        to the event loop thread a chunk at a time. Responses without a
+        Content-Length header are delimited by closing the connection.
+        """
+        response = []
+
+        def startResponse(status, headers, excInfo=None):
+            response[:] = [status, headers]
+
+        headSent = False
+        result = None
+        try:
+            result = self._app(environ, startResponse)
+            chunks = iter(result)
+            # The application may start the response when the first
+            # chunk of the body is generated.
+            firstChunk = next(chunks, b"")
+            status, headers = response
+            contentLength = getContentLength(headers)
+            if contentLength is None:
+                keepAlive = False
+            headSent = True
+            if self._queueOutput(connection, getResponseHead(
+                    status, headers, contentLength, keepAlive) + firstChunk):
+                for chunk in chunks:
+                    if not self._queueOutput(connection, chunk):
+                        break
+        except Exception:
+            log.exception("Error running the application")
+            if headSent:
+                # The client sees a truncated body.
+                keepAlive = False
+            else:
+                self._queueOutput(connection, getResponseHead(
+                    getStatusLine(500), [], 0, keepAlive))
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+            self._completed.append((connection, b"", True, keepAlive))
+            self._wake()
+
+    def _queueOutput(self, connection, data):
+        """
+        Passes the specified part of a response from an executor thread
+        to the event loop thread, first waiting for the client to receive
+        enough of the response if too much of it is waiting to be sent.
+        Returns False if the connection has been closed.
+        """
+        with connection.condition:
+            while (connection.numBufferedBytes > MAX_BUFFERED_BYTES and
+                    not connection.closed):
+                connection.condition.wait()
+            if connection.closed:
+                return False
+            connection.numBufferedBytes += len(data)
+        self._completed.append((connection, data, False, None))
+        self._wake()
+        return True
+
+    def _handleCompleted(self):
+        while len(self._completed) > 0:
+            connection, data, isLast, keepAlive = self._completed.popleft()
+            if isLast:
+                self._numPending -= 1
+                if connection.limit is not None:
+                    connection.limit.release()
+                    connection.limit = None
+            if self._isOpen(connection):
+                self._sendOutput(connection, data, isLast, keepAlive)
+
+    def _sendOutput(self, connection, data, isLast, keepAlive):
+        """
+        Appends the specified data to the output buffer of the connection.
+        If this is the last part of the response, the connection is then
+        closed or made ready for the next request once it has been sent.
+        """
+        connection.outBuffer += data
+        if isLast:
+            connection.responseComplete = True
+            connection.closeAfterWrite = not keepAlive
+        self._poller.modify(connection.fd, _READ_EVENTS | select.POLLOUT)
+
+    def _sendResponse(self, connection, status, headers, body, keepAlive):
+        data = getResponseHead(status, headers, len(body), keepAlive) + body
+        with connection.condition:
+            connection.numBufferedBytes += len(data)
+        self._sendOutput(connection, data, True, keepAlive)
+
+    def _parseRequest(self, connection):
+        """
+        Removes the next complete request from the input buffer of the
+        connection and returns its (environ, keepAlive), or returns None
+        if the request is not yet complete.
+        """
+        headerEnd = connection.inBuffer.find(b"\r\n\r\n")
+        if headerEnd == -1:
+            if len(connection.inBuffer) > MAX_HEADER_LENGTH:
+                raise BadRequestException(431)
+            return None
+        lines = connection.inBuffer[:headerEnd].split(b"\r\n")
+        try:
+            method, target, version = lines[0].split(b" ")
+        except ValueError:
+            raise BadRequestException(400)
+        if not version.startswith(b"HTTP/1."):
+            raise BadRequestException(505)
+        headers = {}
+        for line in lines[1:]:
+            name, separator, value = line.partition(b":")
+            if separator == b"":
+                raise BadRequestException(400)
+            key = name.strip().upper().replace(b"-", b"_")
+            value = value.strip()
+            if key in headers:
+                value = headers[key] + b"," + value
+            headers[key] = value
+        if "chunked" in headers.get(b"TRANSFER_ENCODING", b"").lower():
+            raise BadRequestException(411)
+        try:
+            contentLength = int(headers.get(b"CONTENT_LENGTH", 0))
+        except ValueError:
+            raise BadRequestException(400)
+        if contentLength > MAX_BODY_LENGTH:
+            raise BadRequestException(413)
+        bodyStart = headerEnd + 4
+        if len(connection.inBuffer) < bodyStart + contentLength:
+            return None
+        body = connection.inBuffer[bodyStart:bodyStart + contentLength]
+        connection.inBuffer = connection.inBuffer[
+            bodyStart + contentLength:]
+        connectionHeader = headers.get(b"CONNECTION", b"").lower()
+        if version == b"HTTP/1.0":
+            keepAlive = connectionHeader == b"keep-alive"
+        else:
+            keepAlive = connectionHeader != b"close"
+        path, _, queryString = target.partition(b"?")
+        environ = {
+            "REQUEST_METHOD": method,
+            "SCRIPT_NAME": b"",
+            "PATH_INFO": urllib.unquote(path),
+            "QUERY_STRING": queryString,
+            "SERVER_NAME": self._host,
+            "SERVER_PORT": str(self._port),
+            "SERVER_PROTOCOL": version,
+            "REMOTE_ADDR": connection.address[0],
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": b"http",
+            "wsgi.input": StringIO.StringIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for key, value in headers.items():
+            if key in (b"CONTENT_TYPE", b"CONTENT_LENGTH"):
+                environ[key] = value
+            else:
+                environ[b"HTTP_" + key] = value
+        return environ, keepAlive
@@ -6,13 +6,21 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import collections
+import functools
+import itertools
 import json
 import os
+import timeit
 
+import ga4gh.admission as admission
 import ga4gh.datamodel as datamodel
 import ga4gh.datamodel.datasets as datasets
+import ga4gh.datamodel.reads as reads
 import ga4gh.datamodel.references as references
 import ga4gh.exceptions as exceptions
+import ga4gh.metrics as metrics
+import ga4gh.profiling as profiling
 import ga4gh.protocol as protocol
 
 
@@ -52,6 +60,21 @@ def _parsePageToken(pageToken, numValues):
     return values
 
 
+def _getSearchWidth(request, end):
+    """
+    Returns the number of bases from the point at which the specified
+    interval search request starts, or resumes from its page token, to
+    the specified end of the search.
+    """
+    start = request.start
+    if start is None:
+        start = 0
+    if request.pageToken is not None:
+        searchAnchor, _ = _parsePageToken(request.pageToken, 2)
+        start = max(start, searchAnchor)
+    return max(0, end - start)
+
+
 class IntervalIterator(object):
     """
     Implements generator logic for types which accept a start/end
@@ -59,6 +82,10 @@ class IntervalIterator(object):
     (object, pageToken) pairs. The pageToken is a string which allows
     us to pick up the iteration at any point, and is None for the last
     value in the iterator.
+
+    If the search deadline of the current thread passes while scanning,
+    the iteration ends with a (None, pageToken) pair, where the pageToken
+    picks up the iteration at the position the scan reached.
     """
     def __init__(self, request, parentContainer):
         self._request = request
@@ -68,23 +95,50 @@ class IntervalIterator(object):
         self._nextObject = None
         self._searchAnchor = None
         self._distanceFromAnchor = None
+        self._interruptedPosition = None
         if request.pageToken is None:
+            # The position and number of objects from which to resume
+            # after the objects returned so far.
+            self._lastAnchor = request.start
+            if self._lastAnchor is None:
+                self._lastAnchor = 0
+            self._lastDistance = 0
             self._initialiseIteration()
         else:
             # Set the search start point and the number of records to skip from
             # the page token.
             searchAnchor, objectsToSkip = _parsePageToken(request.pageToken, 2)
+            self._lastAnchor = searchAnchor
+            self._lastDistance = objectsToSkip
             self._pickUpIteration(searchAnchor, objectsToSkip)
 
+    def _getNextObject(self):
+        """
+        Returns the next object from the search iterator, or None if
+        there are no more objects or the scan has been interrupted by the
+        search deadline.
+        """
+        if self._interruptedPosition is not None:
+            return None
+        try:
+            obj = next(self._searchIterator, None)
+            if obj is not None:
+                datamodel.checkSearchDeadline(self._getStart(obj))
+        except datamodel.ScanInterruptedException as exception:
+            self._interruptedPosition = exception.position
+            obj = None
+        return obj
+
     def _initialiseIteration(self):
         """
         Starts a new iteration.
         """
+        datamodel.setScanStart(self._lastAnchor)
         self._searchIterator = self._search(
             self._request.start, self._request.end)
-        self._currentObject = next(self._searchIterator, None)
+        self._currentObject = self._getNextObject()
         if self._currentObject is not None:
-            self._nextObject = next(self._searchIterator, None)
+            self._nextObject = self._getNextObject()
             self._searchAnchor = self._request.start
             self._distanceFromAnchor = 0
             firstObjectStart = self._getStart(self._currentObject)
@@ -102,33 +156,56 @@ class IntervalIterator(object):
         """
         self._searchAnchor = searchAnchor
         self._distanceFromAnchor = objectsToSkip
+        datamodel.setScanStart(searchAnchor)
         self._searchIterator = self._search(searchAnchor, self._request.end)
-        obj = next(self._searchIterator)
+        obj = self._getNextObject()
         if searchAnchor == self._request.start:
             # This is the initial set of intervals, we just skip forward
             # objectsToSkip positions
             for _ in range(objectsToSkip):
-                obj = next(self._searchIterator)
+                if obj is None:
+                    break
+                obj = self._getNextObject()
         else:
             # Now, we are past this initial set of intervals.
             # First, we need to skip forward over the intervals where
             # start < searchAnchor, as we've seen these already.
-            while self._getStart(obj) < searchAnchor:
-                obj = next(self._searchIterator)
+            while obj is not None and self._getStart(obj) < searchAnchor:
+                obj = self._getNextObject()
             # Now, we skip over objectsToSkip objects such that
             # start == searchAnchor
             for _ in range(objectsToSkip):
+                if obj is None:
+                    break
                 assert self._getStart(obj) == searchAnchor
-                obj = next(self._searchIterator)
+                obj = self._getNextObject()
         self._currentObject = obj
-        self._nextObject = next(self._searchIterator, None)
+        if obj is not None:
+            self._nextObject = self._getNextObject()
+
+    def _getInterruptedPageToken(self):
+        """
+        Returns the page token that picks up the iteration at the
+        position where the scan was interrupted.
+        """
+        if self._interruptedPosition > self._lastAnchor:
+            # Every object starting before this position has been
+            # returned, and none starting at it.
+            return "{}:0".format(self._interruptedPosition)
+        return "{}:{}".format(self._lastAnchor, self._lastDistance)
 
     def next(self):
         """
         Returns the next (object, nextPageToken) pair.
         """
         if self._currentObject is None:
-            raise StopIteration()
+            if self._interruptedPosition is None:
+                raise StopIteration()
+            nextPageToken = self._getInterruptedPageToken()
+            self._interruptedPosition = None
+            return None, nextPageToken
+        self._lastAnchor = self._searchAnchor
+        self._lastDistance = self._distanceFromAnchor + 1
         nextPageToken = None
         if self._nextObject is not None:
             start = self._getStart(self._nextObject)
@@ -141,9 +218,14 @@ class IntervalIterator(object):
                 self._distanceFromAnchor += 1
             nextPageToken = "{}:{}".format(
                 self._searchAnchor, self._distanceFromAnchor)
+        elif self._interruptedPosition is not None:
+            nextPageToken = "{}:{}".format(
+                self._lastAnchor, self._lastDistance)
         ret = self._currentObject, nextPageToken
         self._currentObject = self._nextObject
-        self._nextObject = next(self._searchIterator, None)
+        self._nextObject = None
+        if self._currentObject is not None:
+            self._nextObject = self._getNextObject()
         return ret
 
     def __iter__(self):
@@ -154,13 +236,20 @@ class ReadsIntervalIterator(IntervalIterator):
     """
     An interval iterator for reads
     """
-    def __init__(self, request, parentContainer, reference):
+    def __init__(
+            self, request, parentContainer, reference,
+            fillReferenceSequence=False):
         self._reference = reference
+        self._fillReferenceSequence = fillReferenceSequence
         super(ReadsIntervalIterator, self).__init__(request, parentContainer)
 
     def _search(self, start, end):
-        return self._parentContainer.getReadAlignments(
+        readAlignments = self._parentContainer.getReadAlignments(
             self._reference, start, end)
+        if self._fillReferenceSequence:
+            filler = reads.CigarReferenceSequenceFiller(self._reference)
+            readAlignments = itertools.imap(filler.fill, readAlignments)
+        return readAlignments
 
     @classmethod
     def _getStart(cls, readAlignment):
@@ -202,11 +291,17 @@ class AbstractBackend(object):
         self._responseValidation = False
         self._defaultPageSize = 100
         self._maxResponseLength = 2**20  # 1 MiB
+        self._searchTimeBudget = None
+        self._defaultCoverageBins = 1000
+        self._maxCoverageBins = 2**16
         self._datasetIdMap = {}
         self._datasetIds = []
         self._referenceSetIdMap = {}
         self._referenceSetNameMap = {}
         self._referenceSetIds = []
+        self._referenceSetMd5ChecksumMap = None
+        self._referenceSetAccessionMap = collections.defaultdict(list)
+        self._referenceSetAssemblyIdMap = collections.defaultdict(list)
 
     def addDataset(self, dataset):
         """
@@ -224,6 +319,13 @@ class AbstractBackend(object):
         self._referenceSetIdMap[id_] = referenceSet
         self._referenceSetNameMap[referenceSet.getLocalId()] = referenceSet
         self._referenceSetIds.append(id_)
+        # The MD5 index is rebuilt when next needed, so that adding many
+        # reference sets does not rebuild it each time.
+        self._referenceSetMd5ChecksumMap = None
+        for accession in set(referenceSet.getSourceAccessions()):
+            self._referenceSetAccessionMap[accession].append(referenceSet)
+        self._referenceSetAssemblyIdMap[referenceSet.getAssemblyId()].append(
+            referenceSet)
 
     def setRequestValidation(self, requestValidation):
         """
@@ -250,6 +352,13 @@ class AbstractBackend(object):
         """
         self._maxResponseLength = maxResponseLength
 
+    def setSearchTimeBudget(self, searchTimeBudget):
+        """
+        Sets the number of seconds after which a search request returns
+        the page of results found so far, or None to always fill pages.
+        """
+        self._searchTimeBudget = searchTimeBudget
+
     def getDatasets(self):
         """
         Returns a list of datasets in this backend
@@ -298,6 +407,36 @@ class AbstractBackend(object):
             raise exceptions.ReferenceSetNotFoundException(id_)
         return self._referenceSetIdMap[id_]
 
+    def getReferenceSetsByMd5Checksum(self, md5checksum):
+        """
+        Returns the ReferenceSets with the specified MD5 checksum, in the
+        order in which they were added.
+        """
+        md5ChecksumMap = self._referenceSetMd5ChecksumMap
+        if md5ChecksumMap is None:
+            # The index is only published once it is complete, so that
+            # other threads never see a partially built index.
+            md5ChecksumMap = collections.defaultdict(list)
+            for referenceSet in self.getReferenceSets():
+                md5ChecksumMap[referenceSet.getMd5Checksum()].append(
+                    referenceSet)
+            self._referenceSetMd5ChecksumMap = md5ChecksumMap
+        return list(md5ChecksumMap.get(md5checksum, []))
+
+    def getReferenceSetsByAccession(self, accession):
+        """
+        Returns the ReferenceSets that have the specified accession among
+        their source accessions, in the order in which they were added.
+        """
+        return list(self._referenceSetAccessionMap.get(accession, []))
+
+    def getReferenceSetsByAssemblyId(self, assemblyId):
+        """
+        Returns the ReferenceSets with the specified assembly ID, in the
+        order in which they were added.
+        """
+        return list(self._referenceSetAssemblyIdMap.get(assemblyId, []))
+
     def getReferenceSetByIndex(self, index):
         """
         Returns the reference set at the specified index.
@@ -312,18 +451,21 @@ class AbstractBackend(object):
             raise exceptions.ReferenceSetNameNotFoundException(name)
         return self._referenceSetNameMap[name]
 
-    def startProfile(self):
+    def startProfile(self, name):
         """
         Profiling hook. Called at the start of the runSearchRequest method
-        and allows for detailed profiling of search performance.
+        with the name of the search endpoint, and returns the
+        RequestProfile in which the time taken by each phase of the
+        search is recorded. Sampled requests are also profiled in detail.
         """
-        pass
+        return profiling.requestProfiler.start(name)
 
-    def endProfile(self):
+    def endProfile(self, profile):
         """
-        Profiling hook. Called at the end of the runSearchRequest method.
+        Profiling hook. Called with the profile returned by startProfile
+        when the runSearchRequest method finishes, successfully or not.
         """
-        pass
+        profiling.requestProfiler.end(profile)
 
     def validateRequest(self, jsonDict, requestClass):
         """
@@ -420,13 +562,34 @@ class AbstractBackend(object):
                 return self._noObjectGenerator()
             return self._singleObjectGenerator(readGroupSet)
 
+    def _getIndexedCandidates(self, allObjects, indexedLookups):
+        """
+        Returns the smallest of the lists of objects given by the
+        (value, lookupFunction) pairs for which the value is not None, or
+        allObjects if there are none. Every object matching all of the
+        filters is in the returned list.
+        """
+        candidates = None
+        for value, lookupFunction in indexedLookups:
+            if value is not None:
+                objects = lookupFunction(value)
+                if candidates is None or len(objects) < len(candidates):
+                    candidates = objects
+        if candidates is None:
+            candidates = allObjects()
+        return candidates
+
     def referenceSetsGenerator(self, request):
         """
         Returns a generator over the (referenceSet, nextPageToken) pairs
         defined by the specified request.
         """
+        candidates = self._getIndexedCandidates(self.getReferenceSets, [
+            (request.md5checksum, self.getReferenceSetsByMd5Checksum),
+            (request.accession, self.getReferenceSetsByAccession),
+            (request.assemblyId, self.getReferenceSetsByAssemblyId)])
         results = []
-        for obj in self.getReferenceSets():
+        for obj in candidates:
             include = True
             if request.md5checksum is not None:
                 if request.md5checksum != obj.getMd5Checksum():
@@ -447,8 +610,11 @@ class AbstractBackend(object):
         defined by the specified request.
         """
         referenceSet = self.getReferenceSet(request.referenceSetId)
+        candidates = self._getIndexedCandidates(referenceSet.getReferences, [
+            (request.md5checksum, referenceSet.getReferencesByMd5Checksum),
+            (request.accession, referenceSet.getReferencesByAccession)])
         results = []
-        for obj in referenceSet.getReferences():
+        for obj in candidates:
             include = True
             if request.md5checksum is not None:
                 if request.md5checksum != obj.getMd5Checksum():
@@ -470,10 +636,22 @@ class AbstractBackend(object):
             request, dataset.getNumVariantSets(),
             dataset.getVariantSetByIndex)
 
-    def readsGenerator(self, request):
+    def readsGenerator(self, request, fillReferenceSequence=False):
         """
         Returns a generator over the (read, nextPageToken) pairs defined
-        by the specified request
+        by the specified request. If fillReferenceSequence is True, the
+        referenceSequence of the DELETE and SEQUENCE_MISMATCH CIGAR units
+        of the reads is filled in.
+        """
+        readGroup, reference = self._getReadsSearchTarget(request)
+        intervalIterator = ReadsIntervalIterator(
+            request, readGroup, reference, fillReferenceSequence)
+        return intervalIterator
+
+    def _getReadsSearchTarget(self, request):
+        """
+        Returns the (readGroup, reference) pair searched by the specified
+        SearchReadsRequest.
         """
         if request.referenceId is None:
             raise exceptions.UnmappedReadsNotSupported()
@@ -488,8 +666,7 @@ class AbstractBackend(object):
         # Find the reference.
         referenceSet = readGroupSet.getReferenceSet()
         reference = referenceSet.getReference(request.referenceId)
-        intervalIterator = ReadsIntervalIterator(request, readGroup, reference)
-        return intervalIterator
+        return readGroup, reference
 
     def variantsGenerator(self, request):
         """
@@ -502,6 +679,59 @@ class AbstractBackend(object):
         intervalIterator = VariantsIntervalIterator(request, variantSet)
         return intervalIterator
 
+    def readsCost(self, request):
+        """
+        Returns the estimated cost of the specified SearchReadsRequest:
+        the number of bases left to search multiplied by the number of
+        read groups searched.
+        """
+        _, reference = self._getReadsSearchTarget(request)
+        end = request.end
+        if end is None:
+            end = reference.getLength()
+        return _getSearchWidth(request, end) * len(request.readGroupIds)
+
+    def variantsCost(self, request):
+        """
+        Returns the estimated cost of the specified SearchVariantsRequest:
+        the number of bases left to search multiplied by the number of
+        call sets returned, or by one if no calls are returned. Returns
+        None if the request does not have an end.
+        """
+        if request.end is None:
+            return None
+        numCallSets = 1
+        if request.callSetIds is None:
+            compoundId = datamodel.VariantSetCompoundId.parse(
+                request.variantSetId)
+            dataset = self.getDataset(compoundId.datasetId)
+            variantSet = dataset.getVariantSet(compoundId.variantSetId)
+            numCallSets = max(1, variantSet.getNumCallSets())
+        elif len(request.callSetIds) > 0:
+            numCallSets = len(request.callSetIds)
+        return _getSearchWidth(request, request.end) * numCallSets
+
+    def getSearchCost(self, endpointName, requestStr):
+        """
+        Returns the estimated cost of the search request to the specified
+        endpoint in the specified JSON string, or None if searches of the
+        endpoint have no estimated cost or the request is not valid.
+        """
+        costEstimators = dict(
+            (metrics.getSearchEndpointName(requestClass),
+             (requestClass, costEstimator))
+            for requestClass, costEstimator in [
+                (protocol.SearchReadsRequest, self.readsCost),
+                (protocol.SearchVariantsRequest, self.variantsCost)])
+        if endpointName not in costEstimators:
+            return None
+        requestClass, costEstimator = costEstimators[endpointName]
+        try:
+            return costEstimator(requestClass.fromJsonString(requestStr))
+        except Exception:
+            # Invalid requests are reported when they are run.
+            return None
+
     def callSetsGenerator(self, request):
         """
         Returns a generator over the (callSet, nextPageToken) pairs defined
@@ -539,7 +769,8 @@ class AbstractBackend(object):
         return jsonString
 
     def runSearchRequest(
-            self, requestStr, requestClass, responseClass, objectGenerator):
+            self, requestStr, requestClass, responseClass, objectGenerator,
+            costEstimator=None):
         """
         Runs the specified request. The request is a string containing
         a JSON representation of an instance of the specified requestClass.
@@ -548,29 +779,90 @@ class AbstractBackend(object):
         using the specified object generator, which must return
         (object, nextPageToken) pairs, and be able to resume iteration from
         any point using the nextPageToken attribute of the request object.
-        """
-        self.startProfile()
+        The request must be admitted by the admission controller before
+        the object generator is called, using the cost returned for the
+        request object by costEstimator, if specified.
+
+        If a search time budget is set, the page is returned as soon as
+        the budget is spent. Object generators that scan data files stop
+        at the record they are scanning when the budget is spent, and
+        yield a (None, nextPageToken) pair that picks up the scan from
+        there, so that the page may be empty. Other object generators
+        return at least one object in each page.
+        """
+        startTime = timeit.default_timer()
+        endpointName = metrics.getSearchEndpointName(requestClass)
+        profile = self.startProfile(endpointName)
         try:
-            requestDict = json.loads(requestStr)
-        except ValueError:
-            raise exceptions.InvalidJsonException(requestStr)
-        self.validateRequest(requestDict, requestClass)
-        request = requestClass.fromJsonDict(requestDict)
-        if request.pageSize is None:
-            request.pageSize = self._defaultPageSize
-        if request.pageSize <= 0:
-            raise exceptions.BadPageSizeException(request.pageSize)
-        responseBuilder = protocol.SearchResponseBuilder(
-            responseClass, request.pageSize, self._maxResponseLength)
-        nextPageToken = None
-        for obj, nextPageToken in objectGenerator(request):
-            responseBuilder.addValue(obj)
-            if responseBuilder.isFull():
-                break
-        responseBuilder.setNextPageToken(nextPageToken)
-        responseString = responseBuilder.getJsonString()
-        self.validateResponse(responseString, responseClass)
-        self.endProfile()
+            profile.enterPhase("parse")
+            try:
+                requestDict = json.loads(requestStr)
+            except ValueError:
+                raise exceptions.InvalidJsonException(requestStr)
+            profile.enterPhase("validate")
+            self.validateRequest(requestDict, requestClass)
+            profile.enterPhase("parse")
+            request = requestClass.fromJsonDict(requestDict)
+            if request.pageSize is None:
+                request.pageSize = self._defaultPageSize
+            if request.pageSize <= 0:
+                raise exceptions.BadPageSizeException(request.pageSize)
+            responseBuilder = protocol.SearchResponseBuilder(
+                responseClass, request.pageSize, self._maxResponseLength)
+            nextPageToken = None
+            truncated = False
+            cost = None
+            if costEstimator is not None:
+                cost = costEstimator(request)
+            limit = admission.requestAdmission.getLimit(endpointName, cost)
+            if limit is not None:
+                profile.enterPhase("queue")
+                limit.acquire()
+            if self._searchTimeBudget is not None:
+                datamodel.setSearchDeadline(
+                    startTime + self._searchTimeBudget)
+            try:
+                # Object generators that convert the fetched records into
+                # protocol objects attribute that time to the convert
+                # phase.
+                profile.enterPhase("fetch")
+                for obj, nextPageToken in objectGenerator(request):
+                    if obj is None:
+                        # The scan was interrupted by the deadline.
+                        truncated = True
+                        break
+                    profile.enterPhase("serialize")
+                    responseBuilder.addValue(obj)
+                    if responseBuilder.isFull():
+                        break
+                    if (self._searchTimeBudget is not None and
+                            nextPageToken is not None and
+                            timeit.default_timer() - startTime >=
+                            self._searchTimeBudget):
+                        truncated = True
+                        break
+                    profile.enterPhase("fetch")
+            finally:
+                datamodel.setSearchDeadline(None)
+                if limit is not None:
+                    limit.release()
+            profile.enterPhase("serialize")
+            responseBuilder.setNextPageToken(nextPageToken)
+            responseString = responseBuilder.getJsonString()
+            profile.numObjects = responseBuilder.getNumValues()
+            profile.enterPhase("validateResponse")
+            self.validateResponse(responseString, responseClass)
+        finally:
+            self.endProfile(profile)
+        # Every client paging through the same region is issued the same
+        # page tokens, so the pages of a search are tracked by the rest
+        # of its request.
+        searchKey = json.dumps(dict(
+            (key, value) for key, value in requestDict.items()
+            if key != "pageToken"), sort_keys=True)
+        metrics.requestMetrics.observeSearchPage(
+            endpointName, searchKey, request.pageToken, nextPageToken,
+            responseBuilder.getNumValues(), truncated)
         return responseString
 
     def runListReferenceBases(self, id_, requestArgs):
@@ -601,6 +893,70 @@ class AbstractBackend(object):
         response.nextPageToken = nextPageToken
         return response.toJsonString()
 
+    def getReferenceBasesRange(self, id_, requestArgs):
+        """
+        Returns the (start, end) range of bases requested by the specified
+        arguments of a streaming listReferenceBases request for the
+        reference with the specified ID, defaulting to the whole reference.
+        """
+        compoundId = datamodel.ReferenceCompoundId.parse(id_)
+        referenceSet = self.getReferenceSet(compoundId.referenceSetId)
+        reference = referenceSet.getReference(id_)
+        start = _parseIntegerArgument(requestArgs, 'start', 0)
+        end = _parseIntegerArgument(requestArgs, 'end', reference.getLength())
+        reference.checkQueryRange(start, end)
+        return start, end
+
+    def runStreamReferenceBases(self, id_, start, end):
+        """
+        Returns an iterator over the bases of the reference with the
+        specified ID from start (inclusive) to end (exclusive) as
+        consecutive strings of at most the maximum response length. The
+        range must have been checked using getReferenceBasesRange.
+        """
+        compoundId = datamodel.ReferenceCompoundId.parse(id_)
+        referenceSet = self.getReferenceSet(compoundId.referenceSetId)
+        reference = referenceSet.getReference(id_)
+        chunkSize = self._maxResponseLength
+        for chunkStart in range(start, end, chunkSize):
+            yield reference.getBases(
+                chunkStart, min(chunkStart + chunkSize, end))
+
+    def runListCoverage(self, id_, requestArgs):
+        """
+        Runs a coverage request for the read group with the specified ID
+        and request arguments, returning the binned mean and maximum
+        read depth over the requested range of a reference.
+        """
+        compoundId = datamodel.ReadGroupCompoundId.parse(id_)
+        dataset = self.getDataset(compoundId.datasetId)
+        readGroupSet = dataset.getReadGroupSet(compoundId.readGroupSetId)
+        readGroup = readGroupSet.getReadGroup(id_)
+        if 'referenceId' not in requestArgs:
+            raise exceptions.MissingRequestArgumentException('referenceId')
+        referenceSet = readGroupSet.getReferenceSet()
+        reference = referenceSet.getReference(requestArgs['referenceId'])
+        start = _parseIntegerArgument(requestArgs, 'start', 0)
+        end = _parseIntegerArgument(requestArgs, 'end', reference.getLength())
+        reference.checkQueryRange(start, end)
+        defaultBinSize = max(
+            1, -(-(end - start) // self._defaultCoverageBins))
+        binSize = _parseIntegerArgument(requestArgs, 'binSize', defaultBinSize)
+        if binSize <= 0 or (end - start) // binSize > self._maxCoverageBins:
+            raise exceptions.BadCoverageBinSizeException(binSize)
+        binStart, binSize, meanDepth, maxDepth = readGroup.getCoverage(
+            reference, start, end, binSize)
+        response = {
+            "readGroupId": readGroup.getId(),
+            "referenceId": reference.getId(),
+            "start": binStart,
+            "end": end,
+            "binSize": binSize,
+            "meanDepth": [round(value, 3) for value in meanDepth],
+            "maxDepth": [int(value) for value in maxDepth],
+        }
+        return json.dumps(response)
+
     # Get requests.
 
     def runGetCallset(self, id_):
@@ -689,14 +1045,19 @@ class AbstractBackend(object):
             protocol.SearchReadGroupSetsResponse,
             self.readGroupSetsGenerator)
 
-    def runSearchReads(self, request):
+    def runSearchReads(self, request, fillReferenceSequence=False):
         """
-        Runs the specified SearchReadsRequest.
+        Runs the specified SearchReadsRequest. If fillReferenceSequence
+        is True, the referenceSequence of the DELETE and SEQUENCE_MISMATCH
+        CIGAR units of the returned reads is filled in.
         """
         return self.runSearchRequest(
             request, protocol.SearchReadsRequest,
             protocol.SearchReadsResponse,
-            self.readsGenerator)
+            functools.partial(
+                self.readsGenerator,
+                fillReferenceSequence=fillReferenceSequence),
+            self.readsCost)
 
     def runSearchReferenceSets(self, request):
         """
@@ -732,7 +1093,7 @@ class AbstractBackend(object):
         return self.runSearchRequest(
             request, protocol.SearchVariantsRequest,
             protocol.SearchVariantsResponse,
-            self.variantsGenerator)
+            self.variantsGenerator, self.variantsCost)
 
     def runSearchCallSets(self, request):
         """
@@ -768,7 +1129,8 @@ class SimulatedBackend(AbstractBackend):
             numVariantSets=1, numCalls=1, variantDensity=0.5,
             numReferenceSets=1, numReferencesPerReferenceSet=1,
             numReadGroupSets=1, numReadGroupsPerReadGroupSet=1,
-            numAlignments=2):
+            numAlignments=2, referenceLength=200, readLength=100,
+            meanCoverage=None, indelRate=0.1, numTags=2):
         super(SimulatedBackend, self).__init__()
 
         # References
@@ -776,7 +1138,7 @@ class SimulatedBackend(AbstractBackend):
             localId = "referenceSet{}".format(i)
             seed = randomSeed + i
             referenceSet = references.SimulatedReferenceSet(
-                localId, seed, numReferencesPerReferenceSet)
+                localId, seed, numReferencesPerReferenceSet, referenceLength)
             self.addReferenceSet(referenceSet)
 
         # Datasets
@@ -790,7 +1152,9 @@ class SimulatedBackend(AbstractBackend):
                 numVariantSets=numVariantSets,
                 numReadGroupSets=numReadGroupSets,
                 numReadGroupsPerReadGroupSet=numReadGroupsPerReadGroupSet,
-                numAlignments=numAlignments)
+                numAlignments=numAlignments, readLength=readLength,
+                meanCoverage=meanCoverage, indelRate=indelRate,
+                numTags=numTags)
             self.addDataset(dataset)
 
 
@@ -0,0 +1,376 @@
+"""
+End-to-end benchmarks of the GA4GH backend API.
+
+Every endpoint implemented by the run* methods of AbstractBackend is
+timed against a backend, sweeping the page sizes, the number of samples
+(call sets) and the widths of the genomic ranges queried. Paged queries
+are followed through their next page tokens, and each page counts as a
+single request. The latency distribution, throughput and peak resident
+memory of each case are reported as a JSON-serialisable dictionary,
+which can be stored as a baseline and compared against later runs to
+flag performance regressions.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import json
+import os
+import resource
+import timeit
+
+import numpy
+
+import ga4gh.backend as backend
+import ga4gh.datamodel.coverage as coverage
+import ga4gh.datamodel.synthetic as synthetic
+import ga4gh.exceptions as exceptions
+import ga4gh.profiling as profiling
+import ga4gh.protocol as protocol
+
+
+DEFAULT_PAGE_SIZES = (10, 100, 1000)
+DEFAULT_SAMPLE_COUNTS = (0, 1, 10)
+DEFAULT_RANGE_WIDTHS = (10**3, 10**5)
+DEFAULT_TOLERANCE = 0.2
+REGRESSION_METRICS = ("p50", "p95")
+
+
+def getPeakRss():
+    """
+    Returns the peak resident set size of this process in bytes.
+    """
+    # ru_maxrss is measured in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def getSimulatedBackend(numCalls=10, referenceLength=10**6):
+    """
+    Returns a simulated backend sized for benchmarking, with the
+    specified number of call sets per variant set.
+    """
+    return backend.SimulatedBackend(
+        randomSeed=0, numDatasets=1, numVariantSets=1, numCalls=numCalls,
+        variantDensity=0.01, numReferenceSets=1,
+        numReferencesPerReferenceSet=1, numReadGroupSets=1,
+        numReadGroupsPerReadGroupSet=1,
+        referenceLength=referenceLength, readLength=100, meanCoverage=10)
+
+
+def generateCorpus(dataDir, numSamples=10, referenceLength=10**6):
+    """
+    Writes a synthetic data directory for benchmarking the file system
+    backend, including the coverage tiles of its read group sets.
+    """
+    generator = synthetic.SyntheticDataGenerator(
+        dataDir, numReferences=1, referenceLength=referenceLength,
+        numSamples=numSamples, variantDensity=0.01, meanCoverage=10)
+    generator.generate()
+    for samFilePath in generator.getReadGroupSetFilePaths():
+        coverage.CoverageTileBuilder(
+            samFilePath, coverage.DEFAULT_BIN_SIZES).build()
+
+
+def getFileSystemBackend(dataDir, generate=False, numSamples=10):
+    """
+    Returns a file system backend for the specified data directory,
+    first generating a synthetic corpus with the specified number of
+    samples into it if it does not exist and generate is True.
+    """
+    if generate and not os.path.exists(dataDir):
+        generateCorpus(dataDir, numSamples)
+    return backend.FileSystemBackend(dataDir)
+
+
+def summariseLatencies(latencies, elapsedTime, numBytes):
+    """
+    Returns a dictionary summarising the specified list of request
+    latencies, measured over the specified elapsed time, during which
+    the specified number of bytes were returned.
+    """
+    latencies = numpy.array(latencies)
+    return {
+        "numRequests": len(latencies),
+        "latency": {
+            "p50": float(numpy.percentile(latencies, 50)),
+            "p95": float(numpy.percentile(latencies, 95)),
+            "max": float(latencies.max()),
+        },
+        "requestsPerSecond": len(latencies) / elapsedTime,
+        "bytesPerSecond": numBytes / elapsedTime,
+    }
+
+
+class BackendBenchmark(object):
+    """
+    Times all the endpoints of the specified backend. Each case is run
+    numRepeats times, following at most pageLimit pages each time.
+    """
+    def __init__(
+            self, backendName, theBackend, pageSizes=DEFAULT_PAGE_SIZES,
+            sampleCounts=DEFAULT_SAMPLE_COUNTS,
+            rangeWidths=DEFAULT_RANGE_WIDTHS, numRepeats=3, pageLimit=3):
+        self._backendName = backendName
+        self._backend = theBackend
+        self._pageSizes = pageSizes
+        self._sampleCounts = sampleCounts
+        self._rangeWidths = rangeWidths
+        self._numRepeats = numRepeats
+        self._pageLimit = pageLimit
+        dataset = theBackend.getDatasets()[0]
+        self._dataset = dataset
+        self._referenceSet = theBackend.getReferenceSets()[0]
+        self._reference = self._referenceSet.getReferences()[0]
+        self._variantSet = dataset.getVariantSets()[0]
+        self._callSets = self._variantSet.getCallSets()
+        self._readGroupSet = dataset.getReadGroupSets()[0]
+        self._readGroup = self._readGroupSet.getReadGroups()[0]
+        self._phaseTimes = collections.OrderedDict()
+        self._numObjects = 0
+
+    def _getRangeWidths(self):
+        length = self._reference.getLength()
+        return sorted(set(min(width, length) for width in self._rangeWidths))
+
+    def _getSampleCounts(self):
+        numCallSets = len(self._callSets)
+        return sorted(set(
+            min(count, numCallSets) for count in self._sampleCounts))
+
+    def _runSearch(self, method, request):
+        """
+        Runs the specified search request, following the next page tokens
+        for at most pageLimit pages, and returns the list of (latency,
+        numBytes) pairs of the pages. The time spent in each phase of the
+        searches is added to the phase times of the current case.
+        """
+        ret = []
+        request.pageToken = None
+        while len(ret) < self._pageLimit:
+            requestString = request.toJsonString()
+            startTime = timeit.default_timer()
+            responseString = method(requestString)
+            ret.append(
+                (timeit.default_timer() - startTime, len(responseString)))
+            profile = profiling.requestProfiler.popLastProfile()
+            for phase, phaseTime in profile.getPhaseTimes().items():
+                self._phaseTimes[phase] = (
+                    self._phaseTimes.get(phase, 0) + phaseTime)
+            self._numObjects += profile.numObjects
+            request.pageToken = json.loads(responseString)["nextPageToken"]
+            if request.pageToken is None:
+                break
+        return ret
+
+    def _runListReferenceBases(self, start, end):
+        ret = []
+        requestArgs = {"start": start, "end": end}
+        while len(ret) < self._pageLimit:
+            startTime = timeit.default_timer()
+            responseString = self._backend.runListReferenceBases(
+                self._reference.getId(), requestArgs)
+            ret.append(
+                (timeit.default_timer() - startTime, len(responseString)))
+            requestArgs["pageToken"] = json.loads(
+                responseString)["nextPageToken"]
+            if requestArgs["pageToken"] is None:
+                break
+        return ret
+
+    def _runStreamReferenceBases(self, start, end):
+        startTime = timeit.default_timer()
+        numBytes = sum(
+            len(chunk) for chunk in self._backend.runStreamReferenceBases(
+                self._reference.getId(), start, end))
+        return [(timeit.default_timer() - startTime, numBytes)]
+
+    def _runSingle(self, method, *args):
+        startTime = timeit.default_timer()
+        responseString = method(*args)
+        return [(timeit.default_timer() - startTime, len(responseString))]
+
+    def _getFirstVariantId(self):
+        request = protocol.SearchVariantsRequest()
+        request.variantSetId = self._variantSet.getId()
+        request.referenceName = self._reference.getName()
+        request.start = 0
+        request.end = self._reference.getLength()
+        request.callSetIds = []
+        request.pageSize = 1
+        response = protocol.SearchVariantsResponse.fromJsonString(
+            self._backend.runSearchVariants(request.toJsonString()))
+        if len(response.variants) == 0:
+            return None
+        return response.variants[0].id
+
+    def getCases(self):
+        """
+        Returns the list of (endpoint, parameters, function) tuples
+        defining the cases of this benchmark. Calling the function runs
+        the case once and returns the (latency, numBytes) pairs of the
+        requests that were made.
+        """
+        be = self._backend
+        cases = []
+        for endpoint, method, objectId in [
+                ("getDataset", be.runGetDataset, self._dataset.getId()),
+                ("getReferenceSet", be.runGetReferenceSet,
+                    self._referenceSet.getId()),
+                ("getReference", be.runGetReference, self._reference.getId()),
+                ("getVariantSet", be.runGetVariantSet,
+                    self._variantSet.getId()),
+                ("getCallset", be.runGetCallset, self._callSets[0].getId()),
+                ("getReadGroupSet", be.runGetReadGroupSet,
+                    self._readGroupSet.getId()),
+                ("getReadGroup", be.runGetReadGroup,
+                    self._readGroup.getId()),
+                ("getVariant", be.runGetVariant, self._getFirstVariantId())]:
+            if objectId is not None:
+                cases.append((
+                    endpoint, {},
+                    lambda m=method, i=objectId: self._runSingle(m, i)))
+        for pageSize in self._pageSizes:
+            parameters = {"pageSize": pageSize}
+            for endpoint, method, request in [
+                    ("searchDatasets", be.runSearchDatasets,
+                        protocol.SearchDatasetsRequest()),
+                    ("searchReferenceSets", be.runSearchReferenceSets,
+                        protocol.SearchReferenceSetsRequest()),
+                    ("searchReferences", be.runSearchReferences,
+                        protocol.SearchReferencesRequest(
+                            referenceSetId=self._referenceSet.getId())),
+                    ("searchVariantSets", be.runSearchVariantSets,
+                        protocol.SearchVariantSetsRequest(
+                            datasetId=self._dataset.getId())),
+                    ("searchCallSets", be.runSearchCallSets,
+                        protocol.SearchCallSetsRequest(
+                            variantSetId=self._variantSet.getId())),
+                    ("searchReadGroupSets", be.runSearchReadGroupSets,
+                        protocol.SearchReadGroupSetsRequest(
+                            datasetId=self._dataset.getId()))]:
+                request.pageSize = pageSize
+                cases.append((
+                    endpoint, parameters,
+                    lambda m=method, r=request: self._runSearch(m, r)))
+        for rangeWidth in self._getRangeWidths():
+            for pageSize in self._pageSizes:
+                for sampleCount in self._getSampleCounts():
+                    request = protocol.SearchVariantsRequest()
+                    request.variantSetId = self._variantSet.getId()
+                    request.referenceName = self._reference.getName()
+                    request.start = 0
+                    request.end = rangeWidth
+                    request.callSetIds = [
+                        callSet.getId()
+                        for callSet in self._callSets[:sampleCount]]
+                    request.pageSize = pageSize
+                    cases.append((
+                        "searchVariants", {
+                            "pageSize": pageSize, "rangeWidth": rangeWidth,
+                            "numSamples": sampleCount},
+                        lambda r=request: self._runSearch(
+                            be.runSearchVariants, r)))
+                request = protocol.SearchReadsRequest()
+                request.readGroupIds = [self._readGroup.getId()]
+                request.referenceId = self._reference.getId()
+                request.start = 0
+                request.end = rangeWidth
+                request.pageSize = pageSize
+                cases.append((
+                    "searchReads", {
+                        "pageSize": pageSize, "rangeWidth": rangeWidth},
+                    lambda r=request: self._runSearch(be.runSearchReads, r)))
+            parameters = {"rangeWidth": rangeWidth}
+            cases.append((
+                "listReferenceBases", parameters,
+                lambda w=rangeWidth: self._runListReferenceBases(0, w)))
+            cases.append((
+                "streamReferenceBases", parameters,
+                lambda w=rangeWidth: self._runStreamReferenceBases(0, w)))
+            cases.append((
+                "listCoverage", parameters,
+                lambda w=rangeWidth: self._runSingle(
+                    be.runListCoverage, self._readGroup.getId(), {
+                        "referenceId": self._reference.getId(),
+                        "start": 0, "end": w})))
+        return cases
+
+    def getCaseName(self, endpoint, parameters):
+        """
+        Returns the name identifying the specified case in the results.
+        """
+        return "/".join([self._backendName, endpoint] + [
+            "{}={}".format(key, value)
+            for key, value in sorted(parameters.items())])
+
+    def run(self):
+        """
+        Runs all the cases of this benchmark and returns a dictionary
+        mapping their names to their results. Cases for endpoints that
+        are not available in the backend (e.g. coverage without
+        precomputed tiles) are omitted. The results of search cases
+        include the mean time per page and per object spent in each phase
+        of the searches.
+        """
+        results = {}
+        for endpoint, parameters, function in self.getCases():
+            requests = []
+            self._phaseTimes = collections.OrderedDict()
+            self._numObjects = 0
+            startTime = timeit.default_timer()
+            try:
+                for _ in range(self._numRepeats):
+                    requests.extend(function())
+            except exceptions.CoverageNotAvailableException:
+                continue
+            elapsedTime = timeit.default_timer() - startTime
+            result = summariseLatencies(
+                [latency for latency, _ in requests], elapsedTime,
+                sum(numBytes for _, numBytes in requests))
+            result["backend"] = self._backendName
+            result["endpoint"] = endpoint
+            result["parameters"] = parameters
+            result["peakRss"] = getPeakRss()
+            if len(self._phaseTimes) > 0:
+                result["phases"] = dict(
+                    (phase, phaseTime / len(requests))
+                    for phase, phaseTime in self._phaseTimes.items())
+                result["numObjects"] = self._numObjects
+                if self._numObjects > 0:
+                    result["phasesPerObject"] = dict(
+                        (phase, phaseTime / self._numObjects)
+                        for phase, phaseTime in self._phaseTimes.items())
+            results[self.getCaseName(endpoint, parameters)] = result
+        return results
+
+
+def runBenchmarks(benchmarks):
+    """
+    Runs the specified benchmarks and returns the JSON-serialisable
+    report of their results.
+    """
+    cases = {}
+    for benchmark in benchmarks:
+        cases.update(benchmark.run())
+    return {"cases": cases, "peakRss": getPeakRss()}
+
+
+def compareToBaseline(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Returns the list of (caseName, metric, baselineValue, value) tuples
+    for the latency metrics of the cases in the specified report that
+    are more than the specified fraction slower than in the baseline
+    report. Cases that are not in both reports are ignored.
+    """
+    regressions = []
+    for name, result in sorted(report["cases"].items()):
+        if name not in baseline["cases"]:
+            continue
+        baselineLatency = baseline["cases"][name]["latency"]
+        for metric in REGRESSION_METRICS:
+            value = result["latency"][metric]
+            baselineValue = baselineLatency[metric]
+            if value > baselineValue * (1 + tolerance):
+                regressions.append((name, metric, baselineValue, value))
+    return regressions
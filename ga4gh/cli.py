@@ -8,17 +8,29 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import argparse
+import json
 import logging
+import multiprocessing
+import sys
 import unittest
 import unittest.loader
 import unittest.suite
 
 import requests
 
+import ga4gh.asyncserver as asyncserver
 import ga4gh.backend as backend
+import ga4gh.benchmark as benchmark
 import ga4gh.client as client
 import ga4gh.converters as converters
+import ga4gh.datamodel.checksums as checksums
+import ga4gh.datamodel.coverage as coverage
+import ga4gh.datamodel.packed as packed
+import ga4gh.datamodel.reads as reads
+import ga4gh.datamodel.synthetic as synthetic
 import ga4gh.frontend as frontend
+import ga4gh.loadtest as loadtest
+import ga4gh.prefork as prefork
 import ga4gh.configtest as configtest
 import ga4gh.exceptions as exceptions
 
@@ -57,6 +69,27 @@ def addServerOptions(parser):
     parser.add_argument(
         "--dont-use-reloader", default=False, action="store_true",
         help="Don't use the flask reloader")
+    parser.add_argument(
+        "--workers", "-w", default=0, type=int,
+        help=(
+            "The number of pre-forked worker processes to serve requests "
+            "from. If this is zero, the single process development server "
+            "is used"))
+    parser.add_argument(
+        "--max-requests", default=0, type=int,
+        help=(
+            "The approximate number of requests after which a worker is "
+            "replaced, or 0 to never replace workers"))
+    parser.add_argument(
+        "--event-loop", default=False, action="store_true",
+        help=(
+            "Serve connections from an event loop, running metadata "
+            "lookups on the event loop and other requests on a pool of "
+            "executor threads"))
+    parser.add_argument(
+        "--executor-threads", type=int,
+        default=asyncserver.DEFAULT_EXECUTOR_THREADS,
+        help="The number of executor threads used with --event-loop")
     addDisableUrllibWarningsArgument(parser)
 
 
@@ -73,9 +106,382 @@ def server_main(parser=None):
     sslContext = None
     if args.tls or ("OIDC_PROVIDER" in frontend.app.config):
         sslContext = "adhoc"
-    frontend.app.run(
-        host=args.host, port=args.port,
-        use_reloader=not args.dont_use_reloader, ssl_context=sslContext)
+    if args.event_loop:
+        if args.workers > 0 or sslContext is not None:
+            parser.error(
+                "--event-loop cannot be used with --workers or TLS")
+        server = asyncserver.AsyncServer(
+            frontend.app, args.host, args.port, frontend.isInlineRequest,
+            args.executor_threads,
+            getAdmissionLimit=frontend.getAdmissionLimit)
+        server.serveForever()
+    elif args.workers > 0:
+        server = prefork.PreforkServer(
+            frontend.app, args.host, args.port, args.workers,
+            args.max_requests, sslContext)
+        server.serveForever()
+    else:
+        frontend.app.run(
+            host=args.host, port=args.port,
+            use_reloader=not args.dont_use_reloader, ssl_context=sslContext)
+
+
+##############################################################################
+# Reference preprocessing
+##############################################################################
+
+
+def getPackReferencesParser():
+    parser = argparse.ArgumentParser(
+        description=(
+            "GA4GH reference packer. Builds the packed, memory-mapped "
+            "representation of the sequences in FASTA files that is used "
+            "to serve reference bases."))
+    parser.add_argument(
+        "fastaFiles", nargs="+", help="The indexed FASTA files to process")
+    return parser
+
+
+def pack_references_main(args=None):
+    parser = getPackReferencesParser()
+    parsedArgs = parser.parse_args(args)
+    for fastaFile in parsedArgs.fastaFiles:
+        builder = packed.PackedReferenceBuilder(fastaFile)
+        builder.build()
+
+
+def getReferenceChecksumsParser():
+    parser = argparse.ArgumentParser(
+        description=(
+            "GA4GH reference checksum tool. Computes the MD5 checksums of "
+            "the sequences in FASTA files and writes them to, or verifies "
+            "them against, the JSON metadata files next to the FASTA "
+            "files."))
+    parser.add_argument(
+        "fastaFiles", nargs="+", help="The indexed FASTA files to process")
+    parser.add_argument(
+        "--verify", action="store_true", default=False,
+        help=(
+            "Verify the checksums in the metadata files rather than "
+            "writing them, exiting with a non-zero status on mismatches"))
+    parser.add_argument(
+        "--workers", "-w", type=int, default=multiprocessing.cpu_count(),
+        help="The number of worker processes to use")
+    parser.add_argument(
+        "--chunkSize", type=int, default=2**22,
+        help="The number of bases read at a time")
+    return parser
+
+
+def reference_checksums_main(args=None):
+    parser = getReferenceChecksumsParser()
+    parsedArgs = parser.parse_args(args)
+    md5checksums = checksums.computeMd5Checksums(
+        parsedArgs.fastaFiles, parsedArgs.workers, parsedArgs.chunkSize)
+    numMismatches = 0
+    for fastaFile in parsedArgs.fastaFiles:
+        metadataFile = checksums.ReferenceMetadataFile(fastaFile)
+        for referenceName in metadataFile.getReferenceNames():
+            md5checksum = md5checksums[fastaFile, referenceName]
+            if parsedArgs.verify:
+                recorded = metadataFile.getMd5Checksum(referenceName)
+                if recorded != md5checksum:
+                    numMismatches += 1
+                    print("{}:{}: recorded {} computed {}".format(
+                        fastaFile, referenceName, recorded, md5checksum))
+            else:
+                metadataFile.setMd5Checksum(referenceName, md5checksum)
+        if not parsedArgs.verify:
+            metadataFile.write()
+    if numMismatches > 0:
+        sys.exit("{} checksum mismatches".format(numMismatches))
+
+
+##############################################################################
+# Read preprocessing
+##############################################################################
+
+
+def getBuildCoverageParser():
+    parser = argparse.ArgumentParser(
+        description=(
+            "GA4GH coverage tile builder. Precomputes the multi-resolution "
+            "read depth tiles served by the readgroups coverage endpoint."))
+    parser.add_argument(
+        "samFiles", nargs="+", help="The indexed BAM files to process")
+    parser.add_argument(
+        "--binSizes", "-b", default=None,
+        help=(
+            "Comma separated list of the bin sizes to store; defaults "
+            "to {}".format(",".join(map(str, coverage.DEFAULT_BIN_SIZES)))))
+    return parser
+
+
+def build_coverage_main(args=None):
+    parser = getBuildCoverageParser()
+    parsedArgs = parser.parse_args(args)
+    binSizes = coverage.DEFAULT_BIN_SIZES
+    if parsedArgs.binSizes is not None:
+        binSizes = [int(size) for size in parsedArgs.binSizes.split(",")]
+    for samFile in parsedArgs.samFiles:
+        builder = coverage.CoverageTileBuilder(samFile, binSizes)
+        builder.build()
+
+
+def getBuildReadStatsParser():
+    parser = argparse.ArgumentParser(
+        description=(
+            "GA4GH read statistics builder. Counts the aligned and "
+            "unaligned reads and bases of each read group and caches them "
+            "in a sidecar file next to the BAM file."))
+    parser.add_argument(
+        "samFiles", nargs="+", help="The BAM files to process")
+    return parser
+
+
+def build_read_stats_main(args=None):
+    parser = getBuildReadStatsParser()
+    parsedArgs = parser.parse_args(args)
+    for samFile in parsedArgs.samFiles:
+        reads.buildReadStats(samFile)
+
+
+##############################################################################
+# Synthetic data
+##############################################################################
+
+
+def getGenerateDataParser():
+    parser = argparse.ArgumentParser(
+        description=(
+            "GA4GH synthetic data generator. Writes a data directory "
+            "holding a random reference set, and a dataset of variant sets "
+            "and read group sets aligned to it, for benchmarking."))
+    parser.add_argument(
+        "dataDir", help="The data directory to write")
+    parser.add_argument(
+        "--randomSeed", "-s", type=int, default=0,
+        help="The random seed")
+    parser.add_argument(
+        "--numReferences", type=int, default=1,
+        help="The number of references")
+    parser.add_argument(
+        "--referenceLength", type=int, default=10**6,
+        help="The number of bases in each reference")
+    parser.add_argument(
+        "--numVariantSets", type=int, default=1,
+        help="The number of variant sets")
+    parser.add_argument(
+        "--numSamples", type=int, default=10,
+        help="The number of samples in each variant set")
+    parser.add_argument(
+        "--variantDensity", type=float, default=0.001,
+        help="The expected number of variants per base")
+    parser.add_argument(
+        "--numReadGroupSets", type=int, default=1,
+        help="The number of read group sets")
+    parser.add_argument(
+        "--readLength", type=int, default=100,
+        help="The length of the reads")
+    parser.add_argument(
+        "--meanCoverage", type=float, default=1.0,
+        help="The mean read coverage of each read group set")
+    parser.add_argument(
+        "--errorRate", type=float, default=0.01,
+        help="The probability of a substitution in a read base")
+    parser.add_argument(
+        "--workers", "-w", type=int, default=multiprocessing.cpu_count(),
+        help="The number of worker processes to use")
+    return parser
+
+
+def generate_data_main(args=None):
+    parser = getGenerateDataParser()
+    parsedArgs = parser.parse_args(args)
+    generator = synthetic.SyntheticDataGenerator(
+        parsedArgs.dataDir, parsedArgs.randomSeed, parsedArgs.numReferences,
+        parsedArgs.referenceLength, parsedArgs.numVariantSets,
+        parsedArgs.numSamples, parsedArgs.variantDensity,
+        parsedArgs.numReadGroupSets, parsedArgs.readLength,
+        parsedArgs.meanCoverage, parsedArgs.errorRate, parsedArgs.workers)
+    generator.generate()
+
+
+##############################################################################
+# Benchmark
+##############################################################################
+
+
+def getBenchmarkParser():
+    parser = argparse.ArgumentParser(
+        description=(
+            "GA4GH backend benchmark. Times every endpoint of the simulated "
+            "backend and (optionally) a file system backend, and writes "
+            "the latency, throughput and memory use of each case as JSON."))
+    parser.add_argument(
+        "--dataDir", default=None,
+        help="The data directory of the file system backend to benchmark")
+    parser.add_argument(
+        "--generateData", action="store_true", default=False,
+        help="Generate a synthetic corpus into dataDir if it does not exist")
+    parser.add_argument(
+        "--skipSimulated", action="store_true", default=False,
+        help="Do not benchmark the simulated backend")
+    parser.add_argument(
+        "--pageSizes", default=None,
+        help="Comma separated list of the page sizes to sweep")
+    parser.add_argument(
+        "--sampleCounts", default=None,
+        help="Comma separated list of the numbers of samples to sweep")
+    parser.add_argument(
+        "--rangeWidths", default=None,
+        help="Comma separated list of the genomic range widths to sweep")
+    parser.add_argument(
+        "--repeatLimit", type=int, default=3, metavar="N",
+        help="How many times to run each case (default: %(default)s)")
+    parser.add_argument(
+        "--pageLimit", type=int, default=3, metavar="N",
+        help=(
+            "How many pages (max) to load in each run of a case "
+            "(default: %(default)s)"))
+    parser.add_argument(
+        "--outputFile", "-O", default=None,
+        help="The file to write the JSON report to; defaults to stdout")
+    parser.add_argument(
+        "--baseline", "-b", default=None,
+        help=(
+            "A previous JSON report to compare against, exiting with a "
+            "non-zero status if any case has regressed"))
+    parser.add_argument(
+        "--tolerance", type=float, default=benchmark.DEFAULT_TOLERANCE,
+        help=(
+            "The fractional increase in p50 or p95 latency over the "
+            "baseline that is reported as a regression "
+            "(default: %(default)s)"))
+    return parser
+
+
+def _parseIntegerList(value, default):
+    if value is None:
+        return default
+    return [int(item) for item in value.split(",")]
+
+
+def benchmark_main(args=None):
+    parser = getBenchmarkParser()
+    parsedArgs = parser.parse_args(args)
+    pageSizes = _parseIntegerList(
+        parsedArgs.pageSizes, benchmark.DEFAULT_PAGE_SIZES)
+    sampleCounts = _parseIntegerList(
+        parsedArgs.sampleCounts, benchmark.DEFAULT_SAMPLE_COUNTS)
+    rangeWidths = _parseIntegerList(
+        parsedArgs.rangeWidths, benchmark.DEFAULT_RANGE_WIDTHS)
+    backends = []
+    if not parsedArgs.skipSimulated:
+        backends.append((
+            "simulated", benchmark.getSimulatedBackend(
+                max(1, max(sampleCounts)))))
+    if parsedArgs.dataDir is not None:
+        backends.append((
+            "filesystem", benchmark.getFileSystemBackend(
+                parsedArgs.dataDir, parsedArgs.generateData,
+                max(1, max(sampleCounts)))))
+    benchmarks = [
+        benchmark.BackendBenchmark(
+            name, theBackend, pageSizes, sampleCounts, rangeWidths,
+            parsedArgs.repeatLimit, parsedArgs.pageLimit)
+        for name, theBackend in backends]
+    report = benchmark.runBenchmarks(benchmarks)
+    reportString = json.dumps(report, indent=4, sort_keys=True)
+    if parsedArgs.outputFile is None:
+        print(reportString)
+    else:
+        with open(parsedArgs.outputFile, "w") as outputFile:
+            print(reportString, file=outputFile)
+    if parsedArgs.baseline is not None:
+        with open(parsedArgs.baseline) as baselineFile:
+            baseline = json.load(baselineFile)
+        regressions = benchmark.compareToBaseline(
+            report, baseline, parsedArgs.tolerance)
+        for name, metric, baselineValue, value in regressions:
+            print("{}: {} latency {:.6f}s, baseline {:.6f}s".format(
+                name, metric, value, baselineValue), file=sys.stderr)
+        if len(regressions) > 0:
+            sys.exit("{} latency regressions".format(len(regressions)))
+
+
+def getLoadTestParser():
+    parser = argparse.ArgumentParser(
+        description=(
+            "GA4GH load tester. Sends a weighted mix of requests to a "
+            "running server from concurrent workers, and reports the "
+            "latency histogram and error rate of each endpoint and the "
+            "saturation throughput as JSON."))
+    addUrlArgument(parser)
+    requestsGroup = parser.add_mutually_exclusive_group(required=True)
+    requestsGroup.add_argument(
+        "--scenario", default=None,
+        help="A JSON file defining the weighted requests to send")
+    requestsGroup.add_argument(
+        "--requestLog", default=None,
+        help="A request log written by the server to replay")
+    parser.add_argument(
+        "--concurrency", "-c", default="1",
+        help=(
+            "Comma separated list of the numbers of concurrent workers; "
+            "the load test is run once for each"))
+    parser.add_argument(
+        "--rate", "-r", type=float, default=None,
+        help=(
+            "The number of requests to start per second; by default each "
+            "worker sends requests back to back"))
+    parser.add_argument(
+        "--duration", "-d", type=float, default=None,
+        help="The number of seconds to run each load test for")
+    parser.add_argument(
+        "--numRequests", "-n", type=int, default=None,
+        help="The number of requests to send in each load test")
+    parser.add_argument(
+        "--randomSeed", "-s", type=int, default=0,
+        help="The random seed used to choose the requests")
+    parser.add_argument(
+        "--saturationThreshold", type=float,
+        default=loadtest.DEFAULT_SATURATION_THRESHOLD,
+        help=(
+            "The fractional increase in throughput below which the server "
+            "is considered saturated (default: %(default)s)"))
+    parser.add_argument(
+        "--outputFile", "-O", default=None,
+        help="The file to write the JSON report to; defaults to stdout")
+    parser.add_argument(
+        "--key", "-k", default=None,
+        help="Auth Key. Found on server index page.")
+    addDisableUrllibWarningsArgument(parser)
+    return parser
+
+
+def loadtest_main(args=None):
+    parser = getLoadTestParser()
+    parsedArgs = parser.parse_args(args)
+    if parsedArgs.disable_urllib_warnings:
+        requests.packages.urllib3.disable_warnings()
+    if parsedArgs.duration is None and parsedArgs.numRequests is None:
+        parsedArgs.duration = 10
+    if parsedArgs.scenario is not None:
+        templates = loadtest.readScenario(parsedArgs.scenario)
+    else:
+        templates = loadtest.readRequestLog(parsedArgs.requestLog)
+    report = loadtest.runConcurrencySweep(
+        parsedArgs.baseUrl, templates,
+        _parseIntegerList(parsedArgs.concurrency, None), parsedArgs.rate,
+        parsedArgs.duration, parsedArgs.numRequests, parsedArgs.randomSeed,
+        parsedArgs.key, parsedArgs.saturationThreshold)
+    reportString = json.dumps(report, indent=4, sort_keys=True)
+    if parsedArgs.outputFile is None:
+        print(reportString)
+    else:
+        with open(parsedArgs.outputFile, "w") as outputFile:
+            print(reportString, file=outputFile)
 
 
 ##############################################################################
@@ -381,6 +787,7 @@ class SearchReadsRunner(AbstractSearchRunner):
         self._start = args.start
         self._end = args.end
         self._referenceId = args.referenceId
+        self._fillReferenceSequence = args.fillReferenceSequence
         self._readGroupIds = None
         if args.readGroupIds is not None:
             self._readGroupIds = args.readGroupIds.split(",")
@@ -390,7 +797,8 @@ class SearchReadsRunner(AbstractSearchRunner):
         # like we do with SearchVariants and others.
         iterator = self._client.searchReads(
             readGroupIds=self._readGroupIds, referenceId=self._referenceId,
-            start=self._start, end=self._end)
+            start=self._start, end=self._end,
+            fillReferenceSequence=self._fillReferenceSequence)
         self._output(iterator)
 
     def _textOutput(self, gaObjects):
@@ -414,14 +822,17 @@ class ListReferenceBasesRunner(AbstractQueryRunner):
         self._referenceId = args.id
         self._start = args.start
         self._end = args.end
+        self._outputFile = args.outputFile
 
     def run(self):
-        iterator = self._client.listReferenceBases(
-            self._referenceId, self._start, self._end)
         # TODO add support for FASTA output.
-        for segment in iterator:
-            print(segment, end="")
-        print()
+        if self._outputFile is None:
+            self._client.writeReferenceBases(
+                self._referenceId, sys.stdout, self._start, self._end)
+            print()
+        else:
+            self._client.writeReferenceBases(
+                self._referenceId, self._outputFile, self._start, self._end)
 
 
 # Runners for the various GET methods.
@@ -750,6 +1161,9 @@ def addReadsSearchParserArguments(parser):
     parser.add_argument(
         "--referenceId", default=None,
         help="The referenceId to search over")
+    parser.add_argument(
+        "--fillReferenceSequence", default=False, action="store_true",
+        help="Fill in the reference sequence of deletions and mismatches")
 
 
 def addReferenceSetsGetParser(subparsers):
@@ -816,6 +1230,9 @@ def addReferencesBasesListParser(subparsers):
     addIdArgument(parser)
     addStartArgument(parser)
     addEndArgument(parser, defaultValue=None)
+    parser.add_argument(
+        "--outputFile", "-O", default=None,
+        help="The file to write the bases to; standard output by default")
 
 
 def getClientParser():
@@ -5,6 +5,7 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import json
 import requests
 import posixpath
 import logging
@@ -36,15 +37,18 @@ class AbstractClient(object):
         return responseObject
 
     def _runSearchPageRequest(
-            self, protocolRequest, objectName, protocolResponseClass):
+            self, protocolRequest, objectName, protocolResponseClass,
+            searchOptions=None):
         """
         Runs a complete transaction with the server to obtain a single
-        page of search results.
+        page of search results. The searchOptions are the extra,
+        non-protocol options supported by some of the search endpoints.
         """
         raise NotImplemented()
 
     def _runSearchRequest(
-            self, protocolRequest, objectName, protocolResponseClass):
+            self, protocolRequest, objectName, protocolResponseClass,
+            searchOptions=None):
         """
         Runs the specified request at the specified objectName and instantiates
         an object of the specified class. We yield each object in listAttr.
@@ -54,7 +58,8 @@ class AbstractClient(object):
         notDone = True
         while notDone:
             responseObject = self._runSearchPageRequest(
-                protocolRequest, objectName, protocolResponseClass)
+                protocolRequest, objectName, protocolResponseClass,
+                searchOptions)
             valueList = getattr(
                 responseObject, protocolResponseClass.getValueListName())
             for extract in valueList:
@@ -90,6 +95,32 @@ class AbstractClient(object):
             request.pageToken = response.nextPageToken
         return "".join(basesList)
 
+    def writeReferenceBases(self, id_, outputFile, start=0, end=None):
+        """
+        Writes the bases of the reference with the specified ID from start
+        (inclusive) to end (exclusive; the end of the reference by default)
+        to the specified file-like object or file path, streaming them from
+        the server in a single request. Returns the number of bases
+        written.
+        """
+        if isinstance(outputFile, basestring):
+            with open(outputFile, "wb") as outputFileObject:
+                return self.writeReferenceBases(
+                    id_, outputFileObject, start, end)
+        numBases = 0
+        for bases in self._streamReferenceBases(id_, start, end):
+            outputFile.write(bases)
+            numBases += len(bases)
+        return numBases
+
+    def _streamReferenceBases(self, id_, start, end):
+        """
+        Returns an iterator over consecutive strings of the bases of the
+        specified reference, as sent by the server in a single streaming
+        response.
+        """
+        raise NotImplemented()
+
     def _runGetRequest(self, objectName, protocolResponseClass, id_):
         """
         Requests an object from the server and returns the object of
@@ -339,7 +370,8 @@ class AbstractClient(object):
             request, "readgroupsets", protocol.SearchReadGroupSetsResponse)
 
     def searchReads(
-            self, readGroupIds, referenceId=None, start=None, end=None):
+            self, readGroupIds, referenceId=None, start=None, end=None,
+            fillReferenceSequence=False):
         """
         Returns an iterator over the Reads fulfilling the specified
         conditions from the specified ReadGroupIds.
@@ -351,6 +383,9 @@ class AbstractClient(object):
             mapped to.
         :param int start: TODO
         :param int end: TODO
+        :param bool fillReferenceSequence: If True, the server fills in
+            the referenceSequence of the DELETE and SEQUENCE_MISMATCH
+            :class:`ga4gh.protocol.CigarUnit` objects of the reads.
         :return: An iterator over the
             :class:`ga4gh.protocol.ReadAlignment` objects defined by
             the query parameters.
@@ -362,8 +397,11 @@ class AbstractClient(object):
         request.start = start
         request.end = end
         request.pageSize = self._pageSize
+        searchOptions = {}
+        if fillReferenceSequence:
+            searchOptions["fillReferenceSequence"] = True
         return self._runSearchRequest(
-            request, "reads", protocol.SearchReadsResponse)
+            request, "reads", protocol.SearchReadsResponse, searchOptions)
 
 
 class HttpClient(AbstractClient):
@@ -388,6 +426,7 @@ class HttpClient(AbstractClient):
         self._urlPrefix = urlPrefix
         self._authenticationKey = authenticationKey
         self._session = requests.Session()
+        self._streamChunkSize = 2**16
         self._setupHttpSession()
         requestsLog = logging.getLogger("requests.packages.urllib3")
         requestsLog.setLevel(logLevel)
@@ -420,13 +459,35 @@ class HttpClient(AbstractClient):
         """
         return {'key': self._authenticationKey}
 
+    def sendRequest(self, httpMethod, path, params=None, data=None):
+        """
+        Sends an HTTP request with the specified method, query parameters
+        and body for the specified path relative to the URL prefix of this
+        client, and returns the response from the requests package
+        without checking its status. This is used to replay arbitrary
+        requests against the server, for example when load testing.
+        """
+        url = posixpath.join(self._urlPrefix, path.lstrip("/"))
+        requestParams = self._getHttpParameters()
+        if params is not None:
+            requestParams.update(params)
+        response = self._session.request(
+            httpMethod, url, params=requestParams, data=data)
+        self._protocolBytesReceived += len(response.content)
+        return response
+
     def _runSearchPageRequest(
-            self, protocolRequest, objectName, protocolResponseClass):
+            self, protocolRequest, objectName, protocolResponseClass,
+            searchOptions=None):
         url = posixpath.join(self._urlPrefix, objectName + '/search')
         data = protocolRequest.toJsonString()
         self._logger.debug("request:{}".format(data))
-        response = self._session.post(
-            url, params=self._getHttpParameters(), data=data)
+        if searchOptions is None:
+            searchOptions = {}
+        params = self._getHttpParameters()
+        for key, value in searchOptions.items():
+            params[key] = json.dumps(value)
+        response = self._session.post(url, params=params, data=data)
         self._checkResponseStatus(response)
         return self._deserializeResponse(response.text, protocolResponseClass)
 
@@ -447,6 +508,21 @@ class HttpClient(AbstractClient):
         return self._deserializeResponse(
             response.text, protocol.ListReferenceBasesResponse)
 
+    def _streamReferenceBases(self, id_, start, end):
+        urlSuffix = "references/{id}/bases".format(id=id_)
+        url = posixpath.join(self._urlPrefix, urlSuffix)
+        params = self._getHttpParameters()
+        params["start"] = start
+        if end is not None:
+            params["end"] = end
+        response = self._session.get(
+            url, params=params, headers={"Accept": "text/plain"},
+            stream=True)
+        self._checkResponseStatus(response)
+        for bases in response.iter_content(self._streamChunkSize):
+            self._protocolBytesReceived += len(bases)
+            yield bases
+
 
 class LocalClient(AbstractClient):
 
@@ -478,9 +554,13 @@ class LocalClient(AbstractClient):
         return self._deserializeResponse(responseJson, protocolResponseClass)
 
     def _runSearchPageRequest(
-            self, protocolRequest, objectName, protocolResponseClass):
+            self, protocolRequest, objectName, protocolResponseClass,
+            searchOptions=None):
+        if searchOptions is None:
+            searchOptions = {}
         searchMethod = self._searchMethodMap[objectName]
-        responseJson = searchMethod(protocolRequest.toJsonString())
+        responseJson = searchMethod(
+            protocolRequest.toJsonString(), **searchOptions)
         return self._deserializeResponse(responseJson, protocolResponseClass)
 
     def _runListReferenceBasesPageRequest(self, id_, request):
@@ -497,3 +577,12 @@ class LocalClient(AbstractClient):
         responseJson = self._backend.runListReferenceBases(id_, requestArgs)
         return self._deserializeResponse(
             responseJson, protocol.ListReferenceBasesResponse)
+
+    def _streamReferenceBases(self, id_, start, end):
+        requestArgs = {"start": start}
+        if end is not None:
+            requestArgs["end"] = end
+        start, end = self._backend.getReferenceBasesRange(id_, requestArgs)
+        for bases in self._backend.runStreamReferenceBases(id_, start, end):
+            self._protocolBytesReceived += len(bases)
+            yield bases
@@ -10,9 +10,15 @@ import base64
 import collections
 import glob
 import os
+import threading
+import timeit
+
+import pysam
 
 import ga4gh.exceptions as exceptions
 
+CRAM_FILE_EXTENSION = ".cram"
+
 
 class PysamFileHandleCache(object):
     """
@@ -21,14 +27,41 @@ class PysamFileHandleCache(object):
     elements on the left of the deque and pop elements from the right.
     When a file is accessed via getFileHandle, its priority gets
     updated, it is put at the "top" of the deque.
+
+    Each thread has its own cache of at most the maximum size. A pysam
+    handle has a single file position, so it cannot be iterated over by
+    two threads at once, and a handle evicted by one thread must not be
+    closed while another thread is still reading from it. The caches of
+    all the threads are kept in a registry, so that clear can close
+    every open handle, and the handles of threads that have exited are
+    closed when another thread creates its cache.
     """
 
     def __init__(self):
-        self._cache = collections.deque()
-        self._memoTable = dict()
+        self._threadState = threading.local()
+        self._lock = threading.Lock()
+        # Maps each thread to its (deque, memoTable) pair.
+        self._threadCaches = {}
         # Initialize the value even if it will be set up by the config
         self._maxCacheSize = 50
 
+    def _getThreadState(self):
+        """
+        Returns the (deque, memoTable) pair of the calling thread.
+        """
+        state = self._threadState
+        if not hasattr(state, "cache"):
+            state.cache = collections.deque()
+            state.memoTable = dict()
+            with self._lock:
+                for thread, (cache, _) in self._threadCaches.items():
+                    if not thread.is_alive():
+                        del self._threadCaches[thread]
+                        self._closeAll(cache)
+                self._threadCaches[threading.current_thread()] = (
+                    state.cache, state.memoTable)
+        return state.cache, state.memoTable
+
     def setMaxCacheSize(self, size):
         """
         Sets the maximum size of the cache
@@ -42,14 +75,16 @@ class PysamFileHandleCache(object):
         """
         Add a file handle to the left of the deque
         """
-        self._cache.appendleft((dataFile, handle))
+        cache, _ = self._getThreadState()
+        cache.appendleft((dataFile, handle))
 
     def _update(self, dataFile, handle):
         """
         Update the priority of the file handle. The element is first
         removed and then added to the left of the deque.
         """
-        self._cache.remove((dataFile, handle))
+        cache, _ = self._getThreadState()
+        cache.remove((dataFile, handle))
         self._add(dataFile, handle)
 
     def _removeLru(self):
@@ -58,15 +93,38 @@ class PysamFileHandleCache(object):
         The pop method removes an element from the right of the deque.
         Returns the name of the file that has been removed.
         """
-        (dataFile, handle) = self._cache.pop()
+        cache, _ = self._getThreadState()
+        (dataFile, handle) = cache.pop()
         handle.close()
         return dataFile
 
+    def _closeAll(self, cache):
+        while len(cache) > 0:
+            _, handle = cache.pop()
+            handle.close()
+
+    def clear(self):
+        """
+        Closes all file handles opened by any thread and empties the
+        caches. This must not be called while other threads are using
+        their handles; it is intended for use before forking or once the
+        threads have finished.
+        """
+        with self._lock:
+            for cache, memoTable in self._threadCaches.values():
+                self._closeAll(cache)
+                memoTable.clear()
+
     def getCachedFiles(self):
         """
-        Returns all file names stored in the cache.
+        Returns the names of the files with a handle in the cache of any
+        thread. A file opened by several threads is listed once.
         """
-        return self._memoTable.keys()
+        with self._lock:
+            cachedFiles = set()
+            for _, memoTable in self._threadCaches.values():
+                cachedFiles.update(memoTable.keys())
+        return list(cachedFiles)
 
     def getFileHandle(self, dataFile, openMethod):
         """
@@ -75,8 +133,9 @@ class PysamFileHandleCache(object):
         its handle. Otherwise, open the file using openMethod, store
         it in the cache and return the corresponding handle.
         """
-        if dataFile in self._memoTable:
-            handle = self._memoTable[dataFile]
+        _, memoTable = self._getThreadState()
+        if dataFile in memoTable:
+            handle = memoTable[dataFile]
             self._update(dataFile, handle)
             return handle
         else:
@@ -85,17 +144,75 @@ class PysamFileHandleCache(object):
             except ValueError:
                 raise exceptions.FileOpenFailedException(dataFile)
 
-            self._memoTable[dataFile] = handle
+            memoTable[dataFile] = handle
             self._add(dataFile, handle)
-            if len(self._memoTable) > self._maxCacheSize:
+            if len(memoTable) > self._maxCacheSize:
                 dataFile = self._removeLru()
-                del self._memoTable[dataFile]
+                del memoTable[dataFile]
             return handle
 
 
 # LRU cache of open file handles
 fileHandleCache = PysamFileHandleCache()
 
+_threadState = threading.local()
+
+
+class ScanInterruptedException(Exception):
+    """
+    Raised by a scan over the records of a data file when the search
+    deadline of the current thread has passed. Every record starting
+    before the specified position has already been scanned.
+    """
+    def __init__(self, position):
+        super(ScanInterruptedException, self).__init__(position)
+        self.position = position
+
+
+def setSearchDeadline(deadline, scanStart=None):
+    """
+    Sets the time, as returned by timeit.default_timer, after which scans
+    over data files made by the current thread are interrupted, or None
+    to never interrupt them. Scans are only interrupted at positions
+    after scanStart, so that an interrupted search always makes
+    progress; if scanStart is None, scans are not interrupted.
+    """
+    _threadState.searchDeadline = deadline
+    _threadState.scanStart = scanStart
+
+
+def setScanStart(scanStart):
+    """
+    Sets the position from which the current thread is scanning, after
+    which its scans may be interrupted by the search deadline.
+    """
+    _threadState.scanStart = scanStart
+
+
+def checkSearchDeadline(position):
+    """
+    Raises a ScanInterruptedException if the search deadline of the
+    current thread has passed and a scan may be interrupted at the
+    specified position. Scans call this for every record they read,
+    including those that they skip.
+    """
+    deadline = getattr(_threadState, "searchDeadline", None)
+    if (deadline is not None and _threadState.scanStart is not None and
+            position > _threadState.scanStart and
+            timeit.default_timer() >= deadline):
+        raise ScanInterruptedException(position)
+
+
+def openAlignmentFile(samFilePath):
+    """
+    Opens the specified BAM or CRAM file. CRAM files must be opened
+    explicitly in CRAM mode, as pysam does not otherwise find their
+    index.
+    """
+    if samFilePath.endswith(CRAM_FILE_EXTENSION):
+        return pysam.AlignmentFile(samFilePath, b"rc")
+    return pysam.AlignmentFile(samFilePath)
+
 
 class CompoundId(object):
     """
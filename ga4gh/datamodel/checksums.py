@@ -0,0 +1,178 @@
+"""
+Streaming computation and verification of reference MD5 checksums.
+
+The checksum of a reference is the MD5 of its sequence normalised as
+required by the GA4GH API: upper case, with all characters outside the
+printable ASCII range removed. Sequences are read from the indexed FASTA
+files in fixed size chunks, so that memory use is bounded whatever the
+length of the sequence, and different sequences are processed in
+parallel by a pool of worker processes.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import multiprocessing
+import os
+import string
+
+import pysam
+
+import ga4gh.datamodel.references as references
+
+
+_NON_PRINTABLE_CHARACTERS = b"".join(
+    chr(code) for code in range(256) if not 33 <= code <= 126)
+_UPPERCASE_TABLE = string.maketrans(
+    string.ascii_lowercase, string.ascii_uppercase)
+
+DEFAULT_REFERENCE_METADATA = {
+    "sourceUri": None,
+    "ncbiTaxonId": None,
+    "isDerived": False,
+    "sourceDivergence": None,
+    "sourceAccessions": [],
+}
+"""
+The metadata written for references that do not yet have any.
+"""
+
+
+def normaliseBases(bases):
+    """
+    Returns the specified bases normalised for computing MD5 checksums.
+    """
+    return bytes(bases).translate(_UPPERCASE_TABLE, _NON_PRINTABLE_CHARACTERS)
+
+
+def computeMd5Checksum(fastaFilePath, referenceName, chunkSize=2**22):
+    """
+    Returns the MD5 checksum of the specified sequence of the specified
+    FASTA file, reading at most chunkSize bases at a time.
+    """
+    fastaFile = pysam.FastaFile(fastaFilePath)
+    try:
+        length = fastaFile.lengths[fastaFile.references.index(referenceName)]
+        md5 = hashlib.md5()
+        for start in range(0, length, chunkSize):
+            md5.update(normaliseBases(fastaFile.fetch(
+                referenceName, start, min(start + chunkSize, length))))
+    finally:
+        fastaFile.close()
+    return md5.hexdigest()
+
+
+def _computeMd5ChecksumTask(task):
+    fastaFilePath, referenceName, chunkSize = task
+    md5checksum = computeMd5Checksum(fastaFilePath, referenceName, chunkSize)
+    return fastaFilePath, referenceName, md5checksum
+
+
+def computeMd5Checksums(fastaFilePaths, numWorkers=1, chunkSize=2**22):
+    """
+    Returns a dictionary mapping (fastaFilePath, referenceName) pairs to
+    the MD5 checksums of all the sequences in the specified FASTA files.
+    The sequences are processed by numWorkers processes in parallel, the
+    longest first so that the work is evenly balanced.
+    """
+    tasks = []
+    for fastaFilePath in fastaFilePaths:
+        fastaFile = pysam.FastaFile(fastaFilePath)
+        for referenceName, length in zip(
+                fastaFile.references, fastaFile.lengths):
+            tasks.append((length, fastaFilePath, referenceName))
+        fastaFile.close()
+    tasks = [
+        (fastaFilePath, referenceName, chunkSize)
+        for _, fastaFilePath, referenceName in sorted(
+            tasks, key=lambda task: task[0], reverse=True)]
+    if numWorkers <= 1:
+        results = map(_computeMd5ChecksumTask, tasks)
+    else:
+        pool = multiprocessing.Pool(numWorkers)
+        try:
+            results = pool.map(_computeMd5ChecksumTask, tasks, chunksize=1)
+        finally:
+            pool.terminate()
+            pool.join()
+    return dict(
+        ((fastaFilePath, referenceName), md5checksum)
+        for fastaFilePath, referenceName, md5checksum in results)
+
+
+class ReferenceMetadataFile(object):
+    """
+    The JSON metadata file accompanying a FASTA file in a reference set
+    directory. This is either the metadata of a single reference or, for
+    multi-sequence FASTA files, a manifest of the metadata of each of its
+    references.
+    """
+    def __init__(self, fastaFilePath):
+        self._path = references.getReferenceMetadataFilePath(fastaFilePath)
+        fastaFile = pysam.FastaFile(fastaFilePath)
+        self._referenceNames = list(fastaFile.references)
+        fastaFile.close()
+        self._metadata = {}
+        if os.path.exists(self._path):
+            with open(self._path) as metadataFile:
+                self._metadata = json.load(metadataFile)
+        self._isManifest = (
+            references.MANIFEST_REFERENCES_KEY in self._metadata or
+            len(self._referenceNames) != 1)
+        if self._isManifest:
+            self._metadata.setdefault(references.MANIFEST_REFERENCES_KEY, {})
+
+    def getPath(self):
+        """
+        Returns the path of this metadata file.
+        """
+        return self._path
+
+    def getReferenceNames(self):
+        """
+        Returns the names of the sequences in the FASTA file.
+        """
+        return self._referenceNames
+
+    def _getReferenceMetadata(self, referenceName):
+        if self._isManifest:
+            return self._metadata[references.MANIFEST_REFERENCES_KEY].get(
+                referenceName)
+        if len(self._metadata) == 0:
+            return None
+        return self._metadata
+
+    def getMd5Checksum(self, referenceName):
+        """
+        Returns the MD5 checksum recorded for the specified reference, or
+        None if there is none.
+        """
+        referenceMetadata = self._getReferenceMetadata(referenceName)
+        if referenceMetadata is None:
+            return None
+        return referenceMetadata.get("md5checksum")
+
+    def setMd5Checksum(self, referenceName, md5checksum):
+        """
+        Records the MD5 checksum of the specified reference, creating
+        default metadata for it if it has none.
+        """
+        referenceMetadata = self._getReferenceMetadata(referenceName)
+        if referenceMetadata is None:
+            referenceMetadata = dict(DEFAULT_REFERENCE_METADATA)
+            if self._isManifest:
+                self._metadata[references.MANIFEST_REFERENCES_KEY][
+                    referenceName] = referenceMetadata
+            else:
+                self._metadata = referenceMetadata
+        referenceMetadata["md5checksum"] = md5checksum
+
+    def write(self):
+        """
+        Writes this metadata file.
+        """
+        with open(self._path, "w") as metadataFile:
+            json.dump(
+                self._metadata, metadataFile, indent=4, sort_keys=True)
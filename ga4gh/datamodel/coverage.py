@@ -0,0 +1,277 @@
+"""
+Precomputed, multi-resolution read depth tiles.
+
+Coverage tiles are built offline from an indexed BAM file and are stored
+in a directory next to it (``<bam>.coverage``). For every read group and
+every reference that has at least one aligned read, one NumPy array is
+stored for each bin size. Each array has two rows: the mean depth and the
+maximum depth over each bin. The arrays are memory-mapped when queried,
+so answering a coverage request only touches the tiles that overlap the
+requested range.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import os
+
+import numpy
+import numpy.lib.format as npformat
+
+import ga4gh.datamodel as datamodel
+
+
+COVERAGE_DIRECTORY_SUFFIX = ".coverage"
+COVERAGE_METADATA_FILENAME = "coverage.json"
+DEFAULT_READ_GROUP_NAME = "default"
+
+# The bin sizes of the stored levels. Each level is 16 times coarser
+# than the one below it.
+DEFAULT_BIN_SIZES = (64, 1024, 16384, 262144)
+
+# Reads with any of these flags set do not contribute to the depth
+# (unmapped, secondary, QC failure and duplicates), as in samtools depth.
+EXCLUDED_FLAGS = 0x4 | 0x100 | 0x200 | 0x400
+
+
+def getCoverageDirectory(samFilePath):
+    """
+    Returns the path of the directory in which the coverage tiles for
+    the specified BAM file are stored.
+    """
+    return samFilePath + COVERAGE_DIRECTORY_SUFFIX
+
+
+def _getTileFileName(directory, readGroupName, referenceName, binSize):
+    return os.path.join(
+        directory, readGroupName, "{}.{}.npy".format(referenceName, binSize))
+
+
+class CoverageTileBuilder(object):
+    """
+    Computes the coverage tiles for a BAM file in a single sequential pass
+    over its reads, one window of the genome at a time. Memory usage is
+    bounded by the window size, independently of the reference lengths.
+    """
+    def __init__(
+            self, samFilePath, binSizes=DEFAULT_BIN_SIZES,
+            windowSize=2**20):
+        self._samFilePath = samFilePath
+        self._binSizes = sorted(binSizes)
+        for binSize in self._binSizes:
+            if windowSize % binSize != 0:
+                raise ValueError(
+                    "Window size must be a multiple of all bin sizes")
+        self._windowSize = windowSize
+        self._directory = getCoverageDirectory(samFilePath)
+
+    def build(self):
+        """
+        Builds the coverage tiles for all read groups and references.
+        """
+        samFile = datamodel.openAlignmentFile(self._samFilePath)
+        readGroupNames = [
+            readGroupHeader['ID'] for readGroupHeader in
+            samFile.header.get('RG', [])]
+        if len(readGroupNames) == 0:
+            readGroupNames = [DEFAULT_READ_GROUP_NAME]
+        for readGroupName in readGroupNames:
+            path = os.path.join(self._directory, readGroupName)
+            if not os.path.exists(path):
+                os.makedirs(path)
+        referenceLengths = dict(zip(samFile.references, samFile.lengths))
+        for referenceName in samFile.references:
+            self._buildReference(
+                samFile, referenceName, referenceLengths[referenceName],
+                readGroupNames)
+        metadata = {
+            "binSizes": self._binSizes,
+            "readGroups": readGroupNames,
+            "references": referenceLengths,
+        }
+        # The metadata is written last so that a partially built directory
+        # is never mistaken for a complete one.
+        metadataPath = os.path.join(
+            self._directory, COVERAGE_METADATA_FILENAME)
+        with open(metadataPath, "w") as metadataFile:
+            json.dump(metadata, metadataFile, indent=4)
+
+    def _buildReference(
+            self, samFile, referenceName, length, readGroupNames):
+        useDefault = readGroupNames == [DEFAULT_READ_GROUP_NAME]
+        # Depth change events for each read group, as lists of aligned
+        # block start and end coordinates.
+        events = dict(
+            (readGroupName, ([], [])) for readGroupName in readGroupNames)
+        carries = dict((readGroupName, 0) for readGroupName in readGroupNames)
+        tiles = {}
+        windowStart = 0
+        for read in samFile.fetch(referenceName):
+            if read.flag & EXCLUDED_FLAGS:
+                continue
+            # All blocks starting before this read are final once the read
+            # lies past the current window.
+            while read.reference_start >= windowStart + self._windowSize:
+                self._flushWindow(
+                    referenceName, length, windowStart, events, carries,
+                    tiles)
+                windowStart += self._windowSize
+            if useDefault:
+                readGroupName = DEFAULT_READ_GROUP_NAME
+            else:
+                try:
+                    readGroupName = read.opt(b'RG')
+                except KeyError:
+                    continue
+                if readGroupName not in events:
+                    continue
+            starts, ends = events[readGroupName]
+            for blockStart, blockEnd in read.get_blocks():
+                starts.append(blockStart)
+                ends.append(min(blockEnd, length))
+        while windowStart < length and (
+                any(len(starts) > 0 for starts, _ in events.values()) or
+                any(carry != 0 for carry in carries.values())):
+            self._flushWindow(
+                referenceName, length, windowStart, events, carries, tiles)
+            windowStart += self._windowSize
+        for tileArray in tiles.values():
+            tileArray.flush()
+
+    def _flushWindow(
+            self, referenceName, length, windowStart, events, carries,
+            tiles):
+        windowEnd = min(windowStart + self._windowSize, length)
+        windowLength = windowEnd - windowStart
+        for readGroupName, (starts, ends) in events.items():
+            if len(starts) == 0 and carries[readGroupName] == 0:
+                continue
+            startArray = numpy.array(starts, dtype=numpy.int64)
+            endArray = numpy.array(ends, dtype=numpy.int64)
+            inStarts = startArray < windowEnd
+            inEnds = endArray < windowEnd
+            deltas = numpy.bincount(
+                startArray[inStarts] - windowStart,
+                minlength=self._windowSize + 1)
+            deltas -= numpy.bincount(
+                endArray[inEnds] - windowStart,
+                minlength=self._windowSize + 1)
+            deltas[0] += carries[readGroupName]
+            depth = numpy.cumsum(deltas[:self._windowSize])
+            carries[readGroupName] = int(depth[-1])
+            depth[windowLength:] = 0
+            events[readGroupName] = (
+                list(startArray[~inStarts]), list(endArray[~inEnds]))
+            for binSize in self._binSizes:
+                key = (readGroupName, binSize)
+                if key not in tiles:
+                    tiles[key] = self._createTileArray(
+                        readGroupName, referenceName, length, binSize)
+                self._fillTiles(
+                    tiles[key], depth, windowStart, windowLength, binSize)
+
+    def _createTileArray(self, readGroupName, referenceName, length, binSize):
+        numBins = (length + binSize - 1) // binSize
+        path = _getTileFileName(
+            self._directory, readGroupName, referenceName, binSize)
+        tileArray = npformat.open_memmap(
+            path, mode="w+", dtype=numpy.float32, shape=(2, numBins))
+        return tileArray
+
+    def _fillTiles(
+            self, tileArray, depth, windowStart, windowLength, binSize):
+        binsPerWindow = self._windowSize // binSize
+        numBins = (windowLength + binSize - 1) // binSize
+        binned = depth.reshape(binsPerWindow, binSize)[:numBins]
+        widths = numpy.empty(numBins, dtype=numpy.float64)
+        widths[:] = binSize
+        widths[-1] = windowLength - (numBins - 1) * binSize
+        firstBin = windowStart // binSize
+        tileArray[0, firstBin:firstBin + numBins] = (
+            binned.sum(axis=1) / widths)
+        tileArray[1, firstBin:firstBin + numBins] = binned.max(axis=1)
+
+
+class CoverageTiles(object):
+    """
+    Read-only access to the coverage tiles of a BAM file.
+    """
+    def __init__(self, samFilePath):
+        self._directory = getCoverageDirectory(samFilePath)
+        metadataPath = os.path.join(
+            self._directory, COVERAGE_METADATA_FILENAME)
+        self._binSizes = None
+        self._referenceLengths = {}
+        if os.path.exists(metadataPath):
+            with open(metadataPath) as metadataFile:
+                metadata = json.load(metadataFile)
+            self._binSizes = sorted(metadata["binSizes"])
+            self._referenceLengths = metadata["references"]
+        self._tileArrays = {}
+
+    def isAvailable(self):
+        """
+        Returns True if coverage tiles have been built for this BAM file.
+        """
+        return self._binSizes is not None
+
+    def getBinSizes(self):
+        """
+        Returns the list of bin sizes stored, finest first.
+        """
+        return self._binSizes
+
+    def _getTileArray(self, readGroupName, referenceName, binSize):
+        key = (readGroupName, referenceName, binSize)
+        if key not in self._tileArrays:
+            path = _getTileFileName(
+                self._directory, readGroupName, referenceName, binSize)
+            tileArray = None
+            if os.path.exists(path):
+                tileArray = numpy.load(path, mmap_mode="r")
+            self._tileArrays[key] = tileArray
+        return self._tileArrays[key]
+
+    def getCoverage(self, readGroupName, referenceName, start, end, binSize):
+        """
+        Returns a tuple (start, binSize, meanDepth, maxDepth) describing
+        the coverage over the specified range. The returned bins are
+        aligned to the finest stored level not coarser than the requested
+        bin size, and the returned bin size is the largest multiple of
+        that level not greater than the requested bin size.
+        """
+        levelSize = self._binSizes[0]
+        for size in self._binSizes:
+            if size <= binSize:
+                levelSize = size
+        binSize = max(levelSize, binSize - binSize % levelSize)
+        length = self._referenceLengths.get(referenceName, end)
+        end = min(end, length)
+        start -= start % levelSize
+        if start >= end:
+            empty = numpy.zeros(0)
+            return start, binSize, empty, empty
+        firstTile = start // levelSize
+        lastTile = (end + levelSize - 1) // levelSize
+        numBins = (end - start + binSize - 1) // binSize
+        tileArray = self._getTileArray(
+            readGroupName, referenceName, levelSize)
+        if tileArray is None:
+            zeros = numpy.zeros(numBins)
+            return start, binSize, zeros, zeros
+        means = numpy.asarray(
+            tileArray[0, firstTile:lastTile], dtype=numpy.float64)
+        maxima = numpy.asarray(
+            tileArray[1, firstTile:lastTile], dtype=numpy.float64)
+        tileWidths = numpy.empty(len(means))
+        tileWidths[:] = levelSize
+        if lastTile * levelSize > length:
+            tileWidths[-1] = length - (lastTile - 1) * levelSize
+        tilesPerBin = binSize // levelSize
+        binStarts = numpy.arange(0, len(means), tilesPerBin)
+        sums = numpy.add.reduceat(means * tileWidths, binStarts)
+        widths = numpy.add.reduceat(tileWidths, binStarts)
+        meanDepth = sums / widths
+        maxDepth = numpy.maximum.reduceat(maxima, binStarts)
+        return start, binSize, meanDepth, maxDepth
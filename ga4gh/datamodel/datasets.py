@@ -124,7 +124,8 @@ class SimulatedDataset(AbstractDataset):
             self, localId, referenceSet, randomSeed=0,
             numVariantSets=1, numCalls=1, variantDensity=0.5,
             numReadGroupSets=1, numReadGroupsPerReadGroupSet=1,
-            numAlignments=1):
+            numAlignments=1, readLength=100, meanCoverage=None,
+            indelRate=0.1, numTags=2):
         super(SimulatedDataset, self).__init__(localId)
         # Variants
         for i in range(numVariantSets):
@@ -139,7 +140,8 @@ class SimulatedDataset(AbstractDataset):
             seed = randomSeed + i
             readGroupSet = reads.SimulatedReadGroupSet(
                 self, localId, referenceSet, seed,
-                numReadGroupsPerReadGroupSet, numAlignments)
+                numReadGroupsPerReadGroupSet, numAlignments, readLength,
+                meanCoverage, indelRate, numTags)
             self.addReadGroupSet(readGroupSet)
 
 
@@ -161,9 +163,10 @@ class FileSystemDataset(AbstractDataset):
         # Reads
         readGroupSetDir = os.path.join(dataDir, "reads")
         for filename in os.listdir(readGroupSetDir):
-            if fnmatch.fnmatch(filename, '*.bam'):
+            if (fnmatch.fnmatch(filename, '*.bam') or
+                    fnmatch.fnmatch(filename, '*.cram')):
                 localId, _ = os.path.splitext(filename)
-                bamPath = os.path.join(readGroupSetDir, filename)
+                samFilePath = os.path.join(readGroupSetDir, filename)
                 readGroupSet = reads.HtslibReadGroupSet(
-                    self, localId, bamPath, backend)
+                    self, localId, samFilePath, backend)
                 self.addReadGroupSet(readGroupSet)
@@ -0,0 +1,262 @@
+"""
+Packed, memory-mapped reference sequences.
+
+A packed representation of the sequences in a FASTA file is built offline
+and stored in a directory next to it (``<fasta>.packed``). Each sequence
+is stored as three NumPy arrays: the bases packed four to a byte using two
+bits per base, the runs of characters other than A, C, G and T (typically
+N) and the runs of soft-masked (lowercase) bases. The arrays are
+memory-mapped when queried, and any range of bases is decoded using
+vectorised table lookups, without decompressing the FASTA file.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import os
+
+import numpy
+import numpy.lib.format as npformat
+import pysam
+
+
+PACKED_DIRECTORY_SUFFIX = ".packed"
+PACKED_METADATA_FILENAME = "packed.json"
+
+_BASES = b"ACGT"
+_OTHER_CODE = 4
+_LOWERCASE_OFFSET = ord(b"a") - ord(b"A")
+
+
+def _makeEncodingTable():
+    table = numpy.empty(256, dtype=numpy.uint8)
+    table[:] = _OTHER_CODE
+    for code, base in enumerate(_BASES):
+        table[ord(base)] = code
+        table[ord(base) + _LOWERCASE_OFFSET] = code
+    return table
+
+
+def _makeDecodingTable():
+    # Maps each packed byte to the four bases it encodes
+    byteValues = numpy.arange(256, dtype=numpy.uint8)
+    codes = numpy.empty((256, 4), dtype=numpy.uint8)
+    for i in range(4):
+        codes[:, i] = (byteValues >> (6 - 2 * i)) & 3
+    return numpy.fromstring(_BASES, dtype=numpy.uint8)[codes]
+
+
+_ENCODING_TABLE = _makeEncodingTable()
+_DECODING_TABLE = _makeDecodingTable()
+
+
+def getPackedDirectory(fastaFilePath):
+    """
+    Returns the path of the directory in which the packed sequences for
+    the specified FASTA file are stored.
+    """
+    return fastaFilePath + PACKED_DIRECTORY_SUFFIX
+
+
+def _getArrayFileName(directory, referenceName, arrayName):
+    return os.path.join(
+        directory, "{}.{}.npy".format(referenceName, arrayName))
+
+
+def _getRuns(isInRun):
+    """
+    Returns the (starts, ends) of the runs of True values in the
+    specified boolean array.
+    """
+    padded = numpy.concatenate(([False], isInRun, [False]))
+    changes = numpy.flatnonzero(padded[1:] != padded[:-1])
+    return changes[0::2], changes[1::2]
+
+
+class _RunAccumulator(object):
+    """
+    Accumulates runs found in successive chunks of a sequence, merging
+    runs that continue across chunk boundaries.
+    """
+    def __init__(self):
+        self._starts = []
+        self._ends = []
+        self._values = []
+
+    def add(self, starts, ends, values):
+        if len(starts) == 0:
+            return
+        starts = list(starts)
+        ends = list(ends)
+        values = list(values)
+        if (len(self._ends) > 0 and self._ends[-1] == starts[0] and
+                self._values[-1] == values[0]):
+            self._ends[-1] = ends[0]
+            starts, ends, values = starts[1:], ends[1:], values[1:]
+        self._starts.extend(starts)
+        self._ends.extend(ends)
+        self._values.extend(values)
+
+    def getArray(self):
+        return numpy.array(
+            [self._starts, self._ends, self._values],
+            dtype=numpy.int64).reshape(3, len(self._starts))
+
+
+class PackedReferenceBuilder(object):
+    """
+    Builds the packed representation of all the sequences in a FASTA
+    file, one chunk of each sequence at a time.
+    """
+    def __init__(self, fastaFilePath, chunkSize=2**22):
+        if chunkSize % 4 != 0:
+            raise ValueError("Chunk size must be a multiple of 4")
+        self._fastaFilePath = fastaFilePath
+        self._chunkSize = chunkSize
+        self._directory = getPackedDirectory(fastaFilePath)
+
+    def build(self):
+        """
+        Builds the packed sequences for all references in the FASTA file.
+        """
+        if not os.path.exists(self._directory):
+            os.makedirs(self._directory)
+        fastaFile = pysam.FastaFile(self._fastaFilePath)
+        referenceLengths = dict(zip(fastaFile.references, fastaFile.lengths))
+        for referenceName in fastaFile.references:
+            self._buildReference(
+                fastaFile, referenceName, referenceLengths[referenceName])
+        metadata = {"references": referenceLengths}
+        # The metadata is written last so that a partially built directory
+        # is never mistaken for a complete one.
+        metadataPath = os.path.join(
+            self._directory, PACKED_METADATA_FILENAME)
+        with open(metadataPath, "w") as metadataFile:
+            json.dump(metadata, metadataFile, indent=4)
+
+    def _buildReference(self, fastaFile, referenceName, length):
+        packedBases = npformat.open_memmap(
+            _getArrayFileName(self._directory, referenceName, "bases"),
+            mode="w+", dtype=numpy.uint8, shape=((length + 3) // 4,))
+        otherRuns = _RunAccumulator()
+        maskRuns = _RunAccumulator()
+        for chunkStart in range(0, length, self._chunkSize):
+            chunkEnd = min(chunkStart + self._chunkSize, length)
+            chars = numpy.fromstring(
+                fastaFile.fetch(referenceName, chunkStart, chunkEnd),
+                dtype=numpy.uint8)
+            codes = _ENCODING_TABLE[chars]
+            isLowercase = (chars >= ord(b"a")) & (chars <= ord(b"z"))
+            starts, ends = _getRuns(isLowercase)
+            maskRuns.add(
+                starts + chunkStart, ends + chunkStart,
+                numpy.zeros(len(starts)))
+            isOther = codes == _OTHER_CODE
+            if isOther.any():
+                upper = chars.copy()
+                upper[isLowercase] -= _LOWERCASE_OFFSET
+                # Runs of identical characters other than A, C, G and T
+                positions = numpy.flatnonzero(isOther)
+                breaks = numpy.flatnonzero(
+                    (numpy.diff(positions) != 1) |
+                    (numpy.diff(upper[positions]) != 0)) + 1
+                runStarts = positions[numpy.concatenate(([0], breaks))]
+                runEnds = positions[
+                    numpy.concatenate((breaks - 1, [len(positions) - 1]))] + 1
+                otherRuns.add(
+                    runStarts + chunkStart, runEnds + chunkStart,
+                    upper[runStarts])
+                codes[isOther] = 0
+            padding = (-len(codes)) % 4
+            codes = numpy.concatenate(
+                (codes, numpy.zeros(padding, dtype=numpy.uint8)))
+            codes = codes.reshape(-1, 4)
+            packedBases[chunkStart // 4:(chunkEnd + 3) // 4] = (
+                (codes[:, 0] << 6) | (codes[:, 1] << 4) |
+                (codes[:, 2] << 2) | codes[:, 3])
+        packedBases.flush()
+        numpy.save(
+            _getArrayFileName(self._directory, referenceName, "other"),
+            otherRuns.getArray())
+        numpy.save(
+            _getArrayFileName(self._directory, referenceName, "mask"),
+            maskRuns.getArray()[:2])
+
+
+class PackedReferences(object):
+    """
+    Read-only access to the packed sequences of a FASTA file. The packed
+    sequences are only used if they are at least as recent as the FASTA
+    file.
+    """
+    def __init__(self, fastaFilePath):
+        self._directory = getPackedDirectory(fastaFilePath)
+        metadataPath = os.path.join(
+            self._directory, PACKED_METADATA_FILENAME)
+        self._referenceLengths = None
+        if (os.path.exists(metadataPath) and
+                os.path.getmtime(metadataPath) >=
+                os.path.getmtime(fastaFilePath)):
+            with open(metadataPath) as metadataFile:
+                metadata = json.load(metadataFile)
+            self._referenceLengths = metadata["references"]
+        self._arrays = {}
+
+    def isAvailable(self):
+        """
+        Returns True if packed sequences have been built for this FASTA
+        file.
+        """
+        return self._referenceLengths is not None
+
+    def _getArrays(self, referenceName):
+        if referenceName not in self._arrays:
+            self._arrays[referenceName] = tuple(
+                numpy.load(
+                    _getArrayFileName(
+                        self._directory, referenceName, arrayName),
+                    mmap_mode="r")
+                for arrayName in ["bases", "other", "mask"])
+        return self._arrays[referenceName]
+
+    def _getRunValues(self, runs, start, end):
+        """
+        Returns an array holding, for each position in the specified
+        range, the value of the run covering it or zero.
+        """
+        starts, ends = runs[0], runs[1]
+        first = numpy.searchsorted(ends, start, side="right")
+        last = numpy.searchsorted(starts, end, side="left")
+        deltas = numpy.zeros(end - start + 1, dtype=numpy.int64)
+        if first < last:
+            values = numpy.ones(last - first, dtype=numpy.int64)
+            if len(runs) > 2:
+                values = numpy.asarray(runs[2, first:last])
+            runStarts = numpy.maximum(runs[0, first:last], start) - start
+            runEnds = numpy.minimum(runs[1, first:last], end) - start
+            numpy.add.at(deltas, runStarts, values)
+            numpy.add.at(deltas, runEnds, -values)
+        return numpy.cumsum(deltas[:-1])
+
+    def getBases(self, referenceName, start, end):
+        """
+        Returns the bases of the specified reference from start
+        (inclusive) to end (exclusive).
+        """
+        end = min(end, self._referenceLengths[referenceName])
+        if start >= end:
+            return b""
+        packedBases, otherRuns, maskRuns = self._getArrays(referenceName)
+        firstByte = start // 4
+        lastByte = (end + 3) // 4
+        bases = _DECODING_TABLE[packedBases[firstByte:lastByte]].ravel()
+        bases = bases[start - 4 * firstByte:end - 4 * firstByte]
+        if otherRuns.shape[1] > 0:
+            others = self._getRunValues(otherRuns, start, end)
+            isOther = others != 0
+            bases[isOther] = others[isOther]
+        if maskRuns.shape[1] > 0:
+            isMasked = self._getRunValues(maskRuns, start, end) != 0
+            bases[isMasked] += _LOWERCASE_OFFSET
+        return bases.tostring()
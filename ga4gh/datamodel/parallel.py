@@ -0,0 +1,159 @@
+"""
+Parallel, order preserving fetching of large genomic ranges.
+
+A large range is split into fixed size bins which are decoded and
+converted into protocol objects by a pool of worker processes. Each
+worker opens its own pysam file handles. The objects for each bin are
+then yielded in bin order, so that the result is exactly the same
+sequence of objects that a single serial fetch over the whole range
+would produce.
+
+To make this work, a bin yields only the objects that start within it;
+objects that overlap the start of a bin are yielded by the bin in which
+they start. The first bin is the exception, and yields every object
+overlapping it, exactly as a serial fetch would.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import multiprocessing
+import weakref
+
+import ga4gh.datamodel as datamodel
+
+
+def _initialiseWorker():
+    """
+    Discards the file handles inherited from the parent process. These
+    share their file offsets with the parent's handles, and so must
+    never be used in the worker. Bins are always fetched in full, so the
+    search deadline of the forking thread is cleared as well.
+    """
+    datamodel.fileHandleCache.clear()
+    datamodel.setSearchDeadline(None)
+
+
+def _fetchBin(sourceId, methodName, args, binStart, binEnd, minStart):
+    """
+    Runs in a worker process, and returns the list of objects produced by
+    the specified fetch method of the source with the specified ID.
+    """
+    source = regionFetchPool.getSource(sourceId)
+    method = getattr(source, methodName)
+    return list(method(*(tuple(args) + (binStart, binEnd, minStart))))
+
+
+class RegionFetchPool(object):
+    """
+    A lazily started pool of worker processes used to fetch large
+    ranges in parallel. The pool is disabled when the number of workers
+    is zero.
+
+    Datamodel objects that support parallel fetching register themselves
+    with the pool when they are created. Workers are forked when the
+    first parallel fetch is made, and so see every source registered
+    before that; registering a new source discards the existing workers.
+    """
+    def __init__(self):
+        self._numWorkers = 0
+        self._binSize = 2**17
+        # Ranges spanning fewer than this many bins are fetched serially
+        self._minBins = 4
+        self._pool = None
+        self._sources = weakref.WeakValueDictionary()
+
+    def configure(self, numWorkers, binSize):
+        """
+        Sets the number of worker processes and the size of the bins
+        that each worker fetches at a time.
+        """
+        if numWorkers < 0:
+            raise ValueError("The number of workers must not be negative")
+        if binSize <= 0:
+            raise ValueError(
+                "The bin size must be a strictly positive value")
+        self.close()
+        self._numWorkers = numWorkers
+        self._binSize = binSize
+
+    def close(self):
+        """
+        Terminates the worker processes, if they are running.
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def registerSource(self, source):
+        """
+        Registers the specified datamodel object so that it can be used
+        as a source of objects in worker processes.
+        """
+        self._sources[source.getId()] = source
+        self.close()
+
+    def getSource(self, sourceId):
+        """
+        Returns the source with the specified ID.
+        """
+        return self._sources[sourceId]
+
+    def isSplittable(self, start, end):
+        """
+        Returns True if the specified range is large enough to be
+        fetched in parallel.
+        """
+        return (
+            self._numWorkers > 0 and start is not None and end is not None and
+            end - start >= self._minBins * self._binSize)
+
+    def _getPool(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(
+                self._numWorkers, initializer=_initialiseWorker)
+        return self._pool
+
+    def fetch(self, source, methodName, args, start, end):
+        """
+        Returns an iterator over the objects in the specified range. The
+        named method of the source is called with the specified arguments
+        followed by the bin start, the bin end and the minimum start
+        position of the objects to return (None for the first bin).
+        Only a bounded number of bins are in flight at any time, so
+        abandoning the iterator early wastes little work. The search
+        deadline is checked before waiting for each bin.
+        """
+        pool = self._getPool()
+        maxPendingBins = 2 * self._numWorkers
+        pending = collections.deque()
+        binStart = start
+        while binStart < end:
+            binEnd = min(binStart + self._binSize, end)
+            minStart = None if binStart == start else binStart
+            pending.append((binStart, pool.apply_async(
+                _fetchBin, (
+                    source.getId(), methodName, args, binStart, binEnd,
+                    minStart))))
+            binStart = binEnd
+            if len(pending) >= maxPendingBins:
+                for obj in self._getBin(pending):
+                    yield obj
+        while len(pending) > 0:
+            for obj in self._getBin(pending):
+                yield obj
+
+    def _getBin(self, pending):
+        """
+        Removes the first of the pending (binStart, result) pairs and
+        returns the objects in its bin once they have been fetched.
+        """
+        binStart, result = pending.popleft()
+        datamodel.checkSearchDeadline(binStart)
+        return result.get()
+
+
+# The process-wide pool used for parallel fetches
+regionFetchPool = RegionFetchPool()
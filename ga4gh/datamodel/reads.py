@@ -7,12 +7,18 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import datetime
+import json
+import os
+import zlib
 
-import pysam
+import numpy
 
 import ga4gh.datamodel as datamodel
+import ga4gh.datamodel.coverage as coverage
+import ga4gh.datamodel.parallel as parallel
 import ga4gh.datamodel.references as references
 import ga4gh.exceptions as exceptions
+import ga4gh.profiling as profiling
 import ga4gh.protocol as protocol
 
 
@@ -32,6 +38,72 @@ def parseMalformedBamHeader(headerDict):
     return ret
 
 
+READ_STATS_SUFFIX = ".stats.json"
+
+
+def getReadStatsFilePath(samFilePath):
+    """
+    Returns the path of the read statistics sidecar file for the
+    specified sam file.
+    """
+    return samFilePath + READ_STATS_SUFFIX
+
+
+def buildReadStats(samFilePath):
+    """
+    Scans all records in the specified sam file and writes the per read
+    group aligned and unaligned read counts and base counts into the read
+    statistics sidecar file. Records without a read group tag are counted
+    against the 'default' read group.
+    """
+    samFile = datamodel.openAlignmentFile(samFilePath)
+    readGroupStats = {}
+    for readGroupHeader in samFile.header.get('RG', []):
+        readGroupStats[readGroupHeader['ID']] = [0, 0, 0]
+    for read in samFile.fetch(until_eof=True):
+        try:
+            readGroupName = read.opt(b'RG')
+        except KeyError:
+            readGroupName = 'default'
+        if readGroupName not in readGroupStats:
+            readGroupStats[readGroupName] = [0, 0, 0]
+        stats = readGroupStats[readGroupName]
+        if SamFlags.isFlagSet(read.flag, SamFlags.UNMAPPED):
+            stats[1] += 1
+        else:
+            stats[0] += 1
+        stats[2] += read.query_length
+    sidecar = {
+        "alignedReadCount": sum(
+            stats[0] for stats in readGroupStats.values()),
+        "unalignedReadCount": sum(
+            stats[1] for stats in readGroupStats.values()),
+        "readGroups": dict(
+            (readGroupName, {
+                "alignedReadCount": stats[0],
+                "unalignedReadCount": stats[1],
+                "baseCount": stats[2],
+            }) for readGroupName, stats in readGroupStats.items()),
+    }
+    with open(getReadStatsFilePath(samFilePath), "w") as sidecarFile:
+        json.dump(sidecar, sidecarFile, indent=4)
+
+
+def loadReadStats(samFilePath):
+    """
+    Returns the contents of the read statistics sidecar file for the
+    specified sam file, or None if there is no sidecar or it is older
+    than the sam file.
+    """
+    sidecarPath = getReadStatsFilePath(samFilePath)
+    if not os.path.exists(sidecarPath):
+        return None
+    if os.path.getmtime(sidecarPath) < os.path.getmtime(samFilePath):
+        return None
+    with open(sidecarPath) as sidecarFile:
+        return json.load(sidecarFile)
+
+
 class SamCigar(object):
     """
     Utility class for working with SAM CIGAR strings
@@ -67,6 +139,7 @@ class SamFlags(object):
     """
     NUMBER_READS = 0x1
     PROPER_PLACEMENT = 0x2
+    UNMAPPED = 0x4
     REVERSED = 0x10
     NEXT_MATE_REVERSED = 0x20
     READ_NUMBER_ONE = 0x40
@@ -85,6 +158,76 @@ class SamFlags(object):
         flagAttr |= flag
 
 
+class CigarReferenceSequenceFiller(object):
+    """
+    Fills in the referenceSequence of the DELETE and SEQUENCE_MISMATCH
+    CIGAR units of GA4GH ReadAlignments. Reference bases are fetched in
+    windows that slide along the reference as the (sorted) reads are
+    processed, so that each base is usually fetched only once however
+    many reads overlap it.
+    """
+    referenceConsumingOperations = set([
+        protocol.CigarOperation.ALIGNMENT_MATCH,
+        protocol.CigarOperation.DELETE,
+        protocol.CigarOperation.SKIP,
+        protocol.CigarOperation.SEQUENCE_MATCH,
+        protocol.CigarOperation.SEQUENCE_MISMATCH,
+    ])
+    filledOperations = set([
+        protocol.CigarOperation.DELETE,
+        protocol.CigarOperation.SEQUENCE_MISMATCH,
+    ])
+
+    def __init__(self, reference, windowSize=2**16):
+        self._reference = reference
+        self._windowSize = windowSize
+        self._windowStart = 0
+        self._windowEnd = 0
+        self._windowBases = ""
+
+    def _updateWindow(self, start, end):
+        # Reads arrive in order of their start positions, so a window
+        # starting at the start of a read covers the following reads
+        # until one extends beyond its end.
+        end = min(end, self._reference.getLength())
+        if start < self._windowStart or end > self._windowEnd:
+            self._windowStart = start
+            self._windowEnd = min(
+                max(end, start + self._windowSize),
+                self._reference.getLength())
+            self._windowBases = ""
+            if self._windowStart < self._windowEnd:
+                self._windowBases = self._reference.getBases(
+                    self._windowStart, self._windowEnd)
+
+    def fill(self, readAlignment):
+        """
+        Fills in the referenceSequence of the CIGAR units of the specified
+        ReadAlignment, and returns it. The referenceSequence of units that
+        extend beyond the end of the reference is left as None.
+        """
+        alignment = readAlignment.alignment
+        if alignment is None or alignment.position is None:
+            return readAlignment
+        start = alignment.position.position
+        end = start + sum(
+            cigarUnit.operationLength for cigarUnit in alignment.cigar
+            if cigarUnit.operation in self.referenceConsumingOperations)
+        self._updateWindow(start, end)
+        position = start
+        for cigarUnit in alignment.cigar:
+            operationEnd = position
+            if cigarUnit.operation in self.referenceConsumingOperations:
+                operationEnd += cigarUnit.operationLength
+            if (cigarUnit.operation in self.filledOperations and
+                    operationEnd <= self._windowEnd):
+                cigarUnit.referenceSequence = self._windowBases[
+                    position - self._windowStart:
+                    operationEnd - self._windowStart]
+            position = operationEnd
+        return readAlignment
+
+
 class AbstractReadGroupSet(datamodel.DatamodelObject):
     """
     The base class of a read group set
@@ -140,6 +283,7 @@ class AbstractReadGroupSet(datamodel.DatamodelObject):
         stats = protocol.ReadStats()
         stats.alignedReadCount = self.getNumAlignedReads()
         stats.unalignedReadCount = self.getNumUnalignedReads()
+        stats.baseCount = self.getBaseCount()
         readGroupSet.stats = stats
         return readGroupSet
 
@@ -155,6 +299,13 @@ class AbstractReadGroupSet(datamodel.DatamodelObject):
         """
         raise NotImplementedError()
 
+    def getBaseCount(self):
+        """
+        Return the total number of bases in this read group set, or None
+        if it is not known
+        """
+        raise NotImplementedError()
+
     def getPrograms(self):
         """
         Returns an array of Programs used to generate this read group set
@@ -168,23 +319,29 @@ class SimulatedReadGroupSet(AbstractReadGroupSet):
     """
     def __init__(
             self, parentContainer, localId, referenceSet, randomSeed=1,
-            numReadGroups=1, numAlignments=2):
+            numReadGroups=1, numAlignments=2, readLength=100,
+            meanCoverage=None, indelRate=0.1, numTags=2):
         super(SimulatedReadGroupSet, self).__init__(
             parentContainer, localId)
         self._referenceSet = referenceSet
-        self._numAlignments = numAlignments
         for i in range(numReadGroups):
             localId = "rg{}".format(i)
             readGroup = SimulatedReadGroup(
-                self, localId, randomSeed + i, numAlignments)
+                self, localId, randomSeed + i, numAlignments, readLength,
+                meanCoverage, indelRate, numTags)
             self.addReadGroup(readGroup)
 
     def getNumAlignedReads(self):
-        return self._numAlignments
+        return sum(
+            readGroup.getNumAlignedReads()
+            for readGroup in self.getReadGroups())
 
     def getNumUnalignedReads(self):
         return 0
 
+    def getBaseCount(self):
+        return None
+
     def getPrograms(self):
         return []
 
@@ -197,17 +354,24 @@ class HtslibReadGroupSet(datamodel.PysamDatamodelMixin, AbstractReadGroupSet):
             self, parentContainer, localId, samFilePath, backend):
         super(HtslibReadGroupSet, self).__init__(parentContainer, localId)
         self._samFilePath = samFilePath
+        self._coverageTiles = coverage.CoverageTiles(samFilePath)
         samFile = self.getFileHandle(self._samFilePath)
         self._setHeaderFields(samFile)
+        self._setReadStats(samFile)
         if 'RG' not in samFile.header or len(samFile.header['RG']) == 0:
             self._defaultReadGroup = True
-            readGroup = HtslibReadGroup(self, 'default')
+            readGroupStats = self._readGroupStats.get('default', {
+                "alignedReadCount": self._numAlignedReads,
+                "unalignedReadCount": self._numUnalignedReads})
+            readGroup = HtslibReadGroup(
+                self, 'default', readGroupStats=readGroupStats)
             self.addReadGroup(readGroup)
         else:
             self._defaultReadGroup = False
             for readGroupHeader in samFile.header['RG']:
                 readGroup = HtslibReadGroup(
-                    self, readGroupHeader['ID'], readGroupHeader)
+                    self, readGroupHeader['ID'], readGroupHeader,
+                    self._readGroupStats.get(readGroupHeader['ID']))
                 self.addReadGroup(readGroup)
         # Find the reference set name (if there is one) by looking at
         # the BAM headers.
@@ -230,6 +394,51 @@ class HtslibReadGroupSet(datamodel.PysamDatamodelMixin, AbstractReadGroupSet):
             # TODO verify that the references in the BAM file exist
             # in the reference set. Otherwise, we won't be able to
             # query for them.
+        if samFilePath.endswith(datamodel.CRAM_FILE_EXTENSION):
+            self._addCramReferences(samFile)
+
+    def _addCramReferences(self, samFile):
+        # htslib decodes CRAM records against the reference sequences
+        # it finds by the MD5 checksums in the @SQ header lines, so we
+        # make the matching references in our reference set available
+        # to it. References that we do not have are left for htslib to
+        # find elsewhere.
+        if self._referenceSet is None:
+            return
+        for referenceInfo in samFile.header['SQ']:
+            md5checksum = referenceInfo.get('M5', '').lower()
+            try:
+                reference = self._referenceSet.getReferenceByName(
+                    referenceInfo['SN'])
+            except exceptions.ReferenceNameNotFoundException:
+                continue
+            if reference.getMd5Checksum() == md5checksum:
+                references.md5ReferenceDirectory.addReference(reference)
+
+    def _setReadStats(self, samFile):
+        # The aligned and unaligned read counts are taken from the
+        # sidecar if it is present, and otherwise from the per-reference
+        # counts stored in the BAM index. Either way they are computed
+        # once here, so that building the protocol element does not
+        # touch the file.
+        readStats = loadReadStats(self._samFilePath)
+        if readStats is None:
+            if self._samFilePath.endswith(datamodel.CRAM_FILE_EXTENSION):
+                # CRAM indexes do not record the number of reads
+                self._numAlignedReads = -1
+                self._numUnalignedReads = -1
+            else:
+                self._numAlignedReads = samFile.mapped
+                self._numUnalignedReads = samFile.unmapped
+            self._baseCount = None
+            self._readGroupStats = {}
+        else:
+            self._numAlignedReads = readStats["alignedReadCount"]
+            self._numUnalignedReads = readStats["unalignedReadCount"]
+            self._readGroupStats = readStats["readGroups"]
+            self._baseCount = sum(
+                stats["baseCount"] for stats in
+                self._readGroupStats.values())
 
     def _setHeaderFields(self, samFile):
         programs = []
@@ -246,7 +455,7 @@ class HtslibReadGroupSet(datamodel.PysamDatamodelMixin, AbstractReadGroupSet):
         self._programs = programs
 
     def openFile(self, dataFile):
-        return pysam.AlignmentFile(dataFile)
+        return datamodel.openAlignmentFile(dataFile)
 
     def getSamFilePath(self):
         """
@@ -254,6 +463,12 @@ class HtslibReadGroupSet(datamodel.PysamDatamodelMixin, AbstractReadGroupSet):
         """
         return self._samFilePath
 
+    def getCoverageTiles(self):
+        """
+        Returns the precomputed coverage tiles for the sam file
+        """
+        return self._coverageTiles
+
     def isUsingDefaultReadGroup(self):
         """
         Returns whether the readGroupSet is using a default read group
@@ -261,12 +476,13 @@ class HtslibReadGroupSet(datamodel.PysamDatamodelMixin, AbstractReadGroupSet):
         return self._defaultReadGroup
 
     def getNumAlignedReads(self):
-        samFile = self.getFileHandle(self._samFilePath)
-        return samFile.mapped
+        return self._numAlignedReads
 
     def getNumUnalignedReads(self):
-        samFile = self.getFileHandle(self._samFilePath)
-        return samFile.unmapped
+        return self._numUnalignedReads
+
+    def getBaseCount(self):
+        return self._baseCount
 
     def getPrograms(self):
         return self._programs
@@ -313,7 +529,7 @@ class AbstractReadGroup(datamodel.DatamodelObject):
         stats = protocol.ReadStats()
         stats.alignedReadCount = self.getNumAlignedReads()
         stats.unalignedReadCount = self.getNumUnalignedReads()
-        stats.baseCount = None  # TODO requires iterating through all reads
+        stats.baseCount = self.getBaseCount()
         readGroup.stats = stats
         readGroup.programs = self.getPrograms()
         readGroup.description = self.getDescription()
@@ -346,6 +562,14 @@ class AbstractReadGroup(datamodel.DatamodelObject):
             self.getCompoundId(), gaAlignment.fragmentName)
         return str(compoundId)
 
+    def getCoverage(self, reference, start, end, binSize):
+        """
+        Returns a tuple (start, binSize, meanDepth, maxDepth) describing
+        the read depth of this read group over the specified range of the
+        specified reference, as binned from precomputed coverage tiles.
+        """
+        raise exceptions.CoverageNotAvailableException(self.getId())
+
     def getNumAlignedReads(self):
         """
         Return the number of aligned reads in the read group
@@ -358,6 +582,13 @@ class AbstractReadGroup(datamodel.DatamodelObject):
         """
         raise NotImplementedError()
 
+    def getBaseCount(self):
+        """
+        Return the total number of bases in the read group, or None if
+        it is not known
+        """
+        raise NotImplementedError()
+
     def getPrograms(self):
         """
         Returns an array of Programs used to generate this read group
@@ -428,33 +659,177 @@ class AbstractReadGroup(datamodel.DatamodelObject):
 
 class SimulatedReadGroup(AbstractReadGroup):
     """
-    A simulated readgroup
+    A simulated readgroup. Reads of a fixed reference length are tiled
+    evenly across each reference of the read group set, each read
+    starting at a random offset within its own slot, so that the reads
+    overlapping any region can be found directly. Every read is generated
+    from a random number generator seeded with its index, so that the
+    reads are reproducible whatever the query.
+
+    The number of reads on each reference is numAlignments, unless a
+    mean coverage is specified. A proportion indelRate of the reads have an
+    insertion or deletion, and the same proportion are soft clipped;
+    numTags optional tags are added to each read.
     """
-    def __init__(self, parentContainer, localId, randomSeed, numAlignments=2):
-        super(SimulatedReadGroup, self).__init__(parentContainer, localId)
+    _tagNames = ["NM", "AS", "XS", "MQ"]
+    _bases = numpy.fromstring(b"ACGT", dtype=numpy.uint8)
 
-    def getReadAlignments(self, referenceId=None, start=None, end=None):
-        for i in range(self.getNumAlignedReads()):
-            yield self._createReadAlignment(i)
+    def __init__(
+            self, parentContainer, localId, randomSeed, numAlignments=2,
+            readLength=100, meanCoverage=None, indelRate=0.1, numTags=2):
+        super(SimulatedReadGroup, self).__init__(parentContainer, localId)
+        self._randomSeed = randomSeed
+        self._numAlignments = numAlignments
+        self._readLength = readLength
+        self._meanCoverage = meanCoverage
+        self._indelRate = indelRate
+        self._numTags = numTags
+
+    def _getReadLength(self, reference):
+        return min(self._readLength, reference.getLength())
+
+    def _getNumReads(self, reference):
+        if self._meanCoverage is None:
+            return self._numAlignments
+        return int(round(
+            self._meanCoverage * reference.getLength() /
+            self._getReadLength(reference)))
+
+    def _getReadRng(self, reference, index):
+        nameHash = zlib.crc32(reference.getLocalId().encode()) & 0xffffffff
+        return numpy.random.RandomState([self._randomSeed, nameHash, index])
+
+    def _getReadStart(self, rng, stride, index):
+        slotStart = int(index * stride)
+        slotLength = int((index + 1) * stride) - slotStart
+        return slotStart + rng.randint(max(slotLength, 1))
+
+    def getReadAlignments(self, reference=None, start=None, end=None):
+        if reference is None:
+            referenceSet = self._parentContainer.getReferenceSet()
+            for reference in referenceSet.getReferences():
+                for readAlignment in self.getReadAlignments(reference):
+                    yield readAlignment
+            return
+        numReads = self._getNumReads(reference)
+        readLength = self._getReadLength(reference)
+        if start is None:
+            start = 0
+        if end is None:
+            end = reference.getLength()
+        if numReads == 0 or readLength == 0 or start >= end:
+            return
+        stride = (reference.getLength() - readLength + 1) / numReads
+        firstIndex = max(0, int((start - readLength) // stride) - 1)
+        lastIndex = min(numReads - 1, int(end // stride) + 1)
+        for index in range(firstIndex, lastIndex + 1):
+            rng = self._getReadRng(reference, index)
+            readStart = self._getReadStart(rng, stride, index)
+            if readStart >= end:
+                break
+            if readStart + readLength > start:
+                yield self._createReadAlignment(
+                    reference, index, readStart, readLength, rng)
+
+    def _getCigar(self, rng, readLength):
+        """
+        Returns a list of (operation, length) pairs describing an
+        alignment spanning readLength bases of the reference.
+        """
+        ops = protocol.CigarOperation
+        cigar = []
+        if rng.random_sample() < self._indelRate:
+            cigar.append((ops.CLIP_SOFT, rng.randint(1, 6)))
+        if rng.random_sample() < self._indelRate and readLength > 5:
+            indelLength = rng.randint(1, 4)
+            before = rng.randint(1, readLength - indelLength)
+            if rng.randint(2) == 0:
+                cigar.extend([
+                    (ops.ALIGNMENT_MATCH, before), (ops.INSERT, indelLength),
+                    (ops.ALIGNMENT_MATCH, readLength - before)])
+            else:
+                cigar.extend([
+                    (ops.ALIGNMENT_MATCH, before), (ops.DELETE, indelLength),
+                    (ops.ALIGNMENT_MATCH,
+                     readLength - before - indelLength)])
+        else:
+            cigar.append((ops.ALIGNMENT_MATCH, readLength))
+        return cigar
 
-    def _createReadAlignment(self, i):
-        # TODO fill out a bit more
+    def _getAlignedSequence(self, rng, referenceBases, cigar):
+        """
+        Returns the aligned sequence for the specified CIGAR against the
+        specified reference bases, with random mismatches, along with the
+        number of edits.
+        """
+        ops = protocol.CigarOperation
+        chunks = []
+        numEdits = 0
+        position = 0
+        for operation, length in cigar:
+            if operation == ops.ALIGNMENT_MATCH:
+                chunks.append(numpy.fromstring(
+                    referenceBases[position:position + length],
+                    dtype=numpy.uint8))
+                position += length
+            elif operation == ops.DELETE:
+                position += length
+                numEdits += length
+            else:
+                chunks.append(self._bases[rng.randint(0, 4, length)])
+                if operation == ops.INSERT:
+                    numEdits += length
+        sequence = numpy.concatenate(chunks)
+        mismatches = numpy.flatnonzero(rng.random_sample(len(sequence)) < 0.01)
+        sequence[mismatches] = self._bases[
+            rng.randint(0, 4, len(mismatches))]
+        return sequence.tostring(), numEdits + len(mismatches)
+
+    def _createReadAlignment(
+            self, reference, index, readStart, readLength, rng):
+        cigar = self._getCigar(rng, readLength)
+        referenceBases = reference.getBases(
+            readStart, readStart + readLength)
+        alignedSequence, numEdits = self._getAlignedSequence(
+            rng, referenceBases, cigar)
         alignment = protocol.ReadAlignment()
-        alignment.alignedQuality = [1, 2, 3]
-        alignment.alignedSequence = "ACT"
+        alignment.alignedQuality = rng.randint(
+            2, 41, len(alignedSequence)).tolist()
+        alignment.alignedSequence = alignedSequence
         alignment.fragmentId = 'TODO'
         gaPosition = protocol.Position()
-        gaPosition.position = 0
-        gaPosition.referenceName = "NotImplemented"
+        gaPosition.position = readStart
+        gaPosition.referenceName = reference.getLocalId()
         gaPosition.strand = protocol.Strand.POS_STRAND
+        if rng.randint(2) == 1:
+            gaPosition.strand = protocol.Strand.NEG_STRAND
         gaLinearAlignment = protocol.LinearAlignment()
         gaLinearAlignment.position = gaPosition
+        gaLinearAlignment.mappingQuality = int(rng.randint(0, 61))
+        gaLinearAlignment.cigar = []
+        for operation, length in cigar:
+            gaCigarUnit = protocol.CigarUnit()
+            gaCigarUnit.operation = operation
+            gaCigarUnit.operationLength = int(length)
+            gaCigarUnit.referenceSequence = None
+            gaLinearAlignment.cigar.append(gaCigarUnit)
         alignment.alignment = gaLinearAlignment
         alignment.duplicateFragment = False
         alignment.failedVendorQualityChecks = False
-        alignment.fragmentLength = 3
-        alignment.fragmentName = "simulated{}".format(i)
+        alignment.fragmentLength = readLength
+        alignment.fragmentName = "simulated_{}_{}".format(
+            reference.getLocalId(), index)
         alignment.info = {}
+        for i in range(self._numTags):
+            if i == 0:
+                value = numEdits
+            else:
+                value = int(rng.randint(0, 2 * readLength))
+            if i < len(self._tagNames):
+                tagName = self._tagNames[i]
+            else:
+                tagName = "Z{}".format(i - len(self._tagNames))
+            alignment.info[tagName] = [str(value)]
         alignment.nextMatePosition = None
         alignment.numberReads = None
         alignment.properPlacement = False
@@ -466,11 +841,17 @@ class SimulatedReadGroup(AbstractReadGroup):
         return alignment
 
     def getNumAlignedReads(self):
-        return self._parentContainer.getNumAlignedReads()
+        referenceSet = self._parentContainer.getReferenceSet()
+        return sum(
+            self._getNumReads(reference)
+            for reference in referenceSet.getReferences())
 
     def getNumUnalignedReads(self):
         return 0
 
+    def getBaseCount(self):
+        return None
+
     def getPrograms(self):
         return []
 
@@ -506,7 +887,9 @@ class HtslibReadGroup(datamodel.PysamDatamodelMixin, AbstractReadGroup):
     """
     A readgroup based on htslib's reading of a given file
     """
-    def __init__(self, parentContainer, localId, readGroupHeader=None):
+    def __init__(
+            self, parentContainer, localId, readGroupHeader=None,
+            readGroupStats=None):
         super(HtslibReadGroup, self).__init__(parentContainer, localId)
         self._parentSamFilePath = parentContainer.getSamFilePath()
         self._filterReads = not parentContainer.isUsingDefaultReadGroup()
@@ -519,6 +902,13 @@ class HtslibReadGroup(datamodel.PysamDatamodelMixin, AbstractReadGroup):
         self._library = None
         self._platformUnit = None
         self._runTime = None
+        self._numAlignedReads = -1
+        self._numUnalignedReads = -1
+        self._baseCount = None
+        if readGroupStats is not None:
+            self._numAlignedReads = readGroupStats["alignedReadCount"]
+            self._numUnalignedReads = readGroupStats["unalignedReadCount"]
+            self._baseCount = readGroupStats.get("baseCount")
         if readGroupHeader is not None:
             self._sampleId = readGroupHeader.get('SM', None)
             self._description = readGroupHeader.get('DS', None)
@@ -530,6 +920,7 @@ class HtslibReadGroup(datamodel.PysamDatamodelMixin, AbstractReadGroup):
             self._library = readGroupHeader.get('LB', None)
             self._platformUnit = readGroupHeader.get('PU', None)
             self._runTime = readGroupHeader.get('DT', None)
+        parallel.regionFetchPool.registerSource(self)
 
     def getSamFilePath(self):
         return self._parentSamFilePath
@@ -540,19 +931,48 @@ class HtslibReadGroup(datamodel.PysamDatamodelMixin, AbstractReadGroup):
         """
         # TODO If reference is None, return against all references,
         # including unmapped reads.
-        samFile = self._parentContainer.getFileHandle(self._parentSamFilePath)
         referenceName = reference.getLocalId().encode()
         # TODO deal with errors from htslib
         start, end = self.sanitizeAlignmentFileFetch(start, end)
+        fetchPool = parallel.regionFetchPool
+        if fetchPool.isSplittable(start, end):
+            samFile = self._parentContainer.getFileHandle(
+                self._parentSamFilePath)
+            referenceIndex = samFile.gettid(referenceName)
+            if referenceIndex != -1:
+                end = min(end, samFile.lengths[referenceIndex])
+            if fetchPool.isSplittable(start, end):
+                return fetchPool.fetch(
+                    self, "fetchReadAlignments", (referenceName,),
+                    start, end)
+        return self.fetchReadAlignments(referenceName, start, end)
+
+    def fetchReadAlignments(self, referenceName, start, end, minStart=None):
+        """
+        Returns an iterator over the reads overlapping the specified
+        range, skipping those that start before minStart if it is not
+        None.
+        """
+        samFile = self._parentContainer.getFileHandle(self._parentSamFilePath)
         readAlignments = samFile.fetch(referenceName, start, end)
-        if self._filterReads:
-            for readAlignment in readAlignments:
+        for readAlignment in readAlignments:
+            datamodel.checkSearchDeadline(readAlignment.reference_start)
+            if (minStart is not None and
+                    readAlignment.reference_start < minStart):
+                continue
+            if self._filterReads:
                 tags = dict(readAlignment.tags)
-                if 'RG' in tags and tags['RG'] == self._localId:
-                    yield self.convertReadAlignment(readAlignment)
-        else:
-            for readAlignment in readAlignments:
-                yield self.convertReadAlignment(readAlignment)
+                if 'RG' not in tags or tags['RG'] != self._localId:
+                    continue
+            profiling.enterPhase("convert")
+            yield self.convertReadAlignment(readAlignment)
+
+    def getCoverage(self, reference, start, end, binSize):
+        coverageTiles = self._parentContainer.getCoverageTiles()
+        if not coverageTiles.isAvailable():
+            raise exceptions.CoverageNotAvailableException(self.getId())
+        return coverageTiles.getCoverage(
+            self.getLocalId(), reference.getLocalId(), start, end, binSize)
 
     def convertReadAlignment(self, read):
         """
@@ -623,10 +1043,13 @@ class HtslibReadGroup(datamodel.PysamDatamodelMixin, AbstractReadGroup):
         return ret
 
     def getNumAlignedReads(self):
-        return -1  # TODO populate with metadata
+        return self._numAlignedReads
 
     def getNumUnalignedReads(self):
-        return -1  # TODO populate with metadata
+        return self._numUnalignedReads
+
+    def getBaseCount(self):
+        return self._baseCount
 
     def getPrograms(self):
         return self._parentContainer.getPrograms()
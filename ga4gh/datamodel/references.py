@@ -6,14 +6,20 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import collections
 import hashlib
+import itertools
 import json
 import os
 import random
+import tempfile
+import threading
 
+import numpy
 import pysam
 
 import ga4gh.datamodel as datamodel
+import ga4gh.datamodel.packed as packed
 import ga4gh.protocol as protocol
 import ga4gh.exceptions as exceptions
 
@@ -24,6 +30,241 @@ This is the name used for any reference set referred to in a BAM
 file that does not provide the 'AS' tag in the @SQ header.
 """
 
+MANIFEST_REFERENCES_KEY = "references"
+"""
+The key of the per-reference metadata in the JSON manifest of a
+multi-sequence FASTA file.
+"""
+
+# The bases of simulated references, indexed by random codes
+_SIMULATED_BASES = numpy.fromstring(b"ACGT", dtype=numpy.uint8)
+
+
+def getReferenceMetadataFilePath(fastaFilePath):
+    """
+    Returns the path of the JSON metadata file accompanying the specified
+    FASTA file in a reference set directory.
+    """
+    dirname, filename = os.path.split(fastaFilePath)
+    return os.path.join(dirname, "{}.json".format(filename.split(".")[0]))
+
+
+class ReferenceBlockCache(object):
+    """
+    A process-wide, byte-bounded LRU cache of decoded reference bases,
+    which sits underneath AbstractReference.getBases. The bases of each
+    reference are divided into fixed size blocks, which are decoded as a
+    whole the first time any base within them is requested and are then
+    shared by all subsequent requests. When a request starts where the
+    previous request for the same reference ended, the reference is
+    being scanned sequentially, and a missing block is decoded together
+    with the block following it.
+
+    The cache may be used by several threads at once. Blocks are decoded
+    without holding the cache's lock, so two threads missing the same
+    block may both decode it; the second block stored replaces the first.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._blocks = collections.OrderedDict()
+        self._lastEnds = {}
+        self._numBytes = 0
+        # Initialize the values even if they will be set up by the config
+        self._blockSize = 2**16
+        self._maxBytes = 2**26
+        self._resetStatistics()
+
+    def _resetStatistics(self):
+        self._hits = 0
+        self._misses = 0
+        self._prefetches = 0
+        self._evictions = 0
+
+    def configure(self, blockSize, maxBytes):
+        """
+        Sets the size in bases of the blocks and the maximum total size
+        in bytes of the blocks held in the cache.
+        """
+        if blockSize <= 0 or maxBytes <= 0:
+            raise ValueError(
+                "The block size and the maximum cache size must be "
+                "strictly positive values")
+        with self._lock:
+            self._blockSize = blockSize
+            self._maxBytes = maxBytes
+        self.clear()
+
+    def clear(self):
+        """
+        Removes all blocks from the cache and resets the statistics.
+        """
+        with self._lock:
+            self._blocks.clear()
+            self._lastEnds.clear()
+            self._numBytes = 0
+            self._resetStatistics()
+
+    def getStatistics(self):
+        """
+        Returns a dictionary of the cache hit, miss, prefetch and eviction
+        counts (in blocks), and of the current size of the cache.
+        """
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "prefetches": self._prefetches,
+                "evictions": self._evictions,
+                "blocks": len(self._blocks),
+                "bytes": self._numBytes,
+            }
+
+    def _addBlock(self, key, bases):
+        # Must be called with the lock held. Another thread may have
+        # stored the same block while we were decoding it.
+        replaced = self._blocks.pop(key, None)
+        if replaced is not None:
+            self._numBytes -= len(replaced)
+        self._blocks[key] = bases
+        self._numBytes += len(bases)
+        while self._numBytes > self._maxBytes:
+            _, evicted = self._blocks.popitem(last=False)
+            self._numBytes -= len(evicted)
+            self._evictions += 1
+
+    def _getBlock(self, reference, blockIndex, blockSize, isSequential):
+        key = (reference.getBlockCacheKey(), blockIndex)
+        length = reference.getLength()
+        nextKey = (key[0], blockIndex + 1)
+        with self._lock:
+            bases = self._blocks.pop(key, None)
+            if bases is not None:
+                self._hits += 1
+                self._blocks[key] = bases
+                return bases
+            self._misses += 1
+            numBlocks = 1
+            if (isSequential and (blockIndex + 1) * blockSize < length and
+                    nextKey not in self._blocks):
+                numBlocks = 2
+        blockStart = blockIndex * blockSize
+        fetched = reference.fetchBases(
+            blockStart, min(blockStart + numBlocks * blockSize, length))
+        bases = fetched[:blockSize]
+        with self._lock:
+            # The blocks are not stored if the cache was reconfigured.
+            if blockSize == self._blockSize:
+                if numBlocks == 2:
+                    self._prefetches += 1
+                    self._addBlock(nextKey, fetched[blockSize:])
+                self._addBlock(key, bases)
+        return bases
+
+    def getBases(self, reference, start, end):
+        """
+        Returns the bases of the specified reference from start
+        (inclusive) to end (exclusive), decoding the blocks overlapping
+        this range using the reference's fetchBases method if they are
+        not already in the cache. Ranges too large to fit in the cache
+        are fetched directly.
+        """
+        if start >= end:
+            return b""
+        cacheKey = reference.getBlockCacheKey()
+        with self._lock:
+            blockSize = self._blockSize
+            if end - start > self._maxBytes // 2:
+                blockSize = None
+            else:
+                isSequential = self._lastEnds.get(cacheKey) == start
+                self._lastEnds[cacheKey] = end
+        if blockSize is None:
+            return reference.fetchBases(start, end)
+        firstBlock = start // blockSize
+        lastBlock = (end - 1) // blockSize
+        offset = firstBlock * blockSize
+        bases = b"".join(
+            self._getBlock(reference, blockIndex, blockSize, isSequential)
+            for blockIndex in range(firstBlock, lastBlock + 1))
+        return bases[start - offset:end - offset]
+
+
+class Md5ReferenceDirectory(object):
+    """
+    A directory of reference sequences stored as plain uppercase bases,
+    each in a file named by the MD5 checksum of the sequence. This is
+    the layout that htslib searches via the REF_PATH environment variable
+    for the references needed to decode a CRAM file, and so allows CRAM
+    files to be decoded using the server's own references.
+    """
+    def __init__(self):
+        self._directory = None
+        self._chunkSize = 2**20
+
+    def setDirectory(self, directory):
+        """
+        Sets the directory in which the reference sequences are stored.
+        If this is None, a temporary directory is created when it is
+        first needed.
+        """
+        self._directory = directory
+
+    def getDirectory(self):
+        """
+        Returns the directory in which the reference sequences are
+        stored, and makes sure that htslib searches it first.
+        """
+        if self._directory is None:
+            self._directory = tempfile.mkdtemp(prefix="ga4gh_ref_cache")
+        elif not os.path.exists(self._directory):
+            os.makedirs(self._directory)
+        refPath = os.path.join(self._directory, "%s")
+        paths = os.environ.get("REF_PATH", "").split(":")
+        if paths[0] != refPath:
+            os.environ["REF_PATH"] = ":".join(
+                [refPath] + [path for path in paths if path != ""])
+        return self._directory
+
+    def addReference(self, reference):
+        """
+        Writes the sequence of the specified reference into the
+        directory, if it is not already present. The sequence is checked
+        against the reference's MD5 checksum as it is written.
+        """
+        md5checksum = reference.getMd5Checksum()
+        path = os.path.join(self.getDirectory(), md5checksum)
+        if os.path.exists(path):
+            return
+        md5 = hashlib.md5()
+        fd, tempPath = tempfile.mkstemp(dir=self._directory)
+        try:
+            with os.fdopen(fd, "wb") as sequenceFile:
+                length = reference.getLength()
+                for start in range(0, length, self._chunkSize):
+                    bases = reference.fetchBases(
+                        start, min(start + self._chunkSize, length)).upper()
+                    md5.update(bases)
+                    sequenceFile.write(bases)
+            if md5.hexdigest() != md5checksum:
+                raise exceptions.ReferenceMd5MismatchException(
+                    reference.getLocalId(), md5checksum)
+            os.rename(tempPath, path)
+        finally:
+            if os.path.exists(tempPath):
+                os.unlink(tempPath)
+
+
+# The process-wide cache of decoded reference blocks
+referenceBlockCache = ReferenceBlockCache()
+
+# Unique keys identifying references in the block cache. IDs are not
+# unique enough, as different backends may contain references with the
+# same ID but different sequences.
+_blockCacheKeys = itertools.count()
+
+# The directory of reference sequences used to decode CRAM files
+md5ReferenceDirectory = Md5ReferenceDirectory()
+
 
 class AbstractReferenceSet(datamodel.DatamodelObject):
     """
@@ -38,6 +279,8 @@ class AbstractReferenceSet(datamodel.DatamodelObject):
         self._referenceIdMap = {}
         self._referenceNameMap = {}
         self._referenceIds = []
+        self._referenceMd5ChecksumMap = None
+        self._referenceAccessionMap = collections.defaultdict(list)
         self._assemblyId = None
         self._description = None
         self._isDerived = False
@@ -53,6 +296,11 @@ class AbstractReferenceSet(datamodel.DatamodelObject):
         self._referenceIdMap[id_] = reference
         self._referenceNameMap[reference.getLocalId()] = reference
         self._referenceIds.append(id_)
+        # The MD5 index is rebuilt when next needed, so that adding many
+        # references does not rebuild it each time.
+        self._referenceMd5ChecksumMap = None
+        for accession in set(reference.getSourceAccessions()):
+            self._referenceAccessionMap[accession].append(reference)
 
     def getReferences(self):
         """
@@ -80,6 +328,29 @@ class AbstractReferenceSet(datamodel.DatamodelObject):
             raise exceptions.ReferenceNameNotFoundException(name)
         return self._referenceNameMap[name]
 
+    def getReferencesByMd5Checksum(self, md5checksum):
+        """
+        Returns the References in this ReferenceSet with the specified
+        MD5 checksum, in the order in which they were added.
+        """
+        md5ChecksumMap = self._referenceMd5ChecksumMap
+        if md5ChecksumMap is None:
+            # The index is only published once it is complete, so that
+            # other threads never see a partially built index.
+            md5ChecksumMap = collections.defaultdict(list)
+            for reference in self.getReferences():
+                md5ChecksumMap[reference.getMd5Checksum()].append(reference)
+            self._referenceMd5ChecksumMap = md5ChecksumMap
+        return list(md5ChecksumMap.get(md5checksum, []))
+
+    def getReferencesByAccession(self, accession):
+        """
+        Returns the References in this ReferenceSet that have the specified
+        accession among their source accessions, in the order in which
+        they were added.
+        """
+        return list(self._referenceAccessionMap.get(accession, []))
+
     def getReference(self, id_):
         """
         Returns the Reference with the specified ID or raises a
@@ -185,6 +456,14 @@ class AbstractReference(datamodel.DatamodelObject):
         self._isDerived = False
         self._sourceDivergence = None
         self._ncbiTaxonId = None
+        self._blockCacheKey = next(_blockCacheKeys)
+
+    def getBlockCacheKey(self):
+        """
+        Returns the key that uniquely identifies this reference in the
+        reference block cache.
+        """
+        return self._blockCacheKey
 
     def getLength(self):
         """
@@ -285,6 +564,15 @@ class AbstractReference(datamodel.DatamodelObject):
         Returns the string representing the bases of this reference from
         start (inclusive) to end (exclusive).
         """
+        self.checkQueryRange(start, end)
+        return referenceBlockCache.getBases(self, start, end)
+
+    def fetchBases(self, start, end):
+        """
+        Returns the bases of this reference from start (inclusive) to
+        end (exclusive), read directly from the underlying data without
+        any range checking or caching.
+        """
         raise NotImplemented()
 
 ##################################################################
@@ -298,7 +586,9 @@ class SimulatedReferenceSet(AbstractReferenceSet):
     """
     A simulated referenceSet
     """
-    def __init__(self, localId, randomSeed=0, numReferences=1):
+    def __init__(
+            self, localId, randomSeed=0, numReferences=1,
+            referenceLength=200):
         super(SimulatedReferenceSet, self).__init__(localId)
         self._randomSeed = randomSeed
         self._randomGenerator = random.Random()
@@ -316,24 +606,27 @@ class SimulatedReferenceSet(AbstractReferenceSet):
             referenceSeed = self._randomGenerator.getrandbits(32)
             referenceLocalId = "srs{}".format(i)
             reference = SimulatedReference(
-                self, referenceLocalId, referenceSeed)
+                self, referenceLocalId, referenceSeed, referenceLength)
             self.addReference(reference)
 
 
 class SimulatedReference(AbstractReference):
     """
-    A simulated reference. Stores a random sequence of a given length, and
-    generates remaining attributes randomly.
+    A simulated reference of a given length. The bases are generated on
+    demand, one fixed size block at a time, from a random number generator
+    seeded with the reference's seed and the block index, so that any
+    range of bases is reproducible without generating the whole sequence.
+    The remaining attributes are generated randomly.
     """
-
-    def __init__(self, parentContainer, localId, randomSeed=0, length=200):
+    def __init__(
+            self, parentContainer, localId, randomSeed=0, length=200,
+            blockSize=2**16):
         super(SimulatedReference, self).__init__(parentContainer, localId)
         rng = random.Random()
         rng.seed(randomSeed)
         self._length = length
-        bases = [rng.choice('ACGT') for _ in range(self._length)]
-        self._bases = ''.join(bases)
-        self._md5checksum = hashlib.md5(self._bases).hexdigest()
+        self._blockSize = blockSize
+        self._blockSeed = rng.getrandbits(32)
         self._isDerived = bool(rng.randint(0, 1))
         self._sourceDivergence = 0
         if self._isDerived:
@@ -344,10 +637,42 @@ class SimulatedReference(AbstractReference):
                 self._sourceAccessions.append("sim_accession_{}".format(
                     random.randint(1, 2**32)))
         self._sourceUri = "http://example.com/reference.fa"
-
-    def getBases(self, start, end):
-        self.checkQueryRange(start, end)
-        return self._bases[start:end]
+        # The checksum requires generating the whole sequence, so it is
+        # computed once here rather than when a request first needs it.
+        self._md5checksum = self._computeMd5Checksum()
+
+    def _getBlock(self, blockIndex):
+        """
+        Returns the bases of the block with the specified index.
+        """
+        blockStart = blockIndex * self._blockSize
+        blockLength = min(self._blockSize, self._length - blockStart)
+        blockRng = numpy.random.RandomState([self._blockSeed, blockIndex])
+        codes = blockRng.randint(0, 4, blockLength)
+        return _SIMULATED_BASES[codes].tostring()
+
+    def _computeMd5Checksum(self):
+        """
+        Returns the MD5 checksum of the sequence, which is generated one
+        block at a time.
+        """
+        md5 = hashlib.md5()
+        numBlocks = (self._length + self._blockSize - 1) // self._blockSize
+        for blockIndex in range(numBlocks):
+            md5.update(self._getBlock(blockIndex))
+        return md5.hexdigest()
+
+    def fetchBases(self, start, end):
+        end = min(end, self._length)
+        if start >= end:
+            return b""
+        firstBlock = start // self._blockSize
+        lastBlock = (end - 1) // self._blockSize
+        bases = b"".join(
+            self._getBlock(blockIndex)
+            for blockIndex in range(firstBlock, lastBlock + 1))
+        offset = firstBlock * self._blockSize
+        return bases[start - offset:end - offset]
 
 ##################################################################
 #
@@ -382,31 +707,59 @@ class HtslibReferenceSet(datamodel.PysamDatamodelMixin, AbstractReferenceSet):
                     metadataFileName, str(err))
 
     def _addDataFile(self, path):
-        dirname, filename = os.path.split(path)
-        localId = filename.split(".")[0]
-        metadataFileName = os.path.join(dirname, "{}.json".format(localId))
+        localId = os.path.basename(path).split(".")[0]
+        metadataFileName = getReferenceMetadataFilePath(path)
         with open(metadataFileName) as metadataFile:
             metadata = json.load(metadataFile)
-        reference = HtslibReference(self, localId, path, metadata)
-        self.addReference(reference)
+        fastaFile = self.getFileHandle(path)
+        packedReferences = packed.PackedReferences(path)
+        if MANIFEST_REFERENCES_KEY in metadata:
+            # A multi-sequence FASTA file, with the metadata for each of
+            # its sequences in a single manifest.
+            referencesMetadata = metadata[MANIFEST_REFERENCES_KEY]
+            for referenceName in fastaFile.references:
+                if referenceName not in referencesMetadata:
+                    raise exceptions.MissingReferenceMetadata(
+                        path, referenceName)
+                reference = HtslibReference(
+                    self, referenceName, path,
+                    referencesMetadata[referenceName], packedReferences)
+                self.addReference(reference)
+        else:
+            numReferences = len(fastaFile.references)
+            if numReferences != 1:
+                raise exceptions.NotExactlyOneReferenceException(
+                    path, numReferences)
+            if fastaFile.references[0] != localId:
+                raise exceptions.InconsistentReferenceNameException(path)
+            reference = HtslibReference(
+                self, localId, path, metadata, packedReferences)
+            self.addReference(reference)
+
+    def openFile(self, dataFile):
+        return pysam.FastaFile(dataFile)
 
 
 class HtslibReference(datamodel.PysamDatamodelMixin, AbstractReference):
     """
-    A reference based on data stored in a file on the file system
+    A reference based on one of the sequences of a FASTA file on the file
+    system. All the references in a multi-sequence FASTA file share a
+    single file handle.
     """
-    def __init__(self, parentContainer, localId, dataFile, metadata):
+    def __init__(
+            self, parentContainer, localId, dataFile, metadata,
+            packedReferences=None):
         super(HtslibReference, self).__init__(parentContainer, localId)
         self._fastaFilePath = dataFile
+        if packedReferences is None:
+            packedReferences = packed.PackedReferences(dataFile)
+        self._packedReferences = packedReferences
         fastaFile = self.getFileHandle(dataFile)
-        numReferences = len(fastaFile.references)
-        if numReferences != 1:
-            raise exceptions.NotExactlyOneReferenceException(
-                self._fastaFilePath, numReferences)
-        if fastaFile.references[0] != localId:
+        if localId not in fastaFile.references:
             raise exceptions.InconsistentReferenceNameException(
                 self._fastaFilePath)
-        self._length = fastaFile.lengths[0]
+        self._length = fastaFile.lengths[
+            fastaFile.references.index(localId)]
         try:
             self._md5checksum = metadata["md5checksum"]
             self._sourceUri = metadata["sourceUri"]
@@ -426,8 +779,10 @@ class HtslibReference(datamodel.PysamDatamodelMixin, AbstractReference):
     def openFile(self, dataFile):
         return pysam.FastaFile(dataFile)
 
-    def getBases(self, start, end):
-        self.checkQueryRange(start, end)
+    def fetchBases(self, start, end):
+        if self._packedReferences.isAvailable():
+            return self._packedReferences.getBases(
+                self.getLocalId(), start, end)
         fastaFile = self.getFileHandle(self._fastaFilePath)
         # TODO we should have some error checking here...
         bases = fastaFile.fetch(self.getLocalId(), start, end)
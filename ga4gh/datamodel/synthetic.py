@@ -0,0 +1,425 @@
+"""
+Generation of synthetic file system data directories for benchmarking.
+
+A complete data directory in the layout read by the FileSystemBackend is
+written: a reference set of bgzipped and indexed FASTA files with their
+metadata, and a dataset of indexed VCF variant sets and BAM read group
+sets aligned to it. All the data is generated with vectorised NumPy
+operations a block at a time, so that memory use is bounded whatever the
+size of the corpus, and the files are written by a pool of worker
+processes in parallel. The output is a deterministic function of the
+parameters and the random seed.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import multiprocessing
+import os
+
+import numpy
+import pysam
+
+import ga4gh.datamodel.checksums as checksums
+import ga4gh.datamodel.references as references
+
+
+FASTA_LINE_LENGTH = 60
+
+_BASES_STRING = b"ACGT"
+_BASES = numpy.fromstring(_BASES_STRING, dtype=numpy.uint8)
+_BASE_CODES = numpy.zeros(256, dtype=numpy.uint8)
+_BASE_CODES[_BASES] = numpy.arange(len(_BASES))
+_GENOTYPES = numpy.array(
+    [numpy.fromstring(genotype, dtype=numpy.uint8)
+     for genotype in [b"0|0\t", b"0|1\t", b"1|0\t", b"1|1\t"]])
+_FASTA_BLOCK_SIZE = FASTA_LINE_LENGTH * 2**16
+_VARIANT_BLOCK_SIZE = 2**14
+_READ_WINDOW_SIZE = 2**20
+_MIN_BASE_QUALITY = 20
+_MAX_BASE_QUALITY = 40
+_MAPPING_QUALITY = 60
+_REVERSE_STRAND_FLAG = 16
+
+
+def _getByteStrings(array):
+    """
+    Returns the rows of the specified 2D uint8 array as a list of byte
+    strings.
+    """
+    array = numpy.ascontiguousarray(array)
+    if array.shape[0] == 0:
+        return []
+    return array.view(b"S{}".format(array.shape[1])).ravel().tolist()
+
+
+def writeFastaSequence(fastaFile, referenceName, length, randomState):
+    """
+    Writes a random sequence of the specified length to the specified
+    open FASTA file using the specified numpy RandomState, and returns
+    its MD5 checksum.
+    """
+    print(">" + referenceName, file=fastaFile)
+    md5 = hashlib.md5()
+    for start in range(0, length, _FASTA_BLOCK_SIZE):
+        blockLength = min(_FASTA_BLOCK_SIZE, length - start)
+        bases = _BASES[randomState.randint(0, len(_BASES), blockLength)]
+        md5.update(bases.tostring())
+        numLines, remainder = divmod(blockLength, FASTA_LINE_LENGTH)
+        lines = numpy.empty(
+            (numLines, FASTA_LINE_LENGTH + 1), dtype=numpy.uint8)
+        lines[:, :FASTA_LINE_LENGTH] = bases[:blockLength - remainder].reshape(
+            numLines, FASTA_LINE_LENGTH)
+        lines[:, FASTA_LINE_LENGTH] = ord(b"\n")
+        fastaFile.write(lines.tostring())
+        if remainder > 0:
+            fastaFile.write(bases[-remainder:].tostring() + b"\n")
+    return md5.hexdigest()
+
+
+def _writeReference(task):
+    """
+    Writes a bgzipped and indexed FASTA file holding a single random
+    reference, along with its metadata file.
+    """
+    fastaFilePath, referenceName, length, randomSeed = task
+    with open(fastaFilePath, "w") as fastaFile:
+        md5checksum = writeFastaSequence(
+            fastaFile, referenceName, length,
+            numpy.random.RandomState(randomSeed))
+    pysam.tabix_compress(fastaFilePath, fastaFilePath + ".gz", force=True)
+    os.unlink(fastaFilePath)
+    fastaFilePath += ".gz"
+    pysam.faidx(str(fastaFilePath))
+    metadata = dict(checksums.DEFAULT_REFERENCE_METADATA)
+    metadata["md5checksum"] = md5checksum
+    metadataFilePath = references.getReferenceMetadataFilePath(fastaFilePath)
+    with open(metadataFilePath, "w") as metadataFile:
+        json.dump(metadata, metadataFile, indent=4, sort_keys=True)
+
+
+def _writeVariants(task):
+    """
+    Writes a tabix indexed VCF file holding the random variants of the
+    specified samples on a single reference.
+    """
+    (vcfFilePath, fastaFilePath, referenceName, referenceLengths,
+        sampleNames, density, randomSeed) = task
+    referenceName = bytes(referenceName)
+    randomState = numpy.random.RandomState(randomSeed)
+    fastaFile = pysam.FastaFile(fastaFilePath)
+    length = fastaFile.lengths[fastaFile.references.index(referenceName)]
+    with open(vcfFilePath, "w") as vcfFile:
+        print("##fileformat=VCFv4.2", file=vcfFile)
+        for name, referenceLength in referenceLengths:
+            print("##contig=<ID={},length={}>".format(
+                name, referenceLength), file=vcfFile)
+        print(
+            '##INFO=<ID=AF,Number=A,Type=Float,'
+            'Description="Allele Frequency">', file=vcfFile)
+        print(
+            '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+            file=vcfFile)
+        print("\t".join(
+            ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO",
+             "FORMAT"] + sampleNames), file=vcfFile)
+        # The gaps between variants are geometrically distributed, so
+        # each block of positions is drawn in a single call.
+        position = -1
+        while position < length:
+            positions = position + numpy.cumsum(
+                randomState.geometric(density, _VARIANT_BLOCK_SIZE))
+            position = positions[-1]
+            positions = positions[positions < length]
+            if len(positions) == 0:
+                continue
+            bases = numpy.fromstring(fastaFile.fetch(
+                referenceName, int(positions[0]), int(positions[-1]) + 1),
+                dtype=numpy.uint8)
+            referenceCodes = _BASE_CODES[bases[positions - positions[0]]]
+            alternateCodes = (referenceCodes + randomState.randint(
+                1, len(_BASES), len(positions))) % len(_BASES)
+            frequencies = randomState.uniform(size=len(positions))
+            alleles = randomState.uniform(
+                size=(len(positions), len(sampleNames), 2)) < frequencies[
+                    :, numpy.newaxis, numpy.newaxis]
+            genotypes = _GENOTYPES[2 * alleles[:, :, 0] + alleles[:, :, 1]]
+            genotypes = _getByteStrings(
+                genotypes.reshape(len(positions), -1)[:, :-1])
+            qualities = randomState.randint(10, 100, len(positions))
+            vcfFile.writelines([
+                b"%s\t%d\t.\t%s\t%s\t%d\tPASS\tAF=%.3f\tGT\t%s\n" % (
+                    referenceName, pos + 1, _BASES_STRING[ref],
+                    _BASES_STRING[alt], quality, frequency, genotype)
+                for pos, ref, alt, quality, frequency, genotype in zip(
+                    positions.tolist(), referenceCodes.tolist(),
+                    alternateCodes.tolist(), qualities.tolist(),
+                    frequencies.tolist(), genotypes)])
+    fastaFile.close()
+    pysam.tabix_index(vcfFilePath, preset="vcf", force=True)
+
+
+def _writeSamChunk(samFilePath, samHeader, samLines, bamFile):
+    """
+    Appends the reads in the specified SAM lines to the specified BAM
+    file, using a temporary SAM file at the specified path so that the
+    lines are parsed by htslib.
+    """
+    with open(samFilePath, "w") as samFile:
+        samFile.write(samHeader)
+        samFile.writelines(samLines)
+    samFile = pysam.AlignmentFile(samFilePath, "r")
+    for read in samFile:
+        bamFile.write(read)
+    samFile.close()
+
+
+def _writeReads(task):
+    """
+    Writes an indexed BAM file holding the random reads of a single read
+    group, tiled over all the references at the specified mean coverage.
+    The reads are copies of the reference with random substitutions. The
+    reads in each window of the references are formatted as SAM text,
+    which htslib parses much faster than the reads can be built in
+    Python, and appended to the BAM file; only one window of SAM text is
+    held on disk at a time.
+    """
+    (bamFilePath, fastaFilePaths, referenceSetName, readGroupName,
+        readLength, meanCoverage, errorRate, randomSeed) = task
+    readGroupName = bytes(readGroupName)
+    randomState = numpy.random.RandomState(randomSeed)
+    samFilePath = bamFilePath[:-len(".bam")] + ".sam"
+    fastaFiles = []
+    for fastaFilePath in fastaFilePaths:
+        fastaFile = pysam.FastaFile(fastaFilePath)
+        fastaFiles.extend(
+            (fastaFile, name, length)
+            for name, length in zip(fastaFile.references, fastaFile.lengths))
+    offsets = numpy.arange(readLength)
+    samHeader = "@HD\tVN:1.3\tSO:coordinate\n"
+    for _, name, length in fastaFiles:
+        samHeader += "@SQ\tSN:{}\tLN:{}\tAS:{}\n".format(
+            name, length, referenceSetName)
+    samHeader += "@RG\tID:{0}\tSM:{0}\n".format(readGroupName)
+    with open(samFilePath, "w") as samFile:
+        samFile.write(samHeader)
+    templateFile = pysam.AlignmentFile(samFilePath, "r")
+    bamFile = pysam.AlignmentFile(bamFilePath, "wb", template=templateFile)
+    templateFile.close()
+    try:
+        for fastaFile, name, length in fastaFiles:
+            lastStart = length - readLength
+            readIndex = 0
+            for windowStart in range(0, lastStart + 1, _READ_WINDOW_SIZE):
+                windowEnd = min(windowStart + _READ_WINDOW_SIZE, lastStart + 1)
+                numReads = randomState.poisson(
+                    (windowEnd - windowStart) * meanCoverage / readLength)
+                if numReads == 0:
+                    continue
+                starts = numpy.sort(randomState.randint(
+                    windowStart, windowEnd, numReads))
+                bases = numpy.fromstring(fastaFile.fetch(
+                    name, windowStart, windowEnd + readLength - 1),
+                    dtype=numpy.uint8)
+                referenceBases = bases[
+                    (starts - windowStart)[:, numpy.newaxis] + offsets]
+                errors = randomState.uniform(
+                    size=referenceBases.shape) < errorRate
+                sequences = referenceBases.copy()
+                sequences[errors] = _BASES[
+                    (_BASE_CODES[referenceBases[errors]] + randomState.randint(
+                        1, len(_BASES), errors.sum())) % len(_BASES)]
+                qualities = randomState.randint(
+                    _MIN_BASE_QUALITY, _MAX_BASE_QUALITY + 1,
+                    referenceBases.shape).astype(numpy.uint8) + 33
+                flags = _REVERSE_STRAND_FLAG * randomState.randint(
+                    0, 2, numReads)
+                _writeSamChunk(samFilePath, samHeader, [
+                    b"%s:%s:%d\t%d\t%s\t%d\t%d\t%dM\t*\t0\t0\t%s\t%s\t"
+                    b"RG:Z:%s\tNM:i:%d\n" % (
+                        readGroupName, name, readIndex + i, flag, name,
+                        start + 1, _MAPPING_QUALITY, readLength, sequence,
+                        quality, readGroupName, editDistance)
+                    for i, (start, flag, sequence, quality, editDistance)
+                    in enumerate(zip(
+                        starts.tolist(), flags.tolist(),
+                        _getByteStrings(sequences),
+                        _getByteStrings(qualities),
+                        errors.sum(axis=1).tolist()))], bamFile)
+                readIndex += numReads
+    finally:
+        bamFile.close()
+        os.unlink(samFilePath)
+    for fastaFile in set(fastaFile for fastaFile, _, _ in fastaFiles):
+        fastaFile.close()
+    pysam.index(str(bamFilePath))
+
+
+def _runTask(task):
+    function, arguments = task
+    function(arguments)
+
+
+def _runTasks(function, tasks, numWorkers):
+    """
+    Runs the specified function on each of the specified (cost, task)
+    pairs using numWorkers processes, the most costly first so that the
+    work is evenly balanced.
+    """
+    tasks = [task for _, task in sorted(
+        tasks, key=lambda task: task[0], reverse=True)]
+    if numWorkers <= 1:
+        map(function, tasks)
+    else:
+        pool = multiprocessing.Pool(numWorkers)
+        try:
+            pool.map(function, tasks, chunksize=1)
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+class SyntheticDataGenerator(object):
+    """
+    Writes a synthetic data directory that can be served by the
+    FileSystemBackend. The directory holds a single reference set of
+    numReferences references of referenceLength bases each, and a single
+    dataset holding numVariantSets variant sets with numSamples samples
+    and numReadGroupSets read group sets. Variants occur with the
+    specified density per base and reads of readLength bases are tiled
+    at the specified mean coverage, with substitutions at errorRate.
+    """
+    def __init__(
+            self, dataDir, randomSeed=0, numReferences=1,
+            referenceLength=10**6, numVariantSets=1, numSamples=10,
+            variantDensity=0.001, numReadGroupSets=1, readLength=100,
+            meanCoverage=1.0, errorRate=0.01, numWorkers=1,
+            referenceSetName="synthetic", datasetName="synthetic"):
+        if readLength > referenceLength:
+            raise ValueError("Reads cannot be longer than the references")
+        if numSamples < 1:
+            raise ValueError("Variant sets must have at least one sample")
+        self._dataDir = dataDir
+        self._randomSeed = randomSeed
+        self._referenceLength = referenceLength
+        self._numVariantSets = numVariantSets
+        self._numSamples = numSamples
+        self._variantDensity = variantDensity
+        self._numReadGroupSets = numReadGroupSets
+        self._readLength = readLength
+        self._meanCoverage = meanCoverage
+        self._errorRate = errorRate
+        self._numWorkers = numWorkers
+        self._referenceSetName = referenceSetName
+        self._datasetName = datasetName
+        self._referenceNames = [
+            "chr{}".format(i + 1) for i in range(numReferences)]
+
+    def _getReferenceSetDir(self):
+        return os.path.join(
+            self._dataDir, "referenceSets", self._referenceSetName)
+
+    def _getDatasetDir(self):
+        return os.path.join(self._dataDir, "datasets", self._datasetName)
+
+    def _getFastaFilePath(self, referenceName):
+        return os.path.join(
+            self._getReferenceSetDir(), referenceName + ".fa")
+
+    def _makeDirectory(self, *path):
+        path = os.path.join(*path)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        return path
+
+    def _writeReferenceSetMetadata(self):
+        metadata = {
+            "assemblyId": self._referenceSetName,
+            "description": "Synthetic reference set",
+            "isDerived": False,
+            "ncbiTaxonId": None,
+            "sourceAccessions": [],
+            "sourceUri": None,
+        }
+        with open(self._getReferenceSetDir() + ".json", "w") as metadataFile:
+            json.dump(metadata, metadataFile, indent=4, sort_keys=True)
+
+    def getReferenceTasks(self):
+        """
+        Returns the (cost, task) pairs that write the references.
+        """
+        return [
+            (self._referenceLength, (
+                self._getFastaFilePath(referenceName), referenceName,
+                self._referenceLength, [self._randomSeed, 0, i]))
+            for i, referenceName in enumerate(self._referenceNames)]
+
+    def getVariantTasks(self):
+        """
+        Returns the (cost, task) pairs that write the variant sets, one
+        VCF file per variant set and reference.
+        """
+        referenceLengths = [
+            (referenceName, self._referenceLength)
+            for referenceName in self._referenceNames]
+        cost = (
+            self._referenceLength * self._variantDensity * self._numSamples)
+        tasks = []
+        for i in range(self._numVariantSets):
+            variantSetDir = self._makeDirectory(
+                self._getDatasetDir(), "variants", "variants{}".format(i))
+            sampleNames = [
+                "sample{}_{}".format(i, j) for j in range(self._numSamples)]
+            for j, referenceName in enumerate(self._referenceNames):
+                tasks.append((cost, (
+                    os.path.join(variantSetDir, referenceName + ".vcf"),
+                    self._getFastaFilePath(referenceName) + ".gz",
+                    referenceName, referenceLengths, sampleNames,
+                    self._variantDensity, [self._randomSeed, 1, i, j])))
+        return tasks
+
+    def getReadTasks(self):
+        """
+        Returns the (cost, task) pairs that write the read group sets,
+        one BAM file per read group set.
+        """
+        readsDir = self._makeDirectory(self._getDatasetDir(), "reads")
+        fastaFilePaths = [
+            self._getFastaFilePath(referenceName) + ".gz"
+            for referenceName in self._referenceNames]
+        cost = (
+            self._referenceLength * len(self._referenceNames) *
+            self._meanCoverage)
+        tasks = []
+        for i in range(self._numReadGroupSets):
+            readGroupName = "reads{}".format(i)
+            tasks.append((cost, (
+                os.path.join(readsDir, readGroupName + ".bam"),
+                fastaFilePaths, self._referenceSetName, readGroupName,
+                self._readLength, self._meanCoverage, self._errorRate,
+                [self._randomSeed, 2, i])))
+        return tasks
+
+    def getReadGroupSetFilePaths(self):
+        """
+        Returns the paths of the BAM files of the read group sets.
+        """
+        return [task[0] for _, task in self.getReadTasks()]
+
+    def generate(self):
+        """
+        Writes the data directory. The references are written first, as
+        the variants and reads are derived from their bases.
+        """
+        self._makeDirectory(self._getReferenceSetDir())
+        self._writeReferenceSetMetadata()
+        _runTasks(_writeReference, self.getReferenceTasks(), self._numWorkers)
+        self._makeDirectory(self._getDatasetDir(), "variants")
+        tasks = [
+            (cost, (_writeVariants, task))
+            for cost, task in self.getVariantTasks()]
+        tasks.extend(
+            (cost, (_writeReads, task)) for cost, task in self.getReadTasks())
+        _runTasks(_runTask, tasks, self._numWorkers)
@@ -10,11 +10,14 @@ import datetime
 import random
 import hashlib
 
+import numpy
 import pysam
 
 import ga4gh.protocol as protocol
 import ga4gh.exceptions as exceptions
 import ga4gh.datamodel as datamodel
+import ga4gh.datamodel.parallel as parallel
+import ga4gh.profiling as profiling
 
 
 def convertVCFPhaseset(vcfPhaseset):
@@ -212,13 +215,16 @@ class AbstractVariantSet(datamodel.DatamodelObject):
 class SimulatedVariantSet(AbstractVariantSet):
     """
     A variant set that doesn't derive from a data store.
-    Used mostly for testing.
+    Used mostly for testing. Variant sites are generated independently in
+    fixed size blocks of positions, and each variant is generated from
+    its position, so that any range of variants is reproducible.
     """
     def __init__(
             self, parentContainer, localId, randomSeed=1, numCalls=1,
-            variantDensity=1):
+            variantDensity=1, blockSize=2**14):
         super(SimulatedVariantSet, self).__init__(parentContainer, localId)
         self._randomSeed = randomSeed
+        self._blockSize = blockSize
         self._numCalls = numCalls
         for j in range(numCalls):
             self.addCallSet("simCallSet_{}".format(j))
@@ -243,17 +249,47 @@ class SimulatedVariantSet(AbstractVariantSet):
             compoundId.referenceName, start, randomNumberGenerator)
         return variant
 
+    def _getBlockVariantPositions(self, blockIndex):
+        """
+        Returns the positions of the variants in the block with the
+        specified index. The gaps between consecutive variants are drawn
+        from a geometric distribution, using a random number generator
+        seeded with the block index, so that the cost is proportional to
+        the number of variants rather than to the length of the block.
+        """
+        blockStart = blockIndex * self._blockSize
+        blockEnd = blockStart + self._blockSize
+        density = min(self._variantDensity, 1)
+        if density <= 0:
+            return numpy.zeros(0, dtype=numpy.int64)
+        rng = numpy.random.RandomState([self._randomSeed, blockIndex])
+        batchSize = int(self._blockSize * density * 1.1) + 16
+        positions = [numpy.zeros(0, dtype=numpy.int64)]
+        lastPosition = blockStart - 1
+        while lastPosition < blockEnd:
+            batch = lastPosition + numpy.cumsum(
+                rng.geometric(density, batchSize))
+            positions.append(batch)
+            lastPosition = batch[-1]
+        positions = numpy.concatenate(positions)
+        return positions[positions < blockEnd]
+
     def getVariants(self, referenceName, startPosition, endPosition,
                     callSetIds=None):
-        randomNumberGenerator = random.Random()
-        randomNumberGenerator.seed(self._randomSeed)
-        i = startPosition
-        while i < endPosition:
-            if randomNumberGenerator.random() < self._variantDensity:
-                randomNumberGenerator.seed(self._randomSeed + i)
+        startPosition = max(startPosition, 0)
+        if startPosition >= endPosition:
+            return
+        firstBlock = startPosition // self._blockSize
+        lastBlock = (endPosition - 1) // self._blockSize
+        for blockIndex in range(firstBlock, lastBlock + 1):
+            positions = self._getBlockVariantPositions(blockIndex)
+            positions = positions[
+                (positions >= startPosition) & (positions < endPosition)]
+            for position in positions:
+                randomNumberGenerator = random.Random()
+                randomNumberGenerator.seed(self._randomSeed + int(position))
                 yield self.generateVariant(
-                    referenceName, i, randomNumberGenerator)
-            i += 1
+                    referenceName, int(position), randomNumberGenerator)
 
     def generateVariant(self, referenceName, position, randomNumberGenerator):
         """
@@ -318,6 +354,7 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
         self._chromFileMap = {}
         self._metadata = None
         self._scanDataFiles(dataDir, ['*.bcf', '*.vcf.gz'])
+        parallel.regionFetchPool.registerSource(self)
 
     def _updateMetadata(self, variantFile):
         """
@@ -481,14 +518,46 @@ class HtslibVariantSet(datamodel.PysamDatamodelMixin, AbstractVariantSet):
                     raise exceptions.CallSetNotInVariantSetException(
                         callSetId, self.getId())
         if referenceName in self._chromFileMap:
-            varFileName = self._chromFileMap[referenceName]
             referenceName, startPosition, endPosition = \
                 self.sanitizeVariantFileFetch(
                     referenceName, startPosition, endPosition)
-            cursor = self.getFileHandle(varFileName).fetch(
-                referenceName, startPosition, endPosition)
-            for record in cursor:
-                yield self.convertVariant(record, callSetIds)
+            fetchPool = parallel.regionFetchPool
+            if fetchPool.isSplittable(startPosition, endPosition):
+                varFileName = self._chromFileMap[referenceName]
+                contigs = self.getFileHandle(varFileName).header.contigs
+                # The contig length is optional in VCF headers; without
+                # it we cannot tell how many bins the range really spans.
+                length = None
+                if referenceName in contigs:
+                    length = contigs[referenceName].length
+                if length is not None:
+                    endPosition = min(endPosition, length)
+                    if fetchPool.isSplittable(startPosition, endPosition):
+                        return fetchPool.fetch(
+                            self, "fetchVariants",
+                            (referenceName, callSetIds), startPosition,
+                            endPosition)
+            return self.fetchVariants(
+                referenceName, callSetIds, startPosition, endPosition)
+        return iter([])
+
+    def fetchVariants(
+            self, referenceName, callSetIds, startPosition, endPosition,
+            minStart=None):
+        """
+        Returns an iterator over the variants overlapping the specified
+        range, skipping those that start before minStart if it is not
+        None.
+        """
+        varFileName = self._chromFileMap[referenceName]
+        cursor = self.getFileHandle(varFileName).fetch(
+            referenceName, startPosition, endPosition)
+        for record in cursor:
+            datamodel.checkSearchDeadline(record.start)
+            if minStart is not None and record.start < minStart:
+                continue
+            profiling.enterPhase("convert")
+            yield self.convertVariant(record, callSetIds)
 
     def getMetadata(self):
         return self._metadata
@@ -122,6 +122,17 @@ class BadPageSizeException(BadRequestException):
         self.message = "Request page size '{}' is invalid".format(pageSize)
 
 
+class BadCoverageBinSizeException(BadRequestException):
+    def __init__(self, binSize):
+        self.message = "Coverage bin size '{}' is invalid".format(binSize)
+
+
+class MissingRequestArgumentException(BadRequestException):
+    def __init__(self, argumentName):
+        self.message = "Required argument '{}' is missing".format(
+            argumentName)
+
+
 class BadPageTokenException(BadRequestException):
     message = "Request page token invalid"
 
@@ -221,6 +232,13 @@ class ReferenceNotFoundException(ObjectNotFoundException):
         self.message = "referenceId '{}' not found".format(referenceId)
 
 
+class CoverageNotAvailableException(NotFoundException):
+    def __init__(self, readGroupId):
+        self.message = (
+            "Coverage tiles have not been built for readGroupId "
+            "'{}'".format(readGroupId))
+
+
 class ObjectWithIdNotFoundException(ObjectNotFoundException):
     def __init__(self, objectId):
         self.message = "No object of this type exists with id '{}'".format(
@@ -252,6 +270,17 @@ class ReferenceRangeErrorException(RangeErrorException):
                 start, end, referenceId))
 
 
+class UnsatisfiableByteRangeException(RangeErrorException):
+    """
+    Exception raised when the byte range in the Range header of a
+    streaming request lies outside of the requested bases.
+    """
+    def __init__(self, rangeHeader, length):
+        self.message = (
+            "Range '{}' cannot be satisfied by a response of {} "
+            "bytes".format(rangeHeader, length))
+
+
 class VersionNotSupportedException(NotFoundException):
     message = "API version not supported"
 
@@ -267,6 +296,40 @@ class NotAuthenticatedException(RuntimeException):
         "Not authenticated. Use the key on the server index page.")
 
 
+class RequestTooExpensiveException(BadRequestException):
+    def __init__(self, cost, maxCost):
+        self.message = (
+            "The estimated cost {} of the request exceeds the maximum of "
+            "{}; search a smaller range or fewer samples".format(
+                cost, maxCost))
+
+
+class TooManyRequestsException(RuntimeException):
+    """
+    Exception raised when a request is rejected because the server is
+    already handling and queueing as many requests to its endpoint as it
+    allows.
+    """
+    httpStatus = 429
+
+    def __init__(self, endpoint):
+        self.message = (
+            "Too many concurrent {} requests; try again later".format(
+                endpoint))
+
+
+class ServiceUnavailableException(RuntimeException):
+    """
+    Exception raised when a queued request could not be handled in time.
+    """
+    httpStatus = 503
+
+    def __init__(self, endpoint):
+        self.message = (
+            "Timed out waiting to handle {} request; try again "
+            "later".format(endpoint))
+
+
 class NotImplementedException(RuntimeException):
     """
     Exception raised when a part of the API has not been implemented.
@@ -463,6 +526,16 @@ class MissingReferenceSetMetadata(MalformedException):
                 fileName, key))
 
 
+class ReferenceMd5MismatchException(MalformedException):
+    """
+    The sequence of a reference does not match its MD5 checksum.
+    """
+    def __init__(self, referenceName, md5checksum):
+        self.message = (
+            "The sequence of reference '{}' does not match its MD5 "
+            "checksum '{}'".format(referenceName, md5checksum))
+
+
 class ReadGroupReferenceNotFound(MalformedException):
     """
     A BAM file contains reference names that are not in the linked
@@ -7,11 +7,18 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import atexit
 import os
 import datetime
+import json
+import shutil
 import socket
+import tempfile
+import threading
+import timeit
 import urlparse
 import functools
+import StringIO
 
 import flask
 import flask.ext.cors as cors
@@ -23,19 +30,28 @@ import oic.oic.message as message
 import requests
 
 import ga4gh
+import ga4gh.admission as admission
 import ga4gh.backend as backend
 import ga4gh.datamodel as datamodel
+import ga4gh.datamodel.parallel as parallel
+import ga4gh.datamodel.references as references
 import ga4gh.protocol as protocol
 import ga4gh.exceptions as exceptions
+import ga4gh.metrics as metrics
+import ga4gh.profiling as profiling
+import ga4gh.tokenstore as tokenstore
 
 
 MIMETYPE = "application/json"
+TEXT_MIMETYPE = "text/plain"
 SEARCH_ENDPOINT_METHODS = ['POST', 'OPTIONS']
 SECRET_KEY_LENGTH = 24
 
 app = flask.Flask(__name__)
 assert not hasattr(app, 'urls')
 app.urls = []
+app.requestLog = None
+app.inlineEndpoints = set()
 
 
 class NoConverter(werkzeug.routing.BaseConverter):
@@ -143,6 +159,38 @@ class ServerStatus(object):
         return app.backend.getReferenceSets()
 
 
+class RequestLog(object):
+    """
+    Appends the API requests handled by the server to a file, one JSON
+    object per line, so that they can be replayed by the load testing
+    tool.
+    """
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+
+    def write(self, flaskRequest):
+        """
+        Appends the specified flask request to the log. The authentication
+        key is not recorded.
+        """
+        params = flaskRequest.args.to_dict()
+        params.pop("key", None)
+        entry = {
+            "method": flaskRequest.method,
+            "path": flaskRequest.path,
+            "params": params,
+        }
+        if flaskRequest.method == "POST":
+            entry["body"] = flaskRequest.get_data()
+        line = json.dumps(entry, sort_keys=True)
+        # The file is opened for each entry so that concurrent server
+        # processes can append to the same log.
+        with self._lock:
+            with open(self._path, "a") as logFile:
+                print(line, file=logFile)
+
+
 def reset():
     """
     Resets the flask app; used in testing
@@ -168,6 +216,16 @@ def configure(configFile=None, baseConfig="ProductionConfig",
     # Setup file handle cache max size
     datamodel.fileHandleCache.setMaxCacheSize(
         app.config["FILE_HANDLE_CACHE_MAX_SIZE"])
+    # Setup the worker pool for parallel fetching of large ranges
+    parallel.regionFetchPool.configure(
+        app.config["PARALLEL_FETCH_WORKERS"],
+        app.config["PARALLEL_FETCH_BIN_SIZE"])
+    # Setup the reference block cache and the CRAM reference directory
+    references.referenceBlockCache.configure(
+        app.config["REFERENCE_BLOCK_SIZE"],
+        app.config["REFERENCE_BLOCK_CACHE_MAX_BYTES"])
+    references.md5ReferenceDirectory.setDirectory(
+        app.config["REFERENCE_CACHE_DIRECTORY"])
     # Setup CORS
     cors.CORS(app, allow_headers='Content-Type')
     app.serverStatus = ServerStatus()
@@ -188,12 +246,19 @@ def configure(configFile=None, baseConfig="ProductionConfig",
             "SIMULATED_BACKEND_NUM_REFERENCES_PER_REFERENCE_SET"]
         numAlignments = app.config[
             "SIMULATED_BACKEND_NUM_ALIGNMENTS_PER_READ_GROUP"]
+        referenceLength = app.config["SIMULATED_BACKEND_REFERENCE_LENGTH"]
+        readLength = app.config["SIMULATED_BACKEND_READ_LENGTH"]
+        meanCoverage = app.config["SIMULATED_BACKEND_READ_COVERAGE"]
+        indelRate = app.config["SIMULATED_BACKEND_READ_INDEL_RATE"]
+        numTags = app.config["SIMULATED_BACKEND_READ_NUM_TAGS"]
         theBackend = backend.SimulatedBackend(
             randomSeed=randomSeed, numCalls=numCalls,
             variantDensity=variantDensity, numVariantSets=numVariantSets,
             numReferenceSets=numReferenceSets,
             numReferencesPerReferenceSet=numReferencesPerReferenceSet,
-            numAlignments=numAlignments)
+            numAlignments=numAlignments, referenceLength=referenceLength,
+            readLength=readLength, meanCoverage=meanCoverage,
+            indelRate=indelRate, numTags=numTags)
     elif dataSource == "__EMPTY__":
         theBackend = backend.EmptyBackend()
     else:
@@ -202,17 +267,41 @@ def configure(configFile=None, baseConfig="ProductionConfig",
     theBackend.setResponseValidation(app.config["RESPONSE_VALIDATION"])
     theBackend.setDefaultPageSize(app.config["DEFAULT_PAGE_SIZE"])
     theBackend.setMaxResponseLength(app.config["MAX_RESPONSE_LENGTH"])
+    theBackend.setSearchTimeBudget(app.config["SEARCH_TIME_BUDGET"])
     app.backend = theBackend
+    metrics.requestMetrics.configure(app.config["METRICS_DIRECTORY"])
+    profiling.requestProfiler.configure(
+        app.config["PROFILE_DIRECTORY"], app.config["PROFILE_SAMPLE_RATE"],
+        app.config["PROFILE_SLOW_THRESHOLD"], app.config["PROFILE_MAX_FILES"])
+    admission.requestAdmission.configure(
+        app.config["ADMISSION_LIMITS"], app.config["ADMISSION_QUEUE_TIMEOUT"],
+        app.config["MAX_SEARCH_COST"], app.config["EXPENSIVE_SEARCH_COST"],
+        app.config["EXPENSIVE_SEARCH_LIMIT"])
+    app.requestLog = None
+    if app.config["REQUEST_LOG_FILE"] is not None:
+        app.requestLog = RequestLog(app.config["REQUEST_LOG_FILE"])
     app.secret_key = os.urandom(SECRET_KEY_LENGTH)
     app.oidcClient = None
-    app.tokenMap = None
+    app.tokenStore = None
     app.myPort = port
     if "OIDC_PROVIDER" in app.config:
         # The oic client. If we're testing, we don't want to verify
         # SSL certificates
         app.oidcClient = oic.oic.Client(
             verify_ssl=('TESTING' not in app.config))
-        app.tokenMap = {}
+        # Tokens are stored in a file by default, so that all the
+        # processes forked from this one accept the same tokens. The
+        # file is kept in a new private directory, which is removed when
+        # this process exits, so that other users cannot read or replace
+        # it and tokens do not outlive the server.
+        tokenStoreLocation = app.config["OIDC_TOKEN_STORE"]
+        if tokenStoreLocation is None:
+            tokenStoreDirectory = tempfile.mkdtemp(prefix="ga4gh-tokens-")
+            atexit.register(shutil.rmtree, tokenStoreDirectory, True)
+            tokenStoreLocation = os.path.join(
+                tokenStoreDirectory, "tokens.sqlite")
+        app.tokenStore = tokenstore.getTokenStore(
+            tokenStoreLocation, app.config["OIDC_TOKEN_TTL"])
         try:
             app.oidcClient.provider_config(app.config['OIDC_PROVIDER'])
         except requests.exceptions.ConnectionError:
@@ -251,6 +340,45 @@ def configure(configFile=None, baseConfig="ProductionConfig",
             app.oidcClient.store_registration_info(response)
 
 
+def isInlineRequest(environ):
+    """
+    Returns True if the request with the specified WSGI environment is
+    for an inline route, or for no route at all, and so can be handled
+    on the event loop thread of the event loop server.
+    """
+    adapter = app.url_map.bind_to_environ(environ)
+    try:
+        endpoint, _ = adapter.match()
+    except werkzeug.exceptions.HTTPException:
+        return True
+    return endpoint in app.inlineEndpoints
+
+
+def getAdmissionLimit(environ):
+    """
+    Returns the ConcurrencyLimit through which the event loop server
+    admits the request with the specified WSGI environment before
+    handling it, or None if the request is not limited. Requests that
+    are too expensive are not limited, as they are rejected when handled.
+    """
+    if environ["REQUEST_METHOD"] == "OPTIONS":
+        return None
+    adapter = app.url_map.bind_to_environ(environ)
+    try:
+        endpoint, _ = adapter.match()
+    except werkzeug.exceptions.HTTPException:
+        return None
+    cost = None
+    if environ["REQUEST_METHOD"] == "POST":
+        body = environ["wsgi.input"].read()
+        environ["wsgi.input"] = StringIO.StringIO(body)
+        cost = app.backend.getSearchCost(endpoint, body)
+    try:
+        return admission.requestAdmission.getLimit(endpoint, cost)
+    except exceptions.RequestTooExpensiveException:
+        return None
+
+
 def getFlaskResponse(responseString, httpStatus=200):
     """
     Returns a Flask response object for the specified data and HTTP status.
@@ -350,10 +478,10 @@ def checkAuthentication():
     """
     if app.oidcClient is None:
         return
-    if flask.request.endpoint == 'oidcCallback':
+    if flask.request.endpoint in ['oidcCallback', 'getMetrics']:
         return
     key = flask.session.get('key') or flask.request.args.get('key')
-    if app.tokenMap.get(key) is None:
+    if app.tokenStore.get(key) is None:
         if 'key' in flask.request.args:
             raise exceptions.NotAuthenticatedException()
         else:
@@ -371,6 +499,36 @@ def handleFlaskGetRequest(id_, flaskRequest, endpoint):
         raise exceptions.MethodNotAllowedException()
 
 
+def streamReferenceBases(id_, flaskRequest):
+    """
+    Streams the requested bases of the reference with the specified ID as
+    a single text/plain response. A single byte range in a Range header
+    selects a subset of the requested bases, with offsets relative to the
+    start of the requested range.
+    """
+    start, end = app.backend.getReferenceBasesRange(id_, flaskRequest.args)
+    length = end - start
+    headers = {"Accept-Ranges": "bytes"}
+    httpStatus = 200
+    # Multiple ranges are not supported, so we ignore them and send the
+    # complete response instead.
+    requestRange = flaskRequest.range
+    if (requestRange is not None and requestRange.units == "bytes" and
+            len(requestRange.ranges) == 1):
+        byteRange = requestRange.range_for_length(length)
+        if byteRange is None:
+            raise exceptions.UnsatisfiableByteRangeException(
+                flaskRequest.headers["Range"], length)
+        headers["Content-Range"] = requestRange.make_content_range(
+            length).to_header()
+        start, end = start + byteRange[0], start + byteRange[1]
+        httpStatus = 206
+    headers["Content-Length"] = str(end - start)
+    return flask.Response(
+        app.backend.runStreamReferenceBases(id_, start, end),
+        status=httpStatus, mimetype=TEXT_MIMETYPE, headers=headers)
+
+
 def handleFlaskListRequest(id_, flaskRequest, endpoint):
     """
     Handles the specified flask list request for one of the GET URLs.
@@ -397,11 +555,20 @@ def handleFlaskPostRequest(flaskRequest, endpoint):
 
 class DisplayedRoute(object):
     """
-    Registers that a route should be displayed on the html page
+    Registers that a route should be displayed on the html page. Routes
+    that are cheap to serve, because they only look up objects in the
+    data model without reading data files, are marked as inline so that
+    the event loop server runs them on its event loop thread.
+
+    Requests to the route are admitted by the admission controller while
+    they are handled; search requests are instead admitted by the backend
+    once their cost is known.
     """
     def __init__(
-            self, path, postMethod=False, pathDisplay=None):
+            self, path, postMethod=False, pathDisplay=None, inline=False):
         self.path = path
+        self.inline = inline
+        self.postMethod = postMethod
         self.methods = None
         if postMethod:
             methodDisplay = 'POST'
@@ -413,16 +580,52 @@ class DisplayedRoute(object):
         app.urls.append((methodDisplay, pathDisplay))
 
     def __call__(self, func):
-        if self.methods is None:
-            app.add_url_rule(self.path, func.func_name, func)
-        else:
-            app.add_url_rule(
-                self.path, func.func_name, func, methods=self.methods)
-
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            result = func(*args, **kwargs)
+            if flask.request.method == "OPTIONS":
+                return func(*args, **kwargs)
+            if app.requestLog is not None:
+                app.requestLog.write(flask.request)
+            # Discard any profile left by an earlier request handled by
+            # this thread, so that it is not reported for this one.
+            profiling.requestProfiler.popLastProfile()
+            startTime = timeit.default_timer()
+            admitted = flask.request.environ.get(
+                admission.ADMITTED_ENVIRON_KEY, False)
+            try:
+                with admission.requestAdmission.alreadyAdmitted(admitted):
+                    if self.postMethod:
+                        result = func(*args, **kwargs)
+                    else:
+                        with admission.requestAdmission.admit(
+                                func.func_name):
+                            result = func(*args, **kwargs)
+            except Exception as exception:
+                httpStatus = 500
+                if isinstance(exception, exceptions.BaseServerException):
+                    httpStatus = exception.httpStatus
+                metrics.requestMetrics.observeRequest(
+                    func.func_name, httpStatus,
+                    timeit.default_timer() - startTime, None)
+                raise
+            # The latency of streamed responses does not include the time
+            # taken to stream the body.
+            metrics.requestMetrics.observeRequest(
+                func.func_name, result.status_code,
+                timeit.default_timer() - startTime, result.content_length)
+            profile = profiling.requestProfiler.popLastProfile()
+            if profile is not None and app.config["SERVER_TIMING_HEADER"]:
+                result.headers["Server-Timing"] = (
+                    profile.getServerTimingHeader())
             return result
+
+        if self.inline:
+            app.inlineEndpoints.add(func.func_name)
+        if self.methods is None:
+            app.add_url_rule(self.path, func.func_name, wrapper)
+        else:
+            app.add_url_rule(
+                self.path, func.func_name, wrapper, methods=self.methods)
         return wrapper
 
 
@@ -431,13 +634,23 @@ def index():
     return flask.render_template('index.html', info=app.serverStatus)
 
 
-@DisplayedRoute('/references/<id>')
+@app.route('/metrics')
+def getMetrics():
+    """
+    Returns the request metrics of all the server processes in the
+    Prometheus text format.
+    """
+    return flask.Response(
+        metrics.requestMetrics.getText(), content_type=metrics.CONTENT_TYPE)
+
+
+@DisplayedRoute('/references/<id>', inline=True)
 def getReference(id):
     return handleFlaskGetRequest(
         id, flask.request, app.backend.runGetReference)
 
 
-@DisplayedRoute('/referencesets/<id>')
+@DisplayedRoute('/referencesets/<id>', inline=True)
 def getReferenceSet(id):
     return handleFlaskGetRequest(
         id, flask.request, app.backend.runGetReferenceSet)
@@ -445,6 +658,10 @@ def getReferenceSet(id):
 
 @DisplayedRoute('/references/<id>/bases')
 def listReferenceBases(id):
+    if (flask.request.method == "GET" and
+            flask.request.accept_mimetypes.best_match(
+                [MIMETYPE, TEXT_MIMETYPE]) == TEXT_MIMETYPE):
+        return streamReferenceBases(id, flask.request)
     return handleFlaskListRequest(
         id, flask.request, app.backend.runListReferenceBases)
 
@@ -463,8 +680,14 @@ def searchReadGroupSets():
 
 @DisplayedRoute('/reads/search', postMethod=True)
 def searchReads():
+    # Filling in the referenceSequence of CIGAR units is opt-in, via the
+    # fillReferenceSequence=true query parameter.
+    fillReferenceSequence = flask.request.args.get(
+        'fillReferenceSequence', 'false').lower() == 'true'
     return handleFlaskPostRequest(
-        flask.request, app.backend.runSearchReads)
+        flask.request, functools.partial(
+            app.backend.runSearchReads,
+            fillReferenceSequence=fillReferenceSequence))
 
 
 @DisplayedRoute('/referencesets/search', postMethod=True)
@@ -499,7 +722,7 @@ def searchDatasets():
 
 @DisplayedRoute(
     '/variantsets/<no(search):id>',
-    pathDisplay='/variantsets/<id>')
+    pathDisplay='/variantsets/<id>', inline=True)
 def getVariantSet(id):
     return handleFlaskGetRequest(
         id, flask.request, app.backend.runGetVariantSet)
@@ -515,21 +738,27 @@ def getVariant(id):
 
 @DisplayedRoute(
     '/readgroupsets/<no(search):id>',
-    pathDisplay='/readgroupsets/<id>')
+    pathDisplay='/readgroupsets/<id>', inline=True)
 def getReadGroupSet(id):
     return handleFlaskGetRequest(
         id, flask.request, app.backend.runGetReadGroupSet)
 
 
-@DisplayedRoute('/readgroups/<id>')
+@DisplayedRoute('/readgroups/<id>', inline=True)
 def getReadGroup(id):
     return handleFlaskGetRequest(
         id, flask.request, app.backend.runGetReadGroup)
 
 
+@DisplayedRoute('/readgroups/<id>/coverage')
+def listReadGroupCoverage(id):
+    return handleFlaskListRequest(
+        id, flask.request, app.backend.runListCoverage)
+
+
 @DisplayedRoute(
     '/callsets/<no(search):id>',
-    pathDisplay='/callsets/<id>')
+    pathDisplay='/callsets/<id>', inline=True)
 def getCallset(id):
     return handleFlaskGetRequest(
         id, flask.request, app.backend.runGetCallset)
@@ -582,7 +811,7 @@ def oidcCallback():
         raise exceptions.NotAuthenticatedException()
     key = oic.oauth2.rndstr(SECRET_KEY_LENGTH)
     flask.session['key'] = key
-    app.tokenMap[key] = aresp["code"], respState, atrDict
+    app.tokenStore.put(key, (aresp["code"], respState, atrDict))
     # flask.url_for is broken. It relies on SERVER_NAME for both name
     # and port, and defaults to 'localhost' if not found. Therefore
     # we need to fix the returned url
@@ -597,7 +826,7 @@ def oidcCallback():
 
 @DisplayedRoute(
     '/datasets/<no(search):id>',
-    pathDisplay='/datasets/<id>')
+    pathDisplay='/datasets/<id>', inline=True)
 def getDataset(id):
     return handleFlaskGetRequest(
         id, flask.request, app.backend.runGetDataset)
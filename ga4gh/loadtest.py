@@ -0,0 +1,376 @@
+"""
+HTTP load testing of a running GA4GH server.
+
+A weighted mix of requests, read from a scenario file or replayed from
+the request log written by the server (see REQUEST_LOG_FILE), is sent to
+the server by a number of concurrent workers, each using its own
+HttpClient. Requests are either sent back to back by each worker (closed
+loop), or are started at a fixed target rate shared between the workers
+(open loop). In the open loop, the latency of each request is measured
+from the time at which it was scheduled to start, so that the time it
+spends waiting for a worker that has fallen behind the schedule is
+counted, as it would be by a client; the lateness of the requests is
+also reported. The latency histogram, status codes and error rate of each
+endpoint are reported, along with the mean time spent in each phase of
+its requests when the server returns Server-Timing headers (see
+SERVER_TIMING_HEADER), and a sweep over several concurrency levels
+identifies the saturation throughput of the server.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import bisect
+import json
+import random
+import threading
+import time
+import timeit
+
+import numpy
+import requests
+
+import ga4gh.client as client
+import ga4gh.metrics as metrics
+import ga4gh.profiling as profiling
+
+
+LATENCY_BUCKETS = metrics.LATENCY_BUCKETS
+
+DEFAULT_SATURATION_THRESHOLD = 0.1
+
+
+def getEndpointName(httpMethod, path):
+    """
+    Returns the name under which requests with the specified method and
+    path are reported, in which object IDs are replaced by ``<id>``.
+    """
+    parts = path.strip("/").split("/")
+    if httpMethod != "POST" and len(parts) > 1:
+        parts[1] = "<id>"
+    return "{} /{}".format(httpMethod, "/".join(parts))
+
+
+class RequestTemplate(object):
+    """
+    A request that is sent repeatedly during a load test, chosen with
+    probability proportional to its weight. The body is sent as is if it
+    is a string, and serialised as JSON otherwise.
+    """
+    def __init__(
+            self, httpMethod, path, params=None, body=None, weight=1,
+            name=None):
+        self.httpMethod = httpMethod
+        self.path = path
+        self.params = params
+        if params is None:
+            self.params = {}
+        self.data = body
+        if body is not None and not isinstance(body, basestring):
+            self.data = json.dumps(body)
+        self.weight = weight
+        self.name = name
+        if name is None:
+            self.name = getEndpointName(httpMethod, path)
+
+    @classmethod
+    def fromJsonDict(cls, jsonDict):
+        """
+        Returns the template defined by the specified dictionary from a
+        scenario file or request log.
+        """
+        return cls(
+            jsonDict["method"], jsonDict["path"],
+            jsonDict.get("params", {}), jsonDict.get("body"),
+            jsonDict.get("weight", 1), jsonDict.get("name"))
+
+
+def readScenario(scenarioFile):
+    """
+    Returns the list of request templates in the specified JSON scenario
+    file, which holds a "requests" list of objects with "method",
+    "path" and optional "params", "body", "weight" and "name" keys.
+    """
+    with open(scenarioFile) as scenario:
+        jsonDict = json.load(scenario)
+    return [
+        RequestTemplate.fromJsonDict(request)
+        for request in jsonDict["requests"]]
+
+
+def readRequestLog(requestLogFile):
+    """
+    Returns the list of request templates for the requests in the
+    specified request log, one per line. Requests are therefore replayed
+    in proportion to their frequency in the log.
+    """
+    templates = []
+    with open(requestLogFile) as requestLog:
+        for line in requestLog:
+            if line.strip() != "":
+                templates.append(
+                    RequestTemplate.fromJsonDict(json.loads(line)))
+    return templates
+
+
+class EndpointStatistics(object):
+    """
+    The latencies and outcomes of the requests sent to one endpoint.
+    """
+    def __init__(self):
+        self._latencies = []
+        self._statusCodes = {}
+        self._numErrors = 0
+        self._serverTimes = {}
+        self._numTimed = 0
+        self._latenesses = []
+
+    def add(self, latency, statusCode, serverTiming=None, lateness=None):
+        """
+        Records a request that completed after the specified latency with
+        the specified HTTP status code, or None if it failed to complete.
+        The Server-Timing header of the response is None if there was no
+        such header. The lateness is the time by which the request was
+        started after its scheduled start time, or None if it was not
+        scheduled.
+        """
+        self._latencies.append(latency)
+        if lateness is not None:
+            self._latenesses.append(lateness)
+        if serverTiming is not None:
+            self._numTimed += 1
+            timings = profiling.parseServerTimingHeader(serverTiming)
+            for name, value in timings.items():
+                if isinstance(value, float):
+                    self._serverTimes[name] = (
+                        self._serverTimes.get(name, 0) + value)
+        key = str(statusCode)
+        self._statusCodes[key] = self._statusCodes.get(key, 0) + 1
+        if statusCode is None or statusCode >= 400:
+            self._numErrors += 1
+
+    def getNumRequests(self):
+        """
+        Returns the number of requests recorded.
+        """
+        return len(self._latencies)
+
+    def getNumErrors(self):
+        """
+        Returns the number of requests that failed or returned an HTTP
+        error status.
+        """
+        return self._numErrors
+
+    def toJsonDict(self):
+        """
+        Returns a JSON-serialisable summary of these statistics. The
+        histogram gives the cumulative number of requests completed
+        within each bucket's latency bound.
+        """
+        latencies = numpy.array(self._latencies)
+        counts = numpy.searchsorted(
+            numpy.sort(latencies), LATENCY_BUCKETS, side="right")
+        histogram = [
+            {"le": bound, "count": int(count)}
+            for bound, count in zip(LATENCY_BUCKETS, counts)]
+        histogram.append({"le": "+Inf", "count": len(latencies)})
+        jsonDict = {
+            "numRequests": len(latencies),
+            "numErrors": self._numErrors,
+            "errorRate": self._numErrors / len(latencies),
+            "statusCodes": self._statusCodes,
+            "latency": {
+                "mean": float(latencies.mean()),
+                "p50": float(numpy.percentile(latencies, 50)),
+                "p95": float(numpy.percentile(latencies, 95)),
+                "p99": float(numpy.percentile(latencies, 99)),
+                "max": float(latencies.max()),
+            },
+            "histogram": histogram,
+        }
+        if len(self._latenesses) > 0:
+            latenesses = numpy.array(self._latenesses)
+            jsonDict["lateness"] = {
+                "mean": float(latenesses.mean()),
+                "p95": float(numpy.percentile(latenesses, 95)),
+                "max": float(latenesses.max()),
+            }
+        if self._numTimed > 0:
+            jsonDict["serverTiming"] = dict(
+                (name, value / self._numTimed)
+                for name, value in self._serverTimes.items())
+        return jsonDict
+
+
+class LoadGenerator(object):
+    """
+    Sends the requests defined by the specified templates to the server
+    at urlPrefix from the specified number of concurrent workers, until
+    either numRequests requests have been sent or duration seconds have
+    passed. If rate is not None, requests are scheduled to start at that
+    many per second in total, and their latencies are measured from
+    their scheduled start times; otherwise each worker sends its next
+    request as soon as the previous one completes.
+    """
+    def __init__(
+            self, urlPrefix, templates, concurrency=1, rate=None,
+            duration=None, numRequests=None, randomSeed=0,
+            authenticationKey=None):
+        if duration is None and numRequests is None:
+            raise ValueError("A duration or a number of requests is required")
+        if len(templates) == 0:
+            raise ValueError("At least one request template is required")
+        self._urlPrefix = urlPrefix
+        self._templates = templates
+        self._concurrency = concurrency
+        self._rate = rate
+        self._duration = duration
+        self._numRequests = numRequests
+        self._randomSeed = randomSeed
+        self._authenticationKey = authenticationKey
+        self._cumulativeWeights = numpy.cumsum(
+            [template.weight for template in templates]).tolist()
+        self._lock = threading.Lock()
+        self._statistics = {}
+        self._numStarted = 0
+        self._startTime = None
+
+    def _chooseTemplate(self, randomGenerator):
+        value = randomGenerator.random() * self._cumulativeWeights[-1]
+        return self._templates[
+            bisect.bisect_right(self._cumulativeWeights, value)]
+
+    def _nextRequest(self):
+        """
+        Reserves the next request, returning the time at which it should
+        be started, or None if the load test is over.
+        """
+        with self._lock:
+            index = self._numStarted
+            if self._numRequests is not None and index >= self._numRequests:
+                return None
+            self._numStarted += 1
+        now = timeit.default_timer()
+        if self._rate is None:
+            startTime = now
+        else:
+            startTime = self._startTime + index / self._rate
+        if (self._duration is not None and
+                startTime - self._startTime >= self._duration):
+            return None
+        return startTime
+
+    def _record(self, template, latency, statusCode, serverTiming, lateness):
+        with self._lock:
+            if template.name not in self._statistics:
+                self._statistics[template.name] = EndpointStatistics()
+            self._statistics[template.name].add(
+                latency, statusCode, serverTiming, lateness)
+
+    def _runWorker(self, workerIndex):
+        httpClient = client.HttpClient(
+            self._urlPrefix, authenticationKey=self._authenticationKey)
+        randomGenerator = random.Random(
+            "{}:{}".format(self._randomSeed, workerIndex))
+        while True:
+            startTime = self._nextRequest()
+            if startTime is None:
+                break
+            delay = startTime - timeit.default_timer()
+            if delay > 0:
+                time.sleep(delay)
+            template = self._chooseTemplate(randomGenerator)
+            # Requests that start late because this worker fell behind
+            # the schedule must include the delay in their latency, or
+            # the latencies would omit the queueing that clients see.
+            lateness = None
+            if self._rate is not None:
+                lateness = max(0, timeit.default_timer() - startTime)
+            try:
+                response = httpClient.sendRequest(
+                    template.httpMethod, template.path, template.params,
+                    template.data)
+                statusCode = response.status_code
+                serverTiming = response.headers.get("Server-Timing")
+            except requests.exceptions.RequestException:
+                statusCode = None
+                serverTiming = None
+            self._record(
+                template, timeit.default_timer() - startTime, statusCode,
+                serverTiming, lateness)
+
+    def run(self):
+        """
+        Runs the load test and returns a JSON-serialisable report of its
+        results.
+        """
+        self._statistics = {}
+        self._numStarted = 0
+        self._startTime = timeit.default_timer()
+        workers = [
+            threading.Thread(target=self._runWorker, args=(i,))
+            for i in range(self._concurrency)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsedTime = timeit.default_timer() - self._startTime
+        numRequests = sum(
+            statistics.getNumRequests()
+            for statistics in self._statistics.values())
+        numErrors = sum(
+            statistics.getNumErrors()
+            for statistics in self._statistics.values())
+        return {
+            "concurrency": self._concurrency,
+            "targetRate": self._rate,
+            "elapsedTime": elapsedTime,
+            "numRequests": numRequests,
+            "numErrors": numErrors,
+            "errorRate": numErrors / max(1, numRequests),
+            "throughput": (numRequests - numErrors) / elapsedTime,
+            "endpoints": dict(
+                (name, statistics.toJsonDict())
+                for name, statistics in self._statistics.items()),
+        }
+
+
+def findSaturation(runs, threshold=DEFAULT_SATURATION_THRESHOLD):
+    """
+    Returns the run at which the specified runs, in order of increasing
+    concurrency, saturate: the last run after which increasing the
+    concurrency no longer increases the throughput by more than the
+    specified fraction.
+    """
+    saturated = runs[0]
+    for run in runs[1:]:
+        if run["throughput"] <= saturated["throughput"] * (1 + threshold):
+            break
+        saturated = run
+    return saturated
+
+
+def runConcurrencySweep(
+        urlPrefix, templates, concurrencies, rate=None, duration=None,
+        numRequests=None, randomSeed=0, authenticationKey=None,
+        saturationThreshold=DEFAULT_SATURATION_THRESHOLD):
+    """
+    Runs a load test at each of the specified concurrency levels, and
+    returns a report of all the runs along with the concurrency and
+    throughput at which the server saturates.
+    """
+    runs = []
+    for concurrency in sorted(concurrencies):
+        loadGenerator = LoadGenerator(
+            urlPrefix, templates, concurrency, rate, duration, numRequests,
+            randomSeed, authenticationKey)
+        runs.append(loadGenerator.run())
+    saturated = findSaturation(runs, saturationThreshold)
+    return {
+        "runs": runs,
+        "saturation": {
+            "concurrency": saturated["concurrency"],
+            "throughput": saturated["throughput"],
+        },
+    }
@@ -0,0 +1,453 @@
+"""
+Per-endpoint request metrics, exported in the Prometheus text format.
+
+Each server process records its metrics in memory. When a metrics
+directory is configured, each process also writes a snapshot of its
+metrics to its own file in that directory within FLUSH_INTERVAL seconds
+of recording them, and the
+metrics exported by any process are the sum of its own metrics and the
+snapshots of all the other processes. The snapshots of processes that
+have exited can be merged into a single snapshot of retired processes,
+so that the directory does not grow as worker processes are replaced.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import bisect
+import collections
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+import timeit
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+    5.0, 10.0)
+"""
+The upper bounds in seconds of the latency histogram buckets.
+"""
+
+SIZE_BUCKETS = tuple(4 ** i for i in range(4, 14))
+"""
+The upper bounds in bytes of the response size histogram buckets.
+"""
+
+PAGE_ITEM_BUCKETS = (
+    0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+"""
+The upper bounds of the histogram buckets for the number of items in a
+page of search results.
+"""
+
+PAGE_DEPTH_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250, 500, 1000)
+"""
+The upper bounds of the histogram buckets for the number of pages of a
+search that precede the requested page.
+"""
+
+FLUSH_INTERVAL = 1.0
+"""
+The minimum interval in seconds between snapshots written by a process
+to the metrics directory, and the maximum time for which metrics are
+recorded without being written.
+"""
+
+MAX_TRACKED_PAGE_TOKENS = 10000
+
+RETIRED_PROCESSES = "retired"
+"""
+The process ID under which the snapshots of exited processes are merged.
+"""
+
+HISTOGRAM = "histogram"
+COUNTER = "counter"
+
+METRICS = collections.OrderedDict([
+    ("ga4gh_request_duration_seconds", (
+        HISTOGRAM, LATENCY_BUCKETS,
+        "Time taken to handle a request.")),
+    ("ga4gh_response_size_bytes", (
+        HISTOGRAM, SIZE_BUCKETS,
+        "Size of the response body.")),
+    ("ga4gh_request_errors_total", (
+        COUNTER, None,
+        "Number of requests that returned an HTTP error status.")),
+    ("ga4gh_search_page_items", (
+        HISTOGRAM, PAGE_ITEM_BUCKETS,
+        "Number of items in a page of search results.")),
+    ("ga4gh_search_page_depth", (
+        HISTOGRAM, PAGE_DEPTH_BUCKETS,
+        "Number of preceding pages of the search resumed from the page "
+        "token of the request, for searches whose earlier pages were "
+        "served by this process.")),
+    ("ga4gh_search_resumed_total", (
+        COUNTER, None,
+        "Number of search requests resuming from a page token.")),
+    ("ga4gh_search_truncated_total", (
+        COUNTER, None,
+        "Number of pages of search results cut short by the search time "
+        "budget.")),
+])
+"""
+The name, type, histogram buckets and help text of each metric.
+"""
+
+
+def getSearchEndpointName(requestClass):
+    """
+    Returns the endpoint name under which searches using the specified
+    protocol request class are recorded, which is the name of the
+    frontend handler for the search; for example, searchVariants.
+    """
+    name = requestClass.__name__[:-len("Request")]
+    return name[0].lower() + name[1:]
+
+
+def _formatLabels(labels):
+    return "{{{}}}".format(",".join(
+        '{}="{}"'.format(
+            key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels))
+
+
+def _formatValue(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _getSnapshot(counters, histograms):
+    return {
+        "counters": [
+            [name, labels, value]
+            for (name, labels), value in counters.items()],
+        "histograms": [
+            [name, labels, counts, total]
+            for (name, labels), (counts, total) in histograms.items()],
+    }
+
+
+def _loadSnapshot(path):
+    try:
+        with open(path) as snapshotFile:
+            return json.load(snapshotFile)
+    except (IOError, ValueError):
+        # The snapshot may have been removed or merged.
+        return None
+
+
+def _mergeSnapshots(snapshots):
+    """
+    Returns the (counters, histograms) dictionaries holding the sums of
+    the metrics in the specified snapshots.
+    """
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot["counters"]:
+            key = (name, tuple(tuple(label) for label in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, counts, total in snapshot["histograms"]:
+            key = (name, tuple(tuple(label) for label in labels))
+            if key not in histograms:
+                histograms[key] = [[0] * len(counts), 0]
+            histogram = histograms[key]
+            histogram[0] = [a + b for a, b in zip(histogram[0], counts)]
+            histogram[1] += total
+    return counters, histograms
+
+
+def _removeFile(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        # Already removed by another process.
+        pass
+
+
+class MetricsRegistry(object):
+    """
+    A thread-safe collection of counters and histograms, each identified
+    by a metric name and a tuple of (label, value) pairs.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._directory = None
+        self._startProcess()
+
+    def _startProcess(self):
+        # Process IDs are reused, so snapshots are identified by the start
+        # time of the process as well.
+        self._pid = os.getpid()
+        self._processId = "{}-{}".format(self._pid, int(time.time() * 1000))
+        # Timer threads are not inherited by forked processes.
+        self._flushTimer = None
+        self._reset()
+
+    def _reset(self):
+        self._counters = {}
+        self._histograms = {}
+        self._pageDepths = collections.OrderedDict()
+        self._lastFlushTime = timeit.default_timer()
+
+    def configure(self, directory):
+        """
+        Sets the directory in which this process shares its metrics with
+        the other server processes, or disables sharing if directory is
+        None. The directory should be emptied when the server is started
+        (see clearDirectory), since the snapshots of processes that have
+        exited are still included in the exported metrics.
+        """
+        with self._lock:
+            self._cancelFlushTimer()
+            self._directory = directory
+            if directory is not None and not os.path.exists(directory):
+                os.makedirs(directory)
+
+    def clear(self):
+        """
+        Discards all the metrics recorded by this process.
+        """
+        with self._lock:
+            self._reset()
+
+    def clearDirectory(self):
+        """
+        Removes all the snapshots from the metrics directory, if one is
+        configured.
+        """
+        with self._lock:
+            if self._directory is None:
+                return
+            paths = glob.glob(self._getSnapshotPath("*"))
+            paths.extend(glob.glob(os.path.join(self._directory, "*.tmp")))
+            for path in paths:
+                _removeFile(path)
+
+    def retireProcess(self, pid):
+        """
+        Merges the snapshots of the exited process with the specified
+        operating system process ID into the snapshot of retired
+        processes, and removes them. This must only be called by a single
+        process, such as the master of a pre-forking server.
+        """
+        with self._lock:
+            if self._directory is None:
+                return
+            retiredPath = self._getSnapshotPath(RETIRED_PROCESSES)
+            paths = glob.glob(self._getSnapshotPath("{}-*".format(pid)))
+            if len(paths) == 0:
+                return
+            snapshots = [
+                snapshot for snapshot in map(_loadSnapshot, paths + [
+                    retiredPath]) if snapshot is not None]
+            counters, histograms = _mergeSnapshots(snapshots)
+            retired = _getSnapshot(counters, histograms)
+            # Readers skip the merged snapshots until they are removed.
+            retired["merged"] = [os.path.basename(path) for path in paths]
+            self._writeSnapshot(retired, retiredPath)
+            for path in paths:
+                _removeFile(path)
+
+    def _checkProcess(self):
+        # A process forked from this one inherits our metrics, which are
+        # already exported from our own snapshot.
+        if os.getpid() != self._pid:
+            self._startProcess()
+
+    def _increment(self, name, labels, value=1):
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def _observe(self, name, labels, value):
+        key = (name, labels)
+        if key not in self._histograms:
+            buckets = METRICS[name][1]
+            self._histograms[key] = [[0] * (len(buckets) + 1), 0]
+        histogram = self._histograms[key]
+        histogram[0][bisect.bisect_left(METRICS[name][1], value)] += 1
+        histogram[1] += value
+
+    def observeRequest(self, endpoint, statusCode, latency, responseSize):
+        """
+        Records a request to the specified endpoint that completed with
+        the specified HTTP status code after the specified number of
+        seconds. The response size is None if it is not known.
+        """
+        labels = (("endpoint", endpoint),)
+        with self._lock:
+            self._checkProcess()
+            self._observe("ga4gh_request_duration_seconds", labels, latency)
+            if responseSize is not None:
+                self._observe(
+                    "ga4gh_response_size_bytes", labels, responseSize)
+            if statusCode >= 400:
+                self._increment(
+                    "ga4gh_request_errors_total",
+                    labels + (("status", statusCode),))
+            self._flushIfDue()
+
+    def observeSearchPage(
+            self, endpoint, searchKey, pageToken, nextPageToken, numItems,
+            truncated=False):
+        """
+        Records a page of search results for the specified endpoint that
+        contains the specified number of items, and was requested with
+        the specified page token (None for the first page). The search
+        key identifies the search independently of the page requested,
+        since the same page token is issued by different searches. A
+        truncated page was returned before it was full because the
+        search ran out of time.
+        """
+        labels = (("endpoint", endpoint),)
+        with self._lock:
+            self._checkProcess()
+            self._observe("ga4gh_search_page_items", labels, numItems)
+            if truncated:
+                self._increment("ga4gh_search_truncated_total", labels)
+            depth = 0
+            if pageToken is not None:
+                self._increment("ga4gh_search_resumed_total", labels)
+                depth = self._pageDepths.get(
+                    (endpoint, searchKey, pageToken))
+            if depth is not None:
+                self._observe("ga4gh_search_page_depth", labels, depth)
+                if nextPageToken is not None:
+                    # Tokens are kept when used, as the same page may be
+                    # requested again, and are evicted least recently
+                    # issued first.
+                    key = (endpoint, searchKey, nextPageToken)
+                    self._pageDepths.pop(key, None)
+                    self._pageDepths[key] = depth + 1
+                    if len(self._pageDepths) > MAX_TRACKED_PAGE_TOKENS:
+                        self._pageDepths.popitem(last=False)
+            self._flushIfDue()
+
+    def _getSnapshotPath(self, processId):
+        return os.path.join(
+            self._directory, "metrics-{}.json".format(processId))
+
+    def _flushIfDue(self):
+        if self._directory is None:
+            return
+        remaining = FLUSH_INTERVAL - (
+            timeit.default_timer() - self._lastFlushTime)
+        if remaining <= 0:
+            self._flush()
+        elif self._flushTimer is None:
+            # The metrics are written later even if this process records
+            # nothing more, as otherwise the other processes would export
+            # an older snapshot than the metrics this process exports.
+            self._flushTimer = threading.Timer(remaining, self._flushLater)
+            self._flushTimer.daemon = True
+            self._flushTimer.start()
+
+    def _flushLater(self):
+        with self._lock:
+            # A timer that was cancelled or replaced has nothing to do.
+            if self._flushTimer is threading.current_thread():
+                self._flushTimer = None
+                if self._directory is not None:
+                    self._flush()
+
+    def _cancelFlushTimer(self):
+        if self._flushTimer is not None:
+            self._flushTimer.cancel()
+            self._flushTimer = None
+
+    def _writeSnapshot(self, snapshot, path):
+        # Snapshots are renamed into place so that readers never see a
+        # partially written file.
+        fd, tempPath = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as tempFile:
+            json.dump(snapshot, tempFile)
+        os.rename(tempPath, path)
+
+    def _flush(self):
+        self._cancelFlushTimer()
+        self._writeSnapshot(
+            _getSnapshot(self._counters, self._histograms),
+            self._getSnapshotPath(self._processId))
+        self._lastFlushTime = timeit.default_timer()
+
+    def flush(self):
+        """
+        Writes a snapshot of the metrics of this process to the metrics
+        directory, if one is configured.
+        """
+        with self._lock:
+            self._checkProcess()
+            if self._directory is not None:
+                self._flush()
+
+    def _getAggregatedMetrics(self):
+        with self._lock:
+            self._checkProcess()
+            ownSnapshot = _getSnapshot(self._counters, self._histograms)
+            ownPath = None
+            retiredPath = None
+            paths = []
+            if self._directory is not None:
+                ownPath = self._getSnapshotPath(self._processId)
+                retiredPath = self._getSnapshotPath(RETIRED_PROCESSES)
+                paths = glob.glob(self._getSnapshotPath("*"))
+        snapshots = {}
+        for path in paths:
+            if path not in (ownPath, retiredPath):
+                snapshot = _loadSnapshot(path)
+                if snapshot is not None:
+                    snapshots[os.path.basename(path)] = snapshot
+        # The retired snapshot is read last: a snapshot that could not be
+        # read because it has just been merged is then included in it.
+        if retiredPath is not None:
+            retired = _loadSnapshot(retiredPath)
+            if retired is not None:
+                for name in retired.get("merged", []):
+                    snapshots.pop(name, None)
+                snapshots[os.path.basename(retiredPath)] = retired
+        return _mergeSnapshots([ownSnapshot] + snapshots.values())
+
+    def getText(self):
+        """
+        Returns the metrics of all the server processes in the Prometheus
+        text exposition format.
+        """
+        counters, histograms = self._getAggregatedMetrics()
+        lines = []
+        for name, (metricType, buckets, helpText) in METRICS.items():
+            lines.append("# HELP {} {}".format(name, helpText))
+            lines.append("# TYPE {} {}".format(name, metricType))
+            if metricType == COUNTER:
+                for key in sorted(key for key in counters if key[0] == name):
+                    lines.append("{}{} {}".format(
+                        name, _formatLabels(key[1]),
+                        _formatValue(counters[key])))
+                continue
+            for key in sorted(key for key in histograms if key[0] == name):
+                labels = key[1]
+                counts, total = histograms[key]
+                cumulativeCount = 0
+                for bound, count in zip(buckets + (float("inf"),), counts):
+                    cumulativeCount += count
+                    lines.append("{}_bucket{} {}".format(
+                        name,
+                        _formatLabels(labels + (("le", _formatValue(bound)),)),
+                        cumulativeCount))
+                lines.append("{}_sum{} {}".format(
+                    name, _formatLabels(labels), _formatValue(total)))
+                lines.append("{}_count{} {}".format(
+                    name, _formatLabels(labels), cumulativeCount))
+        return "\n".join(lines) + "\n"
+
+
+requestMetrics = MetricsRegistry()
+"""
+The metrics recorded by this server process.
+"""
@@ -0,0 +1,235 @@
+"""
+A pre-forking, multi-process HTTP server for the GA4GH frontend.
+
+The data model is loaded once in the master process, which then forks a
+fixed number of worker processes that all accept connections on the same
+listening socket. The workers share the memory holding the data model
+with the master copy-on-write. File handles are never shared: the master
+closes its handles before forking, and each worker opens its own. Workers
+can be recycled after handling a number of requests, and are replaced by
+the master whenever they exit.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import errno
+import gc
+import logging
+import os
+import random
+import select
+import signal
+import time
+import timeit
+
+import werkzeug.serving
+
+import ga4gh.admission as admission
+import ga4gh.datamodel as datamodel
+import ga4gh.datamodel.parallel as parallel
+import ga4gh.metrics as metrics
+
+
+POLL_INTERVAL = 1.0
+"""
+The interval in seconds at which idle workers check whether they have
+been asked to stop.
+"""
+
+WAIT_INTERVAL = 0.1
+"""
+The interval in seconds at which the master checks whether a worker has
+exited or it has been asked to stop or restart the workers.
+"""
+
+MIN_WORKER_LIFETIME = 1.0
+"""
+Workers that fail within this many seconds of starting are replaced only
+after this many seconds, so that a broken configuration does not cause
+the master to fork continuously.
+"""
+
+log = logging.getLogger(__name__)
+
+
+class PreforkServer(object):
+    """
+    Serves the specified WSGI application on the specified host and port
+    from numWorkers worker processes. Each worker exits gracefully after
+    handling around maxRequests requests, or never if maxRequests is
+    zero; the limit of each worker is increased by a random amount of up
+    to 10% so that the workers do not all restart at once. The listening
+    socket is bound when the server is created, so that the port is known
+    before serveForever is called.
+
+    Sending SIGHUP to the master gracefully restarts all workers; SIGTERM
+    and SIGINT gracefully stop the workers and the master.
+    """
+    def __init__(
+            self, app, host, port, numWorkers, maxRequests=0,
+            sslContext=None):
+        if numWorkers < 1:
+            raise ValueError("At least one worker process is required")
+        if maxRequests < 0:
+            raise ValueError(
+                "The maximum number of requests must not be negative")
+        self._app = app
+        self._numWorkers = numWorkers
+        self._maxRequests = maxRequests
+        self._server = werkzeug.serving.make_server(
+            host, port, self._countRequests, ssl_context=sslContext)
+        self._workers = {}
+        self._running = False
+        self._restartWorkers = False
+        self._numRequests = 0
+
+    def getPort(self):
+        """
+        Returns the port on which the server is listening.
+        """
+        return self._server.server_port
+
+    def _countRequests(self, environ, startResponse):
+        self._numRequests += 1
+        return self._app(environ, startResponse)
+
+    def _stop(self, signum, frame):
+        self._running = False
+
+    def _restart(self, signum, frame):
+        self._restartWorkers = True
+
+    def _signalWorkers(self, signum):
+        for pid in self._workers.keys():
+            try:
+                os.kill(pid, signum)
+            except OSError as error:
+                if error.errno != errno.ESRCH:
+                    raise
+
+    def _wait(self):
+        """
+        Returns the (pid, status) of a worker that has exited, or None if
+        no worker exited within WAIT_INTERVAL. The master polls rather
+        than blocking in os.wait, as a signal arriving just before the
+        call would otherwise not be noticed until a worker exits.
+        """
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except OSError as error:
+            if error.errno != errno.EINTR:
+                raise
+            return None
+        if pid == 0:
+            time.sleep(WAIT_INTERVAL)
+            return None
+        return pid, status
+
+    def _waitForConnection(self):
+        """
+        Returns True if a connection may be waiting to be accepted, and
+        False if none arrived within POLL_INTERVAL or the wait was
+        interrupted by a signal.
+        """
+        try:
+            readable, _, _ = select.select(
+                [self._server], [], [], POLL_INTERVAL)
+        except select.error as error:
+            if error.args[0] != errno.EINTR:
+                raise
+            return False
+        return len(readable) > 0
+
+    def _retireWorker(self, pid):
+        # A worker that was killed may not have returned its admission
+        # slots.
+        admission.requestAdmission.releaseProcess(pid)
+        metrics.requestMetrics.retireProcess(pid)
+
+    def _spawnWorker(self):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                self._runWorker()
+            except Exception:
+                log.exception("Worker {} failed".format(os.getpid()))
+                status = 1
+            finally:
+                # The master merges the final snapshot of this worker.
+                try:
+                    metrics.requestMetrics.flush()
+                finally:
+                    os._exit(status)
+        self._workers[pid] = timeit.default_timer()
+
+    def _runWorker(self):
+        """
+        Handles requests in a worker process until the worker is asked to
+        stop or has handled its maximum number of requests.
+        """
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        # Let the request being handled finish when asked to stop.
+        signal.siginterrupt(signal.SIGTERM, False)
+        # Forked processes share the random state of the master, which
+        # is used to generate session keys.
+        random.seed()
+        datamodel.fileHandleCache.clear()
+        maxRequests = self._maxRequests
+        if maxRequests > 0:
+            maxRequests += random.randint(0, maxRequests // 10)
+        # All workers are woken when a connection arrives; the workers
+        # that lose the race to accept it must not block in accept.
+        self._server.socket.setblocking(False)
+        self._numRequests = 0
+        self._running = True
+        while self._running and (
+                maxRequests == 0 or self._numRequests < maxRequests):
+            if self._waitForConnection():
+                # Does nothing if another worker accepted the connection.
+                self._server._handle_request_noblock()
+        self._server.server_close()
+
+    def serveForever(self):
+        """
+        Forks the workers and replaces them as they exit, until the master
+        is asked to stop. All workers have exited when this returns.
+        """
+        # Nothing the workers could share by accident is left open.
+        datamodel.fileHandleCache.clear()
+        parallel.regionFetchPool.close()
+        gc.collect()
+        # The snapshots of an earlier server would be exported with ours.
+        metrics.requestMetrics.clearDirectory()
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGHUP, self._restart)
+        self._running = True
+        log.info("Serving on port {} with {} workers".format(
+            self.getPort(), self._numWorkers))
+        while self._running:
+            if self._restartWorkers:
+                self._restartWorkers = False
+                self._signalWorkers(signal.SIGTERM)
+            while len(self._workers) < self._numWorkers:
+                self._spawnWorker()
+            result = self._wait()
+            if result is not None:
+                pid, status = result
+                startTime = self._workers.pop(pid, None)
+                self._retireWorker(pid)
+                if (startTime is not None and status != 0 and
+                        timeit.default_timer() - startTime <
+                        MIN_WORKER_LIFETIME):
+                    log.error("Worker {} failed on startup".format(pid))
+                    time.sleep(MIN_WORKER_LIFETIME)
+        self._signalWorkers(signal.SIGTERM)
+        while len(self._workers) > 0:
+            result = self._wait()
+            if result is not None:
+                self._workers.pop(result[0], None)
+                self._retireWorker(result[0])
+        self._server.server_close()
@@ -0,0 +1,247 @@
+"""
+Sampled profiling of search requests in a running server.
+
+The time spent in each phase of every search request is recorded in a
+RequestProfile, which can also be returned to the client in a
+Server-Timing header. When a profile directory is configured, one in
+every N requests is also profiled with cProfile, and the phase timings
+and cProfile statistics of these sampled requests, and the phase timings
+of any request slower than a threshold, are written to the directory.
+Only the most recent dumps are kept.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import cProfile
+import collections
+import datetime
+import glob
+import json
+import os
+import threading
+import timeit
+
+
+_threadState = threading.local()
+
+
+def enterPhase(phase):
+    """
+    Starts the specified phase of the request being profiled in the
+    current thread, if any. This allows the datamodel to attribute time
+    to phases of a request without access to its profile.
+    """
+    profile = getattr(_threadState, "profile", None)
+    if profile is not None:
+        profile.enterPhase(phase)
+
+
+class RequestProfile(object):
+    """
+    The time taken by each phase of a single request. Time is attributed
+    to the current phase until the next phase is entered, so that time
+    spent in interleaved phases accumulates in each of them.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.startDateTime = datetime.datetime.now()
+        self.elapsedTime = None
+        self.numObjects = 0
+        self.profiler = None
+        self._startTime = timeit.default_timer()
+        self._phaseTimes = collections.OrderedDict()
+        self._phase = None
+        self._phaseStartTime = self._startTime
+
+    def enterPhase(self, phase):
+        """
+        Ends the current phase, if any, and starts the specified phase.
+        Entering the None phase stops attributing time to any phase.
+        """
+        now = timeit.default_timer()
+        if self._phase is not None:
+            self._phaseTimes[self._phase] = (
+                self._phaseTimes.get(self._phase, 0) +
+                now - self._phaseStartTime)
+        self._phase = phase
+        self._phaseStartTime = now
+
+    def finish(self):
+        """
+        Ends the current phase and records the total time taken by the
+        request.
+        """
+        self.enterPhase(None)
+        self.elapsedTime = timeit.default_timer() - self._startTime
+
+    def getPhaseTimes(self):
+        """
+        Returns an ordered dictionary mapping the phases entered so far to
+        the time in seconds spent in each of them.
+        """
+        return collections.OrderedDict(self._phaseTimes)
+
+    def getPhaseTimesPerObject(self):
+        """
+        Returns an ordered dictionary mapping the phases entered so far to
+        the mean time in seconds spent in each of them per object produced
+        by the request, or an empty dictionary if no objects were
+        produced.
+        """
+        if self.numObjects == 0:
+            return collections.OrderedDict()
+        return collections.OrderedDict(
+            (phase, phaseTime / self.numObjects)
+            for phase, phaseTime in self._phaseTimes.items())
+
+    def getServerTimingHeader(self):
+        """
+        Returns the value of a Server-Timing header giving the time in
+        milliseconds spent in each phase and in total, and the number of
+        objects produced.
+        """
+        metrics = [
+            "{};dur={:.3f}".format(phase, phaseTime * 1000)
+            for phase, phaseTime in self._phaseTimes.items()]
+        metrics.append("total;dur={:.3f}".format(self.elapsedTime * 1000))
+        metrics.append('objects;desc="{}"'.format(self.numObjects))
+        return ", ".join(metrics)
+
+    def toJsonDict(self):
+        """
+        Returns a JSON-serialisable summary of this profile.
+        """
+        return {
+            "name": self.name,
+            "startTime": self.startDateTime.isoformat(),
+            "elapsedTime": self.elapsedTime,
+            "numObjects": self.numObjects,
+            "phases": self.getPhaseTimes(),
+            "phasesPerObject": self.getPhaseTimesPerObject(),
+            "sampled": self.profiler is not None,
+        }
+
+
+def parseServerTimingHeader(header):
+    """
+    Returns a dictionary mapping the names of the metrics in the specified
+    Server-Timing header to their durations in seconds, or to their
+    descriptions for metrics without a duration.
+    """
+    metrics = {}
+    for metric in header.split(","):
+        parts = [part.strip() for part in metric.split(";")]
+        value = None
+        for parameter in parts[1:]:
+            key, _, parameterValue = parameter.partition("=")
+            if key == "dur":
+                value = float(parameterValue) / 1000
+            elif key == "desc" and value is None:
+                value = parameterValue.strip('"')
+        metrics[parts[0]] = value
+    return metrics
+
+
+class SamplingProfiler(object):
+    """
+    Decides which requests are profiled and writes their profiles to a
+    directory, in which at most maxFiles dumps are kept. Every sampleRate
+    requests, a request is profiled with cProfile; sampling is disabled
+    if sampleRate is zero. Requests taking at least slowThreshold seconds
+    are always dumped, but have cProfile statistics only if they were also
+    sampled. Nothing is dumped if the directory is None.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._numRequests = 0
+        self._numDumps = 0
+        self.configure(None)
+
+    def configure(
+            self, directory, sampleRate=0, slowThreshold=None,
+            maxFiles=100):
+        """
+        Sets the directory and the sampling and slow request criteria.
+        """
+        with self._lock:
+            self._directory = directory
+            self._sampleRate = sampleRate
+            self._slowThreshold = slowThreshold
+            self._maxFiles = maxFiles
+            if directory is not None and not os.path.exists(directory):
+                os.makedirs(directory)
+
+    def start(self, name):
+        """
+        Returns a new RequestProfile for a request with the specified
+        name, which is profiled with cProfile if sampled.
+        """
+        profile = RequestProfile(name)
+        _threadState.profile = profile
+        if self._directory is not None and self._sampleRate > 0:
+            with self._lock:
+                self._numRequests += 1
+                sampled = self._numRequests % self._sampleRate == 0
+            if sampled:
+                profile.profiler = cProfile.Profile()
+                profile.profiler.enable()
+        return profile
+
+    def end(self, profile):
+        """
+        Finishes the specified profile, and writes it to the profile
+        directory if the request was sampled or slow.
+        """
+        if profile.profiler is not None:
+            profile.profiler.disable()
+        profile.finish()
+        _threadState.profile = None
+        _threadState.lastProfile = profile
+        isSlow = (
+            self._slowThreshold is not None and
+            profile.elapsedTime >= self._slowThreshold)
+        if self._directory is not None and (
+                profile.profiler is not None or isSlow):
+            self._dump(profile, isSlow)
+
+    def popLastProfile(self):
+        """
+        Returns the most recently finished profile of the current thread,
+        or None if there is none or it has already been returned.
+        """
+        profile = getattr(_threadState, "lastProfile", None)
+        _threadState.lastProfile = None
+        return profile
+
+    def _dump(self, profile, isSlow):
+        with self._lock:
+            self._numDumps += 1
+            basePath = os.path.join(
+                self._directory, "{:%Y%m%d-%H%M%S}-{}-{:06d}-{}".format(
+                    profile.startDateTime, os.getpid(), self._numDumps,
+                    profile.name))
+        if profile.profiler is not None:
+            profile.profiler.dump_stats(basePath + ".prof")
+        jsonDict = profile.toJsonDict()
+        jsonDict["slow"] = isSlow
+        with open(basePath + ".json", "w") as jsonFile:
+            json.dump(jsonDict, jsonFile, indent=2)
+        self._removeOldDumps()
+
+    def _removeOldDumps(self):
+        # Dump names start with their time, so sort in age order.
+        paths = sorted(glob.glob(os.path.join(self._directory, "*.json")))
+        for path in paths[:max(0, len(paths) - self._maxFiles)]:
+            for oldPath in [path, path[:-len(".json")] + ".prof"]:
+                try:
+                    os.unlink(oldPath)
+                except OSError:
+                    # Already removed by another process, or not sampled.
+                    pass
+
+
+requestProfiler = SamplingProfiler()
+"""
+The profiler used for the search requests handled by this process.
+"""
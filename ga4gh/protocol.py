@@ -67,6 +67,12 @@ class SearchResponseBuilder(object):
         """
         return self._maxResponseLength
 
+    def getNumValues(self):
+        """
+        Returns the number of values added to the value list.
+        """
+        return self._numElements
+
     def getNextPageToken(self):
         """
         Returns the value of the nextPageToken for this
@@ -20,6 +20,8 @@ class BaseConfig(object):
     REQUEST_VALIDATION = False
     RESPONSE_VALIDATION = False
     DEFAULT_PAGE_SIZE = 100
+    # The number of seconds after which a search returns a partial page.
+    SEARCH_TIME_BUDGET = None
     DATA_SOURCE = "__EMPTY__"
 
     # Options for the simulated backend.
@@ -30,9 +32,50 @@ class BaseConfig(object):
     SIMULATED_BACKEND_NUM_REFERENCE_SETS = 1
     SIMULATED_BACKEND_NUM_REFERENCES_PER_REFERENCE_SET = 1
     SIMULATED_BACKEND_NUM_ALIGNMENTS_PER_READ_GROUP = 2
+    SIMULATED_BACKEND_REFERENCE_LENGTH = 200
+    SIMULATED_BACKEND_READ_LENGTH = 100
+    # The mean read depth; NUM_ALIGNMENTS_PER_READ_GROUP reads are tiled
+    # across each reference if this is None.
+    SIMULATED_BACKEND_READ_COVERAGE = None
+    SIMULATED_BACKEND_READ_INDEL_RATE = 0.1
+    SIMULATED_BACKEND_READ_NUM_TAGS = 2
 
     FILE_HANDLE_CACHE_MAX_SIZE = 50
 
+    # Options for splitting large read and variant searches into bins
+    # that are fetched by a pool of worker processes.
+    PARALLEL_FETCH_WORKERS = 0
+    PARALLEL_FETCH_BIN_SIZE = 2**17
+
+    # Options for the cache of decoded reference sequence blocks, and the
+    # directory of reference sequences used to decode CRAM files.
+    REFERENCE_BLOCK_SIZE = 2**16
+    REFERENCE_BLOCK_CACHE_MAX_BYTES = 2**26
+    REFERENCE_CACHE_DIRECTORY = None
+
+    # A file to which the API requests are appended, for replay by the
+    # load testing tool.
+    REQUEST_LOG_FILE = None
+    METRICS_DIRECTORY = None
+    PROFILE_DIRECTORY = None
+    PROFILE_SAMPLE_RATE = 0
+    PROFILE_SLOW_THRESHOLD = None
+    PROFILE_MAX_FILES = 100
+    SERVER_TIMING_HEADER = False
+
+    # Options for limiting the number of concurrent requests to each
+    # endpoint, and the cost of search requests.
+    ADMISSION_LIMITS = {}
+    ADMISSION_QUEUE_TIMEOUT = 1
+    MAX_SEARCH_COST = None
+    EXPENSIVE_SEARCH_COST = None
+    EXPENSIVE_SEARCH_LIMIT = None
+
+    # The SQLite file in which OIDC authentication tokens are stored, and
+    # the number of seconds for which a token is valid.
+    OIDC_TOKEN_STORE = None
+    OIDC_TOKEN_TTL = 24 * 60 * 60
+
 
 class DevelopmentConfig(BaseConfig):
     """
@@ -86,6 +129,7 @@ class TestOidcConfig(TestConfig):
     OIDC_AUTHZ_ENDPOINT = "https://accounts.example.com/auth"
     OIDC_TOKEN_ENDPOINT = "https://accounts.example.com/token"
     OIDC_TOKEN_REV_ENDPOINT = "https://accounts.example.com/revoke"
+    OIDC_TOKEN_STORE = "__MEMORY__"
 
 
 class FlaskDefaultConfig(object):
@@ -0,0 +1,208 @@
+"""
+Stores for the authentication tokens issued to OIDC clients.
+
+Each token maps to the authorization information retrieved when it was
+issued, and expires a fixed time after it was stored. The SQLite store
+keeps the tokens in a file, so that a token issued by one server process
+is accepted by every other process using the same file. The file is
+readable and writable only by the user running the server.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import os
+import sqlite3
+import stat
+import threading
+import time
+
+import ga4gh.exceptions as exceptions
+
+
+PURGE_INTERVAL = 60
+"""
+The minimum interval in seconds between removals of expired tokens.
+"""
+
+MEMORY = "__MEMORY__"
+"""
+The token store location that selects the in-memory store.
+"""
+
+
+def getTokenStore(location, ttl):
+    """
+    Returns a token store whose tokens expire after ttl seconds, kept in
+    memory if location is MEMORY, and in the SQLite file at location
+    otherwise.
+    """
+    if location == MEMORY:
+        return MemoryTokenStore(ttl)
+    return SqliteTokenStore(location, ttl)
+
+
+class AbstractTokenStore(object):
+    """
+    A map from tokens to values in which each token expires ttl seconds
+    after it was stored. Values must be serialisable as JSON.
+    """
+    def __init__(self, ttl):
+        self._ttl = ttl
+        self._lastPurgeTime = time.time()
+
+    def get(self, token, default=None):
+        """
+        Returns the value of the specified token, or default if the token
+        is not in the store or has expired.
+        """
+        raise NotImplementedError()
+
+    def put(self, token, value):
+        """
+        Stores the specified value for the specified token.
+        """
+        now = time.time()
+        self._store(token, value, now + self._ttl)
+        if now - self._lastPurgeTime >= PURGE_INTERVAL:
+            self._lastPurgeTime = now
+            self.purge()
+
+    def remove(self, token):
+        """
+        Removes the specified token, if it is in the store.
+        """
+        raise NotImplementedError()
+
+    def purge(self):
+        """
+        Removes all expired tokens.
+        """
+        raise NotImplementedError()
+
+    def _store(self, token, value, expiryTime):
+        raise NotImplementedError()
+
+
+class MemoryTokenStore(AbstractTokenStore):
+    """
+    A token store held in the memory of a single process.
+    """
+    def __init__(self, ttl):
+        super(MemoryTokenStore, self).__init__(ttl)
+        self._lock = threading.Lock()
+        self._tokens = {}
+
+    def get(self, token, default=None):
+        with self._lock:
+            entry = self._tokens.get(token)
+            if entry is None:
+                return default
+            value, expiryTime = entry
+            if expiryTime <= time.time():
+                del self._tokens[token]
+                return default
+            return value
+
+    def remove(self, token):
+        with self._lock:
+            self._tokens.pop(token, None)
+
+    def purge(self):
+        now = time.time()
+        with self._lock:
+            for token, (_, expiryTime) in self._tokens.items():
+                if expiryTime <= now:
+                    del self._tokens[token]
+
+    def _store(self, token, value, expiryTime):
+        with self._lock:
+            self._tokens[token] = value, expiryTime
+
+
+class SqliteTokenStore(AbstractTokenStore):
+    """
+    A token store kept in an SQLite database file that can be shared by
+    several server processes. Each thread of each process uses its own
+    connection to the database. The file is created with permissions
+    allowing only its owner to access it, and an existing file must be
+    a regular file owned by the user running the server.
+    """
+    def __init__(self, path, ttl):
+        super(SqliteTokenStore, self).__init__(ttl)
+        self._path = path
+        self._threadState = threading.local()
+        self._checkFile()
+        with self._getConnection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS tokens ("
+                "token TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expiryTime REAL NOT NULL)")
+
+    def getPath(self):
+        """
+        Returns the path of the database file.
+        """
+        return self._path
+
+    def _checkFile(self):
+        # Create the file ourselves, rather than letting SQLite create it
+        # with the permissions allowed by the umask, and refuse a file
+        # that another user could have planted or can read.
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, "O_NOFOLLOW", 0)
+        try:
+            fd = os.open(self._path, flags, 0o600)
+        except OSError as error:
+            raise exceptions.ConfigurationException(
+                "Cannot open the token store '{}': {}".format(
+                    self._path, error.strerror))
+        try:
+            fileStat = os.fstat(fd)
+            if not stat.S_ISREG(fileStat.st_mode):
+                raise exceptions.ConfigurationException(
+                    "The token store '{}' is not a regular file".format(
+                        self._path))
+            if fileStat.st_uid != os.getuid():
+                raise exceptions.ConfigurationException(
+                    "The token store '{}' is owned by another user".format(
+                        self._path))
+            if stat.S_IMODE(fileStat.st_mode) & 0o077 != 0:
+                os.fchmod(fd, 0o600)
+        finally:
+            os.close(fd)
+
+    def _getConnection(self):
+        # Connections cannot be shared between threads, or with the
+        # processes forked by the pre-forking server.
+        connection = getattr(self._threadState, "connection", None)
+        if (connection is None or
+                self._threadState.pid != os.getpid()):
+            connection = sqlite3.connect(self._path, timeout=10)
+            self._threadState.connection = connection
+            self._threadState.pid = os.getpid()
+        return connection
+
+    def get(self, token, default=None):
+        row = self._getConnection().execute(
+            "SELECT value FROM tokens WHERE token = ? AND expiryTime > ?",
+            (token, time.time())).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def remove(self, token):
+        with self._getConnection() as connection:
+            connection.execute(
+                "DELETE FROM tokens WHERE token = ?", (token,))
+
+    def purge(self):
+        with self._getConnection() as connection:
+            connection.execute(
+                "DELETE FROM tokens WHERE expiryTime <= ?", (time.time(),))
+
+    def _store(self, token, value, expiryTime):
+        with self._getConnection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO tokens VALUES (?, ?, ?)",
+                (token, json.dumps(value), expiryTime))
@@ -45,12 +45,20 @@ def mkdirAndChdir(dirName):
 def getReferenceChecksum(fastaFile):
     """
     Returns the md5 checksum for the reference sequence in the specified
-    FASTA file. This is the MD5 of the upper case sequence letters.
+    FASTA file. This is the MD5 of the upper case sequence letters, which
+    are read a chunk at a time to bound the memory used.
     """
     inputFile = pysam.FastaFile(fastaFile)
-    bases = inputFile.fetch(inputFile.references[0])
+    referenceName = inputFile.references[0]
+    length = inputFile.lengths[0]
+    chunkSize = 2**22
+    md5 = hashlib.md5()
+    for start in range(0, length, chunkSize):
+        bases = inputFile.fetch(
+            referenceName, start, min(start + chunkSize, length))
+        md5.update(bases.upper())
     inputFile.close()
-    return hashlib.md5(bases.upper()).hexdigest()
+    return md5.hexdigest()
 
 
 def cleanDir():
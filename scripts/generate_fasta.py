@@ -8,10 +8,11 @@ from __future__ import unicode_literals
 import argparse
 import hashlib
 import json
-import math
 import os
 import random
 
+import numpy
+
 import utils
 
 
@@ -24,7 +25,7 @@ class FastaGenerator(object):
         self.outputPrefix = args.output_prefix
         self.fastaFileName = "{}.fa".format(self.outputPrefix)
         self.referenceId = os.path.split(args.output_prefix)[-1]
-        self.bases = ""
+        self.md5checksum = None
 
     def writeFasta(self):
         """
@@ -37,28 +38,30 @@ class FastaGenerator(object):
                     self.referenceId)
             print(firstLine, file=fastaFile)
             basesPerLine = 70
-            numLines = int(math.ceil(self.numBases / basesPerLine))
-            baseChoices = ['A', 'G', 'C', 'T']
+            linesPerBlock = 2**14
+            baseChoices = numpy.fromstring(b"AGCT", dtype=numpy.uint8)
+            md5 = hashlib.md5()
             basesRemaining = self.numBases
-            for i in range(numLines):
-                if basesRemaining < basesPerLine:
-                    basesToWrite = basesRemaining
-                else:
-                    basesToWrite = basesPerLine
-                bases = ''.join(
-                    [random.choice(baseChoices) for _ in range(basesToWrite)])
-                line = "{}".format(bases)
-                self.bases += line
-                print(line, file=fastaFile)
+            # Generate the bases a block of lines at a time, rather than
+            # holding the whole sequence in memory.
+            while basesRemaining > 0:
+                basesToWrite = min(
+                    basesRemaining, basesPerLine * linesPerBlock)
+                bases = baseChoices[numpy.random.randint(
+                    0, len(baseChoices), basesToWrite)].tostring()
+                md5.update(bases)
+                fastaFile.writelines(
+                    bases[i:i + basesPerLine] + b"\n"
+                    for i in range(0, basesToWrite, basesPerLine))
                 basesRemaining -= basesToWrite
-            assert basesRemaining == 0
+            self.md5checksum = md5.hexdigest()
 
     def writeMetadata(self):
         """
         Write some metadata.
         """
         metadata = {
-            "md5checksum": hashlib.md5(self.bases).hexdigest(),
+            "md5checksum": self.md5checksum,
             "sourceUri": "http://example.com/random_url",
             "ncbiTaxonId": random.randint(1, 10000),
             "isDerived": False,
@@ -101,7 +104,7 @@ def main():
         "output_prefix", help="The prefix for generated files.")
     basesDefault = 1000
     parser.add_argument(
-        "--num-bases", "-n", default=basesDefault,
+        "--num-bases", "-n", default=basesDefault, type=int,
         help="number of bases to include; default {}".format(basesDefault))
     fastaGenerator = FastaGenerator(parser.parse_args())
     fastaGenerator.generate()
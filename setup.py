@@ -32,7 +32,7 @@ ga4ghVersion = parseVersion("ga4gh/__init__.py")
 # Flask must come after all other requirements that have "flask" as a prefix
 # due to a setuptools bug.
 requirements = ["avro", "flask-cors", "oic", "flask", "humanize",
-                "pysam>=0.8.2", "requests"]
+                "numpy", "pysam>=0.8.2", "requests"]
 
 setup(
     name="ga4gh",
@@ -53,6 +53,13 @@ setup(
             'ga4gh_server=ga4gh.cli:server_main',
             'ga2vcf=ga4gh.cli:ga2vcf_main',
             'ga2sam=ga4gh.cli:ga2sam_main',
+            'ga4gh_build_coverage=ga4gh.cli:build_coverage_main',
+            'ga4gh_build_read_stats=ga4gh.cli:build_read_stats_main',
+            'ga4gh_pack_references=ga4gh.cli:pack_references_main',
+            'ga4gh_reference_checksums=ga4gh.cli:reference_checksums_main',
+            'ga4gh_generate_data=ga4gh.cli:generate_data_main',
+            'ga4gh_benchmark=ga4gh.cli:benchmark_main',
+            'ga4gh_loadtest=ga4gh.cli:loadtest_main',
         ]
     },
     classifiers=[
@@ -227,14 +227,21 @@ class ReadGroupSetTest(datadriven.DataDrivenTest):
             readGroupSetInfo.numUnalignedReads)
         for readGroup in readGroupSet.getReadGroups():
             gaReadGroup = readGroup.toProtocolElement()
+            numAlignedReads = -1
+            numUnalignedReads = -1
+            if readGroupSet.isUsingDefaultReadGroup():
+                # Without read group headers all reads belong to the
+                # default read group, so the index counts apply.
+                numAlignedReads = readGroupSetInfo.numAlignedReads
+                numUnalignedReads = readGroupSetInfo.numUnalignedReads
             self.assertEqual(
-                readGroup.getNumAlignedReads(), -1)
+                readGroup.getNumAlignedReads(), numAlignedReads)
             self.assertEqual(
-                readGroup.getNumUnalignedReads(), -1)
+                readGroup.getNumUnalignedReads(), numUnalignedReads)
             self.assertEqual(
-                gaReadGroup.stats.alignedReadCount, -1)
+                gaReadGroup.stats.alignedReadCount, numAlignedReads)
             self.assertEqual(
-                gaReadGroup.stats.unalignedReadCount, -1)
+                gaReadGroup.stats.unalignedReadCount, numUnalignedReads)
 
     def testValidateObjects(self):
         # test that validation works on read groups and reads
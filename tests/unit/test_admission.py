@@ -0,0 +1,301 @@
+"""
+Tests for admission control and the estimated cost of search requests
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import multiprocessing
+import threading
+import unittest
+
+import werkzeug.test
+
+import ga4gh.admission as admission
+import ga4gh.exceptions as exceptions
+import ga4gh.frontend as frontend
+import ga4gh.protocol as protocol
+
+
+def acquireAndRelease(limit):
+    """
+    Takes a slot from the specified limit and returns it.
+    """
+    limit.acquire()
+    limit.release()
+
+
+class TestConcurrencyLimit(unittest.TestCase):
+    """
+    Tests the slots and queue of a ConcurrencyLimit.
+    """
+    def testQueueFull(self):
+        limit = admission.ConcurrencyLimit("test", 2)
+        limit.acquire()
+        limit.acquire()
+        self.assertEqual(limit.getNumActive(), 2)
+        with self.assertRaises(exceptions.TooManyRequestsException):
+            limit.acquire()
+        limit.release()
+        limit.acquire()
+        self.assertEqual(limit.getNumActive(), 2)
+
+    def testQueueTimeout(self):
+        limit = admission.ConcurrencyLimit("test", 1, 1, 0.01)
+        limit.acquire()
+        with self.assertRaises(exceptions.ServiceUnavailableException):
+            limit.acquire()
+        self.assertEqual(limit.getNumQueued(), 0)
+        self.assertEqual(limit.getNumActive(), 1)
+
+    def testQueuedRequestAdmitted(self):
+        limit = admission.ConcurrencyLimit("test", 1, 1, 10)
+        limit.acquire()
+        acquired = threading.Event()
+
+        def waitForSlot():
+            limit.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=waitForSlot)
+        thread.start()
+        while limit.getNumQueued() == 0:
+            thread.join(0.001)
+        self.assertFalse(acquired.is_set())
+        # The queue is full while the first request waits.
+        with self.assertRaises(exceptions.TooManyRequestsException):
+            limit.acquire()
+        limit.release()
+        thread.join()
+        self.assertTrue(acquired.is_set())
+        self.assertEqual(limit.getNumActive(), 1)
+
+    def testTryAcquire(self):
+        limit = admission.ConcurrencyLimit("test", 1, 1, 10)
+        self.assertTrue(limit.tryAcquire())
+        self.assertFalse(limit.tryAcquire())
+        self.assertEqual(limit.getNumQueued(), 0)
+        limit.release()
+        self.assertTrue(limit.tryAcquire())
+
+    def testSharedWithForkedProcesses(self):
+        limit = admission.ConcurrencyLimit("test", 1, 1, 10)
+        limit.acquire()
+        process = multiprocessing.Process(
+            target=acquireAndRelease, args=(limit,))
+        process.start()
+        # The queued request of the other process is seen by this one.
+        for _ in range(10000):
+            if limit.getNumQueued() == 1:
+                break
+            process.join(0.001)
+        self.assertEqual(limit.getNumQueued(), 1)
+        self.assertTrue(process.is_alive())
+        limit.release()
+        process.join(10)
+        self.assertEqual(process.exitcode, 0)
+        self.assertEqual(limit.getNumActive(), 0)
+
+    def testReleaseProcess(self):
+        limit = admission.ConcurrencyLimit("test", 2)
+        limit.acquire()
+        # The process exits without returning its slot.
+        process = multiprocessing.Process(target=limit.acquire)
+        process.start()
+        process.join(10)
+        self.assertEqual(process.exitcode, 0)
+        self.assertFalse(limit.tryAcquire())
+        limit.releaseProcess(process.pid)
+        self.assertEqual(limit.getNumActive(), 1)
+        self.assertTrue(limit.tryAcquire())
+
+    def testInvalidArguments(self):
+        with self.assertRaises(ValueError):
+            admission.ConcurrencyLimit("test", 0)
+        with self.assertRaises(ValueError):
+            admission.ConcurrencyLimit("test", 1, -1)
+
+
+class TestAdmissionController(unittest.TestCase):
+    """
+    Tests the choice of limits by cost and endpoint.
+    """
+    def setUp(self):
+        self.controller = admission.AdmissionController()
+        self.controller.configure(
+            {"searchReads": (1, 0)}, maxCost=1000, expensiveCost=100,
+            expensiveLimit=(1, 0))
+
+    def testLimits(self):
+        self.assertIsNone(self.controller.getLimit("searchVariants"))
+        self.assertIsNone(self.controller.getLimit("searchVariants", 10))
+        readsLimit = self.controller.getLimit("searchReads", 10)
+        self.assertIsNotNone(readsLimit)
+        self.assertIs(self.controller.getLimit("searchReads"), readsLimit)
+        expensiveLimit = self.controller.getLimit("searchReads", 100)
+        self.assertIsNot(expensiveLimit, readsLimit)
+        self.assertIs(
+            self.controller.getLimit("searchVariants", 1000), expensiveLimit)
+        with self.assertRaises(exceptions.RequestTooExpensiveException):
+            self.controller.getLimit("searchVariants", 1001)
+
+    def testAdmit(self):
+        with self.controller.admit("searchReads", 10):
+            # An expensive request does not take the endpoint's slot.
+            with self.controller.admit("searchReads", 100):
+                with self.assertRaises(exceptions.TooManyRequestsException):
+                    with self.controller.admit("searchReads", 10):
+                        pass
+        with self.controller.admit("searchReads", 10):
+            pass
+        with self.controller.admit("searchVariants"):
+            pass
+
+    def testAlreadyAdmitted(self):
+        with self.controller.alreadyAdmitted():
+            self.assertIsNone(self.controller.getLimit("searchReads", 10))
+            with self.assertRaises(exceptions.RequestTooExpensiveException):
+                self.controller.getLimit("searchReads", 1001)
+            with self.controller.alreadyAdmitted(False):
+                self.assertIsNotNone(self.controller.getLimit("searchReads"))
+        self.assertIsNotNone(self.controller.getLimit("searchReads"))
+
+
+class TestAdmissionFrontend(unittest.TestCase):
+    """
+    Tests the admission of requests by the frontend and backend.
+    """
+    def setUp(self):
+        frontend.reset()
+        frontend.configure(baseConfig="TestConfig", extraConfig={
+            "DATA_SOURCE": "__SIMULATED__",
+            "SIMULATED_BACKEND_NUM_CALLS": 3,
+            "ADMISSION_LIMITS": {
+                "searchVariants": (1, 0), "listReferenceBases": (1, 0)},
+            "MAX_SEARCH_COST": 10**6})
+        self.app = frontend.app.test_client()
+        self.backend = frontend.app.backend
+        dataset = self.backend.getDatasets()[0]
+        self.variantSet = dataset.getVariantSets()[0]
+        self.readGroup = dataset.getReadGroupSets()[0].getReadGroups()[0]
+        self.reference = self.backend.getReferenceSets()[0].getReferences()[0]
+
+    def tearDown(self):
+        admission.requestAdmission.configure({})
+
+    def _getVariantsRequest(self, start, end):
+        request = protocol.SearchVariantsRequest()
+        request.variantSetId = self.variantSet.getId()
+        request.referenceName = "1"
+        request.start = start
+        request.end = end
+        return request
+
+    def _getReadsRequest(self):
+        request = protocol.SearchReadsRequest()
+        request.readGroupIds = [self.readGroup.getId()]
+        request.referenceId = self.reference.getId()
+        return request
+
+    def _post(self, path, request):
+        return self.app.post(
+            path, data=request.toJsonString(),
+            headers={"Content-Type": "application/json"})
+
+    def _getErrorMessage(self, response):
+        return protocol.GAException.fromJsonString(response.data).message
+
+    def testCosts(self):
+        request = self._getVariantsRequest(100, 200)
+        self.assertEqual(self.backend.variantsCost(request), 300)
+        request.callSetIds = []
+        self.assertEqual(self.backend.variantsCost(request), 100)
+        request.callSetIds = [self.variantSet.getCallSets()[0].getId()]
+        self.assertEqual(self.backend.variantsCost(request), 100)
+        request.pageToken = "150:3"
+        self.assertEqual(self.backend.variantsCost(request), 50)
+        request = self._getReadsRequest()
+        self.assertEqual(
+            self.backend.readsCost(request), self.reference.getLength())
+        request.start = 10
+        request.end = 20
+        self.assertEqual(self.backend.readsCost(request), 10)
+
+    def testSearchLimit(self):
+        request = self._getVariantsRequest(0, 100)
+        self.assertEqual(self._post("/variants/search", request).status_code,
+                         200)
+        limit = admission.requestAdmission.getLimit("searchVariants")
+        limit.acquire()
+        try:
+            response = self._post("/variants/search", request)
+        finally:
+            limit.release()
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("searchVariants", self._getErrorMessage(response))
+        # Other endpoints are not limited.
+        response = self._post("/reads/search", self._getReadsRequest())
+        self.assertEqual(response.status_code, 200)
+
+    def testGetLimit(self):
+        path = "/references/{}/bases".format(self.reference.getId())
+        self.assertEqual(self.app.get(path).status_code, 200)
+        limit = admission.requestAdmission.getLimit("listReferenceBases")
+        limit.acquire()
+        try:
+            response = self.app.get(path)
+        finally:
+            limit.release()
+        self.assertEqual(response.status_code, 429)
+
+    def _getEnvironment(self, path, request=None):
+        if request is None:
+            builder = werkzeug.test.EnvironBuilder(path)
+        else:
+            builder = werkzeug.test.EnvironBuilder(
+                path, method="POST", data=request.toJsonString(),
+                content_type="application/json")
+        return builder.get_environ()
+
+    def testGetAdmissionLimit(self):
+        request = self._getVariantsRequest(0, 100)
+        environ = self._getEnvironment("/variants/search", request)
+        self.assertIs(
+            frontend.getAdmissionLimit(environ),
+            admission.requestAdmission.getLimit("searchVariants"))
+        # The body can still be read by the application.
+        self.assertEqual(
+            environ["wsgi.input"].read(), request.toJsonString())
+        self.assertIsNone(frontend.getAdmissionLimit(
+            self._getEnvironment("/reads/search", self._getReadsRequest())))
+        path = "/references/{}/bases".format(self.reference.getId())
+        self.assertIs(
+            frontend.getAdmissionLimit(self._getEnvironment(path)),
+            admission.requestAdmission.getLimit("listReferenceBases"))
+        self.assertIsNone(
+            frontend.getAdmissionLimit(self._getEnvironment("/notAPath")))
+        # Requests that are too expensive are rejected when handled.
+        self.assertIsNone(frontend.getAdmissionLimit(self._getEnvironment(
+            "/variants/search", self._getVariantsRequest(0, 10**6))))
+
+    def testAdmittedRequest(self):
+        request = self._getVariantsRequest(0, 100)
+        limit = admission.requestAdmission.getLimit("searchVariants")
+        limit.acquire()
+        try:
+            response = self.app.post(
+                "/variants/search", data=request.toJsonString(),
+                headers={"Content-Type": "application/json"},
+                environ_base={admission.ADMITTED_ENVIRON_KEY: True})
+        finally:
+            limit.release()
+        self.assertEqual(response.status_code, 200)
+
+    def testTooExpensive(self):
+        request = self._getVariantsRequest(0, 10**6)
+        response = self._post("/variants/search", request)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("cost", self._getErrorMessage(response))
+        request.callSetIds = []
+        response = self._post("/variants/search", request)
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,384 @@
+"""
+Tests for the event loop server
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import socket
+import threading
+import time
+import unittest
+
+import requests
+
+import ga4gh.admission as admission
+import ga4gh.asyncserver as asyncserver
+import ga4gh.frontend as frontend
+import ga4gh.protocol as protocol
+
+
+CHUNK_SIZE = 2**16
+
+
+class AsyncServerTest(unittest.TestCase):
+    """
+    Runs a server for the specified application in a separate thread.
+    """
+    def startServer(
+            self, app, isInline, numExecutorThreads=1,
+            getAdmissionLimit=None):
+        self.server = asyncserver.AsyncServer(
+            app, "127.0.0.1", 0, isInline, numExecutorThreads,
+            getAdmissionLimit=getAdmissionLimit)
+        self.url = "http://127.0.0.1:{}".format(self.server.getPort())
+        self.serverThread = threading.Thread(target=self.server.serveForever)
+        self.serverThread.daemon = True
+        self.serverThread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.serverThread.join()
+
+
+class TestAsyncServer(AsyncServerTest):
+    """
+    Tests the scheduling of requests and the handling of connections
+    with a simple application.
+    """
+    def setUp(self):
+        self.slowRequestStarted = threading.Event()
+        self.finishSlowRequest = threading.Event()
+        self.numChunksGenerated = 0
+        self.startServer(
+            self._application,
+            lambda environ: not environ["PATH_INFO"].startswith(
+                ("/slow", "/stream")))
+
+    def _generateChunks(self, numChunks):
+        for _ in range(numChunks):
+            self.numChunksGenerated += 1
+            yield b"x" * CHUNK_SIZE
+
+    def _application(self, environ, startResponse):
+        if environ["PATH_INFO"].startswith("/stream"):
+            numChunks = int(environ["QUERY_STRING"])
+            headers = [(b"Content-Type", b"text/plain")]
+            if environ["PATH_INFO"] == "/stream":
+                headers.append(
+                    (b"Content-Length", str(numChunks * CHUNK_SIZE)))
+            startResponse(b"200 OK", headers)
+            return self._generateChunks(numChunks)
+        if environ["PATH_INFO"] == "/slow":
+            self.slowRequestStarted.set()
+            self.finishSlowRequest.wait(10)
+        elif environ["PATH_INFO"] == "/error":
+            raise Exception("error")
+        body = "{} {} {}".format(
+            environ["REQUEST_METHOD"], environ["PATH_INFO"],
+            environ["wsgi.input"].read())
+        startResponse(b"200 OK", [(b"Content-Type", b"text/plain")])
+        return [body.encode()]
+
+    def _getSlow(self, responses):
+        responses.append(requests.get(self.url + "/slow"))
+
+    def testInlineRequestsNotBlocked(self):
+        responses = []
+        thread = threading.Thread(target=self._getSlow, args=(responses,))
+        thread.start()
+        self.assertTrue(self.slowRequestStarted.wait(10))
+        # The only executor thread is busy, but inline requests are
+        # still served.
+        response = requests.post(self.url + "/fast", data="body")
+        self.assertEqual(response.text, "POST /fast body")
+        self.finishSlowRequest.set()
+        thread.join()
+        self.assertEqual(responses[0].text, "GET /slow ")
+
+    def testKeepAlive(self):
+        session = requests.Session()
+        for i in range(5):
+            response = session.get(self.url + "/fast/{}".format(i))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.text, "GET /fast/{} ".format(i))
+        self.assertEqual(self.server.getNumConnections(), 1)
+
+    def testPipelinedRequests(self):
+        connection = socket.create_connection(
+            ("127.0.0.1", self.server.getPort()))
+        connection.sendall(
+            b"GET /a HTTP/1.1\r\nHost: x\r\n\r\n"
+            b"POST /b HTTP/1.1\r\nContent-Length: 3\r\n"
+            b"Connection: close\r\n\r\nabc")
+        data = b""
+        while True:
+            chunk = connection.recv(4096)
+            if chunk == b"":
+                break
+            data += chunk
+        connection.close()
+        self.assertEqual(data.count(b"HTTP/1.1 200 OK"), 2)
+        self.assertTrue(data.endswith(b"POST /b abc"))
+
+    def testErrors(self):
+        self.assertEqual(requests.get(self.url + "/error").status_code, 500)
+        connection = socket.create_connection(
+            ("127.0.0.1", self.server.getPort()))
+        connection.sendall(b"NONSENSE\r\n\r\n")
+        self.assertTrue(connection.recv(4096).startswith(
+            b"HTTP/1.1 400 Bad Request"))
+        self.assertEqual(connection.recv(4096), b"")
+        connection.close()
+
+    def testStreamedResponses(self):
+        session = requests.Session()
+        for _ in range(2):
+            response = session.get(self.url + "/stream?100")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, b"x" * (100 * CHUNK_SIZE))
+        self.assertEqual(self.server.getNumConnections(), 1)
+        # Bodies of unknown length are delimited by closing the
+        # connection.
+        response = session.get(self.url + "/streamUnknownLength?10")
+        self.assertEqual(response.content, b"x" * (10 * CHUNK_SIZE))
+        self.assertEqual(response.headers["Connection"], "close")
+
+    def testStreamedResponseFlowControl(self):
+        numChunks = 1000
+        connection = socket.create_connection(
+            ("127.0.0.1", self.server.getPort()))
+        try:
+            connection.sendall(
+                "GET /stream?{} HTTP/1.1\r\n\r\n".format(numChunks))
+            # The body is not generated faster than the client reads it.
+            time.sleep(0.5)
+            self.assertLess(self.numChunksGenerated, numChunks // 2)
+            numBytes = 0
+            while True:
+                data = connection.recv(2**20)
+                numBytes += len(data)
+                if b"\r\n\r\n" in data[:1000]:
+                    numBytes -= data.index(b"\r\n\r\n") + 4
+                if numBytes >= numChunks * CHUNK_SIZE:
+                    break
+        finally:
+            connection.close()
+        self.assertEqual(self.numChunksGenerated, numChunks)
+
+    def testIdleConnections(self):
+        connections = [
+            socket.create_connection(("127.0.0.1", self.server.getPort()))
+            for _ in range(200)]
+        try:
+            response = requests.get(self.url + "/fast")
+            self.assertEqual(response.status_code, 200)
+            self.assertGreaterEqual(self.server.getNumConnections(), 200)
+        finally:
+            for connection in connections:
+                connection.close()
+
+
+class TestAsyncAdmission(AsyncServerTest):
+    """
+    Tests that requests are admitted on the event loop, and that requests
+    waiting for a slot do not occupy executor threads.
+    """
+    def setUp(self):
+        self.slowRequestStarted = threading.Event()
+        self.finishSlowRequest = threading.Event()
+        self.limit = admission.ConcurrencyLimit("slow", 1, 1, 10)
+        self.admitted = []
+        self.startServer(
+            self._application, lambda environ: False, 2,
+            self._getAdmissionLimit)
+
+    def tearDown(self):
+        self.finishSlowRequest.set()
+        super(TestAsyncAdmission, self).tearDown()
+
+    def _getAdmissionLimit(self, environ):
+        if environ["PATH_INFO"] == "/slow":
+            return self.limit
+        return None
+
+    def _application(self, environ, startResponse):
+        self.admitted.append(
+            environ.get(admission.ADMITTED_ENVIRON_KEY, False))
+        if environ["PATH_INFO"] == "/slow":
+            self.slowRequestStarted.set()
+            self.finishSlowRequest.wait(10)
+        startResponse(b"200 OK", [(b"Content-Type", b"text/plain")])
+        return [b"done"]
+
+    def _getSlow(self, responses):
+        responses.append(requests.get(self.url + "/slow"))
+
+    def testQueuedRequests(self):
+        responses = []
+        threads = [
+            threading.Thread(target=self._getSlow, args=(responses,))
+            for _ in range(2)]
+        threads[0].start()
+        self.assertTrue(self.slowRequestStarted.wait(10))
+        threads[1].start()
+        while len(self.server._waiting.get(self.limit, ())) == 0:
+            time.sleep(0.001)
+        # The queue is full, and the queued request does not hold the
+        # second executor thread.
+        self.assertEqual(requests.get(self.url + "/slow").status_code, 429)
+        self.assertEqual(requests.get(self.url + "/fast").status_code, 200)
+        self.finishSlowRequest.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(
+            [response.status_code for response in responses], [200, 200])
+        self.assertEqual(self.admitted, [True, False, True])
+        self.assertEqual(self.limit.getNumActive(), 0)
+
+    def testQueueTimeout(self):
+        self.limit = admission.ConcurrencyLimit("slow", 1, 1, 0.1)
+        responses = []
+        thread = threading.Thread(target=self._getSlow, args=(responses,))
+        thread.start()
+        self.assertTrue(self.slowRequestStarted.wait(10))
+        self.assertEqual(requests.get(self.url + "/slow").status_code, 503)
+        self.finishSlowRequest.set()
+        thread.join()
+        self.assertEqual(responses[0].status_code, 200)
+        self.assertEqual(self.limit.getNumActive(), 0)
+
+
+class TestAsyncFrontend(AsyncServerTest):
+    """
+    Tests that the event loop server serves the frontend routes.
+    """
+    def setUp(self):
+        frontend.reset()
+        frontend.configure(baseConfig="TestConfig", extraConfig={
+            "DATA_SOURCE": "__SIMULATED__"})
+        self.startServer(frontend.app, frontend.isInlineRequest, 2)
+        self.dataset = frontend.app.backend.getDatasets()[0]
+
+    def testInlineRequests(self):
+        environ = {
+            "REQUEST_METHOD": "GET", "PATH_INFO": "/datasets/abc",
+            "SERVER_NAME": "localhost", "SERVER_PORT": "80",
+            "wsgi.url_scheme": "http"}
+        self.assertTrue(frontend.isInlineRequest(environ))
+        environ["PATH_INFO"] = "/references/abc/bases"
+        self.assertFalse(frontend.isInlineRequest(environ))
+        environ["PATH_INFO"] = "/notAPath"
+        self.assertTrue(frontend.isInlineRequest(environ))
+
+    def testRoutes(self):
+        response = requests.get(
+            "{}/datasets/{}".format(self.url, self.dataset.getId()))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            protocol.Dataset.fromJsonString(response.text).id,
+            self.dataset.getId())
+        request = protocol.SearchVariantsRequest()
+        request.variantSetId = self.dataset.getVariantSets()[0].getId()
+        request.referenceName = "1"
+        request.start = 0
+        request.end = 100
+        request.callSetIds = []
+        response = requests.post(
+            self.url + "/variants/search", data=request.toJsonString(),
+            headers={"Content-Type": "application/json"})
+        self.assertEqual(response.status_code, 200)
+        expected = frontend.app.test_client().post(
+            "/variants/search", data=request.toJsonString(),
+            headers={"Content-Type": "application/json"})
+        self.assertEqual(response.content, expected.data)
+        response = requests.get(self.url + "/datasets/notAnId")
+        self.assertEqual(response.status_code, 404)
+
+    def testStreamedReferenceBases(self):
+        reference = frontend.app.backend.getReferenceSets()[
+            0].getReferences()[0]
+        path = "/references/{}/bases".format(reference.getId())
+        response = requests.get(self.url + path)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(len(response.content), 0)
+        self.assertEqual(
+            response.content, frontend.app.test_client().get(path).data)
+
+
+class TestAsyncConcurrentSearches(AsyncServerTest):
+    """
+    Tests that searches over the same data files run concurrently on the
+    executor threads return the same results as when run serially.
+    """
+    def setUp(self):
+        frontend.reset()
+        frontend.configure(baseConfig="TestConfig", extraConfig={
+            "DATA_SOURCE": "tests/data"})
+        self.startServer(frontend.app, frontend.isInlineRequest, 4)
+        dataset = frontend.app.backend.getDatasets()[0]
+        self.requests = []
+        for name, referenceName, start, end in [
+                ("HG00096.mapped.ILLUMINA.bwa.GBR.low_coverage.20120522",
+                 "1", 9990, 10110),
+                ("chr17.1-250", "chr17", 0, 250)]:
+            readGroupSet = dataset.getReadGroupSetByName(name)
+            reference = readGroupSet.getReferenceSet().getReferenceByName(
+                referenceName)
+            for readGroup in readGroupSet.getReadGroups():
+                request = protocol.SearchReadsRequest()
+                request.readGroupIds = [readGroup.getId()]
+                request.referenceId = reference.getId()
+                request.start = start
+                request.end = end
+                self.requests.append(("/reads/search", request))
+            self.requests.append((
+                "/references/{}/bases".format(reference.getId()), None))
+        for variantSet in dataset.getVariantSets():
+            request = protocol.SearchVariantsRequest()
+            request.variantSetId = variantSet.getId()
+            request.referenceName = "1"
+            request.start = 10000
+            request.end = 18000
+            request.callSetIds = [
+                callSet.getId() for callSet in variantSet.getCallSets()][:2]
+            self.requests.append(("/variants/search", request))
+
+    def _getResponse(self, get, post, path, request):
+        if request is None:
+            return get(path)
+        return post(
+            path, data=request.toJsonString(),
+            headers={"Content-Type": "application/json"})
+
+    def _runRequests(self, order, results):
+        session = requests.Session()
+        for index in order:
+            path, request = self.requests[index]
+            response = self._getResponse(
+                session.get, session.post, self.url + path, request)
+            results.append((index, response.status_code, response.content))
+
+    def testConcurrentSearches(self):
+        client = frontend.app.test_client()
+        expected = []
+        for path, request in self.requests:
+            response = self._getResponse(
+                client.get, client.post, path, request)
+            self.assertEqual(response.status_code, 200)
+            expected.append(response.data)
+        numRequests = len(self.requests)
+        results = []
+        threads = [
+            threading.Thread(target=self._runRequests, args=(
+                [(i + j) % numRequests for j in range(3 * numRequests)],
+                results))
+            for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 8 * 3 * numRequests)
+        for index, statusCode, content in results:
+            self.assertEqual(statusCode, 200)
+            self.assertEqual(content, expected[index])
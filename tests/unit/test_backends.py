@@ -10,8 +10,12 @@ from __future__ import unicode_literals
 import os
 import unittest
 
+import mock
+
 import ga4gh.exceptions as exceptions
 import ga4gh.backend as backend
+import ga4gh.datamodel.parallel as parallel
+import ga4gh.datamodel.references as references
 import ga4gh.protocol as protocol
 
 
@@ -194,6 +198,217 @@ class TestFileSystemBackend(TestAbstractBackend):
         self._backend = backend.FileSystemBackend(self._dataDir)
 
 
+class TestSearchTimeBudget(unittest.TestCase):
+    """
+    Tests that searches of the files in the tests/data directory that are
+    interrupted by the search time budget return every object exactly
+    once, in the same order as uninterrupted searches.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.backend = backend.FileSystemBackend(os.path.join("tests", "data"))
+        cls.dataset = cls.backend.getDatasets()[0]
+
+    def tearDown(self):
+        self.backend.setSearchTimeBudget(None)
+        parallel.regionFetchPool.configure(0, 2**17)
+
+    def _search(self, searchMethod, request, responseClass, listMember):
+        objects = []
+        numEmptyPages = 0
+        request.pageToken = None
+        for _ in range(10000):
+            response = responseClass.fromJsonString(
+                searchMethod(request.toJsonString()))
+            values = getattr(response, listMember)
+            if len(values) == 0:
+                numEmptyPages += 1
+            objects.extend(value.toJsonDict() for value in values)
+            if response.nextPageToken is None:
+                break
+            request.pageToken = response.nextPageToken
+        else:
+            self.fail("The search did not finish")
+        return objects, numEmptyPages
+
+    def _assertTruncatedSearchesMatch(
+            self, searchMethod, request, responseClass, listMember):
+        expected, _ = self._search(
+            searchMethod, request, responseClass, listMember)
+        self.assertGreater(len(expected), 0)
+        self.backend.setSearchTimeBudget(0)
+        objects, numEmptyPages = self._search(
+            searchMethod, request, responseClass, listMember)
+        self.assertEqual(objects, expected)
+        # Pages stop at the record being scanned, before any object is
+        # found in it.
+        self.assertGreater(numEmptyPages, 0)
+
+    def _getReadsRequest(self, name, referenceName, start, end):
+        readGroupSet = self.dataset.getReadGroupSetByName(name)
+        reference = readGroupSet.getReferenceSet().getReferenceByName(
+            referenceName)
+        request = protocol.SearchReadsRequest()
+        request.readGroupIds = [readGroupSet.getReadGroups()[-1].getId()]
+        request.referenceId = reference.getId()
+        request.start = start
+        request.end = end
+        request.pageSize = 5
+        return request
+
+    def testReads(self):
+        # The reads of all the read groups in this file are scanned, and
+        # those of the other read groups are skipped.
+        request = self._getReadsRequest(
+            "HG00096.mapped.ILLUMINA.bwa.GBR.low_coverage.20120522", "1",
+            9990, 10110)
+        self._assertTruncatedSearchesMatch(
+            self.backend.runSearchReads, request,
+            protocol.SearchReadsResponse, "alignments")
+
+    def testParallelReads(self):
+        parallel.regionFetchPool.configure(2, 10)
+        request = self._getReadsRequest("chr17.1-250", "chr17", 5, 250)
+        self._assertTruncatedSearchesMatch(
+            self.backend.runSearchReads, request,
+            protocol.SearchReadsResponse, "alignments")
+
+    def testVariants(self):
+        variantSet = [
+            variantSet for variantSet in self.dataset.getVariantSets()
+            if variantSet.getLocalId() == "1kgPhase3"][0]
+        request = protocol.SearchVariantsRequest()
+        request.variantSetId = variantSet.getId()
+        request.referenceName = "1"
+        request.start = 10000
+        request.end = 18000
+        request.callSetIds = [
+            callSet.getId() for callSet in variantSet.getCallSets()][:2]
+        request.pageSize = 7
+        self._assertTruncatedSearchesMatch(
+            self.backend.runSearchVariants, request,
+            protocol.SearchVariantsResponse, "variants")
+
+
+class TestReferenceSearchIndexes(unittest.TestCase):
+    """
+    Tests that searches for reference sets and references filtered by
+    md5checksum, accession and assemblyId using the indexes give the same
+    results as a scan over all of the objects.
+    """
+    def setUp(self):
+        self.backend = BackendForTesting()
+        self.accessions = ["acc0", "acc1", "acc2"]
+        for i in range(6):
+            referenceSet = references.SimulatedReferenceSet(
+                "referenceSet{}".format(i), randomSeed=i % 4, numReferences=0)
+            referenceSet._assemblyId = "assembly{}".format(i % 2)
+            referenceSet._sourceAccessions = self.accessions[:i % 3]
+            for j in range(5):
+                reference = references.SimulatedReference(
+                    referenceSet, "reference{}".format(j),
+                    randomSeed=10 * (i % 4) + j % 3)
+                reference._sourceAccessions = self.accessions[j % 3:]
+                referenceSet.addReference(reference)
+            self.backend.addReferenceSet(referenceSet)
+
+    def _search(self, searchMethod, request, responseClass, listMember):
+        ids = []
+        request.pageSize = 2
+        notDone = True
+        while notDone:
+            response = responseClass.fromJsonString(
+                searchMethod(request.toJsonString()))
+            ids.extend(obj.id for obj in getattr(response, listMember))
+            notDone = response.nextPageToken is not None
+            request.pageToken = response.nextPageToken
+        return ids
+
+    def _matches(self, obj, md5checksum, accession):
+        return (
+            md5checksum in (None, obj.getMd5Checksum()) and
+            (accession is None or accession in obj.getSourceAccessions()))
+
+    def testSearchReferenceSets(self):
+        referenceSets = self.backend.getReferenceSets()
+        md5checksums = [None, referenceSets[1].getMd5Checksum(), "x"]
+        accessions = [None, "acc1", "x"]
+        assemblyIds = [None, "assembly0", "x"]
+        for md5checksum in md5checksums:
+            for accession in accessions:
+                for assemblyId in assemblyIds:
+                    request = protocol.SearchReferenceSetsRequest()
+                    request.md5checksum = md5checksum
+                    request.accession = accession
+                    request.assemblyId = assemblyId
+                    ids = self._search(
+                        self.backend.runSearchReferenceSets, request,
+                        protocol.SearchReferenceSetsResponse,
+                        "referenceSets")
+                    expected = [
+                        obj.getId() for obj in referenceSets
+                        if self._matches(obj, md5checksum, accession) and
+                        assemblyId in (None, obj.getAssemblyId())]
+                    self.assertEqual(ids, expected)
+        self.assertEqual(
+            len(self.backend.getReferenceSetsByMd5Checksum(
+                referenceSets[1].getMd5Checksum())), 2)
+
+    def testSearchReferences(self):
+        for referenceSet in self.backend.getReferenceSets():
+            references_ = referenceSet.getReferences()
+            md5checksums = [None, references_[0].getMd5Checksum(), "x"]
+            accessions = [None, "acc0", "acc2", "x"]
+            for md5checksum in md5checksums:
+                for accession in accessions:
+                    request = protocol.SearchReferencesRequest()
+                    request.referenceSetId = referenceSet.getId()
+                    request.md5checksum = md5checksum
+                    request.accession = accession
+                    ids = self._search(
+                        self.backend.runSearchReferences, request,
+                        protocol.SearchReferencesResponse, "references")
+                    expected = [
+                        obj.getId() for obj in references_
+                        if self._matches(obj, md5checksum, accession)]
+                    self.assertEqual(ids, expected)
+            self.assertEqual(
+                len(referenceSet.getReferencesByMd5Checksum(
+                    references_[0].getMd5Checksum())), 2)
+
+    def testIndexesPublishedWhenComplete(self):
+        # A lookup made while an index is being built, as by another
+        # thread, must not see the partially built index.
+        referenceSets = self.backend.getReferenceSets()
+        referenceSet = referenceSets[1]
+        references_ = referenceSet.getReferences()
+        lookups = []
+
+        def lookupWhileBuilding(obj, lookup, md5checksum):
+            checksum = obj.getMd5Checksum()
+            calls = []
+
+            def getMd5Checksum():
+                calls.append(None)
+                if len(calls) == 1:
+                    lookups.append(lookup(md5checksum))
+                return checksum
+            return mock.patch.object(
+                obj, "getMd5Checksum", side_effect=getMd5Checksum)
+
+        with lookupWhileBuilding(
+                references_[-1], referenceSet.getReferencesByMd5Checksum,
+                references_[0].getMd5Checksum()):
+            referenceSet.getReferencesByMd5Checksum("x")
+        self.assertEqual(lookups, [[references_[0], references_[3]]])
+        del lookups[:]
+        with lookupWhileBuilding(
+                referenceSets[-1], self.backend.getReferenceSetsByMd5Checksum,
+                referenceSets[1].getMd5Checksum()):
+            self.backend.getReferenceSetsByMd5Checksum("x")
+        self.assertEqual(lookups, [[referenceSets[1], referenceSets[5]]])
+
+
 class TestTopLevelObjectGenerator(unittest.TestCase):
     """
     Tests the generator used for top level objects
@@ -0,0 +1,127 @@
+"""
+Tests for the backend benchmarks
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import StringIO
+import copy
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+import ga4gh.benchmark as benchmark
+import ga4gh.cli as cli
+
+
+class TestBenchmark(unittest.TestCase):
+    """
+    Tests the benchmark cases, reports and baseline comparisons.
+    """
+    def setUp(self):
+        self.backend = benchmark.getSimulatedBackend(2, 10**4)
+        self.benchmark = benchmark.BackendBenchmark(
+            "simulated", self.backend, pageSizes=[5],
+            sampleCounts=[0, 2, 10], rangeWidths=[100, 10**6], numRepeats=2,
+            pageLimit=2)
+        self.tempDir = tempfile.mkdtemp(prefix="ga4gh_benchmark")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def testCases(self):
+        endpoints = set(
+            endpoint for endpoint, _, _ in self.benchmark.getCases())
+        runMethods = set(
+            name[len("run"):] for name in dir(self.backend)
+            if name.startswith("run") and name not in [
+                "runGetRequest", "runSearchRequest"])
+        self.assertEqual(
+            set(endpoint[0].upper() + endpoint[1:] for endpoint in endpoints),
+            runMethods)
+        # Sample counts and range widths are capped at the available
+        # call sets and reference length.
+        variantCases = [
+            parameters for endpoint, parameters, _ in self.benchmark.getCases()
+            if endpoint == "searchVariants"]
+        self.assertEqual(
+            sorted((case["rangeWidth"], case["numSamples"])
+                   for case in variantCases),
+            [(100, 0), (100, 2), (10**4, 0), (10**4, 2)])
+
+    def testRun(self):
+        report = benchmark.runBenchmarks([self.benchmark])
+        json.dumps(report)
+        cases = report["cases"]
+        # Coverage is not available from the simulated backend
+        self.assertNotIn("simulated/listCoverage/rangeWidth=100", cases)
+        result = cases[
+            "simulated/searchVariants/numSamples=2/pageSize=5/"
+            "rangeWidth=10000"]
+        self.assertEqual(result["endpoint"], "searchVariants")
+        self.assertEqual(result["numRequests"], 4)
+        latency = result["latency"]
+        self.assertLessEqual(latency["p50"], latency["p95"])
+        self.assertLessEqual(latency["p95"], latency["max"])
+        self.assertGreater(result["requestsPerSecond"], 0)
+        self.assertGreater(result["bytesPerSecond"], 0)
+        self.assertGreater(result["peakRss"], 0)
+        self.assertGreater(result["numObjects"], 0)
+        for phases in [result["phases"], result["phasesPerObject"]]:
+            self.assertEqual(
+                set(phases.keys()),
+                set(["parse", "validate", "fetch", "serialize",
+                     "validateResponse"]))
+        self.assertNotIn("phases", cases["simulated/getDataset"])
+        self.assertEqual(
+            cases["simulated/getDataset"]["numRequests"], 2)
+
+    def testCompareToBaseline(self):
+        report = benchmark.runBenchmarks([self.benchmark])
+        self.assertEqual(benchmark.compareToBaseline(report, report), [])
+        baseline = copy.deepcopy(report)
+        name = "simulated/getReference"
+        baseline["cases"][name]["latency"]["p95"] = (
+            report["cases"][name]["latency"]["p95"] / 2)
+        del baseline["cases"]["simulated/getDataset"]
+        self.assertEqual(
+            benchmark.compareToBaseline(report, baseline),
+            [(name, "p95", baseline["cases"][name]["latency"]["p95"],
+              report["cases"][name]["latency"]["p95"])])
+        self.assertEqual(
+            benchmark.compareToBaseline(report, baseline, tolerance=1.5), [])
+
+    def testCli(self):
+        outputPath = os.path.join(self.tempDir, "report.json")
+        args = [
+            "--pageSizes", "10", "--sampleCounts", "1",
+            "--rangeWidths", "100", "--repeatLimit", "1", "-O", outputPath]
+        cli.benchmark_main(args)
+        with open(outputPath) as outputFile:
+            report = json.load(outputFile)
+        self.assertIn(
+            "simulated/searchReads/pageSize=10/rangeWidth=100",
+            report["cases"])
+        for result in report["cases"].values():
+            result["latency"] = {"p50": 0, "p95": 0, "max": 0}
+        baselinePath = os.path.join(self.tempDir, "baseline.json")
+        with open(baselinePath, "w") as baselineFile:
+            json.dump(report, baselineFile)
+        # The regressions are reported on stderr, which is captured so
+        # that they do not clutter the output of the tests.
+        with mock.patch("sys.stderr", new_callable=StringIO.StringIO) as \
+                stderr:
+            with self.assertRaises(SystemExit) as context:
+                cli.benchmark_main(args + ["--baseline", baselinePath])
+        lines = stderr.getvalue().splitlines()
+        self.assertGreater(len(lines), 0)
+        self.assertEqual(
+            context.exception.code,
+            "{} latency regressions".format(len(lines)))
+        for line in lines:
+            self.assertIn("baseline 0.000000s", line)
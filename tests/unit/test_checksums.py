@@ -0,0 +1,122 @@
+"""
+Tests for the streaming computation of reference MD5 checksums
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import glob
+import hashlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import pysam
+
+import ga4gh.cli as cli
+import ga4gh.datamodel.checksums as checksums
+import ga4gh.datamodel.references as references
+
+
+class TestChecksums(unittest.TestCase):
+    """
+    Tests the computation, writing and verification of the MD5 checksums
+    of the sequences in FASTA files.
+    """
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp(prefix="ga4gh_checksums")
+        rng = random.Random(1)
+        self.sequences = [
+            (name, "".join(rng.choice("ACGTNacgtn") for _ in range(length)))
+            for name, length in [("seq1", 1000), ("seq2", 7), ("seq3", 250)]]
+        self.multiFastaPath = self._writeFasta("multi", self.sequences)
+        self.singleFastaPath = self._writeFasta("seq2", self.sequences[1:2])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def _writeFasta(self, name, sequences):
+        fastaPath = os.path.join(self.tempDir, name + ".fa")
+        with open(fastaPath, "w") as fastaFile:
+            for referenceName, bases in sequences:
+                print(">" + referenceName, file=fastaFile)
+                for i in range(0, len(bases), 60):
+                    print(bases[i:i + 60], file=fastaFile)
+        pysam.tabix_compress(fastaPath, fastaPath + ".gz")
+        os.unlink(fastaPath)
+        pysam.faidx(str(fastaPath + ".gz"))
+        return fastaPath + ".gz"
+
+    def _getMd5Checksum(self, bases):
+        return hashlib.md5(bases.upper()).hexdigest()
+
+    def _readMetadata(self, fastaPath):
+        with open(references.getReferenceMetadataFilePath(
+                fastaPath)) as metadataFile:
+            return json.load(metadataFile)
+
+    def testNormaliseBases(self):
+        self.assertEqual(checksums.normaliseBases("acgT N\t*n"), "ACGTN*N")
+
+    def testComputeMd5Checksum(self):
+        for name, bases in self.sequences:
+            for chunkSize in [1, 13, 2**22]:
+                self.assertEqual(
+                    checksums.computeMd5Checksum(
+                        self.multiFastaPath, name, chunkSize),
+                    self._getMd5Checksum(bases))
+
+    def testComputeMd5ChecksumsInParallel(self):
+        fastaPaths = [self.multiFastaPath, self.singleFastaPath]
+        serial = checksums.computeMd5Checksums(fastaPaths, 1, 100)
+        parallel = checksums.computeMd5Checksums(fastaPaths, 3, 100)
+        self.assertEqual(serial, parallel)
+        self.assertEqual(len(serial), 4)
+        self.assertEqual(
+            serial[self.singleFastaPath, "seq2"],
+            self._getMd5Checksum(self.sequences[1][1]))
+
+    def testWriteAndVerify(self):
+        fastaPaths = [self.multiFastaPath, self.singleFastaPath]
+        cli.reference_checksums_main(["--workers", "2"] + fastaPaths)
+        manifest = self._readMetadata(self.multiFastaPath)
+        for name, bases in self.sequences:
+            referenceMetadata = manifest[references.MANIFEST_REFERENCES_KEY][
+                name]
+            self.assertEqual(
+                referenceMetadata["md5checksum"],
+                self._getMd5Checksum(bases))
+            self.assertEqual(referenceMetadata["sourceAccessions"], [])
+        metadata = self._readMetadata(self.singleFastaPath)
+        self.assertEqual(
+            metadata["md5checksum"],
+            self._getMd5Checksum(self.sequences[1][1]))
+        cli.reference_checksums_main(["--verify"] + fastaPaths)
+        # Corrupt one of the checksums
+        metadata["md5checksum"] = "0" * 32
+        with open(references.getReferenceMetadataFilePath(
+                self.singleFastaPath), "w") as metadataFile:
+            json.dump(metadata, metadataFile)
+        with self.assertRaises(SystemExit):
+            cli.reference_checksums_main(["--verify"] + fastaPaths)
+
+    def testExistingMetadataIsKept(self):
+        metadata = dict(checksums.DEFAULT_REFERENCE_METADATA)
+        metadata["sourceAccessions"] = ["ACC.1"]
+        metadata["md5checksum"] = "0" * 32
+        with open(references.getReferenceMetadataFilePath(
+                self.singleFastaPath), "w") as metadataFile:
+            json.dump(metadata, metadataFile)
+        cli.reference_checksums_main(["--workers", "1", self.singleFastaPath])
+        metadata = self._readMetadata(self.singleFastaPath)
+        self.assertEqual(metadata["sourceAccessions"], ["ACC.1"])
+        self.assertEqual(
+            metadata["md5checksum"],
+            self._getMd5Checksum(self.sequences[1][1]))
+
+    def testTestDataChecksums(self):
+        cli.reference_checksums_main(
+            ["--verify"] + glob.glob("tests/data/referenceSets/*/*.fa.gz"))
@@ -0,0 +1,185 @@
+"""
+Tests for filling in the reference sequence of CIGAR units
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import pysam
+
+import ga4gh.backend as backend
+import ga4gh.datamodel.reads as reads
+import ga4gh.datamodel.references as references
+import ga4gh.protocol as protocol
+
+
+class CountingReference(object):
+    """
+    A wrapper around a reference that counts the calls to getBases.
+    """
+    def __init__(self, reference):
+        self._reference = reference
+        self.numGetBasesCalls = 0
+
+    def getLength(self):
+        return self._reference.getLength()
+
+    def getBases(self, start, end):
+        self.numGetBasesCalls += 1
+        return self._reference.getBases(start, end)
+
+
+class TestCigarReferenceSequenceFiller(unittest.TestCase):
+    """
+    Tests the filling of CIGAR units from a sliding window of reference
+    bases.
+    """
+    def setUp(self):
+        referenceSet = references.SimulatedReferenceSet("test")
+        self.reference = referenceSet.getReferences()[0]
+        self.bases = self.reference.getBases(0, self.reference.getLength())
+
+    def _makeReadAlignment(self, position, cigar):
+        readAlignment = protocol.ReadAlignment()
+        readAlignment.alignment = protocol.LinearAlignment()
+        readAlignment.alignment.position = protocol.Position()
+        readAlignment.alignment.position.position = position
+        readAlignment.alignment.cigar = []
+        for operation, length in cigar:
+            cigarUnit = protocol.CigarUnit()
+            cigarUnit.operation = operation
+            cigarUnit.operationLength = length
+            readAlignment.alignment.cigar.append(cigarUnit)
+        return readAlignment
+
+    def testFill(self):
+        ops = protocol.CigarOperation
+        cigar = [
+            (ops.CLIP_SOFT, 3), (ops.ALIGNMENT_MATCH, 5), (ops.DELETE, 3),
+            (ops.INSERT, 2), (ops.SEQUENCE_MATCH, 2),
+            (ops.SEQUENCE_MISMATCH, 1), (ops.SKIP, 4), (ops.DELETE, 1),
+            (ops.ALIGNMENT_MATCH, 2)]
+        filler = reads.CigarReferenceSequenceFiller(self.reference)
+        readAlignment = filler.fill(self._makeReadAlignment(10, cigar))
+        expected = [
+            None, None, self.bases[15:18], None, None, self.bases[20:21],
+            None, self.bases[25:26], None]
+        self.assertEqual(
+            [cigarUnit.referenceSequence for cigarUnit in
+             readAlignment.alignment.cigar], expected)
+
+    def testWindowFetchedOnce(self):
+        ops = protocol.CigarOperation
+        cigar = [(ops.ALIGNMENT_MATCH, 4), (ops.DELETE, 2)]
+        reference = CountingReference(self.reference)
+        filler = reads.CigarReferenceSequenceFiller(reference, 100)
+        for position in range(0, 90, 3):
+            readAlignment = filler.fill(self._makeReadAlignment(
+                position, cigar))
+            self.assertEqual(
+                readAlignment.alignment.cigar[1].referenceSequence,
+                self.bases[position + 4:position + 6])
+        self.assertEqual(reference.numGetBasesCalls, 1)
+        filler.fill(self._makeReadAlignment(120, cigar))
+        self.assertEqual(reference.numGetBasesCalls, 2)
+
+    def testBeyondReferenceEnd(self):
+        ops = protocol.CigarOperation
+        length = self.reference.getLength()
+        cigar = [(ops.ALIGNMENT_MATCH, 4), (ops.DELETE, 2)]
+        filler = reads.CigarReferenceSequenceFiller(self.reference)
+        for position in [length - 5, length + 10]:
+            readAlignment = filler.fill(self._makeReadAlignment(
+                position, cigar))
+            self.assertIsNone(
+                readAlignment.alignment.cigar[1].referenceSequence)
+        readAlignment = filler.fill(self._makeReadAlignment(
+            length - 6, cigar))
+        self.assertEqual(
+            readAlignment.alignment.cigar[1].referenceSequence,
+            self.bases[length - 2:])
+
+
+class TestFillReferenceSequenceSearch(unittest.TestCase):
+    """
+    Tests that reads searches fill in the reference sequence only when
+    asked to.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.tempDir = tempfile.mkdtemp(prefix="ga4gh_cigar_reference")
+        cls.dataDir = os.path.join(cls.tempDir, "data")
+        shutil.copytree("tests/data", cls.dataDir)
+        # Replace the short test reference with one covering all the reads
+        rng = random.Random(1)
+        cls.bases = "".join(rng.choice("ACGT") for _ in range(599))
+        referenceSetDir = os.path.join(
+            cls.dataDir, "referenceSets", "Default")
+        fastaPath = os.path.join(referenceSetDir, "chr17.fa")
+        for filename in os.listdir(referenceSetDir):
+            if filename.startswith("chr17.fa"):
+                os.unlink(os.path.join(referenceSetDir, filename))
+        with open(fastaPath, "w") as fastaFile:
+            print(">chr17", file=fastaFile)
+            print(cls.bases, file=fastaFile)
+        pysam.tabix_compress(fastaPath, fastaPath + ".gz")
+        os.unlink(fastaPath)
+        pysam.faidx(str(fastaPath + ".gz"))
+        metadataPath = os.path.join(referenceSetDir, "chr17.json")
+        with open(metadataPath) as metadataFile:
+            metadata = json.load(metadataFile)
+        metadata["md5checksum"] = hashlib.md5(cls.bases).hexdigest()
+        with open(metadataPath, "w") as metadataFile:
+            json.dump(metadata, metadataFile)
+        cls.backend = backend.FileSystemBackend(cls.dataDir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tempDir)
+
+    def _searchReads(self, fillReferenceSequence):
+        dataset = self.backend.getDatasets()[0]
+        readGroupSet = dataset.getReadGroupSetByName("chr17.1-250")
+        readGroup = readGroupSet.getReadGroups()[0]
+        reference = readGroupSet.getReferenceSet().getReferenceByName(
+            "chr17")
+        request = protocol.SearchReadsRequest()
+        request.readGroupIds = [readGroup.getId()]
+        request.referenceId = reference.getId()
+        request.start = 0
+        request.end = 250
+        response = protocol.SearchReadsResponse.fromJsonString(
+            self.backend.runSearchReads(
+                request.toJsonString(), fillReferenceSequence))
+        return response.alignments
+
+    def testFillReferenceSequence(self):
+        numDeletions = 0
+        for readAlignment in self._searchReads(True):
+            position = readAlignment.alignment.position.position
+            for cigarUnit in readAlignment.alignment.cigar:
+                if cigarUnit.operation == protocol.CigarOperation.DELETE:
+                    numDeletions += 1
+                    self.assertEqual(
+                        cigarUnit.referenceSequence,
+                        self.bases[
+                            position:position + cigarUnit.operationLength])
+                else:
+                    self.assertIsNone(cigarUnit.referenceSequence)
+                if (cigarUnit.operation in reads.CigarReferenceSequenceFiller.
+                        referenceConsumingOperations):
+                    position += cigarUnit.operationLength
+        self.assertGreater(numDeletions, 0)
+
+    def testNotFilledByDefault(self):
+        for readAlignment in self._searchReads(False):
+            for cigarUnit in readAlignment.alignment.cigar:
+                self.assertIsNone(cigarUnit.referenceSequence)
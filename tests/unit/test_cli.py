@@ -156,8 +156,12 @@ class TestClientArguments(unittest.TestCase):
         self.assertEqual(args.end, 10)
         self.assertEqual(args.readGroupIds, "READ,GROUP,IDS")
         self.assertEqual(args.referenceId, "REFERENCEID")
+        self.assertFalse(args.fillReferenceSequence)
         self.assertEqual(args.baseUrl, "BASEURL")
         self.assertEquals(args.runner, cli.SearchReadsRunner)
+        args = self.parser.parse_args(
+            (cliInput + " --fillReferenceSequence").split())
+        self.assertTrue(args.fillReferenceSequence)
 
     def testDatasetsSearchArguments(self):
         cliInput = "datasets-search BASEURL"
@@ -208,4 +212,8 @@ class TestClientArguments(unittest.TestCase):
         self.assertEqual(args.id, "ID")
         self.assertEqual(args.start, 1)
         self.assertEqual(args.end, 2)
+        self.assertIsNone(args.outputFile)
         self.assertEquals(args.runner, cli.ListReferenceBasesRunner)
+        cliInput = "references-list-bases BASEURL ID --outputFile bases.txt"
+        args = self.parser.parse_args(cliInput.split())
+        self.assertEqual(args.outputFile, "bases.txt")
@@ -5,6 +5,7 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import StringIO
 import unittest
 
 import mock
@@ -133,7 +134,19 @@ class TestSearchMethodsCallRunRequest(unittest.TestCase):
             self.readGroupIds, referenceId=self.referenceId,
             start=self.start, end=self.end)
         self.httpClient._runSearchRequest.assert_called_once_with(
-            request, "reads", protocol.SearchReadsResponse)
+            request, "reads", protocol.SearchReadsResponse, {})
+
+    def testSearchReadsFillReferenceSequence(self):
+        request = protocol.SearchReadsRequest()
+        request.readGroupIds = self.readGroupIds
+        request.referenceId = self.referenceId
+        request.pageSize = self.pageSize
+        self.httpClient.searchReads(
+            self.readGroupIds, referenceId=self.referenceId,
+            fillReferenceSequence=True)
+        self.httpClient._runSearchRequest.assert_called_once_with(
+            request, "reads", protocol.SearchReadsResponse,
+            {"fillReferenceSequence": True})
 
     def testGetReferenceSet(self):
         self.httpClient.getReferenceSet(self.objectId)
@@ -198,6 +211,10 @@ class DummyResponse(object):
         self.text = text
         self.status_code = 200
 
+    def iter_content(self, chunkSize):
+        for i in range(0, len(self.text), chunkSize):
+            yield self.text[i:i + chunkSize]
+
 
 class DummyRequestsSession(object):
     """
@@ -232,7 +249,7 @@ class DummyRequestsSession(object):
         assert contentType in self.headers
         assert self.headers[contentType] == "application/json"
 
-    def get(self, url, params):
+    def get(self, url, params, headers={}, stream=False):
         # TODO add some more checks for params to see if Key is set,
         # and we're not sending any extra stuff.
         self.checkSessionParameters()
@@ -250,6 +267,11 @@ class DummyRequestsSession(object):
             # This is all very ugly --- see the comments in the LocalClient
             # for why we need to do this. Definitely needs to be fixed.
             args = dict(params)
+            if headers.get("Accept") == "text/plain":
+                assert stream
+                start, end = self._backend.getReferenceBasesRange(id_, args)
+                return DummyResponse("".join(
+                    self._backend.runStreamReferenceBases(id_, start, end)))
             if args['end'] is None:
                 del args['end']
             if args['pageToken'] is None:
@@ -341,6 +363,15 @@ class ExhaustiveListingsMixin(object):
                 otherBases = datamodelReference.getBases(
                     0, datamodelReference.getLength())
                 self.assertEqual(bases, otherBases)
+                outputFile = StringIO.StringIO()
+                numBases = self.client.writeReferenceBases(
+                    datamodelReference.getId(), outputFile)
+                self.assertEqual(numBases, len(otherBases))
+                self.assertEqual(outputFile.getvalue(), otherBases)
+                outputFile = StringIO.StringIO()
+                self.client.writeReferenceBases(
+                    datamodelReference.getId(), outputFile, 1, 5)
+                self.assertEqual(outputFile.getvalue(), otherBases[1:5])
 
     def testAllVariantSets(self):
         for dataset in self.client.searchDatasets():
@@ -390,9 +421,8 @@ class ExhaustiveListingsMixin(object):
                 dmReferenceSet = dmReadGroupSet.getReferenceSet()
                 for dmReadGroup in dmReadGroupSet.getReadGroups():
                     for dmReference in dmReferenceSet.getReferences():
-                        # TODO fix these coordinates.
                         start = 0
-                        end = 10
+                        end = dmReference.getLength()
                         dmReads = list(dmReadGroup.getReadAlignments(
                             dmReference, start, end))
                         reads = list(self.client.searchReads(
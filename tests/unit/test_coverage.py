@@ -0,0 +1,141 @@
+"""
+Tests for the precomputed coverage tiles and the coverage endpoint
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+import pysam
+
+import ga4gh.backend as backend
+import ga4gh.datamodel.coverage as coverage
+import ga4gh.exceptions as exceptions
+
+
+class TestCoverageTiles(unittest.TestCase):
+    """
+    Tests that the coverage tiles agree with depths computed directly
+    from the reads.
+    """
+    binSizes = [4, 16, 64]
+    windowSize = 128
+    bamName = "chr17.1-250.bam"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tempDir = tempfile.mkdtemp(prefix="ga4gh_coverage")
+        cls.dataDir = os.path.join(cls.tempDir, "data")
+        shutil.copytree("tests/data", cls.dataDir)
+        cls.samFilePath = os.path.join(
+            cls.dataDir, "datasets", "dataset1", "reads", cls.bamName)
+        builder = coverage.CoverageTileBuilder(
+            cls.samFilePath, cls.binSizes, cls.windowSize)
+        builder.build()
+        cls.backend = backend.FileSystemBackend(cls.dataDir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tempDir)
+
+    def _getDepths(self, readGroupName, referenceName):
+        samFile = pysam.AlignmentFile(self.samFilePath)
+        length = samFile.lengths[samFile.references.index(referenceName)]
+        depths = numpy.zeros(length)
+        for read in samFile.fetch(referenceName.encode()):
+            if read.flag & coverage.EXCLUDED_FLAGS:
+                continue
+            if dict(read.tags).get('RG') != readGroupName:
+                continue
+            for start, end in read.get_blocks():
+                depths[start:end] += 1
+        return depths
+
+    def _getReadGroup(self, readGroupName):
+        dataset = self.backend.getDatasets()[0]
+        readGroupSet = dataset.getReadGroupSetByName(
+            self.bamName.split(".bam")[0])
+        for readGroup in readGroupSet.getReadGroups():
+            if readGroup.getLocalId() == readGroupName:
+                return readGroup
+
+    def testTilesMatchDepths(self):
+        tiles = coverage.CoverageTiles(self.samFilePath)
+        self.assertTrue(tiles.isAvailable())
+        self.assertEqual(tiles.getBinSizes(), self.binSizes)
+        for readGroupName in ["fish", "cow", "colt"]:
+            depths = self._getDepths(readGroupName, "chr17")
+            length = len(depths)
+            for binSize in [4, 16, 48, 64, 200]:
+                start, actualBinSize, means, maxima = tiles.getCoverage(
+                    readGroupName, "chr17", 0, length, binSize)
+                self.assertEqual(start, 0)
+                self.assertLessEqual(actualBinSize, binSize)
+                self.assertEqual(
+                    len(means), (length + actualBinSize - 1) // actualBinSize)
+                for i in range(len(means)):
+                    binDepths = depths[
+                        i * actualBinSize:(i + 1) * actualBinSize]
+                    self.assertAlmostEqual(
+                        means[i], binDepths.mean(), places=4)
+                    self.assertEqual(maxima[i], binDepths.max())
+
+    def testUnalignedStart(self):
+        tiles = coverage.CoverageTiles(self.samFilePath)
+        start, binSize, means, maxima = tiles.getCoverage(
+            "cow", "chr17", 37, 101, 16)
+        self.assertEqual(start, 32)
+        self.assertEqual(binSize, 16)
+        self.assertEqual(len(means), 5)
+
+    def testMissingTiles(self):
+        tiles = coverage.CoverageTiles(
+            os.path.join(self.tempDir, "doesNotExist.bam"))
+        self.assertFalse(tiles.isAvailable())
+
+    def testCoverageEndpoint(self):
+        readGroup = self._getReadGroup("fish")
+        reference = readGroup.getParentContainer().getReferenceSet(
+            ).getReferences()[0]
+        args = {
+            "referenceId": reference.getId(), "start": "1", "end": "9",
+            "binSize": "4"}
+        response = json.loads(
+            self.backend.runListCoverage(readGroup.getId(), args))
+        self.assertEqual(response["readGroupId"], readGroup.getId())
+        self.assertEqual(response["binSize"], 4)
+        self.assertEqual(response["start"], 0)
+        self.assertEqual(response["end"], 9)
+        self.assertEqual(len(response["meanDepth"]), 3)
+        self.assertEqual(len(response["maxDepth"]), 3)
+        depths = self._getDepths("fish", "chr17")
+        for i in range(3):
+            self.assertEqual(
+                response["maxDepth"][i], depths[i * 4:i * 4 + 4].max())
+
+    def testCoverageEndpointErrors(self):
+        readGroup = self._getReadGroup("fish")
+        reference = readGroup.getParentContainer().getReferenceSet(
+            ).getReferences()[0]
+        with self.assertRaises(exceptions.MissingRequestArgumentException):
+            self.backend.runListCoverage(readGroup.getId(), {})
+        args = {"referenceId": reference.getId(), "binSize": "0"}
+        with self.assertRaises(exceptions.BadCoverageBinSizeException):
+            self.backend.runListCoverage(readGroup.getId(), args)
+        args = {"referenceId": reference.getId(), "end": "100000"}
+        with self.assertRaises(exceptions.ReferenceRangeErrorException):
+            self.backend.runListCoverage(readGroup.getId(), args)
+        dataset = self.backend.getDatasets()[0]
+        for readGroupSet in dataset.getReadGroupSets():
+            if readGroupSet.getLocalId() != self.bamName.split(".bam")[0]:
+                otherReadGroup = readGroupSet.getReadGroups()[0]
+                break
+        with self.assertRaises(exceptions.CoverageNotAvailableException):
+            self.backend.runListCoverage(otherReadGroup.getId(), {
+                "referenceId": reference.getId()})
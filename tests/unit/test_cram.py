@@ -0,0 +1,155 @@
+"""
+Tests for CRAM read group sets and the reference sequence caches
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import pysam
+
+import ga4gh.backend as backend
+import ga4gh.datamodel as datamodel
+import ga4gh.datamodel.references as references
+import ga4gh.exceptions as exceptions
+
+
+class TestCram(unittest.TestCase):
+    """
+    Tests that a CRAM file is decoded using the server's own references
+    and gives exactly the same reads as the BAM file it was made from.
+    """
+    bamName = "chr17.1-250"
+    referenceSetName = "cramTest"
+    referenceName = "chr17"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tempDir = tempfile.mkdtemp(prefix="ga4gh_cram")
+        cls.dataDir = os.path.join(cls.tempDir, "data")
+        shutil.copytree("tests/data", cls.dataDir)
+        readsDir = os.path.join(cls.dataDir, "datasets", "dataset1", "reads")
+        bamFile = pysam.AlignmentFile(
+            os.path.join(readsDir, cls.bamName + ".bam"))
+        rng = random.Random(1)
+        cls.bases = "".join(
+            rng.choice("ACGT") for _ in range(bamFile.lengths[0]))
+        cls._writeReferenceSet()
+        # Write the CRAM against a temporary FASTA file that is removed
+        # before the CRAM is read, so that it can only be decoded using
+        # the reference set.
+        fastaPath = os.path.join(cls.tempDir, "temp.fa")
+        with open(fastaPath, "w") as fastaFile:
+            print(">" + cls.referenceName, file=fastaFile)
+            print(cls.bases, file=fastaFile)
+        pysam.faidx(str(fastaPath))
+        header = bamFile.header
+        for referenceInfo in header["SQ"]:
+            referenceInfo["AS"] = cls.referenceSetName
+        cramPath = os.path.join(readsDir, "cramTest.cram")
+        cramFile = pysam.AlignmentFile(
+            cramPath, b"wc", header=header, reference_filename=fastaPath)
+        for read in bamFile.fetch(until_eof=True):
+            cramFile.write(read)
+        cramFile.close()
+        pysam.index(str(cramPath))
+        os.unlink(fastaPath)
+        os.unlink(fastaPath + ".fai")
+        cls.referenceCacheDir = os.path.join(cls.tempDir, "refCache")
+        references.md5ReferenceDirectory.setDirectory(cls.referenceCacheDir)
+        cls.backend = backend.FileSystemBackend(cls.dataDir)
+        cls.dataset = cls.backend.getDatasets()[0]
+
+    @classmethod
+    def _writeReferenceSet(cls):
+        referenceSetsDir = os.path.join(cls.dataDir, "referenceSets")
+        referenceSetDir = os.path.join(
+            referenceSetsDir, cls.referenceSetName)
+        os.mkdir(referenceSetDir)
+        with open(referenceSetDir + ".json", "w") as metadataFile:
+            json.dump({
+                "assemblyId": cls.referenceSetName,
+                "description": "CRAM test reference set",
+                "isDerived": False, "ncbiTaxonId": 9606,
+                "sourceAccessions": [], "sourceUri": None}, metadataFile)
+        fastaPath = os.path.join(
+            referenceSetDir, cls.referenceName + ".fa")
+        with open(fastaPath, "w") as fastaFile:
+            print(">" + cls.referenceName, file=fastaFile)
+            for i in range(0, len(cls.bases), 60):
+                print(cls.bases[i:i + 60], file=fastaFile)
+        pysam.tabix_compress(fastaPath, fastaPath + ".gz")
+        os.unlink(fastaPath)
+        pysam.faidx(str(fastaPath + ".gz"))
+        metadataPath = os.path.join(
+            referenceSetDir, cls.referenceName + ".json")
+        with open(metadataPath, "w") as metadataFile:
+            json.dump({
+                "md5checksum": hashlib.md5(cls.bases).hexdigest(),
+                "sourceUri": None, "ncbiTaxonId": 9606,
+                "isDerived": False, "sourceDivergence": None,
+                "sourceAccessions": []}, metadataFile)
+
+    @classmethod
+    def tearDownClass(cls):
+        references.md5ReferenceDirectory.setDirectory(None)
+        datamodel.fileHandleCache.clear()
+        shutil.rmtree(cls.tempDir)
+
+    def _getReads(self, readGroupSet, start, end):
+        reference = readGroupSet.getReferenceSet().getReferenceByName(
+            self.referenceName)
+        ret = []
+        for readGroup in readGroupSet.getReadGroups():
+            for read in readGroup.getReadAlignments(reference, start, end):
+                read = read.toJsonDict()
+                del read["id"]
+                del read["readGroupId"]
+                # htslib regenerates the MD and NM tags when decoding CRAM
+                read["info"].pop("MD", None)
+                read["info"].pop("NM", None)
+                ret.append((readGroup.getLocalId(), read))
+        return ret
+
+    def testReadsMatchBam(self):
+        bamReadGroupSet = self.dataset.getReadGroupSetByName(self.bamName)
+        cramReadGroupSet = self.dataset.getReadGroupSetByName("cramTest")
+        self.assertEqual(
+            cramReadGroupSet.getReferenceSet().getLocalId(),
+            self.referenceSetName)
+        for start, end in [(0, 599), (50, 120), (200, 201)]:
+            bamReads = self._getReads(bamReadGroupSet, start, end)
+            cramReads = self._getReads(cramReadGroupSet, start, end)
+            self.assertEqual(bamReads, cramReads)
+            if end - start > 1:
+                self.assertGreater(len(bamReads), 0)
+
+    def testReferenceDirectory(self):
+        md5checksum = hashlib.md5(self.bases).hexdigest()
+        path = os.path.join(self.referenceCacheDir, md5checksum)
+        with open(path) as sequenceFile:
+            self.assertEqual(sequenceFile.read(), self.bases)
+        self.assertEqual(
+            os.environ["REF_PATH"].split(":")[0],
+            os.path.join(self.referenceCacheDir, "%s"))
+
+    def testCramReadCounts(self):
+        cramReadGroupSet = self.dataset.getReadGroupSetByName("cramTest")
+        self.assertEqual(cramReadGroupSet.getNumAlignedReads(), -1)
+        self.assertEqual(cramReadGroupSet.getNumUnalignedReads(), -1)
+
+    def testMd5Mismatch(self):
+        referenceSet = references.SimulatedReferenceSet("mismatch")
+        reference = referenceSet.getReferences()[0]
+        reference._md5checksum = "0" * 32
+        with self.assertRaises(exceptions.ReferenceMd5MismatchException):
+            references.md5ReferenceDirectory.addReference(reference)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.referenceCacheDir, reference._md5checksum)))
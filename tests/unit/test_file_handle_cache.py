@@ -9,6 +9,7 @@ from __future__ import unicode_literals
 import os
 import shutil
 import tempfile
+import threading
 import unittest
 import uuid
 
@@ -39,28 +40,67 @@ class TestFileHandleCache(datamodel.PysamFileHandleCache, unittest.TestCase):
         # Build a list of 10 files and add their handles to the cache
         fileList = map(genFileName, range(0, 10))
 
+        cache, memoTable = self._getThreadState()
         for f in fileList:
             handle = self._getFileHandle(f)
-            self.assertEquals(self._cache.count((f, handle)), 1)
+            self.assertEquals(cache.count((f, handle)), 1)
 
-        self.assertEquals(len(self._memoTable), len(self._cache))
+        self.assertEquals(len(memoTable), len(cache))
 
         # Ensure that the first added file has been removed from the cache
-        self.assertEquals(filter(lambda x: x[0] == fileList[0], self._cache),
+        self.assertEquals(filter(lambda x: x[0] == fileList[0], cache),
                           [])
 
-        topIndex = len(self._cache) - 1
+        topIndex = len(cache) - 1
 
         # Update priority of this file and ensure it's no longer the
         # least recently used
-        self.assertEquals(self._cache[topIndex][0], fileList[1])
+        self.assertEquals(cache[topIndex][0], fileList[1])
         self._getFileHandle(fileList[1])
-        self.assertNotEqual(self._cache[topIndex][0], fileList[1])
-        self.assertEquals(self._cache[0][0], fileList[1])
+        self.assertNotEqual(cache[topIndex][0], fileList[1])
+        self.assertEquals(cache[0][0], fileList[1])
 
     def testSetCacheMaxSize(self):
         self.assertRaises(ValueError, self.setMaxCacheSize, 0)
         self.assertRaises(ValueError, self.setMaxCacheSize, -1)
 
+    def testThreadsHaveSeparateHandles(self):
+        dataFile = os.path.join(self._tempdir, "file")
+        handle = self._getFileHandle(dataFile)
+        handles = []
+        thread = threading.Thread(
+            target=lambda: handles.append(self._getFileHandle(dataFile)))
+        thread.start()
+        thread.join()
+        self.assertEqual(len(handles), 1)
+        self.assertIsNot(handles[0], handle)
+        self.assertIs(self._getFileHandle(dataFile), handle)
+        self.assertEqual(self.getCachedFiles(), [dataFile])
+        # Clearing the cache closes the handles of every thread.
+        self.clear()
+        self.assertTrue(handle.closed)
+        self.assertTrue(handles[0].closed)
+        self.assertEqual(self.getCachedFiles(), [])
+
+    def testExitedThreadHandlesClosed(self):
+        handles = []
+
+        def openFile(name):
+            handles.append(self._getFileHandle(
+                os.path.join(self._tempdir, name)))
+
+        thread = threading.Thread(target=openFile, args=("a",))
+        thread.start()
+        thread.join()
+        self.assertFalse(handles[0].closed)
+        # The handles of the exited thread are closed when the next
+        # thread starts using the cache.
+        thread = threading.Thread(target=openFile, args=("b",))
+        thread.start()
+        thread.join()
+        self.assertTrue(handles[0].closed)
+        self.assertFalse(handles[1].closed)
+        self.clear()
+
     def tearDown(self):
         shutil.rmtree(self._tempdir)
@@ -154,16 +154,29 @@ class ImportGraphLayerChecker(object):
     # each file/module is in one and only one moduleGroup
     moduleGroupNames = {
         'cli': ['ga4gh/cli.py'],
+        'benchmark': ['ga4gh/benchmark.py',
+                      'ga4gh/loadtest.py'],
         'client': ['ga4gh/client.py'],
-        'frontend': ['ga4gh/frontend.py'],
+        'frontend': ['ga4gh/asyncserver.py',
+                     'ga4gh/frontend.py',
+                     'ga4gh/prefork.py'],
         'backend': ['ga4gh/backend.py'],
         'exceptions': ['ga4gh/exceptions.py'],
-        'datamodel': ['ga4gh/datamodel/reads.py',
+        'profiling': ['ga4gh/profiling.py'],
+        'datamodel': ['ga4gh/datamodel/checksums.py',
+                      'ga4gh/datamodel/coverage.py',
+                      'ga4gh/datamodel/packed.py',
+                      'ga4gh/datamodel/parallel.py',
+                      'ga4gh/datamodel/reads.py',
                       'ga4gh/datamodel/references.py',
+                      'ga4gh/datamodel/synthetic.py',
                       'ga4gh/datamodel/variants.py',
                       'ga4gh/datamodel/datasets.py'],
-        'libraries': ['ga4gh/converters.py',
-                      'ga4gh/configtest.py'],
+        'libraries': ['ga4gh/admission.py',
+                      'ga4gh/converters.py',
+                      'ga4gh/configtest.py',
+                      'ga4gh/metrics.py',
+                      'ga4gh/tokenstore.py'],
         'protocol': ['ga4gh/protocol.py',
                      'ga4gh/_protocol_definitions.py'],
         'config': ['ga4gh/serverconfig.py'],
@@ -173,11 +186,13 @@ class ImportGraphLayerChecker(object):
     # each moduleGroupName has one and only one entry here
     layers = [
         ['cli'],
+        ['benchmark'],
         ['client'],
         ['frontend'],
         ['backend'],
         ['libraries'],
         ['datamodel'],
+        ['profiling'],
         ['exceptions'],
         ['avrotools'],
         ['config'],
@@ -0,0 +1,177 @@
+"""
+Tests for the HTTP load testing tool
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import werkzeug.serving
+
+import ga4gh.cli as cli
+import ga4gh.frontend as frontend
+import ga4gh.loadtest as loadtest
+import ga4gh.protocol as protocol
+
+
+class TestLoadTest(unittest.TestCase):
+    """
+    Tests the load tester against a server running in a separate thread,
+    replaying both scenario files and the server's own request log.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.tempDir = tempfile.mkdtemp(prefix="ga4gh_loadtest")
+        cls.requestLogFile = os.path.join(cls.tempDir, "requests.log")
+        frontend.reset()
+        frontend.configure(baseConfig="TestConfig", extraConfig={
+            "DATA_SOURCE": "__SIMULATED__",
+            "REQUEST_LOG_FILE": cls.requestLogFile,
+            "SERVER_TIMING_HEADER": True})
+        logging.getLogger('werkzeug').setLevel(logging.CRITICAL)
+        cls.server = werkzeug.serving.make_server(
+            "127.0.0.1", 0, frontend.app, threaded=True)
+        cls.serverThread = threading.Thread(target=cls.server.serve_forever)
+        cls.serverThread.daemon = True
+        cls.serverThread.start()
+        cls.urlPrefix = "http://127.0.0.1:{}".format(cls.server.server_port)
+        dataset = frontend.app.backend.getDatasets()[0]
+        cls.datasetId = dataset.getId()
+        cls.variantSetId = dataset.getVariantSets()[0].getId()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        frontend.app.requestLog = None
+        shutil.rmtree(cls.tempDir)
+
+    def _getTemplates(self):
+        searchRequest = protocol.SearchVariantsRequest()
+        searchRequest.variantSetId = self.variantSetId
+        searchRequest.referenceName = "1"
+        searchRequest.start = 0
+        searchRequest.end = 100
+        searchRequest.callSetIds = []
+        return [
+            loadtest.RequestTemplate(
+                "POST", "variants/search", body=searchRequest.toJsonDict(),
+                weight=3),
+            loadtest.RequestTemplate(
+                "GET", "datasets/{}".format(self.datasetId)),
+            loadtest.RequestTemplate("GET", "datasets/notAnId", weight=0.5),
+        ]
+
+    def testEndpointNames(self):
+        self.assertEqual(
+            loadtest.getEndpointName("POST", "/variants/search"),
+            "POST /variants/search")
+        self.assertEqual(
+            loadtest.getEndpointName("GET", "references/abc/bases"),
+            "GET /references/<id>/bases")
+
+    def testLoadGenerator(self):
+        loadGenerator = loadtest.LoadGenerator(
+            self.urlPrefix, self._getTemplates(), concurrency=3,
+            numRequests=60)
+        report = loadGenerator.run()
+        self.assertEqual(report["numRequests"], 60)
+        endpoints = report["endpoints"]
+        self.assertEqual(
+            set(endpoints.keys()),
+            set(["POST /variants/search", "GET /datasets/<id>"]))
+        self.assertEqual(
+            sum(endpoint["numRequests"] for endpoint in endpoints.values()),
+            60)
+        searches = endpoints["POST /variants/search"]
+        self.assertEqual(searches["numErrors"], 0)
+        self.assertEqual(searches["statusCodes"].keys(), ["200"])
+        # The 404s for the unknown dataset are counted as errors
+        gets = endpoints["GET /datasets/<id>"]
+        self.assertEqual(gets["statusCodes"].get("404"), gets["numErrors"])
+        self.assertEqual(report["numErrors"], gets["numErrors"])
+        histogram = searches["histogram"]
+        self.assertEqual(histogram[-1], {
+            "le": "+Inf", "count": searches["numRequests"]})
+        counts = [bucket["count"] for bucket in histogram]
+        self.assertEqual(counts, sorted(counts))
+        self.assertGreater(report["throughput"], 0)
+        self.assertGreater(searches["serverTiming"]["fetch"], 0)
+        self.assertNotIn("serverTiming", gets)
+        self.assertNotIn("lateness", searches)
+
+    def testRate(self):
+        loadGenerator = loadtest.LoadGenerator(
+            self.urlPrefix, self._getTemplates()[:1], concurrency=2,
+            rate=100, duration=0.2)
+        report = loadGenerator.run()
+        self.assertLessEqual(report["numRequests"], 20)
+        self.assertGreaterEqual(report["elapsedTime"], 0.15)
+        self.assertIn("lateness", report["endpoints"].values()[0])
+
+    def testRateLatencyIncludesLateness(self):
+        # A single worker cannot keep up with this rate, so each request
+        # starts later than scheduled and the delay counts as latency.
+        loadGenerator = loadtest.LoadGenerator(
+            self.urlPrefix, self._getTemplates()[:1], concurrency=1,
+            rate=10**6, numRequests=20)
+        report = loadGenerator.run()
+        searches = report["endpoints"]["POST /variants/search"]
+        self.assertGreater(searches["lateness"]["max"], 0)
+        self.assertGreaterEqual(
+            searches["latency"]["max"], searches["lateness"]["max"])
+        # The last request waited for all of the others.
+        self.assertGreaterEqual(
+            searches["latency"]["max"], report["elapsedTime"] * 0.9)
+
+    def testFindSaturation(self):
+        runs = [
+            {"concurrency": 1, "throughput": 100},
+            {"concurrency": 2, "throughput": 190},
+            {"concurrency": 4, "throughput": 200},
+            {"concurrency": 8, "throughput": 300}]
+        self.assertEqual(loadtest.findSaturation(runs)["concurrency"], 2)
+        self.assertEqual(
+            loadtest.findSaturation(runs, 0.01)["concurrency"], 8)
+        self.assertEqual(
+            loadtest.findSaturation(runs, 1.0)["concurrency"], 1)
+
+    def testReplayRequestLog(self):
+        open(self.requestLogFile, "w").close()
+        cli.loadtest_main([
+            self.urlPrefix, "--scenario", self._writeScenario(),
+            "--numRequests", "20", "-O", os.devnull])
+        templates = loadtest.readRequestLog(self.requestLogFile)
+        self.assertEqual(len(templates), 20)
+        for template in templates:
+            self.assertNotIn("key", template.params)
+        outputFile = os.path.join(self.tempDir, "report.json")
+        cli.loadtest_main([
+            self.urlPrefix, "--requestLog", self.requestLogFile,
+            "--numRequests", "10", "--concurrency", "1,2", "-O", outputFile])
+        with open(outputFile) as reportFile:
+            report = json.load(reportFile)
+        self.assertEqual(
+            [run["concurrency"] for run in report["runs"]], [1, 2])
+        self.assertIn(report["saturation"]["concurrency"], [1, 2])
+        for run in report["runs"]:
+            self.assertEqual(run["numRequests"], 10)
+            self.assertEqual(run["numErrors"], 0)
+
+    def _writeScenario(self):
+        scenario = {"requests": [
+            {"method": "POST", "path": "/variantsets/search",
+             "body": {"datasetId": self.datasetId}, "weight": 2},
+            {"method": "GET", "path": "/datasets/{}".format(self.datasetId),
+             "params": {"key": "secret"}}]}
+        path = os.path.join(self.tempDir, "scenario.json")
+        with open(path, "w") as scenarioFile:
+            json.dump(scenario, scenarioFile)
+        return path
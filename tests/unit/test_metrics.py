@@ -0,0 +1,232 @@
+"""
+Tests for the request metrics and the /metrics endpoint
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import glob
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import mock
+
+import ga4gh.frontend as frontend
+import ga4gh.metrics as metrics
+import ga4gh.protocol as protocol
+
+
+def parseMetrics(text):
+    """
+    Returns a dictionary mapping the sample names, including labels, in
+    the specified Prometheus text to their values.
+    """
+    samples = {}
+    for line in text.splitlines():
+        if not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    """
+    Tests the recording, formatting and aggregation of metrics.
+    """
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp(prefix="ga4gh_metrics")
+        self.registry = metrics.MetricsRegistry()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def testRequests(self):
+        self.registry.observeRequest("getDataset", 200, 0.003, 100)
+        self.registry.observeRequest("getDataset", 404, 0.5, None)
+        samples = parseMetrics(self.registry.getText())
+        prefix = "ga4gh_request_duration_seconds"
+        self.assertEqual(samples[
+            prefix + '_bucket{endpoint="getDataset",le="0.0025"}'], 0)
+        self.assertEqual(samples[
+            prefix + '_bucket{endpoint="getDataset",le="0.005"}'], 1)
+        self.assertEqual(samples[
+            prefix + '_bucket{endpoint="getDataset",le="0.5"}'], 2)
+        self.assertEqual(samples[
+            prefix + '_bucket{endpoint="getDataset",le="+Inf"}'], 2)
+        self.assertEqual(samples[prefix + '_count{endpoint="getDataset"}'], 2)
+        self.assertAlmostEqual(
+            samples[prefix + '_sum{endpoint="getDataset"}'], 0.503)
+        self.assertEqual(samples[
+            'ga4gh_response_size_bytes_count{endpoint="getDataset"}'], 1)
+        self.assertEqual(samples[
+            'ga4gh_request_errors_total{endpoint="getDataset",'
+            'status="404"}'], 1)
+
+    def testSearchPageDepth(self):
+        observe = self.registry.observeSearchPage
+        observe("searchReads", "x", None, "a", 10)
+        observe("searchReads", "x", "a", "b", 10)
+        # Another search issued the same page token at a different depth
+        observe("searchReads", "y", None, "b", 10)
+        observe("searchReads", "x", "b", None, 3)
+        observe("searchReads", "y", "b", None, 3)
+        # A page token issued by another process has no known depth
+        observe("searchReads", "x", "c", None, 3)
+        samples = parseMetrics(self.registry.getText())
+        self.assertEqual(samples[
+            'ga4gh_search_page_items_count{endpoint="searchReads"}'], 6)
+        self.assertEqual(samples[
+            'ga4gh_search_page_items_sum{endpoint="searchReads"}'], 39)
+        self.assertEqual(samples[
+            'ga4gh_search_page_depth_count{endpoint="searchReads"}'], 5)
+        self.assertEqual(samples[
+            'ga4gh_search_page_depth_sum{endpoint="searchReads"}'], 4)
+        self.assertEqual(samples[
+            'ga4gh_search_resumed_total{endpoint="searchReads"}'], 4)
+
+    def testFlushWhenIdle(self):
+        directory = os.path.join(self.tempDir, "metrics")
+        self.registry.configure(directory)
+        self.registry.flush()
+        snapshotPath, = glob.glob(os.path.join(directory, "*.json"))
+        flushed = threading.Event()
+        flush = self.registry._flush
+
+        def flushAndNotify():
+            flush()
+            flushed.set()
+
+        # The snapshot is written after the flush interval even though
+        # no more metrics are recorded.
+        with mock.patch("ga4gh.metrics.FLUSH_INTERVAL", 0.05):
+            with mock.patch.object(
+                    self.registry, "_flush", side_effect=flushAndNotify):
+                self.registry.observeRequest("getDataset", 200, 0.01, 100)
+                self.assertTrue(flushed.wait(5))
+        with open(snapshotPath) as snapshotFile:
+            snapshot = json.load(snapshotFile)
+        self.assertEqual(len(snapshot["histograms"]), 2)
+        self.registry.configure(None)
+
+    def testAggregation(self):
+        directory = os.path.join(self.tempDir, "metrics")
+        self.registry.configure(directory)
+        self.registry.observeRequest("getDataset", 200, 0.01, 100)
+        self.registry.flush()
+        # Simulate a second process by renaming our snapshot
+        ownPaths = glob.glob(os.path.join(
+            directory, "metrics-{}-*.json".format(os.getpid())))
+        self.assertEqual(len(ownPaths), 1)
+        os.rename(ownPaths[0], os.path.join(directory, "metrics-0-1.json"))
+        self.registry.clear()
+        self.registry.observeRequest("getDataset", 500, 0.01, None)
+        samples = parseMetrics(self.registry.getText())
+        self.assertEqual(samples[
+            'ga4gh_request_duration_seconds_count{endpoint="getDataset"}'], 2)
+        self.assertEqual(samples[
+            'ga4gh_response_size_bytes_sum{endpoint="getDataset"}'], 100)
+        self.assertEqual(samples[
+            'ga4gh_request_errors_total{endpoint="getDataset",'
+            'status="500"}'], 1)
+        self.registry.configure(None)
+        samples = parseMetrics(self.registry.getText())
+        self.assertEqual(samples[
+            'ga4gh_request_duration_seconds_count{endpoint="getDataset"}'], 1)
+
+    def _writeSnapshot(self, processId, numRequests):
+        registry = metrics.MetricsRegistry()
+        registry.configure(self.directory)
+        for _ in range(numRequests):
+            registry.observeRequest("getDataset", 200, 0.01, 100)
+        registry.flush()
+        snapshotPath, = glob.glob(os.path.join(
+            self.directory, "metrics-{}-*.json".format(os.getpid())))
+        os.rename(snapshotPath, os.path.join(
+            self.directory, "metrics-{}.json".format(processId)))
+
+    def _getNumRequests(self):
+        samples = parseMetrics(self.registry.getText())
+        return samples.get(
+            'ga4gh_request_duration_seconds_count{endpoint="getDataset"}', 0)
+
+    def testRetireProcess(self):
+        self.directory = os.path.join(self.tempDir, "metrics")
+        self.registry.configure(self.directory)
+        # Two processes that had the same process ID, and another process.
+        self._writeSnapshot("100-1", 1)
+        self._writeSnapshot("100-2", 2)
+        self._writeSnapshot("200-1", 4)
+        self.assertEqual(self._getNumRequests(), 7)
+        self.registry.retireProcess(100)
+        self.assertEqual(self._getNumRequests(), 7)
+        self.assertEqual(
+            sorted(os.listdir(self.directory)),
+            ["metrics-200-1.json", "metrics-retired.json"])
+        self.registry.retireProcess(200)
+        self.registry.retireProcess(300)
+        self.assertEqual(self._getNumRequests(), 7)
+        self.assertEqual(
+            os.listdir(self.directory), ["metrics-retired.json"])
+        self.registry.clearDirectory()
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(self._getNumRequests(), 0)
+
+    def testMergedSnapshotNotCountedTwice(self):
+        self.directory = os.path.join(self.tempDir, "metrics")
+        self.registry.configure(self.directory)
+        self._writeSnapshot("100-1", 1)
+        self.registry.retireProcess(100)
+        # A reader may find the merged snapshot before it is removed.
+        self._writeSnapshot("100-1", 1)
+        self.assertEqual(self._getNumRequests(), 1)
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+    """
+    Tests that requests to the frontend are recorded in the exported
+    metrics.
+    """
+    @classmethod
+    def setUpClass(cls):
+        frontend.reset()
+        frontend.configure(baseConfig="TestConfig", extraConfig={
+            "DATA_SOURCE": "__SIMULATED__",
+            "SIMULATED_BACKEND_NUM_VARIANT_SETS": 3})
+        cls.app = frontend.app.test_client()
+        cls.datasetId = frontend.app.backend.getDatasets()[0].getId()
+
+    def setUp(self):
+        metrics.requestMetrics.clear()
+
+    def testMetrics(self):
+        request = protocol.SearchVariantSetsRequest()
+        request.datasetId = self.datasetId
+        request.pageSize = 1
+        for _ in range(2):
+            response = self.app.post(
+                "/variantsets/search", data=request.toJsonString(),
+                headers={"Content-type": "application/json"})
+            self.assertEqual(response.status_code, 200)
+            searchResponse = protocol.SearchVariantSetsResponse.fromJsonString(
+                response.data)
+            request.pageToken = searchResponse.nextPageToken
+        self.assertEqual(self.app.get("/datasets/notAnId").status_code, 404)
+        response = self.app.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.headers["Content-Type"], metrics.CONTENT_TYPE)
+        samples = parseMetrics(response.data)
+        endpoint = '{endpoint="searchVariantSets"}'
+        self.assertEqual(samples[
+            "ga4gh_request_duration_seconds_count" + endpoint], 2)
+        self.assertGreater(samples[
+            "ga4gh_response_size_bytes_sum" + endpoint], 0)
+        self.assertEqual(samples["ga4gh_search_page_items_sum" + endpoint], 2)
+        self.assertEqual(samples["ga4gh_search_page_depth_sum" + endpoint], 1)
+        self.assertEqual(samples[
+            'ga4gh_request_errors_total{endpoint="getDataset",'
+            'status="404"}'], 1)
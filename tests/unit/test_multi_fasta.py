@@ -0,0 +1,120 @@
+"""
+Tests for reference sets served from multi-sequence FASTA files
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import pysam
+
+import ga4gh.datamodel as datamodel
+import ga4gh.datamodel.packed as packed
+import ga4gh.datamodel.references as references
+import ga4gh.exceptions as exceptions
+
+
+class TestMultiFastaReferenceSet(unittest.TestCase):
+    """
+    Tests that every sequence of a multi-sequence FASTA file is served
+    through a single file handle, using the metadata in its manifest.
+    """
+    referenceSetName = "multi"
+    fastaName = "genome"
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp(prefix="ga4gh_multi_fasta")
+        self.referenceSetDir = os.path.join(
+            self.tempDir, self.referenceSetName)
+        os.mkdir(self.referenceSetDir)
+        with open(self.referenceSetDir + ".json", "w") as metadataFile:
+            json.dump({
+                "assemblyId": "multi", "description": "Multi FASTA",
+                "isDerived": False, "ncbiTaxonId": 9606,
+                "sourceAccessions": [], "sourceUri": None}, metadataFile)
+        rng = random.Random(1)
+        self.sequences = [
+            (name, "".join(rng.choice("ACGTN") for _ in range(length)))
+            for name, length in [
+                ("chr2", 150), ("chr1", 61), ("chrUn_decoy", 7)]]
+        self.fastaPath = os.path.join(
+            self.referenceSetDir, self.fastaName + ".fa")
+        with open(self.fastaPath, "w") as fastaFile:
+            for name, bases in self.sequences:
+                print(">" + name, file=fastaFile)
+                for i in range(0, len(bases), 60):
+                    print(bases[i:i + 60], file=fastaFile)
+        pysam.tabix_compress(self.fastaPath, self.fastaPath + ".gz")
+        os.unlink(self.fastaPath)
+        self.fastaPath += ".gz"
+        pysam.faidx(str(self.fastaPath))
+        self.manifest = {references.MANIFEST_REFERENCES_KEY: dict(
+            (name, {
+                "md5checksum": hashlib.md5(bases).hexdigest(),
+                "sourceUri": None, "ncbiTaxonId": 9606, "isDerived": False,
+                "sourceDivergence": None,
+                "sourceAccessions": ["{}.1".format(name)]})
+            for name, bases in self.sequences)}
+        datamodel.fileHandleCache.clear()
+
+    def tearDown(self):
+        datamodel.fileHandleCache.clear()
+        shutil.rmtree(self.tempDir)
+
+    def _writeManifest(self):
+        manifestPath = os.path.join(
+            self.referenceSetDir, self.fastaName + ".json")
+        with open(manifestPath, "w") as manifestFile:
+            json.dump(self.manifest, manifestFile)
+
+    def _getReferenceSet(self):
+        return references.HtslibReferenceSet(
+            self.referenceSetName, self.referenceSetDir, None)
+
+    def testReferences(self):
+        self._writeManifest()
+        referenceSet = self._getReferenceSet()
+        self.assertEqual(
+            [reference.getLocalId()
+             for reference in referenceSet.getReferences()],
+            [name for name, _ in self.sequences])
+        for name, bases in self.sequences:
+            reference = referenceSet.getReferenceByName(name)
+            self.assertEqual(reference.getLength(), len(bases))
+            self.assertEqual(reference.getBases(0, len(bases)), bases)
+            self.assertEqual(
+                reference.getMd5Checksum(), hashlib.md5(bases).hexdigest())
+            self.assertEqual(reference.getSourceAccessions(), [name + ".1"])
+            self.assertEqual(reference.getFastaFilePath(), self.fastaPath)
+        self.assertEqual(
+            datamodel.fileHandleCache.getCachedFiles(), [self.fastaPath])
+
+    def testPackedReferences(self):
+        self._writeManifest()
+        packed.PackedReferenceBuilder(self.fastaPath).build()
+        references.referenceBlockCache.clear()
+        referenceSet = self._getReferenceSet()
+        for name, bases in self.sequences:
+            reference = referenceSet.getReferenceByName(name)
+            self.assertEqual(reference.getBases(0, len(bases)), bases)
+        references.referenceBlockCache.clear()
+
+    def testMissingReferenceMetadata(self):
+        del self.manifest[references.MANIFEST_REFERENCES_KEY]["chr1"]
+        self._writeManifest()
+        with self.assertRaises(exceptions.MissingReferenceMetadata):
+            self._getReferenceSet()
+
+    def testMissingReferenceMetadataKey(self):
+        del self.manifest[references.MANIFEST_REFERENCES_KEY]["chr1"][
+            "md5checksum"]
+        self._writeManifest()
+        with self.assertRaises(exceptions.MissingReferenceMetadata):
+            self._getReferenceSet()
@@ -0,0 +1,122 @@
+"""
+Tests for the packed, memory-mapped reference sequences
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import random
+import shutil
+import tempfile
+import time
+import unittest
+
+import pysam
+
+import ga4gh.backend as backend
+import ga4gh.datamodel.packed as packed
+import ga4gh.datamodel.references as references
+
+
+class TestPackedReferences(unittest.TestCase):
+    """
+    Tests that bases decoded from the packed sequences are identical to
+    those read from the FASTA files.
+    """
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp(prefix="ga4gh_packed")
+        self.rng = random.Random(1)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def _randomSequence(self, length):
+        chunks = []
+        while sum(len(chunk) for chunk in chunks) < length:
+            kind = self.rng.random()
+            runLength = self.rng.randint(1, 20)
+            if kind < 0.6:
+                chunks.append("".join(
+                    self.rng.choice("ACGT") for _ in range(runLength)))
+            elif kind < 0.8:
+                chunks.append("".join(
+                    self.rng.choice("acgt") for _ in range(runLength)))
+            elif kind < 0.9:
+                chunks.append(self.rng.choice("Nn") * runLength)
+            else:
+                chunks.append(self.rng.choice("RYKMrykm"))
+        return "".join(chunks)[:length]
+
+    def _writeFasta(self, sequences):
+        fastaPath = os.path.join(self.tempDir, "test.fa")
+        with open(fastaPath, "w") as fastaFile:
+            for name, bases in sequences:
+                print(">" + name, file=fastaFile)
+                for i in range(0, len(bases), 60):
+                    print(bases[i:i + 60], file=fastaFile)
+        pysam.tabix_compress(fastaPath, fastaPath + ".gz")
+        pysam.faidx(str(fastaPath + ".gz"))
+        return fastaPath + ".gz"
+
+    def _verifyPacked(self, fastaPath, chunkSize):
+        packed.PackedReferenceBuilder(fastaPath, chunkSize).build()
+        packedReferences = packed.PackedReferences(fastaPath)
+        self.assertTrue(packedReferences.isAvailable())
+        fastaFile = pysam.FastaFile(fastaPath)
+        for name, length in zip(fastaFile.references, fastaFile.lengths):
+            ranges = [(0, length), (0, 0), (length - 1, length)]
+            for _ in range(50):
+                start = self.rng.randint(0, length - 1)
+                end = self.rng.randint(start, length)
+                ranges.append((start, end))
+            for start, end in ranges:
+                self.assertEqual(
+                    packedReferences.getBases(name, start, end),
+                    fastaFile.fetch(name, start, end))
+
+    def testRandomSequences(self):
+        sequences = [
+            ("seq{}".format(length), self._randomSequence(length))
+            for length in [1, 3, 4, 5, 63, 64, 65, 1000]]
+        fastaPath = self._writeFasta(sequences)
+        for chunkSize in [4, 16, 2**22]:
+            self._verifyPacked(fastaPath, chunkSize)
+
+    def testRunsAcrossChunks(self):
+        sequences = [("runs", "ACGT" * 3 + "N" * 9 + "acgt" * 5 + "NNRRn")]
+        self._verifyPacked(self._writeFasta(sequences), 4)
+
+    def testUnavailable(self):
+        fastaPath = self._writeFasta([("seq", "ACGT")])
+        self.assertFalse(packed.PackedReferences(fastaPath).isAvailable())
+        packed.PackedReferenceBuilder(fastaPath).build()
+        self.assertTrue(packed.PackedReferences(fastaPath).isAvailable())
+        metadataPath = os.path.join(
+            packed.getPackedDirectory(fastaPath),
+            packed.PACKED_METADATA_FILENAME)
+        os.utime(fastaPath, (
+            time.time(), os.path.getmtime(metadataPath) + 10))
+        self.assertFalse(packed.PackedReferences(fastaPath).isAvailable())
+
+    def testHtslibReference(self):
+        dataDir = os.path.join(self.tempDir, "data")
+        shutil.copytree("tests/data", dataDir)
+        fastaBases = {}
+        for referenceSet in backend.FileSystemBackend(
+                dataDir).getReferenceSets():
+            for reference in referenceSet.getReferences():
+                fastaBases[reference.getId()] = reference.fetchBases(
+                    0, reference.getLength())
+                packed.PackedReferenceBuilder(
+                    reference.getFastaFilePath()).build()
+        references.referenceBlockCache.clear()
+        for referenceSet in backend.FileSystemBackend(
+                dataDir).getReferenceSets():
+            for reference in referenceSet.getReferences():
+                self.assertTrue(packed.PackedReferences(
+                    reference.getFastaFilePath()).isAvailable())
+                self.assertEqual(
+                    reference.getBases(0, reference.getLength()),
+                    fastaBases[reference.getId()])
+        references.referenceBlockCache.clear()
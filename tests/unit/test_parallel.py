@@ -0,0 +1,106 @@
+"""
+Tests for the parallel fetching of large ranges
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+
+import ga4gh.backend as backend
+import ga4gh.datamodel.parallel as parallel
+import ga4gh.protocol as protocol
+
+
+class TestParallelFetch(unittest.TestCase):
+    """
+    Tests that parallel fetches return exactly the same objects in the
+    same order as serial fetches.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.backend = backend.FileSystemBackend("tests/data")
+        cls.dataset = cls.backend.getDatasets()[0]
+
+    def tearDown(self):
+        parallel.regionFetchPool.configure(0, 2**17)
+
+    def _getSerialAndParallel(self, fetchFunction, binSize):
+        parallel.regionFetchPool.configure(0, binSize)
+        serial = [obj.toJsonDict() for obj in fetchFunction()]
+        parallel.regionFetchPool.configure(2, binSize)
+        parallelObjects = [obj.toJsonDict() for obj in fetchFunction()]
+        return serial, parallelObjects
+
+    def _getReadGroupSet(self, name):
+        return self.dataset.getReadGroupSetByName(name)
+
+    def testReads(self):
+        readGroupSet = self._getReadGroupSet(
+            "HG00096.mapped.ILLUMINA.bwa.GBR.low_coverage.20120522")
+        reference = readGroupSet.getReferenceSet().getReferenceByName("1")
+        for readGroup in readGroupSet.getReadGroups():
+            for binSize in [1, 2, 7]:
+                serial, parallelObjects = self._getSerialAndParallel(
+                    lambda: readGroup.getReadAlignments(
+                        reference, 9990, 10110), binSize)
+                self.assertEqual(serial, parallelObjects)
+
+    def testReadsOverlappingStart(self):
+        readGroupSet = self._getReadGroupSet("chr17.1-250")
+        reference = readGroupSet.getReferenceSet().getReferenceByName(
+            "chr17")
+        for readGroup in readGroupSet.getReadGroups():
+            for start in [0, 5, 30]:
+                serial, parallelObjects = self._getSerialAndParallel(
+                    lambda: readGroup.getReadAlignments(
+                        reference, start, 250), 10)
+                self.assertGreater(len(serial), 0)
+                self.assertEqual(serial, parallelObjects)
+
+    def testVariants(self):
+        variantSet = [
+            variantSet for variantSet in self.dataset.getVariantSets()
+            if variantSet.getLocalId() == "1kgPhase3"][0]
+        callSetIds = [
+            callSet.getId() for callSet in variantSet.getCallSets()][:2]
+        for binSize in [50, 333]:
+            serial, parallelObjects = self._getSerialAndParallel(
+                lambda: variantSet.getVariants(
+                    "1", 10000, 18000, callSetIds), binSize)
+            self.assertEqual(len(serial), 100)
+            self.assertEqual(serial, parallelObjects)
+
+    def testPagingUnchanged(self):
+        readGroupSet = self._getReadGroupSet("chr17.1-250")
+        readGroup = readGroupSet.getReadGroups()[0]
+        reference = readGroupSet.getReferenceSet().getReferenceByName(
+            "chr17")
+        request = protocol.SearchReadsRequest()
+        request.readGroupIds = [readGroup.getId()]
+        request.referenceId = reference.getId()
+        request.start = 0
+        request.end = 250
+        request.pageSize = 2
+        pages = {}
+        for numWorkers in [0, 2]:
+            parallel.regionFetchPool.configure(numWorkers, 10)
+            request.pageToken = None
+            pages[numWorkers] = []
+            while True:
+                response = protocol.SearchReadsResponse.fromJsonString(
+                    self.backend.runSearchReads(request.toJsonString()))
+                pages[numWorkers].append(response.toJsonDict())
+                if response.nextPageToken is None:
+                    break
+                request.pageToken = response.nextPageToken
+        self.assertGreater(len(pages[0]), 1)
+        self.assertEqual(pages[0], pages[2])
+
+    def testSmallRangeIsSerial(self):
+        fetchPool = parallel.RegionFetchPool()
+        self.assertFalse(fetchPool.isSplittable(0, 10**9))
+        fetchPool.configure(2, 100)
+        self.assertFalse(fetchPool.isSplittable(0, 399))
+        self.assertTrue(fetchPool.isSplittable(0, 400))
+        self.assertFalse(fetchPool.isSplittable(None, 400))
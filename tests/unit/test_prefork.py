@@ -0,0 +1,144 @@
+"""
+Tests for the pre-forking server
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import unittest
+
+import requests
+
+import ga4gh.admission as admission
+import ga4gh.datamodel as datamodel
+import ga4gh.exceptions as exceptions
+import ga4gh.metrics as metrics
+import ga4gh.prefork as prefork
+
+
+def pidApplication(environ, startResponse):
+    """
+    A WSGI application returning the ID of the process handling the
+    request and the number of files in its file handle cache.
+    """
+    startResponse(b"200 OK", [(b"Content-Type", b"text/plain")])
+    return [b"{} {}".format(
+        os.getpid(), len(datamodel.fileHandleCache.getCachedFiles()))]
+
+
+def metricsApplication(environ, startResponse):
+    """
+    A WSGI application recording each request in the request metrics.
+    """
+    metrics.requestMetrics.observeRequest("test", 200, 0.001, 1)
+    return pidApplication(environ, startResponse)
+
+
+def limitedApplication(environ, startResponse):
+    """
+    A WSGI application admitting each request through the "test" limit.
+    """
+    try:
+        with admission.requestAdmission.admit("test"):
+            return pidApplication(environ, startResponse)
+    except exceptions.TooManyRequestsException:
+        startResponse(b"429 Too Many Requests", [])
+        return []
+
+
+class TestPreforkServer(unittest.TestCase):
+    """
+    Tests that workers serve requests and are replaced when they exit.
+    """
+    def _startServer(self, numWorkers, maxRequests=0, app=pidApplication):
+        server = prefork.PreforkServer(
+            app, "127.0.0.1", 0, numWorkers, maxRequests)
+        self.url = "http://127.0.0.1:{}/".format(server.getPort())
+        self.process = multiprocessing.Process(target=server.serveForever)
+        self.process.start()
+
+    def _stopServer(self):
+        os.kill(self.process.pid, signal.SIGTERM)
+        self.process.join(10)
+        self.assertEqual(self.process.exitcode, 0)
+
+    def _getPids(self, numRequests):
+        pids = []
+        for _ in range(numRequests):
+            response = requests.get(self.url)
+            self.assertEqual(response.status_code, 200)
+            pid, numCachedFiles = response.text.split()
+            self.assertEqual(numCachedFiles, "0")
+            pids.append(int(pid))
+        return pids
+
+    def testWorkers(self):
+        self._startServer(2)
+        try:
+            pids = self._getPids(10)
+        finally:
+            self._stopServer()
+        self.assertNotIn(self.process.pid, pids)
+        self.assertLessEqual(len(set(pids)), 2)
+
+    def testRecycling(self):
+        self._startServer(1, maxRequests=2)
+        try:
+            pids = self._getPids(6)
+        finally:
+            self._stopServer()
+        self.assertEqual(len(set(pids)), 3)
+        self.assertEqual(pids[0], pids[1])
+        self.assertNotEqual(pids[1], pids[2])
+
+    def testMetricsOfExitedWorkers(self):
+        directory = tempfile.mkdtemp(prefix="ga4gh_metrics")
+        try:
+            metrics.requestMetrics.configure(directory)
+            self._startServer(1, maxRequests=1, app=metricsApplication)
+            try:
+                self._getPids(3)
+            finally:
+                self._stopServer()
+            # Each worker exits before its periodic snapshot is due.
+            registry = metrics.MetricsRegistry()
+            registry.configure(directory)
+            self.assertIn(
+                'ga4gh_request_duration_seconds_count{endpoint="test"} 3',
+                registry.getText())
+            self.assertEqual(os.listdir(directory), ["metrics-retired.json"])
+        finally:
+            metrics.requestMetrics.configure(None)
+            shutil.rmtree(directory)
+
+    def testAdmissionLimitsShared(self):
+        admission.requestAdmission.configure({"test": (1, 0)})
+        try:
+            self._startServer(2, app=limitedApplication)
+            try:
+                self._getPids(2)
+                # The slot taken here is seen by every worker.
+                limit = admission.requestAdmission.getLimit("test")
+                limit.acquire()
+                try:
+                    for _ in range(4):
+                        self.assertEqual(
+                            requests.get(self.url).status_code, 429)
+                finally:
+                    limit.release()
+                self._getPids(2)
+            finally:
+                self._stopServer()
+        finally:
+            admission.requestAdmission.configure({})
+
+    def testInvalidArguments(self):
+        with self.assertRaises(ValueError):
+            prefork.PreforkServer(pidApplication, "127.0.0.1", 0, 0)
+        with self.assertRaises(ValueError):
+            prefork.PreforkServer(pidApplication, "127.0.0.1", 0, 1, -1)
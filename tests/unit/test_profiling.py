@@ -0,0 +1,159 @@
+"""
+Tests for the sampled profiling of search requests
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import glob
+import json
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import unittest
+
+import ga4gh.backend as backend
+import ga4gh.exceptions as exceptions
+import ga4gh.frontend as frontend
+import ga4gh.profiling as profiling
+import ga4gh.protocol as protocol
+
+
+class TestProfiling(unittest.TestCase):
+    """
+    Tests that sampled and slow search requests are profiled and written
+    to the profile directory.
+    """
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp(prefix="ga4gh_profiling")
+        self.backend = backend.SimulatedBackend(numVariantSets=3)
+        self.request = protocol.SearchVariantSetsRequest()
+        self.request.datasetId = self.backend.getDatasets()[0].getId()
+
+    def tearDown(self):
+        profiling.requestProfiler.configure(None)
+        shutil.rmtree(self.tempDir)
+
+    def _search(self, numRequests=1):
+        for _ in range(numRequests):
+            self.backend.runSearchVariantSets(self.request.toJsonString())
+
+    def _getDumps(self):
+        dumps = []
+        for path in sorted(glob.glob(os.path.join(self.tempDir, "*.json"))):
+            with open(path) as jsonFile:
+                dumps.append((path, json.load(jsonFile)))
+        return dumps
+
+    def testRequestProfile(self):
+        profile = profiling.RequestProfile("test")
+        profile.enterPhase("a")
+        profile.enterPhase("b")
+        profile.enterPhase("a")
+        profile.finish()
+        phaseTimes = profile.getPhaseTimes()
+        self.assertEqual(phaseTimes.keys(), ["a", "b"])
+        self.assertLessEqual(sum(phaseTimes.values()), profile.elapsedTime)
+        self.assertEqual(profile.getPhaseTimesPerObject(), {})
+        profile.numObjects = 2
+        self.assertEqual(
+            profile.getPhaseTimesPerObject()["b"], phaseTimes["b"] / 2)
+        metrics = profiling.parseServerTimingHeader(
+            profile.getServerTimingHeader())
+        self.assertEqual(
+            sorted(metrics.keys()), ["a", "b", "objects", "total"])
+        self.assertEqual(metrics["objects"], "2")
+        self.assertAlmostEqual(
+            metrics["total"], profile.elapsedTime, places=5)
+
+    def testConvertPhase(self):
+        dataBackend = backend.FileSystemBackend("tests/data")
+        variantSet = dataBackend.getDatasets()[0].getVariantSets()[0]
+        request = protocol.SearchVariantsRequest()
+        request.variantSetId = variantSet.getId()
+        request.referenceName = "1"
+        request.start = 0
+        request.end = 2**32
+        request.callSetIds = []
+        request.pageSize = 5
+        dataBackend.runSearchVariants(request.toJsonString())
+        profile = profiling.requestProfiler.popLastProfile()
+        self.assertEqual(profile.name, "searchVariants")
+        self.assertEqual(profile.numObjects, 5)
+        self.assertEqual(
+            profile.getPhaseTimes().keys(),
+            ["parse", "validate", "fetch", "convert", "serialize",
+             "validateResponse"])
+        self.assertIsNone(profiling.requestProfiler.popLastProfile())
+
+    def testSampling(self):
+        profiling.requestProfiler.configure(self.tempDir, sampleRate=2)
+        self._search(4)
+        dumps = self._getDumps()
+        self.assertEqual(len(dumps), 2)
+        for path, jsonDict in dumps:
+            self.assertEqual(jsonDict["name"], "searchVariantSets")
+            self.assertTrue(jsonDict["sampled"])
+            self.assertFalse(jsonDict["slow"])
+            self.assertEqual(
+                set(jsonDict["phases"].keys()),
+                set(["parse", "validate", "fetch", "serialize",
+                     "validateResponse"]))
+            stats = pstats.Stats(path[:-len(".json")] + ".prof")
+            self.assertGreater(stats.total_calls, 0)
+
+    def testSlowRequests(self):
+        profiling.requestProfiler.configure(
+            self.tempDir, slowThreshold=0, maxFiles=3)
+        self._search(5)
+        dumps = self._getDumps()
+        self.assertEqual(len(dumps), 3)
+        for path, jsonDict in dumps:
+            self.assertTrue(jsonDict["slow"])
+            self.assertFalse(jsonDict["sampled"])
+            self.assertFalse(os.path.exists(path[:-len(".json")] + ".prof"))
+        profiling.requestProfiler.configure(self.tempDir, slowThreshold=60)
+        self._search()
+        self.assertEqual(len(self._getDumps()), 3)
+
+    def testFailedRequest(self):
+        profiling.requestProfiler.configure(self.tempDir, sampleRate=1)
+        self.request.pageSize = -1
+        with self.assertRaises(exceptions.BadPageSizeException):
+            self._search()
+        self.assertIsNone(sys.getprofile())
+        self.assertEqual(len(self._getDumps()), 1)
+
+
+class TestServerTimingHeader(unittest.TestCase):
+    """
+    Tests the Server-Timing header of search responses.
+    """
+    @classmethod
+    def setUpClass(cls):
+        frontend.reset()
+        frontend.configure(baseConfig="TestConfig", extraConfig={
+            "DATA_SOURCE": "__SIMULATED__", "SERVER_TIMING_HEADER": True})
+        cls.app = frontend.app.test_client()
+        cls.datasetId = frontend.app.backend.getDatasets()[0].getId()
+
+    def testHeader(self):
+        request = protocol.SearchVariantSetsRequest()
+        request.datasetId = self.datasetId
+        response = self.app.post(
+            "/variantsets/search", data=request.toJsonString(),
+            headers={"Content-type": "application/json"})
+        metrics = profiling.parseServerTimingHeader(
+            response.headers["Server-Timing"])
+        self.assertEqual(metrics["objects"], "1")
+        for phase in ["parse", "fetch", "serialize", "total"]:
+            self.assertGreaterEqual(metrics[phase], 0)
+        response = self.app.get("/datasets/{}".format(self.datasetId))
+        self.assertNotIn("Server-Timing", response.headers)
+        frontend.app.config["SERVER_TIMING_HEADER"] = False
+        response = self.app.post(
+            "/variantsets/search", data=request.toJsonString(),
+            headers={"Content-type": "application/json"})
+        self.assertNotIn("Server-Timing", response.headers)
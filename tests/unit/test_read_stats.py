@@ -0,0 +1,108 @@
+"""
+Tests for the cached read statistics sidecar files
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import pysam
+
+import ga4gh.backend as backend
+import ga4gh.datamodel.reads as reads
+
+
+class TestReadStats(unittest.TestCase):
+    """
+    Tests that the read group statistics agree with counts computed
+    directly from the reads.
+    """
+    bamNames = [
+        "HG00096.mapped.ILLUMINA.bwa.GBR.low_coverage.20120522",
+        "HG00533.mapped.ILLUMINA.bwa.CHS.low_coverage.20120522",
+    ]
+
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp(prefix="ga4gh_read_stats")
+        self.dataDir = os.path.join(self.tempDir, "data")
+        shutil.copytree("tests/data", self.dataDir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def _getSamFilePath(self, bamName):
+        return os.path.join(
+            self.dataDir, "datasets", "dataset1", "reads", bamName + ".bam")
+
+    def _getReadGroupSet(self, bamName):
+        dataBackend = backend.FileSystemBackend(self.dataDir)
+        dataset = dataBackend.getDatasets()[0]
+        return dataset.getReadGroupSetByName(bamName)
+
+    def _countReads(self, samFilePath):
+        counts = collections.defaultdict(lambda: [0, 0, 0])
+        samFile = pysam.AlignmentFile(samFilePath)
+        for read in samFile.fetch(until_eof=True):
+            readGroupName = dict(read.tags).get('RG', 'default')
+            if read.is_unmapped:
+                counts[readGroupName][1] += 1
+            else:
+                counts[readGroupName][0] += 1
+            counts[readGroupName][2] += read.query_length
+        return counts
+
+    def testReadGroupStats(self):
+        for bamName in self.bamNames:
+            samFilePath = self._getSamFilePath(bamName)
+            reads.buildReadStats(samFilePath)
+            counts = self._countReads(samFilePath)
+            readGroupSet = self._getReadGroupSet(bamName)
+            gaReadGroupSet = readGroupSet.toProtocolElement()
+            self.assertEqual(
+                gaReadGroupSet.stats.alignedReadCount,
+                sum(count[0] for count in counts.values()))
+            self.assertEqual(
+                gaReadGroupSet.stats.unalignedReadCount,
+                sum(count[1] for count in counts.values()))
+            self.assertEqual(
+                gaReadGroupSet.stats.baseCount,
+                sum(count[2] for count in counts.values()))
+            for readGroup in readGroupSet.getReadGroups():
+                count = counts[readGroup.getLocalId()]
+                gaReadGroup = readGroup.toProtocolElement()
+                self.assertEqual(gaReadGroup.stats.alignedReadCount, count[0])
+                self.assertEqual(
+                    gaReadGroup.stats.unalignedReadCount, count[1])
+                self.assertEqual(gaReadGroup.stats.baseCount, count[2])
+
+    def testIndexCountsWithoutSidecar(self):
+        for bamName in self.bamNames:
+            samFile = pysam.AlignmentFile(self._getSamFilePath(bamName))
+            readGroupSet = self._getReadGroupSet(bamName)
+            self.assertEqual(
+                readGroupSet.getNumAlignedReads(), samFile.mapped)
+            self.assertEqual(
+                readGroupSet.getNumUnalignedReads(), samFile.unmapped)
+            self.assertIsNone(readGroupSet.getBaseCount())
+            for readGroup in readGroupSet.getReadGroups():
+                self.assertEqual(readGroup.getNumAlignedReads(), -1)
+                self.assertIsNone(readGroup.getBaseCount())
+
+    def testStaleSidecarIgnored(self):
+        bamName = self.bamNames[0]
+        samFilePath = self._getSamFilePath(bamName)
+        reads.buildReadStats(samFilePath)
+        self.assertIsNotNone(reads.loadReadStats(samFilePath))
+        sidecarTime = os.path.getmtime(reads.getReadStatsFilePath(
+            samFilePath))
+        os.utime(samFilePath, (time.time(), sidecarTime + 10))
+        self.assertIsNone(reads.loadReadStats(samFilePath))
+        readGroupSet = self._getReadGroupSet(bamName)
+        for readGroup in readGroupSet.getReadGroups():
+            self.assertEqual(readGroup.getNumAlignedReads(), -1)
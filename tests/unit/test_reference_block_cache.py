@@ -0,0 +1,136 @@
+"""
+Tests for the reference block cache
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import random
+import threading
+import unittest
+
+import ga4gh.datamodel.references as references
+
+
+class CountingReference(references.SimulatedReference):
+    """
+    A simulated reference that records the ranges that are fetched.
+    """
+    def __init__(self, *args, **kwargs):
+        super(CountingReference, self).__init__(*args, **kwargs)
+        self.fetches = []
+
+    def fetchBases(self, start, end):
+        self.fetches.append((start, end))
+        return super(CountingReference, self).fetchBases(start, end)
+
+
+class TestReferenceBlockCache(unittest.TestCase):
+    """
+    Tests the byte-bounded LRU cache of reference blocks.
+    """
+    def setUp(self):
+        self.cache = references.ReferenceBlockCache()
+        self.cache.configure(10, 100)
+        self.referenceSet = references.SimulatedReferenceSet("refs")
+        self.reference = CountingReference(self.referenceSet, "ref", 1, 200)
+        self.bases = self.reference.fetchBases(0, 200)
+        self.reference.fetches = []
+
+    def testGetBases(self):
+        for start, end in [
+                (0, 1), (0, 10), (5, 30), (9, 11), (195, 200), (20, 20),
+                (0, 50)]:
+            self.assertEqual(
+                self.cache.getBases(self.reference, start, end),
+                self.bases[start:end])
+            self.assertLessEqual(self.cache.getStatistics()["bytes"], 100)
+
+    def testHitsAndMisses(self):
+        self.cache.getBases(self.reference, 5, 25)
+        self.assertEqual(self.reference.fetches, [(0, 10), (10, 20), (20, 30)])
+        self.cache.getBases(self.reference, 12, 14)
+        self.assertEqual(len(self.reference.fetches), 3)
+        statistics = self.cache.getStatistics()
+        self.assertEqual(statistics["hits"], 1)
+        self.assertEqual(statistics["misses"], 3)
+        self.assertEqual(statistics["blocks"], 3)
+        self.assertEqual(statistics["bytes"], 30)
+
+    def testEviction(self):
+        for start in range(0, 150, 10):
+            self.cache.getBases(self.reference, start, start + 1)
+        statistics = self.cache.getStatistics()
+        self.assertEqual(statistics["bytes"], 100)
+        self.assertEqual(statistics["evictions"], 5)
+        # The least recently used blocks have been evicted
+        self.reference.fetches = []
+        self.cache.getBases(self.reference, 140, 141)
+        self.cache.getBases(self.reference, 0, 1)
+        self.assertEqual(self.reference.fetches, [(0, 10)])
+
+    def testSequentialPrefetch(self):
+        for start in range(0, 60, 5):
+            self.assertEqual(
+                self.cache.getBases(self.reference, start, start + 5),
+                self.bases[start:start + 5])
+        self.assertEqual(
+            self.reference.fetches, [(0, 10), (10, 30), (30, 50), (50, 70)])
+        self.assertEqual(self.cache.getStatistics()["prefetches"], 3)
+
+    def testPrefetchAtEnd(self):
+        self.cache.getBases(self.reference, 180, 190)
+        self.cache.getBases(self.reference, 190, 200)
+        self.assertEqual(self.reference.fetches, [(180, 190), (190, 200)])
+
+    def testLargeRangeBypassesCache(self):
+        self.assertEqual(
+            self.cache.getBases(self.reference, 0, 200), self.bases)
+        self.assertEqual(self.reference.fetches, [(0, 200)])
+        self.assertEqual(self.cache.getStatistics()["blocks"], 0)
+
+    def testReferencesWithSameId(self):
+        other = references.SimulatedReference(
+            self.referenceSet, "ref", 2, 200)
+        self.assertEqual(other.getId(), self.reference.getId())
+        self.assertEqual(
+            self.cache.getBases(self.reference, 0, 10), self.bases[:10])
+        self.assertEqual(
+            self.cache.getBases(other, 0, 10), other.fetchBases(0, 10))
+
+    def testClear(self):
+        self.cache.getBases(self.reference, 0, 10)
+        self.cache.clear()
+        self.assertEqual(self.cache.getStatistics(), {
+            "hits": 0, "misses": 0, "prefetches": 0, "evictions": 0,
+            "blocks": 0, "bytes": 0})
+
+    def testConfigure(self):
+        with self.assertRaises(ValueError):
+            self.cache.configure(0, 100)
+        with self.assertRaises(ValueError):
+            self.cache.configure(10, 0)
+
+    def testConcurrentAccess(self):
+        errors = []
+
+        def getBases(seed):
+            randomState = random.Random(seed)
+            for _ in range(500):
+                start = randomState.randint(0, 199)
+                end = randomState.randint(start, min(start + 40, 200))
+                if (self.cache.getBases(self.reference, start, end) !=
+                        self.bases[start:end]):
+                    errors.append((start, end))
+
+        threads = [
+            threading.Thread(target=getBases, args=(seed,))
+            for seed in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        statistics = self.cache.getStatistics()
+        self.assertEqual(statistics["bytes"], 10 * statistics["blocks"])
+        self.assertLessEqual(statistics["bytes"], 100)
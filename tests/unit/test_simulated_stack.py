@@ -50,6 +50,7 @@ class TestSimulatedStack(unittest.TestCase):
     def setUp(self):
         self.backend = frontend.app.backend
         self.backend.setMaxResponseLength(10000)
+        self.backend.setSearchTimeBudget(None)
 
     def getBadIds(self):
         """
@@ -523,6 +524,37 @@ class TestSimulatedStack(unittest.TestCase):
         # TODO: Add more useful test scenarios, including some covering
         # pagination behavior.
 
+    def testSearchTimeBudget(self):
+        variantSet = self.backend.getDatasets()[0].getVariantSets()[0]
+        request = protocol.SearchVariantsRequest()
+        request.referenceName = '1'
+        request.start = 0
+        request.end = 5
+        request.variantSetId = variantSet.getId()
+        path = '/variants/search'
+        expected = self.sendSearchRequest(
+            path, request, protocol.SearchVariantsResponse)
+        self.assertIsNone(expected.nextPageToken)
+        self.assertGreater(len(expected.variants), 1)
+        # With no time at all, each page holds at most one variant, and
+        # each search stops at the next variant it scans.
+        self.backend.setSearchTimeBudget(0)
+        variants = []
+        numPages = 0
+        while True:
+            responseData = self.sendSearchRequest(
+                path, request, protocol.SearchVariantsResponse)
+            self.assertLessEqual(len(responseData.variants), 1)
+            variants.extend(responseData.variants)
+            numPages += 1
+            if responseData.nextPageToken is None:
+                break
+            request.pageToken = responseData.nextPageToken
+        self.assertLessEqual(numPages, 2 * len(expected.variants))
+        self.assertEqual(
+            [variant.id for variant in variants],
+            [variant.id for variant in expected.variants])
+
     def testListReferenceBases(self):
         for referenceSet in self.backend.getReferenceSets():
             for reference in referenceSet.getReferences():
@@ -5,13 +5,18 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import hashlib
 import unittest
 
+import mock
+
+import ga4gh.backend as backend
 import ga4gh.datamodel as datamodel
 import ga4gh.datamodel.datasets as datasets
 import ga4gh.datamodel.reads as reads
 import ga4gh.datamodel.references as references
 import ga4gh.datamodel.variants as variants
+import ga4gh.protocol as protocol
 
 
 class TestSimulatedVariantSet(unittest.TestCase):
@@ -108,6 +113,42 @@ class TestSimulatedVariantSet(unittest.TestCase):
         variantListTwo = self._getSimulatedVariantsList()
         self.assertEqual(variantListOne, variantListTwo)
 
+    def testSparseVariants(self):
+        dataset = datasets.AbstractDataset('dataset1')
+        variantSet = variants.SimulatedVariantSet(
+            dataset, 'variantSet1', randomSeed=self.randomSeed,
+            numCalls=self.numCalls, variantDensity=0.01, blockSize=100)
+        positions = [
+            variant.start for variant in variantSet.getVariants(
+                self.referenceName, 0, 100000)]
+        self.assertEqual(positions, sorted(set(positions)))
+        self.assertGreater(len(positions), 500)
+        self.assertLess(len(positions), 1500)
+        # Sub-ranges crossing block boundaries give the same variants
+        for start, end in [(0, 1), (150, 350), (99, 101), (54321, 60000)]:
+            subPositions = [
+                variant.start for variant in variantSet.getVariants(
+                    self.referenceName, start, end)]
+            self.assertEqual(subPositions, [
+                position for position in positions
+                if start <= position < end])
+        # Variants are reproducible by position
+        for variant in variantSet.getVariants(
+                self.referenceName, 1000, 5000):
+            compoundId = datamodel.VariantCompoundId.parse(variant.id)
+            self.assertEqual(
+                variantSet.getVariant(compoundId).alternateBases,
+                variant.alternateBases)
+
+    def testLargeRange(self):
+        dataset = datasets.AbstractDataset('dataset1')
+        variantSet = variants.SimulatedVariantSet(
+            dataset, 'variantSet1', randomSeed=self.randomSeed,
+            numCalls=self.numCalls, variantDensity=0.5)
+        iterator = variantSet.getVariants(self.referenceName, 0, 10**9)
+        variant = next(iterator)
+        self.assertLess(variant.start, 100)
+
     def _assertEqualVariantLists(self, variantListOne, variantListTwo):
         # need to make time-dependent fields equal before the comparison,
         # otherwise we're introducing a race condition
@@ -132,3 +173,146 @@ class TestSimulatedReadGroupSet(unittest.TestCase):
         for readGroup in simulatedReadGroupSet.getReadGroups():
             alignments = list(readGroup.getReadAlignments())
             self.assertGreater(len(alignments), 0)
+
+
+class TestSimulatedReadGroup(unittest.TestCase):
+    """
+    Tests the reads tiled across the references by the simulated
+    ReadGroup.
+    """
+    def setUp(self):
+        dataset = datasets.AbstractDataset('dataset1')
+        referenceSet = references.SimulatedReferenceSet(
+            "srs1", numReferences=2, referenceLength=5000)
+        self.reference = referenceSet.getReferences()[0]
+        self.readLength = 50
+        self.readGroupSet = reads.SimulatedReadGroupSet(
+            dataset, "rgs", referenceSet, readLength=self.readLength,
+            meanCoverage=10, indelRate=0.5, numTags=6)
+        self.readGroup = self.readGroupSet.getReadGroups()[0]
+        self.allReads = list(self.readGroup.getReadAlignments(
+            self.reference))
+
+    def _getQueryLength(self, read):
+        ops = protocol.CigarOperation
+        return sum(
+            unit.operationLength for unit in read.alignment.cigar
+            if unit.operation in [
+                ops.ALIGNMENT_MATCH, ops.INSERT, ops.CLIP_SOFT])
+
+    def _getReferenceLength(self, read):
+        ops = protocol.CigarOperation
+        return sum(
+            unit.operationLength for unit in read.alignment.cigar
+            if unit.operation in [ops.ALIGNMENT_MATCH, ops.DELETE])
+
+    def testReads(self):
+        self.assertEqual(len(self.allReads), 1000)
+        self.assertEqual(self.readGroup.getNumAlignedReads(), 2000)
+        positions = [read.alignment.position.position for read in
+                     self.allReads]
+        self.assertEqual(positions, sorted(positions))
+        self.assertLessEqual(
+            positions[-1] + self.readLength, self.reference.getLength())
+        numIndels = 0
+        for read in self.allReads:
+            self.assertEqual(self._getReferenceLength(read), self.readLength)
+            self.assertEqual(
+                self._getQueryLength(read), len(read.alignedSequence))
+            self.assertEqual(
+                len(read.alignedQuality), len(read.alignedSequence))
+            self.assertEqual(len(read.info), 6)
+            if len(read.alignment.cigar) > 2:
+                numIndels += 1
+        self.assertGreater(numIndels, 0)
+        self.assertEqual(
+            len(set(read.id for read in self.allReads)), len(self.allReads))
+
+    def testRegionQueries(self):
+        for start, end in [
+                (0, 1), (0, 100), (49, 51), (1234, 1300), (4990, 5000),
+                (2500, 2501)]:
+            expected = [
+                read for read in self.allReads
+                if read.alignment.position.position < end and
+                read.alignment.position.position + self.readLength > start]
+            self.assertEqual(
+                list(self.readGroup.getReadAlignments(
+                    self.reference, start, end)), expected)
+
+    def testBackendPaging(self):
+        simulatedBackend = backend.SimulatedBackend(
+            referenceLength=2000, readLength=30, meanCoverage=5)
+        dataset = simulatedBackend.getDatasets()[0]
+        readGroup = dataset.getReadGroupSets()[0].getReadGroups()[0]
+        reference = simulatedBackend.getReferenceSets()[0].getReferences()[0]
+        request = protocol.SearchReadsRequest()
+        request.readGroupIds = [readGroup.getId()]
+        request.referenceId = reference.getId()
+        request.start = 100
+        request.end = 1500
+        request.pageSize = 7
+        ids = []
+        while True:
+            response = protocol.SearchReadsResponse.fromJsonString(
+                simulatedBackend.runSearchReads(request.toJsonString()))
+            ids.extend(read.id for read in response.alignments)
+            if response.nextPageToken is None:
+                break
+            request.pageToken = response.nextPageToken
+        self.assertEqual(ids, [
+            read.id for read in readGroup.getReadAlignments(
+                reference, 100, 1500)])
+        self.assertGreater(len(ids), 100)
+
+
+class TestSimulatedReference(unittest.TestCase):
+    """
+    Tests that the bases of simulated references are generated
+    reproducibly, one block at a time.
+    """
+    def setUp(self):
+        self.referenceSet = references.SimulatedReferenceSet("refs")
+        self.length = 1000
+        self.blockSize = 64
+        self.reference = self._getReference(self.length)
+
+    def _getReference(self, length, randomSeed=1):
+        return references.SimulatedReference(
+            self.referenceSet, "ref", randomSeed, length, self.blockSize)
+
+    def testBases(self):
+        bases = self.reference.fetchBases(0, self.length)
+        self.assertEqual(len(bases), self.length)
+        self.assertTrue(set(bases) <= set("ACGT"))
+        for start, end in [
+                (0, 1), (0, 64), (63, 65), (100, 300), (999, 1000),
+                (500, 500), (990, 2000)]:
+            self.assertEqual(
+                self.reference.fetchBases(start, end), bases[start:end])
+        # A new reference with the same seed has the same bases
+        self.assertEqual(self._getReference(self.length).fetchBases(
+            0, self.length), bases)
+        self.assertNotEqual(self._getReference(
+            self.length, 2).fetchBases(0, self.length), bases)
+
+    def testMd5Checksum(self):
+        bases = self.reference.fetchBases(0, self.length)
+        self.assertEqual(
+            self.reference.getMd5Checksum(), hashlib.md5(bases).hexdigest())
+        # The checksum is computed when the reference is built, so that
+        # requests never generate the whole sequence.
+        reference = self._getReference(self.length)
+        with mock.patch.object(reference, "_getBlock") as getBlock:
+            self.assertEqual(
+                reference.getMd5Checksum(), hashlib.md5(bases).hexdigest())
+        self.assertFalse(getBlock.called)
+
+    def testGenomeScaleLength(self):
+        length = 3 * 10**7
+        reference = references.SimulatedReference(
+            self.referenceSet, "chr1", 1, length)
+        self.assertEqual(reference.getLength(), length)
+        bases = reference.getBases(length - 100, length)
+        self.assertEqual(len(bases), 100)
+        self.assertEqual(reference.getBases(length - 100, length), bases)
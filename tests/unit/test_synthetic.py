@@ -0,0 +1,128 @@
+"""
+Tests for the synthetic data directory generator
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+import ga4gh.backend as backend
+import ga4gh.cli as cli
+import ga4gh.datamodel as datamodel
+import ga4gh.datamodel.synthetic as synthetic
+
+
+class TestSyntheticData(unittest.TestCase):
+    """
+    Tests that the generated data directory can be served by the file
+    system backend and is consistent with its reference bases.
+    """
+    referenceLength = 5000
+    numSamples = 3
+    readLength = 50
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tempDir = tempfile.mkdtemp(prefix="ga4gh_synthetic")
+        cls.dataDir = os.path.join(cls.tempDir, "data")
+        cli.generate_data_main([
+            "--randomSeed", "5", "--numReferences", "2",
+            "--referenceLength", str(cls.referenceLength),
+            "--numVariantSets", "2", "--numSamples", str(cls.numSamples),
+            "--variantDensity", "0.01", "--numReadGroupSets", "2",
+            "--readLength", str(cls.readLength), "--meanCoverage", "4",
+            "--workers", "2", cls.dataDir])
+        cls.backend = backend.FileSystemBackend(cls.dataDir)
+
+    @classmethod
+    def tearDownClass(cls):
+        datamodel.fileHandleCache.clear()
+        shutil.rmtree(cls.tempDir)
+
+    def _getBases(self, referenceName):
+        referenceSet = self.backend.getReferenceSetByName("synthetic")
+        reference = referenceSet.getReferenceByName(referenceName)
+        return reference.getBases(0, reference.getLength())
+
+    def testReferences(self):
+        referenceSet = self.backend.getReferenceSetByName("synthetic")
+        references = referenceSet.getReferences()
+        self.assertEqual(
+            [reference.getLocalId() for reference in references],
+            ["chr1", "chr2"])
+        for reference in references:
+            bases = self._getBases(reference.getLocalId())
+            self.assertEqual(len(bases), self.referenceLength)
+            self.assertEqual(set(bases), set("ACGT"))
+            self.assertEqual(
+                reference.getMd5Checksum(), hashlib.md5(bases).hexdigest())
+
+    def testVariants(self):
+        dataset = self.backend.getDatasets()[0]
+        self.assertEqual(dataset.getNumVariantSets(), 2)
+        for variantSet in dataset.getVariantSets():
+            self.assertEqual(
+                len(variantSet.getCallSets()), self.numSamples)
+            for referenceName in ["chr1", "chr2"]:
+                bases = self._getBases(referenceName)
+                callSetIds = [
+                    callSet.getId() for callSet in variantSet.getCallSets()]
+                variants = list(variantSet.getVariants(
+                    referenceName, 0, self.referenceLength, callSetIds))
+                self.assertGreater(len(variants), 0)
+                for variant in variants:
+                    self.assertEqual(
+                        variant.referenceBases, bases[variant.start])
+                    self.assertNotEqual(
+                        variant.alternateBases[0], variant.referenceBases)
+                    self.assertEqual(len(variant.calls), self.numSamples)
+
+    def testReads(self):
+        dataset = self.backend.getDatasets()[0]
+        self.assertEqual(dataset.getNumReadGroupSets(), 2)
+        for readGroupSet in dataset.getReadGroupSets():
+            referenceSet = readGroupSet.getReferenceSet()
+            self.assertEqual(referenceSet.getLocalId(), "synthetic")
+            readGroup, = readGroupSet.getReadGroups()
+            for reference in referenceSet.getReferences():
+                bases = self._getBases(reference.getLocalId())
+                reads = list(readGroup.getReadAlignments(
+                    reference, 0, self.referenceLength))
+                # About meanCoverage * referenceLength / readLength
+                self.assertGreater(len(reads), 200)
+                for read in reads:
+                    start = read.alignment.position.position
+                    referenceBases = bases[start:start + self.readLength]
+                    numMismatches = sum(
+                        base != referenceBase for base, referenceBase in zip(
+                            read.alignedSequence, referenceBases))
+                    self.assertEqual(len(read.alignedSequence), len(
+                        referenceBases))
+                    self.assertEqual(read.info["NM"], [str(numMismatches)])
+
+    def testDeterminism(self):
+        generator = synthetic.SyntheticDataGenerator(
+            os.path.join(self.tempDir, "other"), randomSeed=5,
+            numReferences=2, referenceLength=self.referenceLength)
+        generator.generate()
+        for referenceName in ["chr1", "chr2"]:
+            paths = [
+                os.path.join(
+                    dataDir, "referenceSets", "synthetic",
+                    referenceName + ".json")
+                for dataDir in [self.dataDir, os.path.join(
+                    self.tempDir, "other")]]
+            with open(paths[0]) as first, open(paths[1]) as second:
+                self.assertEqual(first.read(), second.read())
+
+    def testInvalidParameters(self):
+        with self.assertRaises(ValueError):
+            synthetic.SyntheticDataGenerator(
+                self.tempDir, referenceLength=10, readLength=100)
+        with self.assertRaises(ValueError):
+            synthetic.SyntheticDataGenerator(self.tempDir, numSamples=0)
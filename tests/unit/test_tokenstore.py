@@ -0,0 +1,123 @@
+"""
+Tests for the stores of OIDC authentication tokens
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import multiprocessing
+import os
+import shutil
+import stat
+import tempfile
+import time
+import unittest
+
+import mock
+
+import ga4gh.exceptions as exceptions
+import ga4gh.tokenstore as tokenstore
+
+
+class TokenStoreTest(object):
+    """
+    Tests common to all token stores.
+    """
+    def getTokenStore(self, ttl):
+        raise NotImplementedError()
+
+    def testPutGetRemove(self):
+        store = self.getTokenStore(60)
+        self.assertIsNone(store.get("a"))
+        self.assertEqual(store.get("a", "default"), "default")
+        store.put("a", ["code", "state", {"id_token": {"nonce": "x"}}])
+        self.assertEqual(
+            store.get("a"), ["code", "state", {"id_token": {"nonce": "x"}}])
+        store.put("a", "b")
+        self.assertEqual(store.get("a"), "b")
+        store.remove("a")
+        self.assertIsNone(store.get("a"))
+        store.remove("a")
+        self.assertIsNone(store.get(None))
+
+    def testExpiry(self):
+        store = self.getTokenStore(0.01)
+        store.put("a", "b")
+        time.sleep(0.02)
+        self.assertIsNone(store.get("a"))
+        store.put("c", "d")
+        time.sleep(0.02)
+        store.purge()
+        self.assertIsNone(store.get("c"))
+
+
+class TestMemoryTokenStore(TokenStoreTest, unittest.TestCase):
+    """
+    Tests the in-memory token store.
+    """
+    def getTokenStore(self, ttl):
+        return tokenstore.getTokenStore(tokenstore.MEMORY, ttl)
+
+
+class TestSqliteTokenStore(TokenStoreTest, unittest.TestCase):
+    """
+    Tests the SQLite token store, and the sharing of tokens between
+    processes.
+    """
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp(prefix="ga4gh_tokens")
+        self.path = os.path.join(self.tempDir, "tokens.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def getTokenStore(self, ttl):
+        store = tokenstore.getTokenStore(self.path, ttl)
+        self.assertIsInstance(store, tokenstore.SqliteTokenStore)
+        self.assertEqual(store.getPath(), self.path)
+        return store
+
+    def testSharedBetweenProcesses(self):
+        store = self.getTokenStore(60)
+        store.put("a", "b")
+        # The forked process must not use this process's connection.
+        process = multiprocessing.Process(
+            target=store.put, args=("c", "d"))
+        process.start()
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+        self.assertEqual(store.get("c"), "d")
+        self.assertEqual(self.getTokenStore(60).get("a"), "b")
+
+    def _getMode(self):
+        return stat.S_IMODE(os.stat(self.path).st_mode)
+
+    def testPrivateFile(self):
+        oldUmask = os.umask(0)
+        try:
+            self.getTokenStore(60).put("a", "b")
+        finally:
+            os.umask(oldUmask)
+        self.assertEqual(self._getMode(), 0o600)
+
+    def testPermissiveFileRestricted(self):
+        with open(self.path, "w"):
+            pass
+        os.chmod(self.path, 0o666)
+        self.getTokenStore(60)
+        self.assertEqual(self._getMode(), 0o600)
+
+    def testOtherOwnerRefused(self):
+        with open(self.path, "w"):
+            pass
+        with mock.patch("os.getuid", return_value=os.getuid() + 1):
+            with self.assertRaises(exceptions.ConfigurationException):
+                tokenstore.getTokenStore(self.path, 60)
+
+    def testSymlinkRefused(self):
+        target = os.path.join(self.tempDir, "target")
+        with open(target, "w"):
+            pass
+        os.symlink(target, self.path)
+        with self.assertRaises(exceptions.ConfigurationException):
+            tokenstore.getTokenStore(self.path, 60)
@@ -370,6 +370,68 @@ class TestFrontend(unittest.TestCase):
             responseData.alignments[0].id,
             self.readAlignmentId)
 
+    def testReadsSearchFillReferenceSequence(self):
+        request = protocol.SearchReadsRequest()
+        request.readGroupIds = [self.readGroupId]
+        request.referenceId = self.referenceId
+        response = self.sendPostRequest(
+            '/reads/search?fillReferenceSequence=true', request)
+        self.assertEqual(200, response.status_code)
+        responseData = protocol.SearchReadsResponse.fromJsonString(
+            response.data)
+        self.assertEqual(len(responseData.alignments), 2)
+
+    def sendReferenceBasesStream(self, query="", rangeHeader=None):
+        path = "/references/{}/bases{}".format(self.referenceId, query)
+        headers = {"Origin": self.exampleUrl, "Accept": "text/plain"}
+        if rangeHeader is not None:
+            headers["Range"] = rangeHeader
+        return self.app.get(path, headers=headers)
+
+    def testReferenceBasesStream(self):
+        bases = self.reference.getBases(0, self.reference.getLength())
+        response = self.sendReferenceBasesStream()
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(response.mimetype, "text/plain")
+        self.assertEqual(response.headers["Accept-Ranges"], "bytes")
+        self.assertEqual(
+            response.headers["Content-Length"], str(len(bases)))
+        self.assertEqual(response.data, bases)
+        response = self.sendReferenceBasesStream("?start=10&end=100")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(response.data, bases[10:100])
+        response = self.sendReferenceBasesStream(
+            "?start=0&end={}".format(len(bases) + 1))
+        self.assertEqual(416, response.status_code)
+        # JSON is still the default
+        response = self.sendReferenceBasesList()
+        self.assertEqual(response.mimetype, "application/json")
+
+    def testReferenceBasesStreamRange(self):
+        bases = self.reference.getBases(0, self.reference.getLength())
+        response = self.sendReferenceBasesStream(
+            "?start=10&end=100", "bytes=5-14")
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(response.data, bases[15:25])
+        self.assertEqual(response.headers["Content-Range"], "bytes 5-14/90")
+        self.assertEqual(response.headers["Content-Length"], "10")
+        response = self.sendReferenceBasesStream(
+            "?start=10&end=100", "bytes=80-")
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(response.data, bases[90:100])
+        response = self.sendReferenceBasesStream(
+            "?start=10&end=100", "bytes=-5")
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(response.data, bases[95:100])
+        response = self.sendReferenceBasesStream(
+            "?start=10&end=100", "bytes=90-95")
+        self.assertEqual(416, response.status_code)
+        # Multiple ranges are ignored
+        response = self.sendReferenceBasesStream(
+            "?start=10&end=100", "bytes=0-1,5-6")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(response.data, bases[10:100])
+
     def testDatasetsSearch(self):
         response = self.sendDatasetsSearch()
         responseData = protocol.SearchDatasetsResponse.fromJsonString(